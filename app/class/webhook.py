@@ -0,0 +1,186 @@
+"""
+Alertmanager Webhook 服务
+接收 Alertmanager 推送的告警，立即返回 202，告警进入有界队列由 Agent worker 异步诊断
+
+启动方式：
+    uvicorn app.class.webhook:app --host 0.0.0.0 --port 8001
+
+Alertmanager 配置示例：
+    receivers:
+      - name: aiops-agent
+        webhook_configs:
+          - url: http://<host>:8001/api/alerts
+"""
+import uvicorn
+
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, Field
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+
+from config.config_loader import get_config
+from app.core.alert_queue import Alert, QueueFullError, get_alert_queue
+from app.core.diagnosis_cache import get_diagnosis_cache
+from app.core.prompt_cache import prompt_cache_stats
+from app.core.llm_hedging import hedging_stats
+from app.core.key_pool import key_pool_stats
+from app.core.admission import admission_metrics
+from app.core.deadline import deadline_stats
+
+
+class AlertmanagerAlert(BaseModel):
+    status: str = Field(default="firing", description="firing / resolved")
+    labels: Dict[str, str] = Field(default={}, description="告警标签")
+    annotations: Dict[str, str] = Field(default={}, description="告警注解")
+    startsAt: Optional[str] = Field(default=None, description="告警开始时间")
+    endsAt: Optional[str] = Field(default=None, description="告警结束时间")
+    generatorURL: Optional[str] = Field(default=None, description="告警来源链接")
+    fingerprint: Optional[str] = Field(default=None, description="告警指纹")
+
+
+class AlertmanagerPayload(BaseModel):
+    """Alertmanager webhook 负载（version 4）"""
+    version: Optional[str] = None
+    groupKey: Optional[str] = None
+    status: Optional[str] = None
+    receiver: Optional[str] = None
+    groupLabels: Dict[str, Any] = {}
+    commonLabels: Dict[str, Any] = {}
+    commonAnnotations: Dict[str, Any] = {}
+    externalURL: Optional[str] = None
+    alerts: List[AlertmanagerAlert] = Field(default=[], description="告警列表")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """启动时构建诊断 Agent、拉起告警诊断 worker（并预热集群状态缓存），退出时停止"""
+    await _prepare_diagnosis_agent()
+    queue = get_alert_queue()
+    queue.start()
+    cluster_state = _start_cluster_cache()
+    yield
+    await queue.stop()
+    if cluster_state is not None:
+        for component in cluster_state:
+            if component is not None:
+                await component.stop()
+
+
+async def _prepare_diagnosis_agent() -> None:
+    """在事件循环内异步构建诊断 Agent（加载工具和知识库），第一条告警不用等待构建"""
+    from app.core.agent_factory import get_diagnosis_agent
+
+    try:
+        await get_diagnosis_agent()
+    except Exception as e:
+        print(f"⚠️  诊断 Agent 构建失败，将在第一条告警诊断时重试: {e}")
+
+
+def _start_cluster_cache():
+    """告警到来前先同步集群状态并开始记录快照，诊断时的只读查询直接命中本地缓存，what_changed 有历史可查"""
+    if get_config().get('model.mcp.kubernetes.backend', 'mcp') not in ("native", "hybrid"):
+        return None
+    try:
+        from app.core.cluster_cache import get_cluster_cache
+        from app.core.cluster_snapshots import get_cluster_snapshotter
+
+        cluster_cache = get_cluster_cache()
+        if cluster_cache is not None:
+            cluster_cache.ensure_started()
+        snapshotter = get_cluster_snapshotter()
+        if snapshotter is not None:
+            snapshotter.ensure_started()
+        return cluster_cache, snapshotter
+    except Exception as e:
+        print(f"⚠️  集群状态缓存启动失败，只读查询将直接请求 apiserver: {e}")
+        return None
+
+
+app = FastAPI(
+    title="Alertmanager Webhook API",
+    description="接收 Alertmanager 告警并触发 AIOps Agent 诊断",
+    version="1.0.0",
+    lifespan=lifespan,
+)
+
+
+@app.post("/api/alerts", status_code=202)
+async def receive_alerts(payload: AlertmanagerPayload):
+    """
+    接收 Alertmanager 告警
+
+    告警入队后立即返回 202；队列满时返回 429、队列未启动时返回 503，均带 Retry-After，
+    Alertmanager 会在下一个 group_interval 重新推送
+    """
+    queue = get_alert_queue()
+    process_resolved = get_config().get('alerting.process_resolved', False)
+    alerts = [
+        Alert.from_alertmanager(item.model_dump(), timeout=queue.alert_timeout)
+        for item in payload.alerts
+        if process_resolved or item.status == "firing"
+    ]
+
+    try:
+        accepted = await queue.submit(alerts) if alerts else 0
+    except QueueFullError as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"status": "rejected", "detail": str(e)},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    return {
+        "status": "accepted",
+        "accepted": accepted,
+        "skipped": len(payload.alerts) - accepted,
+        "queue_depth": queue.metrics()["depth"],
+    }
+
+
+@app.get("/api/alerts")
+async def list_alert_results(limit: int = 20):
+    """最近的诊断结果"""
+    return {"results": get_alert_queue().recent_results(limit)}
+
+
+@app.get("/api/alerts/metrics")
+async def alert_metrics():
+    """告警队列指标（队列深度、入队/拒绝/超时计数、排队和诊断耗时分位数、诊断缓存命中、集群缓存同步状态、prompt 前缀缓存命中、模型接口 TTFT / 熔断状态、API Key 利用率）"""
+    metrics = get_alert_queue().metrics()
+    if get_config().get('alerting.diagnosis_cache.enabled', True):
+        metrics["diagnosis_cache"] = get_diagnosis_cache().stats()
+    if get_config().get('model.mcp.kubernetes.backend', 'mcp') in ("native", "hybrid"):
+        from app.core.cluster_cache import cluster_cache_stats
+
+        metrics["cluster_cache"] = cluster_cache_stats()
+    metrics["prompt_cache"] = prompt_cache_stats()
+    metrics["llm_hedging"] = hedging_stats()
+    metrics["key_pools"] = key_pool_stats()
+    metrics["admission"] = admission_metrics()
+    metrics["deadline"] = deadline_stats()
+    return metrics
+
+
+@app.post("/api/alerts/cache/invalidate")
+async def invalidate_diagnosis_cache(fingerprint: Optional[str] = None):
+    """清除诊断缓存（指定 fingerprint 时只清除该告警的条目，包含该告警的组下次重新诊断），用于修复后强制重新诊断"""
+    return {"invalidated": get_diagnosis_cache().invalidate(fingerprint)}
+
+
+@app.get("/api/alerts/{fingerprint}")
+async def get_alert_result(fingerprint: str):
+    """查询某条告警最近一次的诊断结果"""
+    result = get_alert_queue().get_result(fingerprint)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"未找到告警 {fingerprint} 的诊断结果")
+    return result
+
+
+if __name__ == "__main__":
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8001
+    )
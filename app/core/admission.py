@@ -0,0 +1,252 @@
+"""
+LLM 调用准入控制
+聊天接口和 Agent 不限制并发地调用模型，负载升高时所有请求一起变慢，并引发供应商的 429 连锁重试。
+AdmissionController 为模型调用设置全局并发预算，超出预算的调用按优先级排队：
+- alert（告警诊断）> interactive（交互式聊天）> batch（批量任务）
+- 每个优先级有自己的排队上限和排队超时，超时或队满立即拒绝（HTTP 接口返回 503 + Retry-After），
+  而不是让请求无限等待
+- 记录各优先级的排队深度、等待时间分位数、准入 / 拒绝 / 超时计数
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain.agents.middleware.types import ModelRequest, ModelResponse
+from langgraph.config import get_config as get_runnable_config
+from config.config_loader import get_config
+
+
+PRIORITIES = {"alert": 0, "interactive": 1, "batch": 2}
+
+DEFAULT_CLASSES = {
+    "alert": {"queue_timeout": 120, "max_queue": 200},
+    "interactive": {"queue_timeout": 10, "max_queue": 50},
+    "batch": {"queue_timeout": 60, "max_queue": 100},
+}
+
+
+class AdmissionRejected(Exception):
+    """排队超时或队列已满，调用方应稍后重试"""
+
+    def __init__(self, message: str, retry_after: int, status_code: int = 503):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+def _percentile(values: Deque[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class AdmissionController:
+    """带优先级的模型调用并发预算"""
+
+    def __init__(self, max_concurrency: int = 8, classes: Optional[Dict[str, dict]] = None):
+        """
+        初始化准入控制
+
+        Args:
+            max_concurrency: 同时进行的模型调用上限
+            classes: 优先级名称 -> {queue_timeout: 排队超时秒数, max_queue: 排队上限}
+        """
+        self.max_concurrency = max_concurrency
+        self.classes = {name: dict(DEFAULT_CLASSES[name]) for name in PRIORITIES}
+        for name, options in (classes or {}).items():
+            if name not in PRIORITIES:
+                raise ValueError(f"未知的优先级: {name}，可选 {list(PRIORITIES)}")
+            self.classes[name].update(options or {})
+
+        self.inflight = 0
+        # 等待队列：(优先级, 序号, 优先级名称, future)，同优先级先到先得
+        self._waiters: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._queued = {name: 0 for name in PRIORITIES}
+
+        # 统计信息
+        self._counters = {name: {"admitted": 0, "rejected": 0, "timeouts": 0} for name in PRIORITIES}
+        self._waits = {name: deque(maxlen=1000) for name in PRIORITIES}
+        self._hold_ewma = 5.0
+
+    def _retry_after(self) -> int:
+        """按平均占用时间估计队列排空需要的秒数"""
+        queued = sum(self._queued.values())
+        estimate = self._hold_ewma * (queued + 1) / max(self.max_concurrency, 1)
+        return int(min(max(math.ceil(estimate), 1), 60))
+
+    async def acquire(self, priority: str = "interactive") -> None:
+        """
+        获取一个调用名额（预算已满时按优先级排队）
+
+        Args:
+            priority: 优先级名称（alert / interactive / batch）
+
+        Raises:
+            AdmissionRejected: 队列已满或排队超时
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的优先级: {priority}，可选 {list(PRIORITIES)}")
+        options = self.classes[priority]
+        counters = self._counters[priority]
+
+        if self.inflight < self.max_concurrency and not self._waiters:
+            self.inflight += 1
+            counters["admitted"] += 1
+            self._waits[priority].append(0.0)
+            return
+
+        if self._queued[priority] >= int(options["max_queue"]):
+            counters["rejected"] += 1
+            raise AdmissionRejected(f"{priority} 队列已满（{self._queued[priority]}）", self._retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITIES[priority], next(self._seq), priority, future))
+        self._queued[priority] += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=float(options["queue_timeout"]))
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # 超时的同时刚好分到名额：照常使用
+                pass
+            else:
+                future.cancel()
+                counters["timeouts"] += 1
+                raise AdmissionRejected(
+                    f"{priority} 排队超过 {options['queue_timeout']}s", self._retry_after()
+                )
+        except asyncio.CancelledError:
+            # 调用方被取消：已经分到的名额要归还
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+            raise
+        finally:
+            self._queued[priority] -= 1
+        counters["admitted"] += 1
+        self._waits[priority].append(time.monotonic() - started)
+
+    def release(self, held: Optional[float] = None) -> None:
+        """
+        归还名额：直接交给优先级最高的等待者
+
+        Args:
+            held: 本次占用的秒数（可选，用于估计 Retry-After）
+        """
+        if held is not None:
+            self._hold_ewma = 0.9 * self._hold_ewma + 0.1 * held
+        while self._waiters:
+            _, _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(True)
+                return
+        self.inflight = max(self.inflight - 1, 0)
+
+    @asynccontextmanager
+    async def slot(self, priority: str = "interactive") -> AsyncIterator[None]:
+        """在 async with 代码块期间占用一个名额"""
+        await self.acquire(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def metrics(self) -> dict:
+        """并发、排队深度、等待时间分位数和各优先级计数"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "inflight": self.inflight,
+            "queue_depth": dict(self._queued),
+            "classes": {
+                name: {
+                    **self._counters[name],
+                    "wait_p50": round(_percentile(self._waits[name], 0.5), 3),
+                    "wait_p95": round(_percentile(self._waits[name], 0.95), 3),
+                    "queue_timeout": self.classes[name]["queue_timeout"],
+                    "max_queue": self.classes[name]["max_queue"],
+                }
+                for name in PRIORITIES
+            },
+            "retry_after_estimate": self._retry_after(),
+        }
+
+
+class AdmissionMiddleware(AgentMiddleware):
+    """
+    Agent 模型调用的准入控制中间件
+
+    优先级来自线程配置 configurable.priority（告警诊断为 alert），默认 interactive；
+    只在模型调用期间占用名额，工具调用不占用
+    """
+
+    def __init__(self, controller: AdmissionController, default_priority: str = "interactive"):
+        """
+        初始化准入控制中间件
+
+        Args:
+            controller: 准入控制器
+            default_priority: 没有指定优先级时使用的优先级
+        """
+        super().__init__()
+        self.controller = controller
+        self.default_priority = default_priority
+
+    def _priority(self) -> str:
+        try:
+            configurable = get_runnable_config().get("configurable", {})
+        except RuntimeError:
+            configurable = {}
+        return configurable.get("priority") or self.default_priority
+
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        """在模型调用期间占用一个名额"""
+        async with self.controller.slot(self._priority()):
+            return await handler(request)
+
+
+_admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """
+    获取准入控制器（单例模式，参数从 config.yaml 的 model.admission 段读取）
+
+    Returns:
+        AdmissionController 实例；未启用时返回 None
+    """
+    global _admission_controller
+
+    config = get_config()
+    if not config.get('model.admission.enabled', True):
+        return None
+    if _admission_controller is None:
+        _admission_controller = AdmissionController(
+            max_concurrency=int(config.get('model.admission.max_concurrency', 8)),
+            classes=config.get('model.admission.classes', {}) or {},
+        )
+    return _admission_controller
+
+
+def get_admission_middleware() -> Optional[AdmissionMiddleware]:
+    """创建使用全局准入控制器的 Agent 中间件（未启用时返回 None）"""
+    controller = get_admission_controller()
+    return AdmissionMiddleware(controller) if controller is not None else None
+
+
+def admission_metrics() -> Optional[dict]:
+    """准入控制指标（未启用或尚未创建时返回 None）"""
+    return _admission_controller.metrics() if _admission_controller is not None else None
@@ -5,7 +5,7 @@
 from langchain.agents import create_agent
 from app.core import prompt
 from config.config_loader import get_config
-from langchain.chat_models import init_chat_model
+from config.model_factory import get_model
 from app.tools.base import tools_usage
 from app.tools.mcp_tools import get_all_tools_sync
 from app.core.prompt import SYSTEM_PROMPT
@@ -18,31 +18,22 @@ import asyncio
 from langgraph.checkpoint.memory import InMemorySaver
 
 # RAG 集成
-from app.core.rag_integration import initialize_rag_system, is_rag_initialized
-from app.core.rag_middleware import RAGMiddleware
+from app.core.rag_integration import initialize_rag_system
+# 工具参数和中间件与异步构建（webhook 服务）共用一套配置
+from app.core.agent_factory import build_middleware, tool_options
 
 
 
 # 加载model相关配置
 config = get_config()
 
-model_usage = init_chat_model(
-    model = config.get('model.deepseek.model'),
-    model_provider = config.get('model.deepseek.model_provider'),
-    api_key = config.get('model.deepseek.api'),
-    base_url = config.get('model.deepseek.api_base'),
-    max_tokens = config.get('model.deepseek.max_token'),
-)
+# 默认模型（按名称从模型注册表创建，流式调用返回 token 用量并记录 prompt 前缀缓存命中）
+model_usage = get_model(config.get('model.default', 'deepseek'))
 
-# 加载所有工具（本地工具 + Kubernetes MCP 工具）
-# kubernetes_non_destructive: True 表示只允许只读和创建/更新操作，不允许删除操作
-k8s_config = config.get('model.mcp.kubernetes', {})
-all_tools = get_all_tools_sync(
-    include_kubernetes=True,
-    kubernetes_non_destructive=k8s_config.get('non_destructive', False),
-    kubernetes_kubeconfig=k8s_config.get('kubeconfig'),  # 可选：指定 kubeconfig 路径
-    kubernetes_context=k8s_config.get('context'),  # 可选：指定上下文
-)
+# 加载所有工具（本地工具 + Kubernetes MCP 工具 + Prometheus 工具）
+# 注意：get_all_tools_sync 内部调用 asyncio.run，不能在运行中的事件循环里导入本模块，
+# 事件循环内请使用 app.core.agent_factory.create_diagnosis_agent
+all_tools = get_all_tools_sync(**tool_options())
 
 # 初始化 RAG 系统（可选，如果不需要 RAG 功能可以注释掉）
 # 注意：RAG 初始化可能需要一些时间，特别是第一次运行时
@@ -51,11 +42,8 @@ try:
 except Exception as e:
     print(f"⚠️  RAG 系统初始化失败，将不使用知识库功能: {e}")
 
-# 创建 RAG 中间件（如果 RAG 系统已初始化）
-rag_middleware = None
-if is_rag_initialized():
-    rag_middleware = RAGMiddleware(rag_k=4, enable_auto_rag=True)
-    print("✅ RAG 中间件已启用：将在输出运维建议时自动检索知识库\n")
+# 中间件：运行期限 + RAG（已初始化时）+ 工具选择 + 模型路由 + 准入控制
+middleware = build_middleware()
 
 # 创建agent智能体。
 agent = create_agent(
@@ -63,7 +51,7 @@ agent = create_agent(
     tools=all_tools,
     system_prompt=SYSTEM_PROMPT,
     checkpointer=InMemorySaver(),
-    middleware=[rag_middleware] if rag_middleware else [],  # 添加 RAG 中间件
+    middleware=middleware,
 )
 
 # 提问
@@ -0,0 +1,135 @@
+"""
+Agent 构建
+agent.py 在导入时同步构建 Agent（命令行脚本和聊天接口使用），其中 get_all_tools_sync 内部调用 asyncio.run，
+不能在已经运行的事件循环（如 uvicorn 的 webhook 服务）中导入。
+这里提供同一套工具和中间件的异步构建方式：webhook 服务启动时在事件循环内 await 构建告警诊断 Agent
+"""
+import asyncio
+from typing import Any, List, Optional
+
+from langchain.agents import create_agent
+from config.config_loader import get_config
+from config.model_factory import get_model
+from app.tools.mcp_tools import get_all_tools
+from app.core.prompt import SYSTEM_PROMPT
+from app.core.rag_integration import initialize_rag_system, is_rag_initialized
+from app.core.rag_middleware import RAGMiddleware
+from app.core.tool_selection import get_tool_selection_middleware
+from app.core.model_routing import get_model_routing_middleware
+from app.core.admission import get_admission_middleware
+from app.core.deadline import get_deadline_middleware
+
+
+def tool_options() -> dict:
+    """
+    按 config.yaml 生成 get_all_tools / get_all_tools_sync 的参数
+
+    Returns:
+        参数字典
+    """
+    config = get_config()
+    k8s_config = config.get('model.mcp.kubernetes', {}) or {}
+    prometheus_config = config.get('model.mcp.prometheus', {}) or {}
+    return {
+        "include_kubernetes": True,
+        # True 表示只允许只读和创建/更新操作，不允许删除操作
+        "kubernetes_non_destructive": k8s_config.get('non_destructive', False),
+        "kubernetes_kubeconfig": k8s_config.get('kubeconfig'),  # 可选：指定 kubeconfig 路径
+        "kubernetes_context": k8s_config.get('context'),  # 可选：指定上下文
+        "kubernetes_backend": k8s_config.get('backend', 'mcp'),  # mcp / native / hybrid
+        "include_prometheus": prometheus_config.get('enabled', False),
+        "prometheus_url": prometheus_config.get('url'),
+        "prometheus_token": prometheus_config.get('token'),
+    }
+
+
+def build_middleware() -> List[Any]:
+    """
+    按配置创建 Agent 中间件（RAG 系统需已初始化才会启用 RAG 中间件）
+
+    顺序即嵌套顺序（第一个在最外层）：运行期限 + RAG + 工具选择 + 模型路由 + 准入控制
+
+    Returns:
+        中间件列表
+    """
+    middleware = []
+
+    # 运行期限中间件放在最外层：期限覆盖模型路由的重新生成和准入控制的排队时间
+    deadline_middleware = get_deadline_middleware()
+    if deadline_middleware:
+        middleware.append(deadline_middleware)
+
+    # RAG 中间件（如果 RAG 系统已初始化）
+    if is_rag_initialized():
+        middleware.append(RAGMiddleware(rag_k=4, enable_auto_rag=True))
+        print("✅ RAG 中间件已启用：将在输出运维建议时自动检索知识库\n")
+
+    # 工具选择中间件：每个线程只绑定与问题最相关的工具
+    tool_selection_middleware = get_tool_selection_middleware()
+    if tool_selection_middleware:
+        middleware.append(tool_selection_middleware)
+
+    # 模型路由中间件：工具步骤使用低延迟模型，最终回答使用强模型
+    model_routing_middleware = get_model_routing_middleware()
+    if model_routing_middleware:
+        middleware.append(model_routing_middleware)
+
+    # 准入控制中间件：模型调用受全局并发预算约束，告警诊断优先于交互式请求
+    admission_middleware = get_admission_middleware()
+    if admission_middleware:
+        middleware.append(admission_middleware)
+    return middleware
+
+
+async def create_diagnosis_agent(checkpointer: Optional[Any] = None):
+    """
+    在事件循环内异步构建 Agent（与 agent.py 使用相同的模型、工具和中间件）
+
+    Args:
+        checkpointer: 会话记忆（可选）。告警诊断每个告警组只运行一次，不需要记忆；
+                      使用 InMemorySaver 时每次诊断的完整消息历史会在进程生命周期内一直占用内存
+
+    Returns:
+        Agent 实例
+    """
+    config = get_config()
+    model = get_model(config.get('model.default', 'deepseek'))
+    tools = await get_all_tools(**tool_options())
+
+    # 初始化 RAG 系统（加载知识库可能需要向量化，放到线程池避免阻塞事件循环）
+    try:
+        await asyncio.to_thread(initialize_rag_system, auto_init=True)
+    except Exception as e:
+        print(f"⚠️  RAG 系统初始化失败，将不使用知识库功能: {e}")
+
+    return create_agent(
+        model=model,
+        tools=tools,
+        system_prompt=SYSTEM_PROMPT,
+        checkpointer=checkpointer,
+        middleware=build_middleware(),
+    )
+
+
+_diagnosis_agent: Optional[Any] = None
+_diagnosis_agent_lock: Optional[asyncio.Lock] = None
+
+
+async def get_diagnosis_agent():
+    """
+    获取告警诊断 Agent（单例模式，首次调用时异步构建，不使用 checkpointer）
+
+    Returns:
+        Agent 实例
+    """
+    global _diagnosis_agent, _diagnosis_agent_lock
+
+    if _diagnosis_agent is not None:
+        return _diagnosis_agent
+    if _diagnosis_agent_lock is None:
+        _diagnosis_agent_lock = asyncio.Lock()
+    async with _diagnosis_agent_lock:
+        if _diagnosis_agent is None:
+            _diagnosis_agent = await create_diagnosis_agent(checkpointer=None)
+            print("✅ 告警诊断 Agent 已就绪")
+    return _diagnosis_agent
@@ -0,0 +1,333 @@
+"""
+告警分组
+节点宕机等故障会在短时间内触发大量相关告警，逐条诊断会重复运行几百次 Agent。
+告警入队前先在滑动窗口内分组，每组只运行一次 Agent，诊断结果分发给组内所有告警：
+- 相同指纹的告警（Alertmanager 重发）直接折叠
+- 按标签关联：同一节点，或同一命名空间下的同一工作负载
+- 可选：告警文本的 embedding 相似度达到阈值时归入同一组
+"""
+import re
+import time
+import uuid
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+if TYPE_CHECKING:
+    from app.core.alert_queue import Alert
+
+
+# Kubernetes 生成随机后缀使用的字符集（去掉元音和易混淆字符，见 apimachinery 的 rand.SafeEncodeString），
+# 只有由这些字符组成的段才视为生成的后缀，nginx-proxy、redis-cache 这类名称不会被截断
+_SUFFIX_CHARS = "bcdfghjklmnpqrstvwxz2456789"
+
+# 从 Pod 名称推断工作负载名称：Deployment（<名称>-<哈希>-<后缀>）、DaemonSet/Job（<名称>-<后缀>）、StatefulSet（<名称>-<序号>）
+_POD_SUFFIX_PATTERNS = (
+    re.compile(rf"^(?P<name>.+)-[{_SUFFIX_CHARS}]{{6,10}}-[{_SUFFIX_CHARS}]{{5}}$"),
+    re.compile(rf"^(?P<name>.+)-[{_SUFFIX_CHARS}]{{5}}$"),
+    re.compile(r"^(?P<name>.+)-\d+$"),
+)
+
+# ReplicaSet 名称：<Deployment 名称>-<pod-template-hash>
+_REPLICASET_PATTERN = re.compile(rf"^(?P<name>.+)-[{_SUFFIX_CHARS}]{{6,10}}$")
+
+# 直接表示工作负载的标签（kube-state-metrics 等导出的告警常见标签）
+_WORKLOAD_LABELS = ("workload", "deployment", "statefulset", "daemonset", "job_name", "cronjob", "replicaset")
+
+# 表示 Pod 所属对象的标签：(名称标签, 类型标签)，如 kube_pod_owner 的 owner_name / owner_kind
+_OWNER_LABELS = (("owner_name", "owner_kind"), ("created_by_name", "created_by_kind"))
+
+# 默认的关联规则：按顺序匹配，第一个所有标签都存在的规则生效
+DEFAULT_GROUP_BY: Tuple[Tuple[str, ...], ...] = (("node",), ("namespace", "workload"))
+
+
+def workload_of(labels: Dict[str, str]) -> Optional[str]:
+    """
+    从告警标签推断工作负载名称
+
+    优先使用工作负载标签和所属对象标签，都没有时才从 Pod 名称去掉生成的后缀
+
+    Args:
+        labels: 告警标签
+
+    Returns:
+        工作负载名称，无法推断时返回 None
+    """
+    for key in _WORKLOAD_LABELS:
+        if labels.get(key):
+            value = labels[key]
+            if key == "replicaset":
+                match = _REPLICASET_PATTERN.match(value)
+                return match.group("name") if match else value
+            return value
+    for name_key, kind_key in _OWNER_LABELS:
+        owner = labels.get(name_key)
+        if owner:
+            if labels.get(kind_key, "").lower() == "replicaset":
+                match = _REPLICASET_PATTERN.match(owner)
+                return match.group("name") if match else owner
+            return owner
+    pod = labels.get("pod")
+    if not pod:
+        return None
+    for pattern in _POD_SUFFIX_PATTERNS:
+        match = pattern.match(pod)
+        if match:
+            return match.group("name")
+    return pod
+
+
+class AlertGroup:
+    """一组相关告警（一次 Agent 诊断）"""
+
+    def __init__(self, key: Optional[str], first: "Alert", window: float, max_window: float):
+        """
+        初始化告警组
+
+        Args:
+            key: 关联键（如 "node=worker-1"），没有关联标签时为 None
+            first: 第一条告警（代表告警）
+            window: 滑动窗口（秒），每加入一条新告警窗口顺延
+            max_window: 组从创建到关闭的最长时间（秒）
+        """
+        self.id = f"g-{uuid.uuid4().hex[:12]}"
+        self.key = key
+        self.alerts: Dict[str, "Alert"] = {first.fingerprint: first}
+        self.duplicates = 0
+        self.vector: Optional[np.ndarray] = None
+
+        now = time.monotonic()
+        self.window = window
+        self.opened_at = now
+        self.closes_at = now + window
+        self._latest_close = now + max_window
+
+    def add(self, alert: "Alert") -> bool:
+        """
+        加入一条告警并顺延窗口
+
+        Returns:
+            True 如果是新告警，False 如果是重复指纹（已折叠）
+        """
+        if alert.fingerprint in self.alerts:
+            self.duplicates += 1
+            return False
+        self.alerts[alert.fingerprint] = alert
+        self.closes_at = min(time.monotonic() + self.window, self._latest_close)
+        return True
+
+    @property
+    def members(self) -> List["Alert"]:
+        """组内所有告警"""
+        return list(self.alerts.values())
+
+    @property
+    def representative(self) -> "Alert":
+        """代表告警（第一条）"""
+        return next(iter(self.alerts.values()))
+
+    @property
+    def name(self) -> str:
+        """告警组名称（代表告警的名称）"""
+        return self.representative.name
+
+    @property
+    def received_at(self) -> float:
+        """组的创建时间（第一条告警的接收时间）"""
+        return self.opened_at
+
+    def remaining(self) -> Optional[float]:
+        """距离组内最早期限的剩余秒数（都不限期时为 None）"""
+        remaining = [r for r in (a.remaining() for a in self.alerts.values()) if r is not None]
+        return min(remaining) if remaining else None
+
+    def to_dict(self) -> dict:
+        """转换为可 JSON 序列化的字典"""
+        return {
+            "id": self.id,
+            "key": self.key,
+            "size": len(self.alerts),
+            "duplicates": self.duplicates,
+            "fingerprints": list(self.alerts),
+        }
+
+
+def alert_text(alert: "Alert") -> str:
+    """用于相似度分组的告警文本"""
+    summary = alert.annotations.get("summary") or alert.annotations.get("description") or ""
+    return f"{alert.name} {summary}".strip()
+
+
+class AlertGrouper:
+    """滑动窗口告警分组器"""
+
+    def __init__(
+        self,
+        window: float = 30,
+        max_window: float = 120,
+        group_by: Sequence[Sequence[str]] = DEFAULT_GROUP_BY,
+        embeddings: Optional[Embeddings] = None,
+        similarity_threshold: float = 0.9,
+    ):
+        """
+        初始化告警分组器
+
+        Args:
+            window: 滑动窗口（秒），组在最后一条告警之后 window 秒关闭；0 表示不分组
+            max_window: 组的最长等待时间（秒），防止持续告警让组永远不关闭
+            group_by: 关联规则列表，每条规则是一组标签名（workload 由 Pod 名称等推断）
+            embeddings: Embeddings 实例（可选，提供时启用告警文本相似度分组）
+            similarity_threshold: 余弦相似度阈值
+        """
+        self.window = window
+        self.max_window = max(max_window, window)
+        self.group_by = [tuple(rule) for rule in group_by]
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+
+        self._open: Dict[str, AlertGroup] = {}
+        self._by_fingerprint: Dict[str, AlertGroup] = {}
+        self._by_key: Dict[str, AlertGroup] = {}
+
+        # 统计信息
+        self.groups_created = 0
+        self.alerts_grouped = 0
+        self.duplicates = 0
+
+    def correlation_key(self, alert: "Alert") -> Optional[str]:
+        """
+        按关联规则计算告警的关联键
+
+        Returns:
+            关联键（如 "namespace=prod,workload=api"），没有匹配的规则时返回 None
+        """
+        labels = dict(alert.labels)
+        workload = workload_of(labels)
+        if workload:
+            labels["workload"] = workload
+        for rule in self.group_by:
+            if all(labels.get(name) for name in rule):
+                return ",".join(f"{name}={labels[name]}" for name in rule)
+        return None
+
+    def groups_needed(self, alerts: Sequence["Alert"]) -> int:
+        """
+        估算一批告警最多需要新建的组数（不考虑相似度分组，用于入队前的容量检查）
+
+        Args:
+            alerts: 告警列表
+
+        Returns:
+            需要新建的组数上限
+        """
+        needed = 0
+        new_keys = set()
+        for alert in alerts:
+            if alert.fingerprint in self._by_fingerprint:
+                continue
+            key = self.correlation_key(alert) if self.window > 0 else None
+            if key is None:
+                needed += 1
+            elif key not in self._by_key and key not in new_keys:
+                new_keys.add(key)
+                needed += 1
+        return needed
+
+    async def _embed(self, alert: "Alert") -> Optional[np.ndarray]:
+        if self.embeddings is None:
+            return None
+        try:
+            vector = np.asarray(await self.embeddings.aembed_query(alert_text(alert)), dtype=np.float32)
+        except Exception as e:
+            print(f"⚠️  告警文本向量化失败，跳过相似度分组: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def _most_similar(self, vector: np.ndarray) -> Optional[AlertGroup]:
+        best, best_score = None, self.similarity_threshold
+        for group in self._open.values():
+            if group.vector is None:
+                continue
+            score = float(group.vector @ vector)
+            if score >= best_score:
+                best, best_score = group, score
+        return best
+
+    async def assign(self, alert: "Alert", can_open: bool = True) -> Tuple[Optional[AlertGroup], bool]:
+        """
+        将告警分配到已打开的组，或新建一个组
+
+        Args:
+            alert: 告警
+            can_open: 是否允许新建组（队列容量不足时为 False）
+
+        Returns:
+            (告警组, 是否新建)；不允许新建且没有可加入的组时返回 (None, False)
+        """
+        group = self._by_fingerprint.get(alert.fingerprint)
+        if group is not None:
+            group.add(alert)
+            self.duplicates += 1
+            return group, False
+
+        key = self.correlation_key(alert)
+        vector = None
+        if self.window > 0:
+            group = self._by_key.get(key) if key is not None else None
+            if group is None:
+                vector = await self._embed(alert)
+                if vector is not None:
+                    group = self._most_similar(vector)
+            if group is not None:
+                group.add(alert)
+                self._by_fingerprint[alert.fingerprint] = group
+                self.alerts_grouped += 1
+                return group, False
+
+        if not can_open:
+            return None, False
+
+        group = AlertGroup(key, alert, self.window, self.max_window)
+        group.vector = vector
+        self._open[group.id] = group
+        self._by_fingerprint[alert.fingerprint] = group
+        if key is not None:
+            self._by_key[key] = group
+        self.groups_created += 1
+        return group, True
+
+    def pop_ready(self, force: bool = False) -> List[AlertGroup]:
+        """
+        取出窗口已关闭的组
+
+        Args:
+            force: 是否取出所有组（停止时使用）
+
+        Returns:
+            已关闭的告警组列表
+        """
+        now = time.monotonic()
+        ready = [g for g in self._open.values() if force or g.closes_at <= now]
+        for group in ready:
+            del self._open[group.id]
+            for fingerprint in group.alerts:
+                if self._by_fingerprint.get(fingerprint) is group:
+                    del self._by_fingerprint[fingerprint]
+            if group.key is not None and self._by_key.get(group.key) is group:
+                del self._by_key[group.key]
+        return ready
+
+    @property
+    def open_groups(self) -> int:
+        """尚未关闭的组数量"""
+        return len(self._open)
+
+    def stats(self) -> dict:
+        """分组效果统计"""
+        return {
+            "open_groups": self.open_groups,
+            "groups_created": self.groups_created,
+            "alerts_grouped": self.alerts_grouped,
+            "duplicates": self.duplicates,
+        }
@@ -0,0 +1,456 @@
+"""
+告警诊断队列
+Alertmanager webhook 收到的告警先在滑动窗口内分组（app/core/alert_grouping.py），
+窗口关闭后整组进入有界异步队列，由固定数量的 worker 取出并调用 Agent 诊断，结果分发给组内所有告警：
+- 有界队列 + 背压：队列满时拒绝新告警（HTTP 429 + Retry-After），Alertmanager 会按自己的策略重发
+- 每条告警有诊断期限（从接收时开始计算），排队超期直接丢弃，诊断超时则取消
+- 统计队列深度、排队延迟和诊断耗时，便于观察告警风暴时的负载
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from config.config_loader import get_config
+from app.core.alert_grouping import DEFAULT_GROUP_BY, AlertGroup, AlertGrouper
+
+
+class Alert:
+    """一条 Alertmanager 告警"""
+
+    def __init__(
+        self,
+        fingerprint: str,
+        status: str,
+        labels: Dict[str, str],
+        annotations: Dict[str, str],
+        starts_at: Optional[str] = None,
+        generator_url: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ):
+        """
+        初始化告警
+
+        Args:
+            fingerprint: Alertmanager 计算的告警指纹
+            status: firing / resolved
+            labels: 告警标签（alertname / namespace / pod 等）
+            annotations: 告警注解（summary / description 等）
+            starts_at: 告警开始时间
+            generator_url: 告警来源链接
+            timeout: 诊断期限（秒，从接收时开始计算），None 表示不限
+        """
+        self.fingerprint = fingerprint
+        self.status = status
+        self.labels = labels
+        self.annotations = annotations
+        self.starts_at = starts_at
+        self.generator_url = generator_url
+        self.received_at = time.monotonic()
+        self.deadline = self.received_at + timeout if timeout else None
+
+    @classmethod
+    def from_alertmanager(cls, data: Dict[str, Any], timeout: Optional[float] = None) -> "Alert":
+        """
+        从 Alertmanager webhook 负载中的单条告警构建
+
+        Args:
+            data: alerts 数组中的一项
+            timeout: 诊断期限（秒）
+
+        Returns:
+            Alert 实例
+        """
+        labels = dict(data.get("labels") or {})
+        fingerprint = data.get("fingerprint") or "|".join(f"{k}={labels[k]}" for k in sorted(labels))
+        return cls(
+            fingerprint=fingerprint,
+            status=data.get("status", "firing"),
+            labels=labels,
+            annotations=dict(data.get("annotations") or {}),
+            starts_at=data.get("startsAt"),
+            generator_url=data.get("generatorURL"),
+            timeout=timeout,
+        )
+
+    @property
+    def name(self) -> str:
+        """告警名称"""
+        return self.labels.get("alertname", "unknown")
+
+    def remaining(self) -> Optional[float]:
+        """距离诊断期限的剩余秒数（不限期时为 None）"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def to_dict(self) -> dict:
+        """转换为可 JSON 序列化的字典"""
+        return {
+            "fingerprint": self.fingerprint,
+            "status": self.status,
+            "labels": self.labels,
+            "annotations": self.annotations,
+            "starts_at": self.starts_at,
+        }
+
+
+class QueueFullError(Exception):
+    """队列已满（或未启动），调用方应稍后重试"""
+
+    def __init__(self, message: str, retry_after: int, status_code: int = 429):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+def _percentile(values: Deque[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class DiagnosisResult(str):
+    """诊断结果文本，degraded 记录结果不完整的原因（None 表示完整诊断）"""
+
+    def __new__(cls, text: str, degraded: Optional[str] = None):
+        result = super().__new__(cls, text)
+        result.degraded = degraded
+        return result
+
+
+AlertHandler = Callable[[AlertGroup], Awaitable[str]]
+
+
+class AlertQueue:
+    """有界告警队列 + worker 池（队列元素为告警组）"""
+
+    def __init__(
+        self,
+        handler: AlertHandler,
+        workers: int = 2,
+        maxsize: int = 100,
+        alert_timeout: Optional[float] = 300,
+        history_size: int = 200,
+        grouper: Optional[AlertGrouper] = None,
+    ):
+        """
+        初始化告警队列
+
+        Args:
+            handler: 诊断函数（协程），参数为告警组，返回诊断结果文本
+            workers: worker 数量（同时进行的诊断数量上限）
+            maxsize: 队列容量（告警组数量，包括尚未关闭的组）
+            alert_timeout: 每条告警的诊断期限（秒，从接收时开始计算）
+            history_size: 保留的最近诊断结果数量
+            grouper: 告警分组器（默认不分组，只折叠同一批次内的重复指纹）
+        """
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.alert_timeout = alert_timeout
+        self.grouper = grouper if grouper is not None else AlertGrouper(window=0)
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._submit_lock: Optional[asyncio.Lock] = None
+
+        # 最近的诊断结果（指纹 -> 结果）
+        self._results: Dict[str, dict] = {}
+        self._history_size = history_size
+
+        # 统计信息
+        self._counters = {"enqueued": 0, "rejected": 0, "processed": 0, "failed": 0, "expired": 0, "timeout": 0}
+        self._wait_times: Deque[float] = deque(maxlen=1000)
+        self._process_times: Deque[float] = deque(maxlen=1000)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        """启动 worker（需在事件循环中调用）"""
+        if self.running:
+            return
+        # 容量由 submit 统一检查（已入队的组 + 尚未关闭的组），队列本身不设上限
+        self._queue = asyncio.Queue()
+        self._submit_lock = asyncio.Lock()
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"alert-worker-{i}")
+            for i in range(self.workers)
+        ]
+        if self.grouper.window > 0:
+            self._tasks.append(asyncio.create_task(self._flusher(), name="alert-grouper"))
+        print(f"✅ 告警诊断队列已启动（{self.workers} 个 worker，容量 {self.maxsize}，分组窗口 {self.grouper.window}s）")
+
+    async def stop(self) -> None:
+        """停止 worker（队列中和尚未关闭的组内未处理的告警会被丢弃）"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _depth(self) -> int:
+        """占用的容量：已入队的组 + 尚未关闭的组"""
+        return (self._queue.qsize() if self._queue is not None else 0) + self.grouper.open_groups
+
+    def _retry_after(self) -> int:
+        """按当前积压和平均诊断耗时估算重试等待秒数"""
+        avg = sum(self._process_times) / len(self._process_times) if self._process_times else 30.0
+        return int(min(300, max(1, self._depth() * avg / max(1, self.workers))))
+
+    async def submit(self, alerts: List[Alert]) -> int:
+        """
+        提交告警（不等待诊断）
+
+        告警先加入已打开的相关组，否则新建组。容量不足以容纳整批告警需要新建的组时整批拒绝，
+        避免 Alertmanager 重发时部分告警重复
+
+        Args:
+            alerts: 告警列表
+
+        Returns:
+            接收的告警数量
+
+        Raises:
+            QueueFullError: 队列未启动（503）或剩余容量不足（429）
+        """
+        if self._queue is None or not self.running:
+            raise QueueFullError("告警诊断队列未启动", retry_after=5, status_code=503)
+
+        async with self._submit_lock:
+            if self.maxsize - self._depth() < self.grouper.groups_needed(alerts):
+                self._counters["rejected"] += len(alerts)
+                raise QueueFullError(
+                    f"告警诊断队列已满（{self._depth()}/{self.maxsize}）",
+                    retry_after=self._retry_after(),
+                )
+            for alert in alerts:
+                group, _ = await self.grouper.assign(alert)
+                self._record_pending(alert, group)
+            self._counters["enqueued"] += len(alerts)
+            self._flush_ready()
+        return len(alerts)
+
+    def _flush_ready(self, force: bool = False) -> None:
+        """将窗口已关闭的组放入队列"""
+        for group in self.grouper.pop_ready(force=force):
+            self._queue.put_nowait(group)
+            if len(group.alerts) > 1:
+                print(f"📦 告警组 {group.id}（{group.key or group.name}）合并了 {len(group.alerts)} 条告警")
+
+    async def _flusher(self) -> None:
+        """定期检查分组窗口"""
+        interval = min(1.0, max(0.05, self.grouper.window / 4))
+        while True:
+            await asyncio.sleep(interval)
+            self._flush_ready()
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            group = await self._queue.get()
+            try:
+                await self._process(group)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, group: AlertGroup) -> None:
+        started = time.monotonic()
+        self._wait_times.append(started - group.received_at)
+
+        remaining = group.remaining()
+        if remaining is not None and remaining <= 0:
+            self._counters["expired"] += 1
+            self._record(group, "expired", None)
+            print(f"⚠️  告警组 {group.name} ({group.id}) 排队超过诊断期限，已丢弃")
+            return
+
+        try:
+            result = await asyncio.wait_for(self.handler(group), timeout=remaining)
+            self._counters["processed"] += 1
+            self._record(group, "done", result)
+        except asyncio.TimeoutError:
+            self._counters["timeout"] += 1
+            self._record(group, "timeout", None)
+            print(f"⚠️  告警组 {group.name} ({group.id}) 诊断超时")
+        except Exception as e:
+            self._counters["failed"] += 1
+            self._record(group, "failed", str(e))
+            print(f"❌ 告警组 {group.name} ({group.id}) 诊断失败: {e}")
+        finally:
+            self._process_times.append(time.monotonic() - started)
+
+    def _store(self, fingerprint: str, entry: dict) -> None:
+        self._results.pop(fingerprint, None)
+        self._results[fingerprint] = entry
+        while len(self._results) > self._history_size:
+            self._results.pop(next(iter(self._results)))
+
+    def _record_pending(self, alert: Alert, group: Optional[AlertGroup]) -> None:
+        self._store(alert.fingerprint, {
+            "alert": alert.to_dict(),
+            "group": group.id if group is not None else None,
+            "status": "pending",
+            "result": None,
+            "finished_at": None,
+        })
+
+    def _record(self, group: AlertGroup, status: str, result: Optional[str]) -> None:
+        """将一次诊断的结果分发给组内所有告警"""
+        finished_at = time.time()
+        for alert in group.members:
+            self._store(alert.fingerprint, {
+                "alert": alert.to_dict(),
+                "group": group.id,
+                "group_size": len(group.alerts),
+                "status": status,
+                "result": result,
+                "degraded": getattr(result, "degraded", None),
+                "finished_at": finished_at,
+            })
+
+    def get_result(self, fingerprint: str) -> Optional[dict]:
+        """查询某条告警最近一次的诊断结果"""
+        return self._results.get(fingerprint)
+
+    def recent_results(self, limit: int = 20) -> List[dict]:
+        """最近的诊断结果（新的在前）"""
+        return list(self._results.values())[-limit:][::-1]
+
+    def metrics(self) -> dict:
+        """队列深度、计数和延迟统计"""
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "depth": self._depth(),
+            "capacity": self.maxsize,
+            **self._counters,
+            **self.grouper.stats(),
+            "queue_wait_p50": round(_percentile(self._wait_times, 0.5), 3),
+            "queue_wait_p95": round(_percentile(self._wait_times, 0.95), 3),
+            "process_p50": round(_percentile(self._process_times, 0.5), 3),
+            "process_p95": round(_percentile(self._process_times, 0.95), 3),
+        }
+
+
+# 诊断问题中逐条列出的相关告警数量上限（其余只给出数量）
+_MAX_LISTED_ALERTS = 20
+
+
+def build_alert_prompt(group: AlertGroup) -> str:
+    """将告警组转换为 Agent 的诊断问题（代表告警给出完整信息，其余告警列出名称和关键标签）"""
+    alert = group.representative
+    labels = "\n".join(f"  {k}: {v}" for k, v in sorted(alert.labels.items()))
+    annotations = "\n".join(f"  {k}: {v}" for k, v in sorted(alert.annotations.items()))
+    prompt = (
+        f"收到 Alertmanager 告警，请按工作流程进行诊断并给出根因分析和建议行动方案。\n\n"
+        f"告警名称: {alert.name}\n"
+        f"状态: {alert.status}\n"
+        f"开始时间: {alert.starts_at or '未知'}\n"
+        f"标签:\n{labels or '  (无)'}\n"
+        f"注解:\n{annotations or '  (无)'}\n"
+    )
+
+    others = group.members[1:]
+    if others:
+        lines = []
+        for other in others[:_MAX_LISTED_ALERTS]:
+            keys = ("namespace", "node", "pod", "severity")
+            brief = ", ".join(f"{k}={other.labels[k]}" for k in keys if other.labels.get(k))
+            lines.append(f"  - {other.name}" + (f" ({brief})" if brief else ""))
+        if len(others) > _MAX_LISTED_ALERTS:
+            lines.append(f"  - ……另有 {len(others) - _MAX_LISTED_ALERTS} 条")
+        prompt += (
+            f"\n同一时间窗口内还有 {len(others)} 条相关告警"
+            f"（关联: {group.key or '告警内容相似'}），它们很可能是同一个根因，请一并分析:\n"
+            + "\n".join(lines) + "\n"
+        )
+    return prompt
+
+
+async def diagnose_alert(group: AlertGroup) -> DiagnosisResult:
+    """
+    调用 Agent 诊断一组告警（一次运行，结果由队列分发给组内所有告警）
+
+    Args:
+        group: 告警组
+
+    Returns:
+        Agent 的最终回答；没有回答或运行期限触发了降级（强制结论、兜底说明、工具超时或跳过）时
+        标记为 degraded，诊断缓存不会保存
+    """
+    # 延迟导入：构建 Agent 时会加载工具和知识库。
+    # 不能导入 app.core.agent：它在导入时调用 asyncio.run，而这里运行在 webhook 的事件循环中
+    from app.core.agent_factory import get_diagnosis_agent
+    from app.core.deadline import deadline_degradation
+
+    agent = await get_diagnosis_agent()
+
+    # 诊断 Agent 没有 checkpointer，运行结束后消息历史随之释放；thread_id 仅用于标识本次运行
+    configurable = {"thread_id": f"alert-{group.id}", "priority": "alert"}
+
+    # 运行期限：从 worker 开始诊断时计算（组在分组窗口内最长等待 max_window 秒，从接收时计算会在诊断开始前就耗尽预算），
+    # 且不晚于告警的诊断期限；Agent 在期限前降级并给出 best-effort 结论，而不是被队列超时直接取消
+    budget = get_config().get('model.deadline.alert_budget', 30)
+    deadline = time.monotonic() + float(budget) if budget else None
+    remaining = group.remaining()
+    if remaining is not None:
+        hard_deadline = time.monotonic() + remaining
+        deadline = hard_deadline if deadline is None else min(deadline, hard_deadline)
+    if deadline is not None:
+        configurable["deadline"] = deadline
+
+    result = await agent.ainvoke(
+        {"messages": [{"role": "user", "content": build_alert_prompt(group)}]},
+        {"configurable": configurable},
+    )
+    messages = result.get("messages", []) if isinstance(result, dict) else []
+    text = str(messages[-1].content) if messages else ""
+    degraded = deadline_degradation(messages) or (None if text.strip() else "empty")
+    if degraded:
+        print(f"⏱️  告警组 {group.name} ({group.id}) 的诊断结论不完整（{degraded}），不会缓存")
+    return DiagnosisResult(text, degraded=degraded)
+
+
+# 全局告警队列实例
+_alert_queue: Optional[AlertQueue] = None
+
+
+def get_alert_queue() -> AlertQueue:
+    """
+    获取告警队列（单例模式，参数从 config.yaml 的 alerting 段读取）
+
+    Returns:
+        AlertQueue 实例
+    """
+    global _alert_queue
+
+    if _alert_queue is None:
+        config = get_config()
+
+        # 告警文本相似度分组复用默认知识库的 embedding 模型
+        embeddings = None
+        if config.get('alerting.grouping.similarity.enabled', False):
+            from app.rag.vector_store import get_vector_store_manager
+            embeddings = get_vector_store_manager().get_embeddings()
+
+        grouper = AlertGrouper(
+            window=float(config.get('alerting.grouping.window', 30)),
+            max_window=float(config.get('alerting.grouping.max_window', 120)),
+            group_by=config.get('alerting.grouping.group_by') or DEFAULT_GROUP_BY,
+            embeddings=embeddings,
+            similarity_threshold=float(config.get('alerting.grouping.similarity.threshold', 0.9)),
+        )
+        # 同一告警在集群状态未变化时复用上一次的诊断结果
+        handler = diagnose_alert
+        if config.get('alerting.diagnosis_cache.enabled', True):
+            from app.core.diagnosis_cache import get_diagnosis_cache
+            handler = get_diagnosis_cache().wrap(diagnose_alert)
+
+        _alert_queue = AlertQueue(
+            handler=handler,
+            workers=int(config.get('alerting.workers', 2)),
+            maxsize=int(config.get('alerting.queue_size', 100)),
+            alert_timeout=config.get('alerting.alert_timeout', 300),
+            grouper=grouper,
+        )
+    return _alert_queue
@@ -0,0 +1,460 @@
+"""
+集群状态缓存（informer）
+诊断过程中会反复列出 Pod、事件、节点和 Deployment，每次都是一次新的 apiserver 请求；
+故障期间 apiserver 本身往往压力最大。这里对核心资源做 list + watch，在本地维护一份完整副本：
+- 首次 list 后从返回的 resourceVersion 开始 watch，连接断开后从最后的 resourceVersion 续传
+- resourceVersion 过期（410 Gone）时重新 list
+- 每类资源的对象数有上限（事件按最近更新保留，其他资源超限后不再用于回答查询）
+- 读取时附带缓存状态：watch 连接中为实时，断开后报告已断开的秒数，超过 max_staleness 不再使用缓存
+
+Agent 的原生只读工具（kubectl_get / kubectl_describe / kubectl_events）优先从这里读取，
+缓存未同步或查询条件无法在本地计算时回退到 apiserver
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from config.config_loader import get_config
+from app.tools.kubernetes_native import (
+    KubernetesAPIError,
+    KubernetesClient,
+    ResourceType,
+    get_kubernetes_client,
+    resolve_resource,
+    strip_noise,
+)
+
+
+# 默认缓存的资源
+DEFAULT_RESOURCES = ("pods", "events", "nodes", "deployments")
+
+
+def parse_label_selector(selector: Optional[str]) -> Optional[List[Callable[[Dict[str, str]], bool]]]:
+    """
+    解析标签选择器（支持 a=b、a==b、a!=b、a、!a、a in (x,y)、a notin (x,y)）
+
+    Args:
+        selector: 标签选择器
+
+    Returns:
+        匹配函数列表；无法解析时返回 None（调用方回退到 apiserver）
+    """
+    if not selector:
+        return []
+    # 按逗号切分，但保留括号内的逗号
+    terms, depth, current = [], 0, ""
+    for ch in selector:
+        depth += ch == "("
+        depth -= ch == ")"
+        if ch == "," and depth == 0:
+            terms.append(current.strip())
+            current = ""
+        else:
+            current += ch
+    terms.append(current.strip())
+
+    matchers = []
+    for term in terms:
+        if not term:
+            continue
+        parts = term.split()
+        if len(parts) >= 3 and parts[1] in ("in", "notin"):
+            key = parts[0]
+            values = {v.strip() for v in " ".join(parts[2:]).strip("()").split(",")}
+            negate = parts[1] == "notin"
+            matchers.append(lambda labels, k=key, vs=values, n=negate: (labels.get(k) in vs) != n)
+        elif "!=" in term:
+            key, value = (x.strip() for x in term.split("!=", 1))
+            matchers.append(lambda labels, k=key, v=value: labels.get(k) != v)
+        elif "=" in term:
+            key, value = (x.strip() for x in term.replace("==", "=").split("=", 1))
+            matchers.append(lambda labels, k=key, v=value: labels.get(k) == v)
+        elif term.startswith("!"):
+            matchers.append(lambda labels, k=term[1:].strip(): k not in labels)
+        elif " " not in term:
+            matchers.append(lambda labels, k=term: k in labels)
+        else:
+            return None
+    return matchers
+
+
+# 本地支持的字段选择器
+_FIELD_GETTERS: Dict[str, Callable[[dict], Any]] = {
+    "metadata.name": lambda o: (o.get("metadata") or {}).get("name"),
+    "metadata.namespace": lambda o: (o.get("metadata") or {}).get("namespace"),
+    "spec.nodeName": lambda o: (o.get("spec") or {}).get("nodeName"),
+    "status.phase": lambda o: (o.get("status") or {}).get("phase"),
+    "involvedObject.kind": lambda o: (o.get("involvedObject") or {}).get("kind"),
+    "involvedObject.name": lambda o: (o.get("involvedObject") or {}).get("name"),
+    "involvedObject.namespace": lambda o: (o.get("involvedObject") or {}).get("namespace"),
+    "type": lambda o: o.get("type"),
+    "reason": lambda o: o.get("reason"),
+}
+
+
+def parse_field_selector(selector: Optional[str]) -> Optional[List[Callable[[dict], bool]]]:
+    """
+    解析字段选择器（仅支持 _FIELD_GETTERS 中的字段，= / == / !=）
+
+    Returns:
+        匹配函数列表；包含不支持的字段时返回 None
+    """
+    if not selector:
+        return []
+    matchers = []
+    for term in selector.split(","):
+        term = term.strip()
+        negate = "!=" in term
+        key, sep, value = term.replace("!=", "=").replace("==", "=").partition("=")
+        getter = _FIELD_GETTERS.get(key.strip())
+        if getter is None or not sep:
+            return None
+        value = value.strip()
+        matchers.append(lambda obj, g=getter, v=value, n=negate: (str(g(obj) or "") == v) != n)
+    return matchers
+
+
+class Informer:
+    """单类资源的 list + watch 本地副本"""
+
+    def __init__(
+        self,
+        client: KubernetesClient,
+        resource: ResourceType,
+        max_objects: int = 20000,
+        watch_timeout: int = 300,
+        page_size: int = 500,
+    ):
+        """
+        初始化 informer
+
+        Args:
+            client: Kubernetes 客户端
+            resource: 资源类型
+            max_objects: 最多保存的对象数（事件超出时淘汰最久未更新的，其他资源超出时标记为不完整）
+            watch_timeout: 单次 watch 的时长（秒），到期后从当前 resourceVersion 继续
+            page_size: list 时的分页大小
+        """
+        self.client = client
+        self.resource = resource
+        self.max_objects = max_objects
+        self.watch_timeout = watch_timeout
+        self.page_size = page_size
+
+        # (命名空间, 名称) -> 对象；按最近更新排序
+        self._objects: "OrderedDict[Tuple[str, str], dict]" = OrderedDict()
+        self.resource_version: Optional[str] = None
+        self.synced = False
+        self.truncated = False
+        self.watching = False
+        self._disconnected_at: Optional[float] = None
+
+        # 统计信息
+        self.lists = 0
+        self.relists_410 = 0
+        self.events = 0
+        self.errors = 0
+        self.evicted = 0
+
+    @staticmethod
+    def _key(obj: dict) -> Tuple[str, str]:
+        metadata = obj.get("metadata") or {}
+        return metadata.get("namespace") or "", metadata.get("name") or ""
+
+    def _put(self, obj: dict) -> None:
+        obj.setdefault("kind", self.resource.kind)
+        key = self._key(obj)
+        self._objects[key] = strip_noise(obj)
+        self._objects.move_to_end(key)
+        while len(self._objects) > self.max_objects:
+            if self.resource.plural != "events":
+                self.truncated = True
+            self._objects.popitem(last=False)
+            self.evicted += 1
+
+    async def _relist(self) -> None:
+        """完整 list（分页），替换本地副本并记录 resourceVersion"""
+        # 全部分页读完后再一次性替换，list 期间查询仍使用旧副本
+        items: List[dict] = []
+        continue_token = None
+        while True:
+            data = await self.client.get_json(
+                self.resource.path(),
+                {"limit": self.page_size, "continue": continue_token},
+            )
+            items.extend(data.get("items", []))
+            metadata = data.get("metadata") or {}
+            continue_token = metadata.get("continue")
+            if not continue_token:
+                break
+
+        self._objects = OrderedDict()
+        self.truncated = False
+        for item in items:
+            self._put(item)
+        self.resource_version = metadata.get("resourceVersion")
+        self.synced = True
+        self.lists += 1
+
+    async def _watch(self) -> None:
+        """从 resourceVersion 开始 watch，直到服务端结束本次 watch"""
+        def connected():
+            self.watching = True
+            self._disconnected_at = None
+
+        async for event in self.client.watch(self.resource, self.resource_version, self.watch_timeout, connected):
+            event_type = event.get("type")
+            obj = event.get("object") or {}
+            if event_type == "ERROR":
+                raise KubernetesAPIError(obj.get("code", 500), obj.get("reason", ""), obj.get("message", ""))
+            version = (obj.get("metadata") or {}).get("resourceVersion")
+            if event_type in ("ADDED", "MODIFIED"):
+                self._put(obj)
+            elif event_type == "DELETED":
+                self._objects.pop(self._key(obj), None)
+            if version:
+                self.resource_version = version
+            self.events += 1
+
+    def _mark_disconnected(self) -> None:
+        if self.watching or self._disconnected_at is None:
+            self._disconnected_at = time.monotonic()
+        self.watching = False
+
+    async def run(self) -> None:
+        """list + watch 主循环（出错时指数退避重试，直到任务被取消）"""
+        backoff = 1.0
+        while True:
+            try:
+                if self.resource_version is None:
+                    await self._relist()
+                await self._watch()
+                backoff = 1.0
+                continue
+            except asyncio.CancelledError:
+                raise
+            except KubernetesAPIError as e:
+                if e.status_code == 410:
+                    # resourceVersion 已被 etcd 压缩，无法续传，重新 list
+                    self.resource_version = None
+                    self.relists_410 += 1
+                    continue
+                self._on_error(e)
+            except Exception as e:
+                self._on_error(e)
+            finally:
+                self._mark_disconnected()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    def _on_error(self, error: Exception) -> None:
+        self.errors += 1
+        if self.errors == 1 or self.errors % 10 == 0:
+            print(f"⚠️  {self.resource.plural} informer 同步失败（第 {self.errors} 次），稍后重试: {error}")
+
+    def staleness(self) -> Optional[float]:
+        """
+        缓存落后的秒数
+
+        Returns:
+            watch 连接中为 0；断开后为断开的秒数；尚未同步时为 None
+        """
+        if not self.synced:
+            return None
+        if self.watching:
+            return 0.0
+        return time.monotonic() - (self._disconnected_at or time.monotonic())
+
+    def items(self) -> List[dict]:
+        """当前缓存的所有对象"""
+        return list(self._objects.values())
+
+    def get(self, namespace: Optional[str], name: str) -> Optional[dict]:
+        """按命名空间和名称读取对象"""
+        return self._objects.get((namespace or "", name))
+
+    def stats(self) -> dict:
+        """同步状态统计"""
+        return {
+            "objects": len(self._objects),
+            "synced": self.synced,
+            "watching": self.watching,
+            "truncated": self.truncated,
+            "staleness": self.staleness(),
+            "resource_version": self.resource_version,
+            "lists": self.lists,
+            "relists_410": self.relists_410,
+            "events": self.events,
+            "errors": self.errors,
+            "evicted": self.evicted,
+        }
+
+
+class ClusterCache:
+    """单个集群的核心资源缓存"""
+
+    def __init__(
+        self,
+        client: KubernetesClient,
+        resources: Sequence[str] = DEFAULT_RESOURCES,
+        max_objects: int = 20000,
+        max_events: int = 5000,
+        max_staleness: float = 60,
+        watch_timeout: int = 300,
+    ):
+        """
+        初始化集群缓存
+
+        Args:
+            client: Kubernetes 客户端
+            resources: 缓存的资源类型
+            max_objects: 每类资源的对象数上限
+            max_events: 事件的数量上限（超出时淘汰最久未更新的事件）
+            max_staleness: watch 断开超过该秒数后不再用缓存回答查询
+            watch_timeout: 单次 watch 的时长（秒）
+        """
+        self.client = client
+        self.max_staleness = max_staleness
+        self.informers: Dict[str, Informer] = {}
+        for name in resources:
+            resource = resolve_resource(name)
+            self.informers[resource.plural] = Informer(
+                client,
+                resource,
+                max_objects=max_events if resource.plural == "events" else max_objects,
+                watch_timeout=watch_timeout,
+            )
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+
+        # 统计信息
+        self.hits = 0
+        self.fallbacks = 0
+
+    def ensure_started(self) -> None:
+        """在当前事件循环中启动 informer（已在运行时不重复启动；事件循环变化时重新启动）"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and not loop.is_closed() and all(not t.done() for t in self._tasks):
+            return
+        for task in self._tasks:
+            task.cancel()
+        self._loop = loop
+        self._tasks = [
+            loop.create_task(informer.run(), name=f"informer-{plural}")
+            for plural, informer in self.informers.items()
+        ]
+        print(f"🔄 集群缓存开始同步: {', '.join(self.informers)}")
+
+    async def stop(self) -> None:
+        """停止所有 informer"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for informer in self.informers.values():
+            informer._mark_disconnected()
+
+    async def wait_synced(self, timeout: float = 30) -> bool:
+        """等待所有 informer 完成首次 list"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if all(i.synced for i in self.informers.values()):
+                return True
+            await asyncio.sleep(0.05)
+        return False
+
+    def query(
+        self,
+        resource: ResourceType,
+        namespace: Optional[str] = None,
+        name: Optional[str] = None,
+        label_selector: Optional[str] = None,
+        field_selector: Optional[str] = None,
+    ) -> Optional[Tuple[List[dict], float]]:
+        """
+        从缓存回答查询
+
+        Args:
+            resource: 资源类型
+            namespace: 命名空间（None 表示所有命名空间）
+            name: 资源名称（可选）
+            label_selector: 标签选择器
+            field_selector: 字段选择器
+
+        Returns:
+            (匹配的对象列表, 缓存落后秒数)；资源未缓存、未同步、过旧、不完整、选择器无法在本地计算，
+            或按名称查询命名空间级资源但没有指定命名空间时返回 None
+        """
+        informer = self.informers.get(resource.plural)
+        staleness = informer.staleness() if informer is not None else None
+        labels = parse_label_selector(label_selector)
+        fields = parse_field_selector(field_selector)
+        # 没有命名空间时无法确定按名称查找的是哪个对象，交给 apiserver 处理（而不是返回本地的“未找到”）
+        unscoped_name = bool(name) and resource.namespaced and namespace is None
+        if (staleness is None or staleness > self.max_staleness or informer.truncated
+                or labels is None or fields is None or unscoped_name):
+            self.fallbacks += 1
+            return None
+
+        if name:
+            obj = informer.get(namespace if resource.namespaced else None, name)
+            candidates = [obj] if obj is not None else []
+        else:
+            candidates = informer.items()
+        items = [
+            obj for obj in candidates
+            if (namespace is None or not resource.namespaced or (obj.get("metadata") or {}).get("namespace") == namespace)
+            and all(m((obj.get("metadata") or {}).get("labels") or {}) for m in labels)
+            and all(m(obj) for m in fields)
+        ]
+        self.hits += 1
+        return items, staleness
+
+    def stats(self) -> dict:
+        """缓存状态和命中统计"""
+        return {
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+            "resources": {plural: informer.stats() for plural, informer in self.informers.items()},
+        }
+
+
+# 每个集群（apiserver + 上下文）一个缓存实例
+_cluster_caches: Dict[Tuple[str, Optional[str]], ClusterCache] = {}
+
+
+def get_cluster_cache(client: Optional[KubernetesClient] = None) -> Optional[ClusterCache]:
+    """
+    获取集群缓存（按集群单例，参数从 config.yaml 的 model.mcp.kubernetes.informer 段读取）
+
+    Args:
+        client: Kubernetes 客户端（默认使用原生工具的全局客户端）
+
+    Returns:
+        ClusterCache 实例；未启用时返回 None
+    """
+    config = get_config()
+    if not config.get('model.mcp.kubernetes.informer.enabled', False):
+        return None
+    client = client or get_kubernetes_client()
+    key = (client.credentials.server, client.credentials.context)
+    cache = _cluster_caches.get(key)
+    if cache is None or cache.client is not client:
+        cache = ClusterCache(
+            client,
+            resources=config.get('model.mcp.kubernetes.informer.resources', DEFAULT_RESOURCES) or DEFAULT_RESOURCES,
+            max_objects=int(config.get('model.mcp.kubernetes.informer.max_objects', 20000)),
+            max_events=int(config.get('model.mcp.kubernetes.informer.max_events', 5000)),
+            max_staleness=float(config.get('model.mcp.kubernetes.informer.max_staleness', 60)),
+            watch_timeout=int(config.get('model.mcp.kubernetes.informer.watch_timeout', 300)),
+        )
+        _cluster_caches[key] = cache
+    return cache
+
+
+def cluster_cache_stats() -> Dict[str, dict]:
+    """所有集群缓存的同步状态（集群 -> 统计信息）"""
+    return {
+        f"{server} ({context})": cache.stats()
+        for (server, context), cache in _cluster_caches.items()
+    }
@@ -0,0 +1,419 @@
+"""
+集群状态快照与变更记录
+排查故障时最常问的是"最近几分钟集群里变了什么"。以前只能重新列出所有资源让 LLM 自己对比。
+这里定期记录每个对象的精简状态（phase / 就绪数 / 重启次数 / 镜像 / 节点状况等）及其哈希，
+只对 resourceVersion 变化的对象重新计算，与上一次快照的差异以增量形式保存；
+what_changed 工具合并时间窗口内的增量，返回一份很短的变更记录
+
+对象来源优先使用集群状态缓存（informer），缓存不可用时直接 list apiserver
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+from langchain_core.tools import BaseTool, tool
+from config.config_loader import get_config
+from app.tools.kubernetes_native import (
+    KubernetesClient,
+    get_kubernetes_client,
+    resolve_resource,
+    summarize_object,
+)
+
+
+# 默认记录快照的资源
+DEFAULT_SNAPSHOT_RESOURCES = ("pods", "deployments", "statefulsets", "daemonsets", "nodes")
+
+# (kind, 命名空间, 名称)
+ObjectKey = Tuple[str, str, str]
+
+
+def _images(pod_spec: dict) -> List[str]:
+    return sorted(c.get("image", "") for c in pod_spec.get("containers") or [])
+
+
+def object_state(obj: dict) -> Dict[str, Any]:
+    """
+    提取对象中与排障相关的精简状态（忽略时间戳等每次都会变化的字段）
+
+    Args:
+        obj: 资源对象
+
+    Returns:
+        状态字典
+    """
+    kind = obj.get("kind")
+    spec = obj.get("spec") or {}
+    status = obj.get("status") or {}
+    summary = summarize_object(obj)
+    summary.pop("age", None)
+    summary.pop("name", None)
+    summary.pop("namespace", None)
+
+    if kind == "Pod":
+        summary["images"] = _images(spec)
+        summary.pop("ip", None)
+    elif kind in ("Deployment", "StatefulSet", "DaemonSet", "ReplicaSet"):
+        template = spec.get("template") or {}
+        summary["images"] = _images(template.get("spec") or {})
+        # Pod 模板（环境变量、资源限制、探针等）的变化只记录哈希
+        summary["template"] = hashlib.sha1(json.dumps(template, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+        if kind != "DaemonSet":
+            summary["replicas"] = spec.get("replicas")
+    elif kind == "Node":
+        summary["taints"] = sorted(f"{t.get('key')}:{t.get('effect')}" for t in spec.get("taints") or [])
+        summary.pop("version", None)
+    elif "phase" in status:
+        summary["status"] = status["phase"]
+    return summary
+
+
+def diff_states(before: Optional[dict], after: Optional[dict]) -> Dict[str, List[Any]]:
+    """
+    比较两个状态
+
+    Returns:
+        字段 -> [旧值, 新值]（只包含变化的字段）
+    """
+    before, after = before or {}, after or {}
+    return {
+        key: [before.get(key), after.get(key)]
+        for key in sorted(set(before) | set(after))
+        if before.get(key) != after.get(key)
+    }
+
+
+def _digest(state: dict) -> str:
+    return hashlib.sha1(json.dumps(state, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class SnapshotStore:
+    """增量快照：保存最新状态和每次快照相对上一次的变化"""
+
+    def __init__(self, retention: float = 3600, max_changes_per_snapshot: int = 2000):
+        """
+        初始化快照存储
+
+        Args:
+            retention: 增量的保留时间（秒）
+            max_changes_per_snapshot: 单次快照最多记录的变化数（防止重新部署大量 Pod 时内存暴涨）
+        """
+        self.retention = retention
+        self.max_changes_per_snapshot = max_changes_per_snapshot
+
+        # 最新状态：对象 -> (resourceVersion, 状态哈希, 状态)
+        self._current: Dict[ObjectKey, Tuple[Optional[str], str, dict]] = {}
+        # 增量：(快照时间, {对象: (旧状态, 新状态)})，None 表示不存在
+        self._deltas: Deque[Tuple[float, Dict[ObjectKey, Tuple[Optional[dict], Optional[dict]]]]] = deque()
+        self.first_snapshot_at: Optional[float] = None
+        self.last_snapshot_at: Optional[float] = None
+
+        # 统计信息
+        self.snapshots = 0
+        self.objects_hashed = 0
+        self.objects_skipped = 0
+
+    def take(self, objects_by_kind: Dict[str, List[dict]], at: Optional[float] = None) -> int:
+        """
+        记录一次快照
+
+        Args:
+            objects_by_kind: kind -> 该类型的所有对象（未出现的 kind 不做删除判断）
+            at: 快照时间（Unix 时间戳，默认当前时间）
+
+        Returns:
+            本次检测到的变化数
+        """
+        at = time.time() if at is None else at
+        changes: Dict[ObjectKey, Tuple[Optional[dict], Optional[dict]]] = {}
+        seen = set()
+
+        for kind, objects in objects_by_kind.items():
+            for obj in objects:
+                metadata = obj.get("metadata") or {}
+                key = (kind, metadata.get("namespace") or "", metadata.get("name") or "")
+                seen.add(key)
+                version = metadata.get("resourceVersion")
+                previous = self._current.get(key)
+                # resourceVersion 未变化的对象跳过，不重新计算状态
+                if previous is not None and version is not None and previous[0] == version:
+                    self.objects_skipped += 1
+                    continue
+                state = object_state({"kind": kind, **obj})
+                digest = _digest(state)
+                self.objects_hashed += 1
+                self._current[key] = (version, digest, state)
+                if previous is None:
+                    if self.first_snapshot_at is not None:
+                        changes[key] = (None, state)
+                elif previous[1] != digest:
+                    changes[key] = (previous[2], state)
+
+        kinds = set(objects_by_kind)
+        for key in [k for k in self._current if k[0] in kinds and k not in seen]:
+            changes[key] = (self._current.pop(key)[2], None)
+
+        if self.first_snapshot_at is None:
+            self.first_snapshot_at = at
+        self.last_snapshot_at = at
+        self.snapshots += 1
+        if changes:
+            if len(changes) > self.max_changes_per_snapshot:
+                changes = dict(list(changes.items())[: self.max_changes_per_snapshot])
+            self._deltas.append((at, changes))
+        while self._deltas and self._deltas[0][0] < at - self.retention:
+            self._deltas.popleft()
+        if self.first_snapshot_at < at - self.retention:
+            self.first_snapshot_at = at - self.retention
+        return len(changes)
+
+    def changes_since(
+        self,
+        since: float,
+        namespace: Optional[str] = None,
+        kinds: Optional[Sequence[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        合并 since 之后的所有增量
+
+        Args:
+            since: 起始时间（Unix 时间戳）
+            namespace: 只看该命名空间（节点等集群级资源始终包含）
+            kinds: 只看这些 kind
+
+        Returns:
+            变更列表（按最后变化时间倒序），每项包含对象、变化类型、字段差异、首次 / 最后变化时间
+        """
+        merged: Dict[ObjectKey, Dict[str, Any]] = {}
+        for at, changes in self._deltas:
+            if at < since:
+                continue
+            for key, (before, after) in changes.items():
+                if kinds and key[0] not in kinds:
+                    continue
+                if namespace and key[1] and key[1] != namespace:
+                    continue
+                entry = merged.get(key)
+                if entry is None:
+                    merged[key] = {"before": before, "after": after, "first": at, "last": at, "times": 1}
+                else:
+                    entry["after"] = after
+                    entry["last"] = at
+                    entry["times"] += 1
+
+        result = []
+        for (kind, ns, name), entry in merged.items():
+            before, after = entry["before"], entry["after"]
+            if before is None and after is None:
+                continue
+            if before is None:
+                change = "added"
+            elif after is None:
+                change = "removed"
+            else:
+                change = "modified"
+            diff = diff_states(before, after) if change == "modified" else {}
+            if change == "modified" and not diff:
+                # 窗口内变化后又恢复原状，只记录发生过波动
+                change = "flapped"
+            result.append({
+                "kind": kind,
+                "namespace": ns,
+                "name": name,
+                "change": change,
+                "diff": diff,
+                "state": after if change == "added" else None,
+                "first": entry["first"],
+                "last": entry["last"],
+                "times": entry["times"],
+            })
+        result.sort(key=lambda c: c["last"], reverse=True)
+        return result
+
+    def stats(self) -> dict:
+        """快照统计"""
+        return {
+            "objects": len(self._current),
+            "deltas": len(self._deltas),
+            "snapshots": self.snapshots,
+            "objects_hashed": self.objects_hashed,
+            "objects_skipped": self.objects_skipped,
+            "covers_seconds": (self.last_snapshot_at - self.first_snapshot_at) if self.first_snapshot_at else 0,
+        }
+
+
+class ClusterSnapshotter:
+    """定期从集群缓存（或 apiserver）采集对象并记录快照"""
+
+    def __init__(
+        self,
+        client: KubernetesClient,
+        resources: Sequence[str] = DEFAULT_SNAPSHOT_RESOURCES,
+        interval: float = 30,
+        retention: float = 3600,
+    ):
+        """
+        初始化快照采集器
+
+        Args:
+            client: Kubernetes 客户端
+            resources: 记录快照的资源类型
+            interval: 快照间隔（秒）
+            retention: 增量的保留时间（秒）
+        """
+        self.client = client
+        self.resources = [resolve_resource(r) for r in resources]
+        self.interval = interval
+        self.store = SnapshotStore(retention=retention)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _collect(self) -> Dict[str, List[dict]]:
+        from app.core.cluster_cache import get_cluster_cache
+
+        cache = get_cluster_cache(self.client)
+        objects: Dict[str, List[dict]] = {}
+        for resource in self.resources:
+            informer = cache.informers.get(resource.plural) if cache is not None else None
+            if informer is not None and informer.synced and not informer.truncated:
+                objects[resource.kind] = informer.items()
+                continue
+            try:
+                objects[resource.kind] = (await self.client.list(resource)).get("items", [])
+            except Exception as e:
+                # 本次跳过该资源（不会被误判为删除）
+                print(f"⚠️  快照采集 {resource.plural} 失败: {e}")
+        return objects
+
+    async def snapshot(self) -> int:
+        """立即记录一次快照，返回检测到的变化数"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            return self.store.take(await self._collect())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.snapshot()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️  记录集群快照失败: {e}")
+            await asyncio.sleep(self.interval)
+
+    def ensure_started(self) -> None:
+        """在当前事件循环中启动定期快照（已在运行时不重复启动）"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task is not None and not self._task.done():
+            return
+        self._loop = loop
+        self._lock = asyncio.Lock()
+        self._task = loop.create_task(self._run(), name="cluster-snapshots")
+
+    async def stop(self) -> None:
+        """停止定期快照"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def format_changelog(changes: List[Dict[str, Any]], limit: int = 50) -> List[str]:
+    """
+    将变更列表格式化为紧凑的文本行
+
+    Args:
+        changes: changes_since 的返回值
+        limit: 最多展示的条数
+
+    Returns:
+        文本行列表
+    """
+    lines = []
+    for c in changes[:limit]:
+        when = datetime.fromtimestamp(c["last"]).strftime("%H:%M:%S")
+        target = f"{c['kind']} {c['namespace'] + '/' if c['namespace'] else ''}{c['name']}"
+        if c["change"] == "modified":
+            detail = ", ".join(f"{k}: {json.dumps(v[0], ensure_ascii=False)} → {json.dumps(v[1], ensure_ascii=False)}" for k, v in c["diff"].items())
+        elif c["change"] == "added":
+            detail = json.dumps(c["state"], ensure_ascii=False)
+        else:
+            detail = ""
+        times = f" (x{c['times']})" if c["times"] > 1 else ""
+        lines.append(f"[{when}] {target} {c['change']}{times}{': ' + detail if detail else ''}")
+    if len(changes) > limit:
+        lines.append(f"... 另有 {len(changes) - limit} 处变化未展示")
+    return lines
+
+
+# 全局快照采集器实例
+_snapshotter: Optional[ClusterSnapshotter] = None
+
+
+def get_cluster_snapshotter() -> Optional[ClusterSnapshotter]:
+    """
+    获取集群快照采集器（单例模式，参数从 config.yaml 的 model.mcp.kubernetes.snapshots 段读取）
+
+    Returns:
+        ClusterSnapshotter 实例；未启用时返回 None
+    """
+    global _snapshotter
+
+    config = get_config()
+    if not config.get('model.mcp.kubernetes.snapshots.enabled', False):
+        return None
+    client = get_kubernetes_client()
+    if _snapshotter is None or _snapshotter.client is not client:
+        _snapshotter = ClusterSnapshotter(
+            client,
+            resources=config.get('model.mcp.kubernetes.snapshots.resources', DEFAULT_SNAPSHOT_RESOURCES) or DEFAULT_SNAPSHOT_RESOURCES,
+            interval=float(config.get('model.mcp.kubernetes.snapshots.interval', 30)),
+            retention=float(config.get('model.mcp.kubernetes.snapshots.retention', 3600)),
+        )
+    return _snapshotter
+
+
+@tool
+async def what_changed(minutes: int = 15, namespace: Optional[str] = None, kinds: Optional[str] = None) -> str:
+    """
+    查看最近一段时间集群中发生了哪些变化（Pod 状态 / 重启次数 / 镜像、工作负载副本数和模板、节点状况等）
+    比重新列出所有资源更快，适合排查"故障前后变了什么"
+    参数:
+    - minutes: 查看最近多少分钟的变化（默认 15）
+    - namespace: 只看某个命名空间（可选，节点等集群级资源始终包含）
+    - kinds: 只看某些资源类型，逗号分隔，例如 Pod,Deployment（可选）
+    返回:
+    - 变更记录（时间 对象 变化类型: 字段 旧值 → 新值）
+    """
+    try:
+        snapshotter = get_cluster_snapshotter()
+        if snapshotter is None:
+            return "集群快照未启用（model.mcp.kubernetes.snapshots.enabled）"
+        snapshotter.ensure_started()
+        # 先记录一次最新状态，确保变更记录包含到当前时刻
+        await snapshotter.snapshot()
+
+        store = snapshotter.store
+        now = time.time()
+        since = now - minutes * 60
+        kind_list = [resolve_resource(k).kind for k in kinds.split(",")] if kinds else None
+        changes = store.changes_since(since, namespace=namespace, kinds=kind_list)
+
+        covered = now - (store.first_snapshot_at or now)
+        header = f"最近 {minutes} 分钟共 {len(changes)} 个对象发生变化"
+        if covered < minutes * 60:
+            header += f"（快照只覆盖最近 {covered / 60:.1f} 分钟，更早的变化无法得知）"
+        lines = format_changelog(changes)
+        return header + ("：\n" + "\n".join(lines) if lines else "")
+    except Exception as e:
+        return f"查询集群变化失败: {e}"
+
+
+def get_snapshot_tools() -> List[BaseTool]:
+    """获取集群快照相关工具（未启用时为空列表）"""
+    return [what_changed] if get_config().get('model.mcp.kubernetes.snapshots.enabled', False) else []
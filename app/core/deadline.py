@@ -0,0 +1,318 @@
+"""
+Agent 运行期限
+一次 Agent 运行没有总时间上限：可能连续调用很多次工具，RAG 中间件还会触发第二轮模型调用。
+DeadlineMiddleware 为每次运行设置期限，随剩余时间减少逐级降级：
+1. 工具调用超时不超过剩余时间（扣除最终回答的预留时间），时间用完后不再执行工具
+2. 剩余时间低于 skip_optional_below 时跳过可选步骤（RAG 知识库增强）
+3. 按剩余时间和输出速度降低 max_tokens
+4. 剩余时间只够最终回答时，去掉工具并要求模型根据已有信息直接给出结论（best-effort）
+
+期限的来源（按优先级）：
+- 线程配置 configurable.deadline：time.monotonic() 时钟下的截止时间（告警诊断从 worker 开始诊断时计算）
+- 线程配置 configurable.time_budget：从本次运行开始计算的秒数
+- config.yaml 的 model.deadline.default_budget（为空表示不限）
+
+降级产生的消息在 response_metadata["deadline"] 中记录原因，调用方可以用 deadline_degradation 判断结果是否完整
+（如告警诊断缓存不保存降级的结论）
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from typing_extensions import NotRequired
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain.agents.middleware.types import AgentState, ModelRequest, ModelResponse, ToolCallRequest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.config import get_config as get_runnable_config
+from langgraph.types import Command
+from config.config_loader import get_config
+
+
+# 剩余时间只够最终回答时追加的提示（模型路由中间件据此直接使用 final 模型）
+DEADLINE_FINAL_MARKER = "诊断时间即将用完"
+
+# 消息 response_metadata 中记录降级原因的键
+DEADLINE_METADATA_KEY = "deadline"
+
+# 降级原因，按严重程度排列
+DEGRADATION_REASONS = ("fallback", "forced_final", "tool_timeout", "tool_skipped")
+
+_FINAL_PROMPT = f"""{DEADLINE_FINAL_MARKER}，不能再调用工具。
+请根据目前已经收集到的信息直接给出诊断结论和建议行动方案，并说明哪些检查因时间不足没有完成。"""
+
+
+class DeadlineState(AgentState):
+    """带运行期限的 Agent 状态"""
+
+    deadline: NotRequired[Optional[float]]
+    """time.monotonic() 时钟下的截止时间，None 表示不限"""
+
+
+def remaining_time(state: Any) -> Optional[float]:
+    """
+    本次运行距离期限的剩余秒数
+
+    Args:
+        state: Agent 状态
+
+    Returns:
+        剩余秒数（可能为负数）；没有期限时返回 None
+    """
+    deadline = state.get("deadline") if isinstance(state, dict) else getattr(state, "deadline", None)
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def optional_step_allowed(state: Any) -> bool:
+    """
+    剩余时间是否足够执行可选步骤（如 RAG 知识库增强）
+
+    Args:
+        state: Agent 状态
+
+    Returns:
+        没有期限或剩余时间不少于 model.deadline.skip_optional_below 秒时返回 True
+    """
+    remaining = remaining_time(state)
+    if remaining is None:
+        return True
+    return remaining >= float(get_config().get('model.deadline.skip_optional_below', 15))
+
+
+def deadline_degradation(messages: Any) -> Optional[str]:
+    """
+    一次运行中最严重的降级原因
+
+    Args:
+        messages: 运行结束后的消息列表
+
+    Returns:
+        fallback / forced_final / tool_timeout / tool_skipped；没有降级时返回 None
+    """
+    found = {
+        (getattr(message, "response_metadata", None) or {}).get(DEADLINE_METADATA_KEY)
+        for message in messages or []
+    }
+    return next((reason for reason in DEGRADATION_REASONS if reason in found), None)
+
+
+def _configured_max_tokens(model: Any) -> Optional[int]:
+    """模型配置的 max_tokens（对冲模型取主接口的配置）"""
+    value = getattr(model, "max_tokens", None)
+    if value is None and getattr(model, "endpoints", None):
+        value = getattr(model.endpoints[0][1], "max_tokens", None)
+    return value
+
+
+class DeadlineMiddleware(AgentMiddleware):
+    """
+    Agent 运行期限中间件
+
+    工作流程：
+    1. 运行开始时确定截止时间并写入状态（deadline）
+    2. 每次模型调用按剩余时间限制 max_tokens 和调用时长，调用超时则改为最终回答
+    3. 每次工具调用的超时不超过剩余时间，时间用完后直接返回跳过说明
+    4. 剩余时间只够最终回答时，去掉工具强制输出结论；仍然超时则返回兜底说明
+    """
+
+    state_schema = DeadlineState
+
+    def __init__(
+        self,
+        default_budget: Optional[float] = None,
+        final_reserve: float = 8.0,
+        min_final_time: float = 5.0,
+        tool_timeout: Optional[float] = None,
+        tokens_per_second: float = 40.0,
+        min_tokens: int = 256,
+    ):
+        """
+        初始化运行期限中间件
+
+        Args:
+            default_budget: 没有在线程配置中指定期限时的默认时间预算（秒），None 表示不限
+            final_reserve: 为最终回答预留的秒数，剩余时间低于该值时强制输出结论
+            min_final_time: 强制输出结论时至少等待的秒数（即使已经超过期限）
+            tool_timeout: 单次工具调用的超时上限（秒），None 表示只受剩余时间限制
+            tokens_per_second: 估计的模型输出速度，用于按剩余时间计算 max_tokens
+            min_tokens: max_tokens 的下限
+        """
+        super().__init__()
+        self.default_budget = default_budget
+        self.final_reserve = final_reserve
+        self.min_final_time = min_final_time
+        self.tool_timeout = tool_timeout
+        self.tokens_per_second = tokens_per_second
+        self.min_tokens = min_tokens
+
+        # 统计信息
+        self._counters = {
+            "runs": 0,
+            "tokens_limited": 0,
+            "model_timeouts": 0,
+            "forced_final": 0,
+            "fallback_answers": 0,
+            "tool_timeouts": 0,
+            "tools_skipped": 0,
+        }
+
+    def _resolve_deadline(self) -> Optional[float]:
+        try:
+            configurable = get_runnable_config().get("configurable", {})
+        except RuntimeError:
+            configurable = {}
+        if configurable.get("deadline") is not None:
+            return float(configurable["deadline"])
+        budget = configurable.get("time_budget", self.default_budget)
+        return time.monotonic() + float(budget) if budget else None
+
+    async def abefore_agent(self, state: DeadlineState, runtime: Any) -> dict[str, Any] | None:
+        """运行开始时确定截止时间（同一线程的每次运行重新计算）"""
+        deadline = self._resolve_deadline()
+        if deadline is not None:
+            self._counters["runs"] += 1
+        return {"deadline": deadline}
+
+    def _limit_tokens(self, request: ModelRequest, seconds: float) -> ModelRequest:
+        """按可用时间限制本次调用的 max_tokens"""
+        limit = max(int(seconds * self.tokens_per_second), self.min_tokens)
+        current = request.model_settings.get("max_tokens") or _configured_max_tokens(request.model)
+        if current is not None and current <= limit:
+            return request
+        self._counters["tokens_limited"] += 1
+        return request.override(model_settings={**request.model_settings, "max_tokens": limit})
+
+    async def _final_answer(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+        remaining: float,
+    ) -> ModelResponse:
+        """去掉工具，要求模型根据已有信息直接给出结论"""
+        self._counters["forced_final"] += 1
+        timeout = max(remaining, self.min_final_time)
+        print(f"⏱️  剩余时间 {max(remaining, 0):.1f}s，停止调用工具并生成最终结论")
+        final_request = self._limit_tokens(
+            request.override(
+                tools=[],
+                tool_choice=None,
+                messages=[*request.messages, HumanMessage(content=_FINAL_PROMPT)],
+            ),
+            timeout,
+        )
+        try:
+            response = await asyncio.wait_for(handler(final_request), timeout=timeout)
+            for message in response.result:
+                if isinstance(message, AIMessage):
+                    message.response_metadata[DEADLINE_METADATA_KEY] = "forced_final"
+            return response
+        except asyncio.TimeoutError:
+            self._counters["fallback_answers"] += 1
+            tools_used = sorted({
+                call["name"]
+                for message in request.messages if isinstance(message, AIMessage)
+                for call in message.tool_calls
+            })
+            detail = f"已执行的检查：{'、'.join(tools_used)}，结果见上文。" if tools_used else "尚未执行任何检查。"
+            return ModelResponse(
+                result=[AIMessage(
+                    content=f"⏱️ 诊断超出时间预算，未能生成完整结论。{detail}",
+                    response_metadata={DEADLINE_METADATA_KEY: "fallback"},
+                )]
+            )
+
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        """按剩余时间限制模型调用"""
+        remaining = remaining_time(request.state)
+        if remaining is None:
+            return await handler(request)
+        if remaining <= self.final_reserve:
+            return await self._final_answer(request, handler, remaining)
+
+        available = remaining - self.final_reserve
+        try:
+            return await asyncio.wait_for(handler(self._limit_tokens(request, available)), timeout=available)
+        except asyncio.TimeoutError:
+            self._counters["model_timeouts"] += 1
+            return await self._final_answer(request, handler, remaining_time(request.state))
+
+    async def awrap_tool_call(
+        self,
+        request: ToolCallRequest,
+        handler: Callable[[ToolCallRequest], Awaitable[ToolMessage | Command]],
+    ) -> ToolMessage | Command:
+        """工具调用的超时不超过剩余时间（扣除最终回答的预留时间）"""
+        remaining = remaining_time(request.state)
+        if remaining is None:
+            if self.tool_timeout is None:
+                return await handler(request)
+            available = self.tool_timeout
+        else:
+            available = remaining - self.final_reserve
+            if self.tool_timeout is not None:
+                available = min(available, self.tool_timeout)
+
+        tool_call = request.tool_call
+        if available <= 0:
+            self._counters["tools_skipped"] += 1
+            return ToolMessage(
+                content="⏱️ 诊断时间预算已用完，跳过该工具调用",
+                tool_call_id=tool_call["id"],
+                name=tool_call["name"],
+                status="error",
+                response_metadata={DEADLINE_METADATA_KEY: "tool_skipped"},
+            )
+        try:
+            return await asyncio.wait_for(handler(request), timeout=available)
+        except asyncio.TimeoutError:
+            self._counters["tool_timeouts"] += 1
+            print(f"⏱️  工具 {tool_call['name']} 超过 {available:.1f}s 未返回，已取消")
+            return ToolMessage(
+                content=f"⏱️ 工具调用超时（{available:.1f}s），已取消",
+                tool_call_id=tool_call["id"],
+                name=tool_call["name"],
+                status="error",
+                response_metadata={DEADLINE_METADATA_KEY: "tool_timeout"},
+            )
+
+    def stats(self) -> dict:
+        """降级统计"""
+        return dict(self._counters)
+
+
+_deadline_middleware: Optional[DeadlineMiddleware] = None
+
+
+def get_deadline_middleware() -> Optional[DeadlineMiddleware]:
+    """
+    获取按 config.yaml 的 model.deadline 段配置的运行期限中间件（单例模式）
+
+    Returns:
+        DeadlineMiddleware 实例；未启用时返回 None
+    """
+    global _deadline_middleware
+
+    config = get_config()
+    if not config.get('model.deadline.enabled', True):
+        return None
+    if _deadline_middleware is None:
+        _deadline_middleware = DeadlineMiddleware(
+            default_budget=config.get('model.deadline.default_budget'),
+            final_reserve=float(config.get('model.deadline.final_reserve', 8)),
+            min_final_time=float(config.get('model.deadline.min_final_time', 5)),
+            tool_timeout=config.get('model.deadline.tool_timeout'),
+            tokens_per_second=float(config.get('model.deadline.tokens_per_second', 40)),
+            min_tokens=int(config.get('model.deadline.min_tokens', 256)),
+        )
+    return _deadline_middleware
+
+
+def deadline_stats() -> Optional[dict]:
+    """运行期限降级统计（未启用或尚未创建时返回 None）"""
+    return _deadline_middleware.stats() if _deadline_middleware is not None else None
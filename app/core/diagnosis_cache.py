@@ -0,0 +1,420 @@
+"""
+诊断结果缓存
+问题持续期间同一告警会反复触发，每次都完整运行一次 Agent（工具调用 + RAG + LLM）。
+缓存按每条告警的指纹保存：告警指纹 -> (该告警相关资源的状态摘要, 诊断结果)。
+告警组中每条告警都有条目、状态摘要（如 Pod phase / 重启次数）都未变化、且来自同一次诊断时直接返回该诊断结果，
+组成员变化（出现新告警）、状态变化或超过 TTL 后重新诊断
+
+集群状态由可替换的探针（probe）获取，默认按配置的 Kubernetes 工具后端只读取告警指向的单个对象
+（Pod / 工作负载 / 节点，集群缓存已同步时直接在本地查询）。只缓存完整的诊断结果：空结果和降级结果（如超出时间预算）不缓存
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Optional
+from config.config_loader import get_config
+from app.core.alert_grouping import AlertGroup
+
+if TYPE_CHECKING:
+    from app.core.alert_queue import Alert
+
+
+# 探针：根据单条告警返回相关资源的状态摘要（None 表示无法获取，不使用缓存）
+StateProbe = Callable[["Alert"], Awaitable[Optional[str]]]
+
+# 告警标签 -> 工作负载资源类型（没有 pod 标签时读取工作负载对象）
+_WORKLOAD_RESOURCES = (("deployment", "deployments"), ("statefulset", "statefulsets"), ("daemonset", "daemonsets"))
+
+# 参与状态摘要的工作负载副本数字段
+_REPLICA_FIELDS = (
+    "replicas", "readyReplicas", "availableReplicas", "updatedReplicas", "unavailableReplicas",
+    "desiredNumberScheduled", "numberReady", "numberAvailable", "numberUnavailable",
+)
+
+_CONDITION_TYPES = (
+    "Ready", "MemoryPressure", "DiskPressure", "PIDPressure", "NetworkUnavailable",
+    "Available", "Progressing", "ReplicaFailure",
+)
+
+
+def _tool_output_text(output: Any) -> str:
+    """将工具输出（字符串 / 内容块列表 / (内容, artifact) 元组）统一为文本"""
+    if isinstance(output, tuple):
+        output = output[0]
+    if isinstance(output, list):
+        return "".join(
+            block.get("text", "") if isinstance(block, dict) else str(block)
+            for block in output
+        )
+    return str(output)
+
+
+def _object_state(item: Dict[str, Any]) -> tuple:
+    """
+    提取单个资源中稳定的状态字段（忽略 age / 时间戳等每次都会变化的字段）
+
+    同时兼容完整的 Kubernetes 对象和 MCP 返回的精简对象
+    """
+    metadata = item.get("metadata") or {}
+    status = item.get("status")
+    name = metadata.get("name") or item.get("name")
+
+    if isinstance(status, dict):
+        phase = status.get("phase")
+        containers = status.get("containerStatuses") or []
+        restarts = sum(c.get("restartCount", 0) for c in containers)
+        ready = all(c.get("ready", False) for c in containers) if containers else None
+        conditions = tuple(sorted(
+            (c.get("type"), c.get("status"))
+            for c in status.get("conditions") or []
+            if c.get("type") in _CONDITION_TYPES
+        ))
+        replicas = tuple(status.get(field) for field in _REPLICA_FIELDS)
+        return (name, phase, restarts, ready, conditions, replicas)
+    return (name, status, item.get("restarts"), item.get("ready"))
+
+
+def digest_state(text: str) -> str:
+    """
+    计算 kubectl_get 输出的状态摘要
+
+    Args:
+        text: 工具输出文本（JSON 或表格）
+
+    Returns:
+        十六进制摘要
+    """
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        data = None
+
+    if isinstance(data, dict) and isinstance(data.get("items"), list):
+        states = sorted((_object_state(item) for item in data["items"] if isinstance(item, dict)), key=str)
+        payload = json.dumps(states, default=str)
+    elif isinstance(data, dict):
+        payload = json.dumps(_object_state(data), default=str)
+    else:
+        # 表格输出：只保留每行前 4 列（NAME / READY / STATUS / RESTARTS），忽略 AGE 等易变列
+        rows = [" ".join(line.split()[:4]) for line in str(text).splitlines() if line.strip()]
+        payload = "\n".join(sorted(rows))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class KubernetesStateProbe:
+    """
+    获取告警相关资源的状态摘要
+
+    只读取告警指向的单个对象：Pod（pod 标签）、工作负载（deployment / statefulset / daemonset 标签）或节点，
+    命名空间内其他对象的变化不会让缓存失效；同一时刻相同的查询只执行一次。
+
+    按 model.mcp.kubernetes.backend 选择数据来源：
+    - native / hybrid：集群缓存（informer）已同步时直接在本地查询，否则调用原生 kubectl_get
+      （hybrid 下原生客户端不可用时改用 MCP）
+    - mcp：Kubernetes MCP 的 kubectl_get（首次调用会启动 npx 进程）
+    """
+
+    def __init__(self, tool_name: str = "kubectl_get", backend: Optional[str] = None):
+        """
+        初始化探针
+
+        Args:
+            tool_name: 读取资源使用的工具名称
+            backend: Kubernetes 工具后端（默认读取 model.mcp.kubernetes.backend）
+        """
+        self.tool_name = tool_name
+        self.backend = backend
+        self._tool = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _backend(self) -> str:
+        return self.backend or get_config().get('model.mcp.kubernetes.backend', 'mcp')
+
+    async def _get_mcp_tool(self):
+        from app.core.mcp_servers.kubernetes_mcp import get_kubernetes_mcp_tools
+
+        k8s_config = get_config().get('model.mcp.kubernetes', {}) or {}
+        tools = await get_kubernetes_mcp_tools(
+            non_destructive=k8s_config.get('non_destructive', False),
+            kubeconfig=k8s_config.get('kubeconfig'),
+            context=k8s_config.get('context'),
+        )
+        return next((t for t in tools if t.name == self.tool_name), None)
+
+    async def _get_tool(self):
+        if self._tool is None:
+            backend = self._backend()
+            if backend in ("native", "hybrid"):
+                try:
+                    from app.tools.kubernetes_native import get_kubernetes_client, get_kubernetes_native_tools
+
+                    get_kubernetes_client()  # 提前校验 kubeconfig，失败时 hybrid 改用 MCP
+                    tools = get_kubernetes_native_tools()
+                    self._tool = next((t for t in tools if t.name == self.tool_name), None)
+                except Exception as e:
+                    if backend == "native":
+                        raise
+                    print(f"⚠️  诊断缓存无法使用 Kubernetes 原生客户端，改用 MCP: {e}")
+            if self._tool is None and backend in ("mcp", "hybrid"):
+                self._tool = await self._get_mcp_tool()
+        return self._tool
+
+    def _from_cluster_cache(self, query: Dict[str, Any]) -> Optional[str]:
+        """集群缓存已同步时直接在本地计算摘要（不启动 informer，也不访问 apiserver）"""
+        if self._backend() not in ("native", "hybrid"):
+            return None
+        try:
+            from app.core.cluster_cache import get_cluster_cache
+            from app.tools.kubernetes_native import get_kubernetes_client, resolve_resource
+
+            client = get_kubernetes_client()
+            cache = get_cluster_cache(client)
+            if cache is None:
+                return None
+            namespace = query.get("namespace")
+            resource = resolve_resource(query["resourceType"])
+            cached = cache.query(
+                resource,
+                namespace=(namespace or client.default_namespace) if resource.namespaced else None,
+                name=query["name"],
+            )
+        except Exception:
+            return None
+        if not cached or not cached[0]:
+            return None
+        return digest_state(json.dumps(cached[0][0], default=str))
+
+    @staticmethod
+    def query_for(alert: "Alert") -> Optional[Dict[str, Any]]:
+        """
+        根据告警标签确定要读取的单个对象
+
+        Returns:
+            kubectl_get 参数；告警没有可定位到单个对象的标签时返回 None
+        """
+        labels = alert.labels
+        namespace = labels.get("namespace")
+        if namespace and labels.get("pod"):
+            return {"resourceType": "pods", "name": labels["pod"], "namespace": namespace, "output": "json"}
+        if namespace:
+            for label, resource_type in _WORKLOAD_RESOURCES:
+                if labels.get(label):
+                    return {"resourceType": resource_type, "name": labels[label], "namespace": namespace, "output": "json"}
+        if labels.get("node"):
+            return {"resourceType": "nodes", "name": labels["node"], "output": "json"}
+        return None
+
+    async def _digest(self, query: Dict[str, Any]) -> Optional[str]:
+        digest = self._from_cluster_cache(query)
+        if digest is not None:
+            return digest
+        tool = await self._get_tool()
+        if tool is None:
+            return None
+        text = _tool_output_text(await tool.ainvoke(query))
+        # 请求的是 JSON 输出，无法解析说明工具返回了错误文本（如对象不存在），不能作为状态摘要
+        try:
+            json.loads(text)
+        except ValueError:
+            raise ValueError(f"kubectl_get 未返回 JSON: {text[:200]}")
+        return digest_state(text)
+
+    async def __call__(self, alert: "Alert") -> Optional[str]:
+        query = self.query_for(alert)
+        if query is None:
+            return None
+        key = json.dumps(query, sort_keys=True)
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            digest = await self._digest(query)
+            future.set_result(digest)
+            return digest
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # 没有其他等待者时不报 "exception was never retrieved"
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+
+class DiagnosisCache:
+    """按告警指纹保存 (状态摘要, 诊断结果) 的诊断结果缓存"""
+
+    def __init__(self, probe: Optional[StateProbe] = None, ttl: float = 600, max_entries: int = 1000,
+                 max_members: int = 20):
+        """
+        初始化诊断结果缓存
+
+        Args:
+            probe: 集群状态探针（默认 KubernetesStateProbe）
+            ttl: 缓存有效期（秒）
+            max_entries: 最大缓存条目数（告警数，超出时淘汰最早的条目）
+            max_members: 告警数超过该值的组不使用缓存（避免为一次诊断发出大量状态查询）
+        """
+        self.probe = probe if probe is not None else KubernetesStateProbe()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_members = max_members
+        self._entries: Dict[str, dict] = {}
+        self._diagnosis_ids = itertools.count(1)
+
+        # 统计信息
+        self._counters = {
+            "hits": 0, "misses": 0, "state_changed": 0, "expired": 0, "probe_errors": 0,
+            "not_cached": 0, "too_large": 0,
+        }
+
+    async def _digests(self, group: AlertGroup) -> Optional[Dict[str, str]]:
+        """
+        组内每条告警的状态摘要
+
+        Returns:
+            告警指纹 -> 状态摘要；组太大、任何一条告警无法定位或获取失败时返回 None（不使用缓存）
+        """
+        if len(group.alerts) > self.max_members:
+            self._counters["too_large"] += 1
+            return None
+        members = group.members
+        try:
+            digests = await asyncio.gather(*(self.probe(alert) for alert in members))
+        except Exception as e:
+            self._counters["probe_errors"] += 1
+            print(f"⚠️  获取集群状态摘要失败，跳过诊断缓存: {e}")
+            return None
+        if any(digest is None for digest in digests):
+            return None
+        return {alert.fingerprint: digest for alert, digest in zip(members, digests)}
+
+    def lookup(self, digests: Dict[str, str]) -> Optional[str]:
+        """
+        查找缓存的诊断结果
+
+        Args:
+            digests: 告警指纹 -> 当前的状态摘要（组内所有告警）
+
+        Returns:
+            诊断结果；任何一条告警没有条目、已过期、状态已变化，或各条目来自不同的诊断时返回 None
+        """
+        now = time.monotonic()
+        diagnoses = set()
+        for fingerprint, digest in digests.items():
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            if now - entry["created_at"] > self.ttl:
+                self._counters["expired"] += 1
+                del self._entries[fingerprint]
+                return None
+            if entry["digest"] != digest:
+                self._counters["state_changed"] += 1
+                del self._entries[fingerprint]
+                return None
+            diagnoses.add(entry["diagnosis"])
+        if len(diagnoses) != 1:
+            # 组成员此前分属不同的诊断：重新诊断整组
+            self._counters["misses"] += 1
+            return None
+        self._counters["hits"] += 1
+        return self._entries[next(iter(digests))]["result"]
+
+    def store(self, digests: Dict[str, str], result: str) -> None:
+        """为组内每条告警保存诊断结果"""
+        diagnosis = next(self._diagnosis_ids)
+        created_at = time.monotonic()
+        for fingerprint, digest in digests.items():
+            self._entries.pop(fingerprint, None)
+            self._entries[fingerprint] = {
+                "digest": digest, "result": result, "diagnosis": diagnosis, "created_at": created_at,
+            }
+        while len(self._entries) > self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+
+    @staticmethod
+    def cacheable(result: Optional[str]) -> bool:
+        """
+        诊断结果是否可以缓存
+
+        Args:
+            result: 诊断函数的返回值（DiagnosisResult 的 degraded 标记说明结果不完整）
+
+        Returns:
+            非空且没有降级标记时返回 True
+        """
+        return bool(result) and not getattr(result, "degraded", None)
+
+    def invalidate(self, fingerprint: Optional[str] = None) -> int:
+        """
+        使缓存失效
+
+        Args:
+            fingerprint: 只清除该告警的条目（默认清空全部）
+
+        Returns:
+            清除的条目数
+        """
+        if fingerprint is None:
+            count = len(self._entries)
+            self._entries.clear()
+            return count
+        return 1 if self._entries.pop(fingerprint, None) is not None else 0
+
+    def wrap(self, handler: Callable[[AlertGroup], Awaitable[str]]) -> Callable[[AlertGroup], Awaitable[str]]:
+        """
+        为诊断函数加上缓存
+
+        Args:
+            handler: 诊断函数
+
+        Returns:
+            带缓存的诊断函数（状态摘要获取失败或诊断结果不完整时直接返回且不缓存）
+        """
+        async def cached(group: AlertGroup) -> str:
+            digests = await self._digests(group)
+            if digests is not None:
+                result = self.lookup(digests)
+                if result is not None:
+                    print(f"♻️  告警组 {group.name} 集群状态未变化，复用上一次诊断结果")
+                    return result
+
+            result = await handler(group)
+            if digests is not None and self.cacheable(result):
+                self.store(digests, result)
+            elif digests is not None:
+                self._counters["not_cached"] += 1
+            return result
+
+        return cached
+
+    def stats(self) -> dict:
+        """缓存命中统计"""
+        return {"entries": len(self._entries), "ttl": self.ttl, **self._counters}
+
+
+# 全局诊断缓存实例
+_diagnosis_cache: Optional[DiagnosisCache] = None
+
+
+def get_diagnosis_cache() -> DiagnosisCache:
+    """
+    获取诊断结果缓存（单例模式，参数从 config.yaml 的 alerting.diagnosis_cache 段读取）
+
+    Returns:
+        DiagnosisCache 实例
+    """
+    global _diagnosis_cache
+
+    if _diagnosis_cache is None:
+        config = get_config()
+        _diagnosis_cache = DiagnosisCache(
+            ttl=float(config.get('alerting.diagnosis_cache.ttl', 600)),
+            max_entries=int(config.get('alerting.diagnosis_cache.max_entries', 1000)),
+            max_members=int(config.get('alerting.diagnosis_cache.max_members', 20)),
+        )
+    return _diagnosis_cache
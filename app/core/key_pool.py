@@ -0,0 +1,528 @@
+"""
+API Key 池
+每个供应商只配置一个 Key 时，吞吐受单个 Key 的速率限制约束，遇到 429 只能等待。
+KeyPool 把请求分散到多个 Key 上：
+- 每个 Key 可以设置每分钟请求数（rpm）和每分钟 token 数（tpm）预算，按最近 60 秒的用量选择利用率最低的 Key
+- 返回 429 的 Key 进入冷却（优先使用 Retry-After，连续 429 时冷却时间翻倍），冷却期间不再分配
+- 所有 Key 都不可用时等待最早恢复的 Key（有上限），而不是固定睡眠
+
+接入方式：
+- 智谱 Embedding：ZhipuAIEmbeddings 遇到 429 时换下一个 Key 重试
+- OpenAI 兼容的对话模型：KeyPoolAuth 作为 httpx 的认证流程，为每个请求选择 Key，429 时换 Key 重发；
+  预估 token 数包含请求的 max_tokens，响应结束后按响应体（JSON 或 SSE 最后的 usage 块）中的实际用量修正
+"""
+import asyncio
+import json
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Deque, Dict, Generator, Iterator, List, Optional, Sequence, Tuple, Union
+
+import httpx
+from config.config_loader import get_config
+
+
+WINDOW_SECONDS = 60.0
+
+
+class KeyPoolExhaustedError(RuntimeError):
+    """等待超时仍没有可用的 Key"""
+
+
+class APIKey:
+    """一个 API Key 及其最近 60 秒的用量"""
+
+    def __init__(self, secret: str, rpm: Optional[int] = None, tpm: Optional[int] = None, name: Optional[str] = None):
+        """
+        初始化 API Key
+
+        Args:
+            secret: Key 内容
+            rpm: 每分钟请求数预算（None 表示不限制）
+            tpm: 每分钟 token 数预算（None 表示不限制）
+            name: 展示名称（默认为脱敏后的 Key）
+        """
+        self.secret = secret
+        self.rpm = rpm
+        self.tpm = tpm
+        self.name = name or (f"{secret[:4]}...{secret[-4:]}" if len(secret) > 12 else "***")
+
+        self._usage: Deque[Tuple[float, int]] = deque()
+        self.cooldown_until = 0.0
+        self.consecutive_429 = 0
+        self.inflight = 0
+        self.requests = 0
+        self.tokens = 0
+        self.rate_limited = 0
+
+    def _trim(self, now: float) -> None:
+        while self._usage and now - self._usage[0][0] >= WINDOW_SECONDS:
+            self._usage.popleft()
+
+    def window_usage(self, now: float) -> Tuple[int, int]:
+        """最近 60 秒的 (请求数, token 数)"""
+        self._trim(now)
+        return len(self._usage), sum(tokens for _, tokens in self._usage)
+
+    def utilization(self, now: float, extra_tokens: int = 0) -> float:
+        """加上本次请求后的预算利用率（请求数和 token 数中较高的一项）"""
+        requests, tokens = self.window_usage(now)
+        ratios = [0.0]
+        if self.rpm:
+            ratios.append((requests + 1) / self.rpm)
+        if self.tpm:
+            ratios.append((tokens + extra_tokens) / self.tpm)
+        return max(ratios)
+
+    def available_at(self, now: float, tokens: int) -> float:
+        """这个 Key 最早可以再发送本次请求的时间"""
+        at = max(now, self.cooldown_until)
+        self._trim(now)
+        if self.rpm and len(self._usage) >= self.rpm:
+            at = max(at, self._usage[len(self._usage) - self.rpm][0] + WINDOW_SECONDS)
+        if self.tpm:
+            total = sum(t for _, t in self._usage) + tokens
+            for ts, used in self._usage:
+                if total <= self.tpm:
+                    break
+                total -= used
+                at = max(at, ts + WINDOW_SECONDS)
+        return at
+
+
+class KeyPool:
+    """多个 API Key 的负载分配与 429 冷却"""
+
+    def __init__(
+        self,
+        name: str,
+        keys: Sequence[Union[str, dict]],
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        default_cooldown: float = 10.0,
+        max_cooldown: float = 120.0,
+        max_wait: float = 30.0,
+    ):
+        """
+        初始化 Key 池
+
+        Args:
+            name: 池名称（一般为供应商名称）
+            keys: Key 列表，每项为字符串或 {key, rpm, tpm, name}
+            rpm: 每个 Key 默认的每分钟请求数预算
+            tpm: 每个 Key 默认的每分钟 token 数预算
+            default_cooldown: 429 响应没有 Retry-After 时的冷却秒数
+            max_cooldown: 冷却秒数上限
+            max_wait: 所有 Key 都不可用时最多等待的秒数
+        """
+        self.name = name
+        self.keys: List[APIKey] = []
+        for item in keys:
+            if isinstance(item, str):
+                item = {"key": item}
+            if not item.get("key"):
+                continue
+            self.keys.append(APIKey(item["key"], item.get("rpm", rpm), item.get("tpm", tpm), item.get("name")))
+        if not self.keys:
+            raise ValueError(f"Key 池 {name} 没有配置任何 Key")
+        self.default_cooldown = default_cooldown
+        self.max_cooldown = max_cooldown
+        self.max_wait = max_wait
+        self.waits = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def try_acquire(self, tokens: int = 0) -> Tuple[Optional[APIKey], float]:
+        """
+        选择一个 Key 并记录本次用量（不等待）
+
+        Args:
+            tokens: 本次请求预计消耗的 token 数
+
+        Returns:
+            (Key, 0)；没有可用 Key 时返回 (None, 最早可用的时间)
+        """
+        now = time.monotonic()
+        with self._lock:
+            ready = [k for k in self.keys if k.available_at(now, tokens) <= now]
+            if not ready:
+                return None, min(k.available_at(now, tokens) for k in self.keys)
+            key = min(ready, key=lambda k: (k.utilization(now, tokens), k.inflight))
+            key._usage.append((now, tokens))
+            key.requests += 1
+            key.tokens += tokens
+            key.inflight += 1
+            return key, 0.0
+
+    def _fallback(self) -> APIKey:
+        """等待超时：使用冷却最早结束的 Key，由服务端决定是否接受"""
+        with self._lock:
+            key = min(self.keys, key=lambda k: k.cooldown_until)
+            key.requests += 1
+            key.inflight += 1
+            return key
+
+    def acquire(self, tokens: int = 0, max_wait: Optional[float] = None) -> APIKey:
+        """
+        选择一个 Key（同步版本，所有 Key 都不可用时阻塞等待）
+
+        Args:
+            tokens: 本次请求预计消耗的 token 数
+            max_wait: 最多等待的秒数（默认使用池的 max_wait）
+
+        Returns:
+            APIKey；等待超时后返回冷却最早结束的 Key
+        """
+        deadline = time.monotonic() + (self.max_wait if max_wait is None else max_wait)
+        while True:
+            key, available_at = self.try_acquire(tokens)
+            if key is not None:
+                return key
+            if available_at >= deadline:
+                return self._fallback()
+            self.waits += 1
+            time.sleep(max(available_at - time.monotonic(), 0.01))
+
+    async def aacquire(self, tokens: int = 0, max_wait: Optional[float] = None) -> APIKey:
+        """选择一个 Key（异步版本，所有 Key 都不可用时 await 等待）"""
+        deadline = time.monotonic() + (self.max_wait if max_wait is None else max_wait)
+        while True:
+            key, available_at = self.try_acquire(tokens)
+            if key is not None:
+                return key
+            if available_at >= deadline:
+                return self._fallback()
+            self.waits += 1
+            await asyncio.sleep(max(available_at - time.monotonic(), 0.01))
+
+    def release(self, key: APIKey, tokens: Optional[int] = None, estimated: int = 0) -> None:
+        """
+        请求结束
+
+        Args:
+            key: acquire 返回的 Key
+            tokens: 服务端报告的实际 token 数（可选，用于修正预算窗口中的预估值）
+            estimated: acquire 时的预估 token 数
+        """
+        with self._lock:
+            key.inflight = max(key.inflight - 1, 0)
+            if tokens is not None and tokens != estimated:
+                key.tokens += tokens - estimated
+                for i in range(len(key._usage) - 1, -1, -1):
+                    ts, used = key._usage[i]
+                    if used == estimated:
+                        key._usage[i] = (ts, tokens)
+                        break
+
+    def mark_success(self, key: APIKey) -> None:
+        """请求成功，重置连续 429 计数"""
+        key.consecutive_429 = 0
+
+    def mark_rate_limited(self, key: APIKey, retry_after: Optional[float] = None) -> float:
+        """
+        Key 返回 429：进入冷却
+
+        Args:
+            key: 返回 429 的 Key
+            retry_after: 响应头 Retry-After 的秒数（可选）
+
+        Returns:
+            冷却秒数
+        """
+        with self._lock:
+            key.rate_limited += 1
+            key.consecutive_429 += 1
+            base = retry_after if retry_after is not None else self.default_cooldown
+            cooldown = min(base * (2 ** (key.consecutive_429 - 1)), self.max_cooldown)
+            key.cooldown_until = max(key.cooldown_until, time.monotonic() + cooldown)
+            return cooldown
+
+    def has_available(self) -> bool:
+        """当前是否有不在冷却中的 Key"""
+        now = time.monotonic()
+        return any(k.cooldown_until <= now for k in self.keys)
+
+    def stats(self) -> dict:
+        """每个 Key 的预算利用率、冷却状态和累计用量"""
+        now = time.monotonic()
+        keys = []
+        with self._lock:
+            for k in self.keys:
+                requests, tokens = k.window_usage(now)
+                keys.append({
+                    "name": k.name,
+                    "requests_last_minute": requests,
+                    "tokens_last_minute": tokens,
+                    "rpm": k.rpm,
+                    "tpm": k.tpm,
+                    "utilization": round(max(
+                        requests / k.rpm if k.rpm else 0.0,
+                        tokens / k.tpm if k.tpm else 0.0,
+                    ), 3),
+                    "cooldown_remaining": round(max(k.cooldown_until - now, 0.0), 1),
+                    "inflight": k.inflight,
+                    "requests": k.requests,
+                    "tokens": k.tokens,
+                    "rate_limited": k.rate_limited,
+                })
+        return {"keys": keys, "waits": self.waits}
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _estimate_request_tokens(request: httpx.Request) -> int:
+    """
+    粗略估计请求消耗的 token 数：请求体长度（约 4 字节 1 个 token）+ 请求的最大输出 token 数
+
+    响应结束后按实际用量修正（见 _UsageParser）
+    """
+    try:
+        content = request.content
+    except httpx.RequestNotRead:
+        return 0
+    tokens = len(content) // 4
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return tokens
+    if isinstance(body, dict):
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        if isinstance(max_tokens, int):
+            tokens += max_tokens
+    return tokens
+
+
+# 非流式响应最多缓存多少字节用于解析 usage（超过后放弃修正，保留预估值）
+_MAX_USAGE_BODY = 4 * 1024 * 1024
+
+
+class _UsageParser:
+    """从响应体（JSON 或 SSE）中提取 usage.total_tokens（流式响应取最后一个带 usage 的块）"""
+
+    def __init__(self, response: httpx.Response):
+        encoding = response.headers.get("content-encoding", "identity").lower()
+        self._decoder = None
+        if encoding == "gzip":
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            self._decoder = zlib.decompressobj()
+        self._enabled = encoding in ("identity", "gzip", "deflate")
+        self._sse = "text/event-stream" in response.headers.get("content-type", "")
+        self._buffer = b""
+        self.tokens: Optional[int] = None
+
+    def _parse(self, data: bytes) -> None:
+        try:
+            usage = json.loads(data).get("usage")
+        except (ValueError, AttributeError):
+            return
+        if isinstance(usage, dict) and isinstance(usage.get("total_tokens"), int):
+            self.tokens = usage["total_tokens"]
+
+    def _parse_line(self, line: bytes) -> None:
+        line = line.strip()
+        if line.startswith(b"data:") and b'"usage"' in line:
+            self._parse(line[5:].strip())
+
+    def feed(self, chunk: bytes) -> None:
+        """处理一段原始响应体"""
+        if not self._enabled:
+            return
+        try:
+            if self._decoder is not None:
+                chunk = self._decoder.decompress(chunk)
+        except zlib.error:
+            self._enabled = False
+            return
+        self._buffer += chunk
+        if self._sse:
+            *lines, self._buffer = self._buffer.split(b"\n")
+            for line in lines:
+                self._parse_line(line)
+        elif len(self._buffer) > _MAX_USAGE_BODY:
+            self._enabled = False
+            self._buffer = b""
+
+    def finish(self) -> Optional[int]:
+        """
+        响应结束
+
+        Returns:
+            实际 token 数；无法解析（未读完、压缩格式不支持等）时返回 None
+        """
+        if self._enabled and self._buffer:
+            if self._sse:
+                self._parse_line(self._buffer)
+            else:
+                self._parse(self._buffer)
+        self._buffer = b""
+        return self.tokens
+
+
+class _SyncUsageStream(httpx.SyncByteStream):
+    """同步响应体包装：读取时解析 usage，关闭时回调"""
+
+    def __init__(self, stream: httpx.SyncByteStream, parser: _UsageParser, on_close: Callable[[], None]):
+        self._stream = stream
+        self._parser = parser
+        self._on_close = on_close
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self._stream:
+            self._parser.feed(chunk)
+            yield chunk
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            self._on_close()
+
+
+class _AsyncUsageStream(httpx.AsyncByteStream):
+    """异步响应体包装：读取时解析 usage，关闭时回调"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, parser: _UsageParser, on_close: Callable[[], None]):
+        self._stream = stream
+        self._parser = parser
+        self._on_close = on_close
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            self._parser.feed(chunk)
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._on_close()
+
+
+class KeyPoolAuth(httpx.Auth):
+    """
+    httpx 认证流程：每个请求从 Key 池选择 Key，429 时把该 Key 置为冷却并换下一个 Key 重发
+
+    只在还有不在冷却中的 Key 时重发，全部冷却时把 429 交还给调用方（OpenAI SDK 自身的重试会再次经过这里）
+    """
+
+    def __init__(self, pool: KeyPool):
+        self.pool = pool
+
+    def _authorize(self, request: httpx.Request, key: APIKey) -> None:
+        request.headers["Authorization"] = f"Bearer {key.secret}"
+
+    def _release_on_close(self, response: httpx.Response, key: APIKey, estimated: int) -> Tuple[_UsageParser, Callable[[], None]]:
+        """响应体关闭时释放 Key，并用响应中的实际用量修正预估值"""
+        parser = _UsageParser(response)
+        released = False
+
+        def on_close() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self.pool.release(key, parser.finish(), estimated)
+
+        return parser, on_close
+
+    def sync_auth_flow(self, request: httpx.Request) -> Generator[httpx.Request, httpx.Response, None]:
+        tokens = _estimate_request_tokens(request)
+        for attempt in range(len(self.pool)):
+            key = self.pool.acquire(tokens)
+            self._authorize(request, key)
+            response = yield request
+            if response.status_code != 429:
+                self.pool.mark_success(key)
+                response.stream = _SyncUsageStream(response.stream, *self._release_on_close(response, key, tokens))
+                return
+            self.pool.release(key)
+            self.pool.mark_rate_limited(key, _retry_after(response))
+            if not self.pool.has_available():
+                return
+            response.close()
+
+    async def async_auth_flow(self, request: httpx.Request) -> AsyncGenerator[httpx.Request, httpx.Response]:
+        tokens = _estimate_request_tokens(request)
+        for attempt in range(len(self.pool)):
+            key = await self.pool.aacquire(tokens)
+            self._authorize(request, key)
+            response = yield request
+            if response.status_code != 429:
+                self.pool.mark_success(key)
+                response.stream = _AsyncUsageStream(response.stream, *self._release_on_close(response, key, tokens))
+                return
+            self.pool.release(key)
+            self.pool.mark_rate_limited(key, _retry_after(response))
+            if not self.pool.has_available():
+                return
+            await response.aclose()
+
+
+_key_pools: Dict[str, KeyPool] = {}
+_key_pools_lock = threading.Lock()
+
+
+def get_key_pool(provider: str) -> KeyPool:
+    """
+    获取供应商的 Key 池（单例，按 config.yaml 的 model.<供应商> 段创建）
+
+    Key 来自 api_keys 列表（字符串或 {key, rpm, tpm, name}），没有配置时使用单个 api；
+    默认预算和冷却参数来自 model.<供应商>.key_pool
+
+    Args:
+        provider: 供应商名称，如 'deepseek' 或 'glm'
+
+    Returns:
+        KeyPool 实例
+
+    Raises:
+        ValueError: 供应商没有配置任何 Key
+    """
+    with _key_pools_lock:
+        if provider not in _key_pools:
+            config = get_config()
+            keys = config.get(f'model.{provider}.api_keys') or [config.get(f'model.{provider}.api')]
+            options = config.get(f'model.{provider}.key_pool', {}) or {}
+            _key_pools[provider] = KeyPool(
+                provider,
+                [k for k in keys if k],
+                rpm=options.get('rpm'),
+                tpm=options.get('tpm'),
+                default_cooldown=float(options.get('default_cooldown', 10)),
+                max_cooldown=float(options.get('max_cooldown', 120)),
+                max_wait=float(options.get('max_wait', 30)),
+            )
+        return _key_pools[provider]
+
+
+def key_pool_http_clients(provider: str) -> Dict[str, Any]:
+    """
+    供应商配置了多个 Key 时，返回使用 Key 池认证的 httpx 客户端（传给 ChatOpenAI 的 http_client / http_async_client）
+
+    Args:
+        provider: 供应商名称
+
+    Returns:
+        参数字典；只有一个 Key 时返回空字典（沿用 SDK 默认客户端）
+    """
+    config = get_config()
+    if len(config.get(f'model.{provider}.api_keys') or []) < 2:
+        return {}
+    auth = KeyPoolAuth(get_key_pool(provider))
+    return {
+        "http_client": httpx.Client(auth=auth, timeout=None),
+        "http_async_client": httpx.AsyncClient(auth=auth, timeout=None),
+    }
+
+
+def key_pool_stats() -> Dict[str, dict]:
+    """所有已创建的 Key 池的统计"""
+    return {name: pool.stats() for name, pool in _key_pools.items()}
@@ -0,0 +1,445 @@
+"""
+LLM 对冲请求与故障切换
+单个模型接口变慢或卡住时，整个诊断都会被拖住。HedgedChatModel 包装同一角色的多个 OpenAI 兼容模型（主模型 + 备用模型）：
+- 按接口统计最近的首 token 延迟（TTFT），主模型的首 token 超过其 TTFT 分位数仍未到达时，
+  向下一个接口发出对冲请求，先开始输出内容的一方胜出，另一方被取消
+- 主模型在首 token 之前出错时立即切换到下一个接口
+- 每个接口一个熔断器：连续失败达到阈值后一段时间内不再发送请求，冷却后放行一个试探请求
+- 首 token 和两次输出之间都有超时上限，卡住的流不会无限等待
+
+首 token 之后的失败无法切换（内容已经输出给调用方），直接抛出
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict, PrivateAttr
+from config.config_loader import get_config
+
+
+class CircuitOpenError(RuntimeError):
+    """所有接口的熔断器都处于打开状态"""
+
+
+class TTFTTracker:
+    """
+    滚动窗口内的首 token 延迟统计
+
+    被取消的请求（对冲落选或调用方取消）记录已等待的时间作为截尾样本：真实 TTFT 不小于该值。
+    只统计胜出请求会让分位数偏低（慢的请求总是被取消），进而让对冲越来越激进
+    """
+
+    def __init__(self, window: int = 200):
+        """
+        初始化 TTFT 统计
+
+        Args:
+            window: 保留最近多少次调用的 TTFT（含截尾样本）
+        """
+        self._samples: Deque[float] = deque(maxlen=window)
+        self.censored = 0
+
+    def record(self, ttft: float, censored: bool = False) -> None:
+        """
+        记录一次 TTFT（秒）
+
+        Args:
+            ttft: 首 token 延迟；censored 时为取消前已等待的时间
+            censored: 是否是截尾样本（请求在首 token 之前被取消）
+        """
+        self._samples.append(ttft)
+        if censored:
+            self.censored += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """第 q 百分位的 TTFT，没有样本时返回 None"""
+        if not self._samples:
+            return None
+        return float(np.percentile(self._samples, q))
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    closed：正常放行；连续失败 failure_threshold 次后进入 open
+    open：拒绝请求，reset_timeout 秒后进入 half_open
+    half_open：只放行一个试探请求，成功则 closed，失败则重新 open
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        """
+        初始化熔断器
+
+        Args:
+            failure_threshold: 连续失败多少次后熔断
+            reset_timeout: 熔断后多少秒放行试探请求
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否放行一次请求"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def release(self) -> None:
+        """试探请求被取消（既不算成功也不算失败），允许再次试探"""
+        with self._lock:
+            self._probing = False
+
+
+class _Endpoint:
+    """一个模型接口及其统计"""
+
+    def __init__(self, name: str, model: BaseChatModel, breaker: CircuitBreaker, window: int):
+        self.name = name
+        self.model = model
+        self.breaker = breaker
+        self.ttft = TTFTTracker(window)
+        self.requests = 0
+        self.wins = 0
+        self.failures = 0
+        self.cancelled = 0
+
+
+def _has_output(chunk: ChatGenerationChunk) -> bool:
+    """是否是有实际内容的块（只有 role 的首个空块不算首 token）"""
+    message = chunk.message
+    return bool(message.content) or bool(getattr(message, "tool_call_chunks", None))
+
+
+class HedgedChatModel(BaseChatModel):
+    """
+    对冲请求的聊天模型包装
+
+    所有接口都需要是 OpenAI 兼容模型：工具通过第一个接口的 bind_tools 转换为请求参数，原样发给其他接口
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    endpoints: List[Tuple[str, BaseChatModel]]
+    """(名称, 模型) 列表，按优先级排列"""
+    hedge_percentile: float = 95.0
+    """主接口首 token 超过该百分位的历史 TTFT 仍未到达时发出对冲请求"""
+    min_hedge_delay: float = 0.5
+    max_hedge_delay: float = 10.0
+    initial_hedge_delay: float = 3.0
+    """样本不足（少于 min_samples）时使用的对冲等待时间"""
+    min_samples: int = 20
+    first_token_timeout: float = 60.0
+    """所有接口都没有输出首 token 时的总等待上限"""
+    idle_timeout: float = 60.0
+    """两次输出之间的最长间隔"""
+    failure_threshold: int = 3
+    reset_timeout: float = 30.0
+    window: int = 200
+
+    _endpoints: List[_Endpoint] = PrivateAttr(default_factory=list)
+    _hedges: int = PrivateAttr(default=0)
+    _secondary_wins: int = PrivateAttr(default=0)
+    _failovers: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context: Any) -> None:
+        super().model_post_init(__context)
+        self._endpoints = [
+            _Endpoint(name, model, CircuitBreaker(self.failure_threshold, self.reset_timeout), self.window)
+            for name, model in self.endpoints
+        ]
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged-chat"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"endpoints": [name for name, _ in self.endpoints]}
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        """用第一个接口的 bind_tools 转换工具定义，转换结果作为调用参数发给所有接口"""
+        binding = self._endpoints[0].model.bind_tools(tools, **kwargs)
+        return self.bind(**binding.kwargs)
+
+    def _hedge_delay(self, endpoint: _Endpoint) -> float:
+        if len(endpoint.ttft) < self.min_samples:
+            return self.initial_hedge_delay
+        delay = endpoint.ttft.percentile(self.hedge_percentile)
+        return min(max(delay, self.min_hedge_delay), self.max_hedge_delay)
+
+    async def _open_stream(
+        self,
+        endpoint: _Endpoint,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]],
+        kwargs: Dict[str, Any],
+    ) -> Tuple[AsyncIterator[ChatGenerationChunk], List[ChatGenerationChunk]]:
+        """
+        向一个接口发起流式请求，直到收到首个有内容的块
+
+        Returns:
+            (流, 已收到的块)；流已经结束时已收到的块就是全部输出
+        """
+        endpoint.requests += 1
+        started = time.perf_counter()
+        stream = endpoint.model._astream(messages, stop=stop, **kwargs)
+        received: List[ChatGenerationChunk] = []
+        try:
+            async for chunk in stream:
+                received.append(chunk)
+                if _has_output(chunk):
+                    break
+        except asyncio.CancelledError:
+            endpoint.ttft.record(time.perf_counter() - started, censored=True)
+            await stream.aclose()
+            raise
+        except BaseException:
+            await stream.aclose()
+            raise
+        endpoint.ttft.record(time.perf_counter() - started)
+        return stream, received
+
+    def _pick(self) -> List[_Endpoint]:
+        """熔断器放行的接口（按优先级）；全部熔断时抛出 CircuitOpenError"""
+        allowed = [e for e in self._endpoints if e.breaker.allow()]
+        if not allowed:
+            raise CircuitOpenError(f"所有模型接口均已熔断: {[e.name for e in self._endpoints]}")
+        return allowed
+
+    async def _race(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]],
+        kwargs: Dict[str, Any],
+    ) -> Tuple[_Endpoint, AsyncIterator[ChatGenerationChunk], List[ChatGenerationChunk]]:
+        """按优先级发起请求，超过对冲等待时间或出错时启动下一个接口，返回最先输出首 token 的接口"""
+        candidates = self._pick()
+        deadline = time.monotonic() + self.first_token_timeout
+        running: Dict[asyncio.Task, _Endpoint] = {}
+        last_error: Optional[BaseException] = None
+
+        def launch() -> Optional[_Endpoint]:
+            if not candidates:
+                return None
+            endpoint = candidates.pop(0)
+            task = asyncio.create_task(self._open_stream(endpoint, messages, stop, kwargs))
+            running[task] = endpoint
+            return endpoint
+
+        primary = launch()
+        try:
+            while running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError(f"{self.first_token_timeout}s 内没有模型接口输出首 token")
+                # 还有备用接口时，等待到当前最新请求的对冲时间
+                timeout = remaining
+                if candidates:
+                    newest = list(running.values())[-1]
+                    timeout = min(timeout, self._hedge_delay(newest))
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if candidates and time.monotonic() < deadline:
+                        slow = list(running.values())[-1]
+                        hedge = launch()
+                        self._hedges += 1
+                        print(f"⏱️  模型接口 {slow.name} 首 token 超过 {self._hedge_delay(slow):.2f}s，向 {hedge.name} 发出对冲请求")
+                    continue
+
+                for task in done:
+                    endpoint = running.pop(task)
+                    try:
+                        stream, received = task.result()
+                    except Exception as e:
+                        endpoint.failures += 1
+                        endpoint.breaker.record_failure()
+                        last_error = e
+                        print(f"⚠️  模型接口 {endpoint.name} 请求失败: {e}")
+                        if not running and launch() is not None:
+                            self._failovers += 1
+                        continue
+                    endpoint.breaker.record_success()
+                    endpoint.wins += 1
+                    if endpoint is not primary:
+                        self._secondary_wins += 1
+                    return endpoint, stream, received
+            raise last_error or CircuitOpenError("没有可用的模型接口")
+        finally:
+            # 没有用到的接口归还熔断器的试探名额
+            for endpoint in candidates:
+                endpoint.breaker.release()
+            # 取消落后的请求（_open_stream 会关闭对应的流）
+            for task, endpoint in running.items():
+                task.cancel()
+                endpoint.cancelled += 1
+                endpoint.breaker.release()
+            if running:
+                results = await asyncio.gather(*running, return_exceptions=True)
+                for endpoint, result in zip(running.values(), results):
+                    # 与胜出者在同一轮完成（取消时已经结束）的请求：关闭它已经打开的流
+                    if isinstance(result, tuple):
+                        endpoint.breaker.record_success()
+                        await result[0].aclose()
+                    elif isinstance(result, Exception):
+                        endpoint.failures += 1
+                        endpoint.breaker.record_failure()
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        endpoint, stream, received = await self._race(messages, stop, kwargs)
+        try:
+            for chunk in received:
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=self.idle_timeout)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    endpoint.failures += 1
+                    endpoint.breaker.record_failure()
+                    raise asyncio.TimeoutError(f"模型接口 {endpoint.name} 超过 {self.idle_timeout}s 没有输出")
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return await agenerate_from_stream(self._astream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # 同步调用只使用第一个放行的接口（对冲依赖事件循环）
+        return self._pick()[0].model._generate(messages, stop=stop, **kwargs)
+
+    def _stream(self, *args: Any, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        return self._pick()[0].model._stream(*args, **kwargs)
+
+    def stats(self) -> dict:
+        """各接口的 TTFT 分位数、熔断状态和对冲统计"""
+        endpoints = {}
+        for e in self._endpoints:
+            p50, p95 = e.ttft.percentile(50), e.ttft.percentile(95)
+            endpoints[e.name] = {
+                "requests": e.requests,
+                "wins": e.wins,
+                "failures": e.failures,
+                "cancelled": e.cancelled,
+                "ttft_p50": round(p50, 3) if p50 is not None else None,
+                "ttft_p95": round(p95, 3) if p95 is not None else None,
+                "ttft_censored": e.ttft.censored,
+                "hedge_delay": round(self._hedge_delay(e), 3),
+                "circuit": e.breaker.state,
+            }
+        return {
+            "hedges": self._hedges,
+            "secondary_wins": self._secondary_wins,
+            "failovers": self._failovers,
+            "endpoints": endpoints,
+        }
+
+
+_hedged_models: Dict[str, HedgedChatModel] = {}
+
+
+def create_hedged_model(model_name: str, model: BaseChatModel, **kwargs: Any) -> BaseChatModel:
+    """
+    按 config.yaml 的 model.hedging 段为模型加上对冲请求和故障切换
+
+    Args:
+        model_name: 模型名称（model.hedging.fallbacks 的键）
+        model: 主模型实例
+        kwargs: 备用模型和包装模型的额外参数（如 callbacks）
+
+    Returns:
+        HedgedChatModel；未启用或该模型没有配置备用模型时原样返回 model
+    """
+    config = get_config()
+    if not config.get('model.hedging.enabled', False):
+        return model
+    fallbacks = (config.get('model.hedging.fallbacks', {}) or {}).get(model_name) or []
+    if not fallbacks:
+        return model
+
+    from config.model_factory import create_model_from_config
+
+    endpoints = [(model_name, model)] + [
+        (name, create_model_from_config(name, stream_usage=True)) for name in fallbacks
+    ]
+    hedged = HedgedChatModel(
+        endpoints=endpoints,
+        hedge_percentile=float(config.get('model.hedging.percentile', 95)),
+        min_hedge_delay=float(config.get('model.hedging.min_delay', 0.5)),
+        max_hedge_delay=float(config.get('model.hedging.max_delay', 10)),
+        initial_hedge_delay=float(config.get('model.hedging.initial_delay', 3)),
+        min_samples=int(config.get('model.hedging.min_samples', 20)),
+        first_token_timeout=float(config.get('model.hedging.first_token_timeout', 60)),
+        idle_timeout=float(config.get('model.hedging.idle_timeout', 60)),
+        failure_threshold=int(config.get('model.hedging.circuit_breaker.failure_threshold', 3)),
+        reset_timeout=float(config.get('model.hedging.circuit_breaker.reset_timeout', 30)),
+        **kwargs,
+    )
+    _hedged_models[model_name] = hedged
+    print(f"✅ 模型 {model_name} 已启用对冲请求，备用模型: {fallbacks}")
+    return hedged
+
+
+def hedging_stats() -> Dict[str, dict]:
+    """所有启用了对冲请求的模型的统计"""
+    return {name: model.stats() for name, model in _hedged_models.items()}
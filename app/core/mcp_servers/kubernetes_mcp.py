@@ -1,12 +1,80 @@
 """
 Kubernetes MCP 集成模块
 用于将 Kubernetes MCP 服务器的工具集成到 Agent 中
+
+工具清单缓存：
+获取工具列表需要先通过 npx 启动 MCP 服务器再调用 list_tools，Agent 构建因此要等待几秒到几十秒。
+工具清单（名称、描述、参数 Schema）按 服务器包/版本/配置 缓存在磁盘上，命中缓存时直接用清单构建工具，
+MCP 服务器在第一次调用工具时才启动；同时在后台线程重新拉取清单，服务器版本或工具发生变化时更新缓存
 """
 import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from langchain_core.tools import BaseTool
 from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.sessions import create_session
+from langchain_mcp_adapters.tools import convert_mcp_tool_to_langchain_tool
+from mcp.types import Tool as MCPTool
 from config.config_loader import get_config
 
 
+SERVER_NAME = "kubernetes"
+MANIFEST_FORMAT = 1
+
+
+class ToolManifestCache:
+    """MCP 工具清单的磁盘缓存（每个缓存键一个 JSON 文件）"""
+    
+    def __init__(self, cache_dir: str):
+        """
+        初始化清单缓存
+        
+        Args:
+            cache_dir: 缓存目录
+        """
+        self.cache_dir = Path(cache_dir)
+    
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{SERVER_NAME}-{key}.json"
+    
+    def load(self, key: str) -> Optional[dict]:
+        """
+        读取清单
+        
+        Args:
+            key: 缓存键
+        
+        Returns:
+            清单字典；不存在、格式不兼容或已损坏时返回 None
+        """
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"⚠️  MCP 工具清单缓存读取失败，将重新获取: {e}")
+            return None
+        if manifest.get("format") != MANIFEST_FORMAT or manifest.get("key") != key:
+            return None
+        return manifest
+    
+    def save(self, key: str, manifest: dict) -> None:
+        """写入清单（先写临时文件再原子替换，多个进程同时写入也不会读到半个文件）"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+
 class KubernetesMCPManager:
     """Kubernetes MCP 管理器"""
     
@@ -25,10 +93,21 @@ class KubernetesMCPManager:
         self.context = context
         self.client = None
         self._tools = None
+        
+        # 服务器包（可以带版本号，如 mcp-server-kubernetes@2.9.0；固定版本时升级后缓存键随之变化）
+        self.package = self.config.get('model.mcp.kubernetes.package', 'mcp-server-kubernetes')
+        self.manifest_cache = None
+        if self.config.get('model.mcp.kubernetes.manifest_cache.enabled', True):
+            cache_dir = self.config.get('model.mcp.kubernetes.manifest_cache.dir', '.mcp_cache')
+            if not os.path.isabs(cache_dir):
+                cache_dir = str(Path(__file__).resolve().parent.parent.parent.parent / cache_dir)
+            self.manifest_cache = ToolManifestCache(cache_dir)
+        self.refresh_interval = float(self.config.get('model.mcp.kubernetes.manifest_cache.refresh_interval', 600))
+        self._refresh_thread: Optional[threading.Thread] = None
     
-    def _create_client(self, kubeconfig: str = None, context: str = None) -> MultiServerMCPClient:
+    def _connection(self, kubeconfig: str = None, context: str = None) -> Dict[str, Any]:
         """
-        创建 MCP 客户端
+        MCP 服务器的 stdio 连接配置
         
         Args:
             kubeconfig: kubeconfig 文件路径（可选，默认使用 ~/.kube/config）
@@ -48,35 +127,127 @@ class KubernetesMCPManager:
         if context:
             env["KUBECTL_CONTEXT"] = context
         
-        return MultiServerMCPClient(
+        return {
+            "command": "npx",
+            "args": [
+                "-y",
+                self.package
+            ],
+            "env": env,
+            "transport": "stdio"
+        }
+    
+    def _create_client(self, kubeconfig: str = None, context: str = None) -> MultiServerMCPClient:
+        """
+        创建 MCP 客户端
+        
+        Args:
+            kubeconfig: kubeconfig 文件路径（可选，默认使用 ~/.kube/config）
+            context: Kubernetes 上下文名称（可选，默认使用当前上下文）
+        """
+        return MultiServerMCPClient({SERVER_NAME: self._connection(kubeconfig, context)})
+    
+    def _cache_key(self) -> str:
+        """清单缓存键：服务器包（含版本）+ 影响工具集合的配置"""
+        identity = json.dumps(
             {
-                "kubernetes": {
-                    "command": "npx",
-                    "args": [
-                        "-y",
-                        "mcp-server-kubernetes"
-                    ],
-                    "env": env,
-                    "transport": "stdio"
-                }
-            }
+                "package": self.package,
+                "non_destructive": self.non_destructive,
+                "kubeconfig": self.kubeconfig,
+                "context": self.context,
+            },
+            sort_keys=True,
         )
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:16]
+    
+    async def _fetch_manifest(self) -> dict:
+        """启动 MCP 服务器并拉取工具清单（分页读取 list_tools）"""
+        async with create_session(self._connection(self.kubeconfig, self.context)) as session:
+            init = await session.initialize()
+            tools: List[MCPTool] = []
+            cursor = None
+            while True:
+                page = await session.list_tools(cursor=cursor)
+                tools.extend(page.tools)
+                cursor = page.nextCursor
+                if not cursor:
+                    break
+        return {
+            "format": MANIFEST_FORMAT,
+            "key": self._cache_key(),
+            "package": self.package,
+            "server_version": init.serverInfo.version,
+            "fetched_at": time.time(),
+            "tools": [t.model_dump(mode="json", exclude_none=True) for t in tools],
+        }
+    
+    def _build_tools(self, manifest: dict) -> List[BaseTool]:
+        """用清单构建工具：每次调用时才按连接配置启动 MCP 服务器会话"""
+        connection = self._connection(self.kubeconfig, self.context)
+        return [
+            convert_mcp_tool_to_langchain_tool(
+                None,
+                MCPTool.model_validate(tool),
+                connection=connection,
+                server_name=SERVER_NAME,
+            )
+            for tool in manifest["tools"]
+        ]
+    
+    async def _refresh_manifest(self, cached: dict) -> None:
+        """后台重新拉取工具清单，服务器版本或工具有变化时更新缓存"""
+        key = self._cache_key()
+        try:
+            manifest = await self._fetch_manifest()
+        except Exception as e:
+            print(f"⚠️  后台刷新 Kubernetes MCP 工具清单失败，继续使用缓存: {e}")
+            return
+        if manifest["server_version"] != cached.get("server_version") or manifest["tools"] != cached.get("tools"):
+            print(f"🔄 Kubernetes MCP 工具清单已变化（服务器版本 {cached.get('server_version')} -> {manifest['server_version']}，"
+                  f"工具数 {len(cached.get('tools', []))} -> {len(manifest['tools'])}），已更新缓存，重新构建 Agent 后生效")
+        try:
+            self.manifest_cache.save(key, manifest)
+        except OSError as e:
+            print(f"⚠️  写入 Kubernetes MCP 工具清单缓存失败: {e}")
+    
+    def _start_background_refresh(self, cached: dict) -> None:
+        """在独立线程的事件循环中刷新清单（调用方的事件循环可能很快结束，如 get_all_tools_sync）"""
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+        self._refresh_thread = threading.Thread(
+            target=lambda: asyncio.run(self._refresh_manifest(cached)),
+            name="mcp-manifest-refresh",
+            daemon=True,
+        )
+        self._refresh_thread.start()
     
     async def get_tools(self):
         """
         获取 Kubernetes MCP 工具列表
         
+        优先使用磁盘上的工具清单缓存（不启动 MCP 服务器），未命中时启动服务器拉取清单并写入缓存
+        
         Returns:
             List[Tool]: Kubernetes MCP 工具列表
         """
         if self._tools is None:
-            if self.client is None:
-                self.client = self._create_client(
-                    kubeconfig=self.kubeconfig,
-                    context=self.context
-                )
-            
-            self._tools = await self.client.get_tools()
+            key = self._cache_key()
+            cached = self.manifest_cache.load(key) if self.manifest_cache else None
+            if cached is not None:
+                self._tools = self._build_tools(cached)
+                age = time.time() - cached.get("fetched_at", 0)
+                print(f"📦 使用缓存的 Kubernetes MCP 工具清单（服务器版本 {cached.get('server_version')}，"
+                      f"{age / 60:.0f} 分钟前获取），MCP 服务器将在首次调用工具时启动")
+                if age >= self.refresh_interval:
+                    self._start_background_refresh(cached)
+            else:
+                manifest = await self._fetch_manifest()
+                self._tools = self._build_tools(manifest)
+                if self.manifest_cache:
+                    try:
+                        self.manifest_cache.save(key, manifest)
+                    except OSError as e:
+                        print(f"⚠️  写入 Kubernetes MCP 工具清单缓存失败: {e}")
             cluster_info = ""
             if self.kubeconfig:
                 cluster_info = f" (kubeconfig: {self.kubeconfig})"
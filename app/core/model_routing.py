@@ -0,0 +1,135 @@
+"""
+模型角色路由中间件
+Agent 的大部分步骤只是选择工具、整理工具结果，不需要旗舰模型的能力和延迟；只有最终报告需要强模型。
+ModelRoutingMiddleware 按角色为每次模型调用选择模型：
+- tool：选择工具和中间推理，使用低延迟的便宜模型
+- final：最终报告，使用强模型
+
+调用前无法知道这一步是否会输出最终回答，策略（final_policy）：
+- rerun：先用 tool 模型；它不再调用工具（准备给出最终回答）时，丢弃这次回答，改用 final 模型重新生成
+- accept：直接采用 tool 模型的回答，只有明确需要强模型的调用（见下）才使用 final 模型
+
+以下情况直接使用 final 模型：要求结构化输出、RAG 中间件追加了完善建议的提示、
+运行期限中间件要求直接给出结论（避免时间不足时再重新生成一次）、线程配置 configurable.model_role = "final"
+"""
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain.agents.middleware.types import ModelRequest, ModelResponse
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.config import get_config as get_runnable_config
+from config.config_loader import get_config
+from config.model_factory import get_model
+from app.core.deadline import DEADLINE_FINAL_MARKER
+
+
+FINAL_POLICIES = ("rerun", "accept")
+
+# RAG 中间件要求完善"建议行动方案"时追加的提示
+_RAG_ENHANCEMENT_MARKER = "请参考以下运维知识库中的标准流程和最佳实践"
+
+
+class ModelRoutingMiddleware(AgentMiddleware):
+    """
+    模型角色路由中间件
+
+    工作流程：
+    1. 判断本次调用是否必须由 final 模型完成
+    2. 否则使用 tool 模型调用；返回工具调用时直接采用
+    3. tool 模型准备输出最终回答时，按 final_policy 决定是否改用 final 模型重新生成
+    """
+
+    def __init__(self, tool_model: Any, final_model: Any, final_policy: str = "rerun"):
+        """
+        初始化模型路由中间件
+
+        Args:
+            tool_model: 工具步骤使用的模型（BaseChatModel）
+            final_model: 最终报告使用的模型（BaseChatModel）
+            final_policy: rerun（最终回答改用 final 模型重新生成）或 accept（直接采用 tool 模型的回答）
+        """
+        super().__init__()
+        if final_policy not in FINAL_POLICIES:
+            raise ValueError(f"final_policy 必须是 {FINAL_POLICIES} 之一: {final_policy}")
+        self.tool_model = tool_model
+        self.final_model = final_model
+        self.final_policy = final_policy
+
+        # 统计信息
+        self.calls: Dict[str, int] = {"tool": 0, "final": 0}
+        self.reruns = 0
+
+    @staticmethod
+    def _thread_role() -> Optional[str]:
+        try:
+            configurable = get_runnable_config().get("configurable", {})
+        except RuntimeError:
+            configurable = {}
+        return configurable.get("model_role")
+
+    def _requires_final(self, request: ModelRequest) -> bool:
+        """本次调用是否必须由 final 模型完成"""
+        if self._thread_role() == "final" or request.response_format is not None:
+            return True
+        last = request.messages[-1] if request.messages else None
+        if not isinstance(last, HumanMessage):
+            return False
+        content = str(last.content)
+        return _RAG_ENHANCEMENT_MARKER in content or DEADLINE_FINAL_MARKER in content
+
+    @staticmethod
+    def _is_final_answer(response: Any) -> bool:
+        """模型回答中没有工具调用（准备输出最终回答）"""
+        messages = response.result if isinstance(response, ModelResponse) else [response]
+        ai_messages = [m for m in messages if isinstance(m, AIMessage)]
+        return bool(ai_messages) and not ai_messages[-1].tool_calls
+
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        """按角色选择模型"""
+        if self._thread_role() == "tool":
+            self.calls["tool"] += 1
+            return await handler(request.override(model=self.tool_model))
+        if self._requires_final(request):
+            self.calls["final"] += 1
+            return await handler(request.override(model=self.final_model))
+
+        self.calls["tool"] += 1
+        response = await handler(request.override(model=self.tool_model))
+        if self.final_policy == "accept" or not self._is_final_answer(response):
+            return response
+
+        # tool 模型准备输出最终回答：改用 final 模型生成报告（仍绑定工具，强模型可以决定继续排查）
+        self.calls["final"] += 1
+        self.reruns += 1
+        print("🔄 工具步骤已完成，改用 final 模型生成最终回答")
+        return await handler(request.override(model=self.final_model))
+
+    def stats(self) -> dict:
+        """路由统计"""
+        return {"calls": dict(self.calls), "final_reruns": self.reruns, "final_policy": self.final_policy}
+
+
+def get_model_routing_middleware() -> Optional[ModelRoutingMiddleware]:
+    """
+    创建按 config.yaml 的 model.routing 段配置的模型路由中间件
+
+    Returns:
+        ModelRoutingMiddleware 实例；未启用时返回 None
+    """
+    config = get_config()
+    if not config.get('model.routing.enabled', False):
+        return None
+    tool_name = config.get('model.routing.roles.tool', 'deepseek')
+    final_name = config.get('model.routing.roles.final', 'deepseek')
+    if tool_name == final_name:
+        return None
+    print(f"✅ 模型路由已启用：工具步骤使用 {tool_name}，最终回答使用 {final_name}")
+    return ModelRoutingMiddleware(
+        tool_model=get_model(tool_name),
+        final_model=get_model(final_name),
+        final_policy=config.get('model.routing.final_policy', 'rerun'),
+    )
@@ -0,0 +1,255 @@
+"""
+Prompt 前缀缓存遥测
+DeepSeek 等 OpenAI 兼容服务会缓存重复的 prompt 前缀（系统提示词 + 工具 Schema + 历史），
+命中部分按折扣计费且首 token 延迟（TTFT）更低。前提是前缀逐字节不变：
+系统提示词和工具列表保持稳定，每次请求都不同的内容（RAG 上下文等）放在消息末尾。
+
+PromptCacheTelemetry 作为模型的回调记录每次调用的：
+- 服务端报告的缓存命中 token 数（usage_metadata.input_token_details.cache_read，
+  或 DeepSeek 的 prompt_cache_hit_tokens）
+- 首 token 延迟（流式调用）和总耗时
+- 前缀指纹（系统消息 + 工具 Schema 的哈希），用于发现意外变化的前缀；
+  启用工具选择（model.tool_selection）时工具列表按线程变化是预期行为，指纹只包含系统消息，
+  工具列表的种类数单独统计（distinct_tool_sets）
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+from uuid import UUID
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.outputs import LLMResult
+from config.config_loader import get_config
+
+
+def _cached_tokens(response: LLMResult) -> Optional[int]:
+    """从模型响应中取出服务端报告的缓存命中 token 数（未报告时返回 None）"""
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            if message is None:
+                continue
+            usage = getattr(message, "usage_metadata", None) or {}
+            cache_read = (usage.get("input_token_details") or {}).get("cache_read")
+            if cache_read is not None:
+                return cache_read
+            token_usage = (message.response_metadata or {}).get("token_usage") or {}
+            if token_usage.get("prompt_cache_hit_tokens") is not None:
+                return token_usage["prompt_cache_hit_tokens"]
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    if token_usage.get("prompt_cache_hit_tokens") is not None:
+        return token_usage["prompt_cache_hit_tokens"]
+    return (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+
+
+def _prompt_tokens(response: LLMResult) -> Optional[int]:
+    """从模型响应中取出 prompt token 数"""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens")
+    return ((response.llm_output or {}).get("token_usage") or {}).get("prompt_tokens")
+
+
+def prefix_fingerprint(messages: List[BaseMessage], tools: Any = None, include_tools: bool = True) -> str:
+    """
+    前缀指纹：系统消息和工具 Schema 的哈希
+
+    Args:
+        messages: 发送给模型的消息
+        tools: 绑定的工具（invocation_params 中的 tools）
+        include_tools: 指纹是否包含工具 Schema
+
+    Returns:
+        16 位十六进制指纹
+    """
+    digest = hashlib.sha256()
+    for message in messages:
+        if not isinstance(message, SystemMessage):
+            break
+        digest.update(json.dumps(message.content, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    if include_tools:
+        digest.update(json.dumps(tools or [], ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def tools_fingerprint(tools: Any = None) -> str:
+    """工具 Schema 列表的哈希（16 位十六进制）"""
+    raw = json.dumps(tools or [], ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+class PromptCacheTelemetry(BaseCallbackHandler):
+    """记录 prompt 前缀缓存命中情况和首 token 延迟的模型回调"""
+
+    # 统计开销很小，直接在调用线程 / 事件循环中执行
+    run_inline = True
+
+    def __init__(self, window: int = 1000, verbose: bool = False, fingerprint_tools: bool = True):
+        """
+        初始化遥测
+
+        Args:
+            window: 保留最近多少次调用的明细用于计算分位数
+            verbose: 是否为每次调用打印一行命中情况
+            fingerprint_tools: 前缀指纹是否包含工具 Schema（启用工具选择时应为 False）
+        """
+        super().__init__()
+        self.verbose = verbose
+        self.fingerprint_tools = fingerprint_tools
+        self._lock = threading.Lock()
+        self._pending: Dict[UUID, dict] = {}
+        self._records: Deque[dict] = deque(maxlen=window)
+        self._prefixes: Dict[str, int] = {}
+        self._tool_sets: Dict[str, int] = {}
+
+        self.calls = 0
+        self.reported = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[BaseMessage]],
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        """记录开始时间和前缀指纹"""
+        tools = (kwargs.get("invocation_params") or {}).get("tools")
+        fingerprint = prefix_fingerprint(messages[0] if messages else [], tools, include_tools=self.fingerprint_tools)
+        with self._lock:
+            self._pending[run_id] = {
+                "start": time.perf_counter(),
+                "first_token": None,
+                "prefix": fingerprint,
+                "tools": tools_fingerprint(tools),
+            }
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        """记录首 token 时间（流式调用）"""
+        pending = self._pending.get(run_id)
+        if pending is not None and pending["first_token"] is None and token:
+            pending["first_token"] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        """记录本次调用的缓存命中 token 数和延迟"""
+        with self._lock:
+            pending = self._pending.pop(run_id, None)
+        if pending is None:
+            return
+        now = time.perf_counter()
+        prompt_tokens = _prompt_tokens(response)
+        cached = _cached_tokens(response)
+        record = {
+            "prefix": pending["prefix"],
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached,
+            "latency": now - pending["start"],
+            "ttft": pending["first_token"] - pending["start"] if pending["first_token"] else None,
+        }
+        with self._lock:
+            self.calls += 1
+            self._records.append(record)
+            self._prefixes[record["prefix"]] = self._prefixes.get(record["prefix"], 0) + 1
+            self._tool_sets[pending["tools"]] = self._tool_sets.get(pending["tools"], 0) + 1
+            if prompt_tokens and cached is not None:
+                self.reported += 1
+                self.prompt_tokens += prompt_tokens
+                self.cached_tokens += cached
+        if self.verbose and prompt_tokens and cached is not None:
+            print(f"♻️  prompt 缓存命中 {cached}/{prompt_tokens} tokens（{cached / prompt_tokens:.0%}），"
+                  f"耗时 {record['latency']:.2f}s")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        """调用失败时丢弃计时"""
+        with self._lock:
+            self._pending.pop(run_id, None)
+
+    @staticmethod
+    def _percentiles(values: List[float]) -> Optional[dict]:
+        if not values:
+            return None
+        p50, p95 = np.percentile(values, [50, 95])
+        return {"count": len(values), "p50": round(float(p50), 3), "p95": round(float(p95), 3)}
+
+    def stats(self) -> dict:
+        """
+        缓存命中统计
+
+        TTFT 按本次调用的缓存命中比例分为 hit（>= 50%）和 miss 两组，用于对比前缀缓存带来的延迟改善；
+        非流式调用没有 TTFT，使用总耗时
+
+        Returns:
+            统计字典
+        """
+        with self._lock:
+            records = list(self._records)
+            prefixes = sorted(self._prefixes.items(), key=lambda kv: -kv[1])
+            tool_sets = len(self._tool_sets)
+            summary = {
+                "calls": self.calls,
+                "calls_with_cache_usage": self.reported,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cache_hit_ratio": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else None,
+            }
+
+        groups: Dict[str, Dict[str, List[float]]] = {
+            "hit": {"ttft": [], "latency": []},
+            "miss": {"ttft": [], "latency": []},
+        }
+        for record in records:
+            if not record["prompt_tokens"] or record["cached_tokens"] is None:
+                continue
+            group = groups["hit" if record["cached_tokens"] / record["prompt_tokens"] >= 0.5 else "miss"]
+            group["latency"].append(record["latency"])
+            if record["ttft"] is not None:
+                group["ttft"].append(record["ttft"])
+        summary["recent"] = {
+            name: {metric: self._percentiles(values) for metric, values in group.items()}
+            for name, group in groups.items()
+        }
+        # 前缀种类数远多于预期时说明系统提示词（或未启用工具选择时的工具列表）在请求间变化
+        summary["fingerprint_tools"] = self.fingerprint_tools
+        summary["distinct_prefixes"] = len(prefixes)
+        summary["top_prefixes"] = dict(prefixes[:5])
+        summary["distinct_tool_sets"] = tool_sets
+        return summary
+
+
+_prompt_cache_telemetry: Optional[PromptCacheTelemetry] = None
+
+
+def get_prompt_cache_telemetry() -> Optional[PromptCacheTelemetry]:
+    """
+    获取 prompt 缓存遥测回调（单例模式，参数从 config.yaml 的 model.prompt_cache 段读取）
+
+    Returns:
+        PromptCacheTelemetry 实例；未启用时返回 None
+    """
+    global _prompt_cache_telemetry
+
+    config = get_config()
+    if not config.get('model.prompt_cache.telemetry', True):
+        return None
+    if _prompt_cache_telemetry is None:
+        _prompt_cache_telemetry = PromptCacheTelemetry(
+            window=int(config.get('model.prompt_cache.window', 1000)),
+            verbose=bool(config.get('model.prompt_cache.verbose', False)),
+            # 工具选择按线程绑定不同的工具子集，指纹不包含工具列表，避免 distinct_prefixes 随子集增长
+            fingerprint_tools=not config.get('model.tool_selection.enabled', False),
+        )
+    return _prompt_cache_telemetry
+
+
+def prompt_cache_stats() -> Optional[dict]:
+    """prompt 缓存统计（遥测未启用或尚未创建时返回 None）"""
+    return _prompt_cache_telemetry.stats() if _prompt_cache_telemetry is not None else None
@@ -5,7 +5,7 @@ RAG 集成模块
 import os
 from typing import Optional, List
 from langchain_core.documents import Document
-from app.rag.document_loader import DocumentLoader
+from app.rag.metadata_index import MetadataFilter
 from app.rag.vector_store import get_vector_store_manager
 from app.rag.rag_retriever import get_rag_retriever
 
@@ -14,13 +14,13 @@ from app.rag.rag_retriever import get_rag_retriever
 _rag_initialized: bool = False
 
 
-def initialize_rag_system(files_dir: str = "app/rag/files", auto_init: bool = True) -> bool:
+def initialize_rag_system(files_dir: Optional[str] = None, auto_init: bool = True) -> bool:
     """
-    初始化 RAG 系统
+    初始化 RAG 系统（加载默认知识库）
     
     Args:
-        files_dir: 文档目录路径
-        auto_init: 是否自动初始化（如果文档已加载过，可以跳过）
+        files_dir: 文档目录路径（默认使用默认知识库配置的目录）
+        auto_init: 是否自动初始化（如果文档已加载过，可以跳过；为 False 时强制重建）
     
     Returns:
         True 如果初始化成功，False 否则
@@ -35,28 +35,26 @@ def initialize_rag_system(files_dir: str = "app/rag/files", auto_init: bool = Tr
         print("🚀 初始化 RAG 知识库...")
         print("="*60 + "\n")
         
-        # 1. 加载文档
-        loader = DocumentLoader(files_dir=files_dir)
-        documents = loader.load_all_documents()
-        
-        if not documents:
-            print("⚠️  未找到任何文档，RAG 功能将不可用")
-            _rag_initialized = False
-            return False
-        
-        # 2. 初始化向量存储
         vector_store_manager = get_vector_store_manager()
-        vector_store_manager.initialize(documents)
+        if files_dir is not None:
+            vector_store_manager.get_collection().files_dir = files_dir
         
-        if vector_store_manager.is_initialized():
-            _rag_initialized = True
-            print("="*60)
-            print("✅ RAG 知识库初始化完成！")
-            print("="*60 + "\n")
-            return True
+        # 已加载（或其他 worker 已发布共享索引）时直接复用，否则加载文档并构建
+        if auto_init:
+            vector_store_manager.ensure_loaded()
         else:
+            vector_store_manager.rebuild()
+        
+        if not vector_store_manager.is_initialized():
+            print("⚠️  未找到任何文档，RAG 功能将不可用")
             _rag_initialized = False
             return False
+        
+        _rag_initialized = True
+        print("="*60)
+        print("✅ RAG 知识库初始化完成！")
+        print("="*60 + "\n")
+        return True
             
     except Exception as e:
         print(f"❌ RAG 系统初始化失败: {e}")
@@ -66,23 +64,30 @@ def initialize_rag_system(files_dir: str = "app/rag/files", auto_init: bool = Tr
         return False
 
 
-def get_rag_context(query: str, k: int = 4) -> str:
+def get_rag_context(
+    query: str,
+    k: int = 4,
+    filter: Optional[MetadataFilter] = None,
+    collection: Optional[str] = None,
+) -> str:
     """
     从 RAG 知识库检索相关上下文
     
     Args:
         query: 用户查询
         k: 检索的文档数量
+        filter: 元数据过滤条件（可选），例如 {"runbook": "node-not-ready"}
+        collection: 知识库名称（可选，默认为默认知识库）
     
     Returns:
         格式化的上下文文本，如果没有相关文档则返回空字符串
     """
-    if not _rag_initialized:
+    if not is_rag_initialized(collection):
         return ""
     
     try:
-        retriever = get_rag_retriever(k=k)
-        documents = retriever.retrieve(query)
+        retriever = get_rag_retriever(k=k, collection=collection)
+        documents = retriever.retrieve(query, filter=filter)
         
         if not documents:
             return ""
@@ -107,23 +112,30 @@ def get_rag_context(query: str, k: int = 4) -> str:
         return ""
 
 
-async def get_rag_context_async(query: str, k: int = 4) -> str:
+async def get_rag_context_async(
+    query: str,
+    k: int = 4,
+    filter: Optional[MetadataFilter] = None,
+    collection: Optional[str] = None,
+) -> str:
     """
     异步从 RAG 知识库检索相关上下文
     
     Args:
         query: 用户查询
         k: 检索的文档数量
+        filter: 元数据过滤条件（可选）
+        collection: 知识库名称（可选，默认为默认知识库）
     
     Returns:
         格式化的上下文文本，如果没有相关文档则返回空字符串
     """
-    if not _rag_initialized:
+    if not is_rag_initialized(collection):
         return ""
     
     try:
-        retriever = get_rag_retriever(k=k)
-        documents = await retriever.aretrieve(query)
+        retriever = get_rag_retriever(k=k, collection=collection)
+        documents = await retriever.aretrieve(query, filter=filter)
         
         if not documents:
             return ""
@@ -143,7 +155,15 @@ async def get_rag_context_async(query: str, k: int = 4) -> str:
         return ""
 
 
-def is_rag_initialized() -> bool:
-    """检查 RAG 系统是否已初始化"""
-    return _rag_initialized
+def is_rag_initialized(collection: Optional[str] = None) -> bool:
+    """
+    检查 RAG 系统是否可用
+    
+    Args:
+        collection: 知识库名称（可选）。默认知识库需已初始化；
+                    命名知识库只要已注册即视为可用（首次检索时按需加载）
+    """
+    if collection is None:
+        return _rag_initialized
+    return get_vector_store_manager().has_collection(collection)
 
@@ -11,7 +11,10 @@ if TYPE_CHECKING:
 from langchain.agents.middleware import AgentMiddleware
 from langchain.agents.middleware.types import AgentState
 from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.config import get_config as get_runnable_config
 from app.core.rag_integration import get_rag_context_async, is_rag_initialized
+from app.core.deadline import optional_step_allowed
+from app.rag.metadata_index import MetadataFilter
 
 
 class RAGMiddleware(AgentMiddleware):
@@ -25,17 +28,28 @@ class RAGMiddleware(AgentMiddleware):
     4. 将检索到的信息注入到上下文中，让 Agent 重新生成或增强回答
     """
     
-    def __init__(self, rag_k: int = 4, enable_auto_rag: bool = True):
+    def __init__(
+        self,
+        rag_k: int = 4,
+        enable_auto_rag: bool = True,
+        rag_filter: Optional[MetadataFilter] = None,
+        rag_collection: Optional[str] = None,
+    ):
         """
         初始化 RAG 中间件
         
         Args:
             rag_k: 检索的文档数量
             enable_auto_rag: 是否自动启用 RAG（如果为 False，需要手动触发）
+            rag_filter: 检索时的元数据过滤条件（可选），例如只检索某个团队的运维手册
+            rag_collection: 检索的知识库名称（可选，默认为默认知识库）；
+                            也可以在调用 Agent 时通过 configurable.rag_collection 按线程指定
         """
         super().__init__()
         self.rag_k = rag_k
         self.enable_auto_rag = enable_auto_rag
+        self.rag_filter = rag_filter
+        self.rag_collection = rag_collection
         self._rag_trigger_keywords = [
             "建议行动方案",
             "建议",
@@ -47,7 +61,20 @@ class RAGMiddleware(AgentMiddleware):
             "处理方案"
         ]
     
-    def _should_trigger_rag(self, messages: list) -> bool:
+    def _resolve_collection(self) -> Optional[str]:
+        """
+        获取本次运行使用的知识库
+        
+        优先使用线程配置中的 configurable.rag_collection，其次使用中间件默认值
+        """
+        try:
+            configurable = get_runnable_config().get("configurable", {})
+        except RuntimeError:
+            # 不在 Runnable 上下文中运行
+            configurable = {}
+        return configurable.get("rag_collection") or self.rag_collection
+    
+    def _should_trigger_rag(self, messages: list, collection: Optional[str] = None) -> bool:
         """
         判断是否应该触发 RAG 检索
         
@@ -57,11 +84,12 @@ class RAGMiddleware(AgentMiddleware):
         
         Args:
             messages: 消息列表
+            collection: 知识库名称（可选）
             
         Returns:
             True 如果需要触发 RAG，False 否则
         """
-        if not self.enable_auto_rag or not is_rag_initialized():
+        if not self.enable_auto_rag or not is_rag_initialized(collection):
             return False
         
         # 检查最后一条 AI 消息
@@ -110,9 +138,15 @@ class RAGMiddleware(AgentMiddleware):
         则从 RAG 知识库检索相关信息并注入到上下文中
         """
         messages = state.get("messages", [])
+        collection = self._resolve_collection()
         
         # 判断是否需要触发 RAG
-        if not self._should_trigger_rag(messages):
+        if not self._should_trigger_rag(messages, collection):
+            return None
+
+        # 知识库增强是可选步骤：运行期限快到时跳过，把时间留给最终回答
+        if not optional_step_allowed(state):
+            print("⏱️  剩余时间不足，跳过知识库检索增强\n")
             return None
         
         # 提取 Agent 的分析结果（包含 A-B-C 过程的回答）
@@ -154,7 +188,9 @@ class RAGMiddleware(AgentMiddleware):
         # 从 RAG 知识库检索相关信息
         print("\n🔍 检测到需要输出运维建议，正在从知识库检索相关标准流程...")
         print(f"   检索关键词：{combined_query[:100]}...")
-        rag_context = await get_rag_context_async(combined_query, k=self.rag_k)
+        rag_context = await get_rag_context_async(
+            combined_query, k=self.rag_k, filter=self.rag_filter, collection=collection
+        )
         
         if not rag_context:
             print("ℹ️  知识库中暂无相关信息\n")
@@ -0,0 +1,409 @@
+"""
+工具子集选择中间件
+create_agent 每次调用模型都会带上所有工具（本地工具 + 几十个 Kubernetes MCP 工具）的完整 JSON Schema，
+每一轮都重复发送，增加 prompt token 和首 token 延迟。
+这里对工具名称、描述和参数名建立索引（BM25 词法检索 + 可选的 embedding 语义检索），
+只绑定与用户问题最相关的 top-N 个工具：
+- 每个线程在用户提问时选择一次，之后的模型调用复用同一个子集，工具列表保持不变，
+  prompt 前缀缓存（app/core/prompt_cache.py）才能在多步调用之间命中；
+  同一线程的新问题只会向子集追加工具，不会移除
+- 固定工具（pinned，默认为 Kubernetes 基础只读工具）和本线程已经调用过的工具始终保留，
+  其余按得分排名补足 top-N 个
+- 查询词在工具文本中的覆盖率过低（如中文问题对英文工具描述，得分没有区分度）时回退为绑定全部工具
+- 可通过 configurable.tool_selection = "all" 对单个线程关闭选择
+"""
+import asyncio
+import json
+import math
+import re
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set
+
+import numpy as np
+from langchain.agents.middleware import AgentMiddleware
+from langchain.agents.middleware.types import ModelRequest, ModelResponse
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langgraph.config import get_config as get_runnable_config
+from config.config_loader import get_config
+
+
+_ASCII_WORD_RE = re.compile(r"[a-zA-Z][a-zA-Z0-9]*")
+_CJK_RE = re.compile(r"[一-鿿]+")
+
+# 默认固定绑定的 Kubernetes 基础只读工具（排查几乎总要用到，不依赖问题的措辞）
+DEFAULT_PINNED_TOOLS = ("kubectl_get", "kubectl_describe", "kubectl_logs", "kubectl_events")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    分词：英文按单词（驼峰和下划线拆开，小写），中文按字和相邻两字
+
+    Args:
+        text: 文本
+
+    Returns:
+        词列表
+    """
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text).replace("_", " ")
+    tokens = [w.lower() for w in _ASCII_WORD_RE.findall(text)]
+    for run in _CJK_RE.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数（ASCII 约 4 字符 1 个 token，中文约 1 字 1 个 token）"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii
+
+
+def _tool_name(tool: Any) -> str:
+    if isinstance(tool, BaseTool):
+        return tool.name
+    return (tool.get("function") or tool).get("name", "")
+
+
+def _tool_schema(tool: Any) -> dict:
+    return tool if isinstance(tool, dict) else convert_to_openai_tool(tool)
+
+
+def _tool_document(tool: Any) -> str:
+    """用于检索的工具文本：名称 + 描述 + 参数名和参数描述"""
+    function = _tool_schema(tool).get("function", {})
+    parameters = (function.get("parameters") or {}).get("properties") or {}
+    args = " ".join(f"{name} {spec.get('description', '')}" for name, spec in parameters.items())
+    return f"{function.get('name', '')} {function.get('name', '')} {function.get('description', '')} {args}"
+
+
+class BM25Index:
+    """BM25 词法检索"""
+
+    def __init__(self, documents: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        """
+        初始化索引
+
+        Args:
+            documents: 文档列表
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        self._docs = [Counter(tokenize(doc)) for doc in documents]
+        self._lengths = np.array([sum(d.values()) for d in self._docs], dtype=np.float64)
+        self._avg_length = float(self._lengths.mean()) if len(self._docs) else 0.0
+        df = Counter(term for doc in self._docs for term in doc)
+        n = len(self._docs)
+        self._idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+
+    def scores(self, query: str) -> np.ndarray:
+        """查询与每个文档的 BM25 得分"""
+        scores = np.zeros(len(self._docs))
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            tf = np.array([doc.get(term, 0) for doc in self._docs], dtype=np.float64)
+            norm = self.k1 * (1 - self.b + self.b * self._lengths / max(self._avg_length, 1e-9))
+            scores += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def coverage(self, query: str) -> float:
+        """查询词（英文单词和中文相邻两字，单个汉字不计）出现在任一文档中的比例"""
+        terms = {t for t in tokenize(query) if not _CJK_RE.fullmatch(t) or len(t) > 1}
+        if not terms:
+            return 0.0
+        return sum(1 for t in terms if t in self._idf) / len(terms)
+
+
+class ToolSelectionMiddleware(AgentMiddleware):
+    """
+    工具子集选择中间件
+
+    工作流程：
+    1. 线程收到新的用户问题后第一次调用模型时，用该问题作为查询
+    2. 查询词覆盖率低于 min_score 时绑定全部工具；否则 BM25（和可选的 embedding 相似度）为每个工具打分
+    3. 固定工具、本线程已调用过的工具加上按得分排名的 top-N 个工具，并入线程的工具子集（只增不减）
+    4. 同一问题后续的模型调用直接复用线程的工具子集
+    """
+
+    def __init__(
+        self,
+        top_n: int = 8,
+        pinned: Sequence[str] = DEFAULT_PINNED_TOOLS,
+        embeddings: Optional[Embeddings] = None,
+        embedding_weight: float = 0.5,
+        min_score: float = 0.15,
+        max_threads: int = 1000,
+        verbose: bool = False,
+    ):
+        """
+        初始化工具选择中间件
+
+        Args:
+            top_n: 每次绑定的相关工具数量（不含固定工具和已使用的工具）
+            pinned: 始终绑定的工具名称（不存在的名称忽略）
+            embeddings: Embeddings 实例（可选，提供时与 BM25 得分加权融合）
+            embedding_weight: embedding 相似度的权重（0~1）
+            min_score: 查询词在工具文本中的覆盖率（0~1）低于该值时认为无法判断，回退为绑定全部工具
+            max_threads: 最多记住多少个线程的工具子集（超出时淘汰最久未使用的线程）
+            verbose: 是否为每次选择打印绑定的工具
+        """
+        super().__init__()
+        self.top_n = top_n
+        self.pinned = set(pinned)
+        self.embeddings = embeddings
+        self.embedding_weight = embedding_weight if embeddings is not None else 0.0
+        self.min_score = min_score
+        self.max_threads = max_threads
+        self.verbose = verbose
+
+        # 线程键 -> {"turn": 最近一条用户消息的 ID, "names": 工具子集（None 表示全部工具）}
+        self._threads: "OrderedDict[str, dict]" = OrderedDict()
+
+        # 按工具名称列表缓存索引（不同请求的工具集合通常相同）
+        self._index_key: Optional[tuple] = None
+        self._bm25: Optional[BM25Index] = None
+        self._tool_vectors: Optional[np.ndarray] = None
+        self._schema_tokens: Dict[str, int] = {}
+        self._index_lock: Optional[asyncio.Lock] = None
+
+        # 统计信息
+        self.calls = 0
+        self.selections = 0
+        self.fallbacks = 0
+        self.tools_offered = 0
+        self.tools_bound = 0
+        self.prompt_tokens_saved = 0
+
+    async def _ensure_index(self, tools: Sequence[Any]) -> None:
+        key = tuple(_tool_name(t) for t in tools)
+        if key == self._index_key:
+            return
+        if self._index_lock is None:
+            self._index_lock = asyncio.Lock()
+        async with self._index_lock:
+            if key == self._index_key:
+                return
+            documents = [_tool_document(t) for t in tools]
+            self._bm25 = BM25Index(documents)
+            self._schema_tokens = {
+                _tool_name(t): estimate_tokens(json.dumps(_tool_schema(t), ensure_ascii=False)) for t in tools
+            }
+            self._tool_vectors = None
+            if self.embeddings is not None:
+                try:
+                    vectors = np.asarray(await asyncio.to_thread(self.embeddings.embed_documents, documents), dtype=np.float32)
+                    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                    self._tool_vectors = vectors / np.where(norms > 0, norms, 1)
+                except Exception as e:
+                    print(f"⚠️  工具描述向量化失败，只使用 BM25 选择工具: {e}")
+            self._index_key = key
+
+    async def _scores(self, query: str) -> np.ndarray:
+        lexical = self._bm25.scores(query)
+        if lexical.max() > 0:
+            lexical = lexical / lexical.max()
+        if self._tool_vectors is None:
+            return lexical
+        try:
+            vector = np.asarray(await self.embeddings.aembed_query(query), dtype=np.float32)
+        except Exception as e:
+            print(f"⚠️  查询向量化失败，只使用 BM25 选择工具: {e}")
+            return lexical
+        vector /= max(float(np.linalg.norm(vector)), 1e-9)
+        semantic = np.clip(self._tool_vectors @ vector, 0, None)
+        return (1 - self.embedding_weight) * lexical + self.embedding_weight * semantic
+
+    @staticmethod
+    def _query(messages: Sequence[Any]) -> str:
+        """选择工具使用的查询：最近一条用户消息 + 之后模型的文字输出"""
+        parts: List[str] = []
+        for msg in reversed(messages):
+            if isinstance(msg, AIMessage) and isinstance(msg.content, str) and msg.content:
+                parts.append(msg.content[:1000])
+            elif isinstance(msg, HumanMessage):
+                parts.append(msg.content if isinstance(msg.content, str) else str(msg.content))
+                break
+        return " ".join(reversed(parts))
+
+    @staticmethod
+    def _used_tools(messages: Sequence[Any]) -> Set[str]:
+        """本线程已经调用过的工具"""
+        used = set()
+        for msg in messages:
+            if isinstance(msg, AIMessage):
+                used.update(call.get("name") for call in msg.tool_calls or [])
+            elif isinstance(msg, ToolMessage) and msg.name:
+                used.add(msg.name)
+        return used
+
+    @staticmethod
+    def _configurable() -> dict:
+        try:
+            return get_runnable_config().get("configurable", {})
+        except RuntimeError:
+            return {}
+
+    @staticmethod
+    def _thread_key(configurable: dict, messages: Sequence[Any]) -> Optional[str]:
+        """线程键：configurable.thread_id，没有时使用第一条消息的 ID"""
+        if configurable.get("thread_id") is not None:
+            return str(configurable["thread_id"])
+        first = messages[0] if messages else None
+        return f"message:{first.id}" if getattr(first, "id", None) else None
+
+    @staticmethod
+    def _turn(messages: Sequence[Any]) -> Optional[str]:
+        """最近一条用户消息的标识（新问题时变化）"""
+        for index in range(len(messages) - 1, -1, -1):
+            if isinstance(messages[index], HumanMessage):
+                return messages[index].id or f"index:{index}"
+        return None
+
+    async def select(self, tools: Sequence[Any], messages: Sequence[Any]) -> Optional[List[Any]]:
+        """
+        选择本次绑定的工具
+
+        Args:
+            tools: 全部工具
+            messages: 当前消息
+
+        Returns:
+            工具子集（保持原顺序）；无法判断时返回 None（绑定全部工具）
+        """
+        names = [_tool_name(t) for t in tools]
+        pinned = self.pinned.intersection(names)
+        if len(tools) <= self.top_n + len(pinned):
+            return None
+        query = self._query(messages)
+        if not query:
+            return None
+        await self._ensure_index(tools)
+        # 融合得分是归一化后的相对值，不能说明问题与工具是否相关；用查询词覆盖率判断
+        if self._bm25.coverage(query) < self.min_score:
+            return None
+        scores = await self._scores(query)
+
+        keep = pinned | self._used_tools(messages)
+        ranked = [names[i] for i in np.argsort(-scores, kind="stable")]
+        # 按排名补足 top_n 个（得分相同或为 0 的工具按原顺序）
+        keep.update([name for name in ranked if name not in keep][: self.top_n])
+        return [t for t in tools if _tool_name(t) in keep]
+
+    async def thread_tools(self, tools: Sequence[Any], messages: Sequence[Any], thread_key: Optional[str]) -> Optional[List[Any]]:
+        """
+        线程当前的工具子集：新问题时重新选择并并入子集，否则复用
+
+        Args:
+            tools: 全部工具
+            messages: 当前消息
+            thread_key: 线程键（None 时不记住子集，每次都重新选择）
+
+        Returns:
+            工具子集（保持原顺序）；None 表示绑定全部工具
+        """
+        entry = self._threads.get(thread_key) if thread_key is not None else None
+        turn = self._turn(messages)
+        if entry is not None:
+            self._threads.move_to_end(thread_key)
+            if entry["turn"] == turn:
+                names = entry["names"]
+                if names is None:
+                    return None
+                names = names | self._used_tools(messages)
+                return [t for t in tools if _tool_name(t) in names]
+
+        self.selections += 1
+        selected = await self.select(tools, messages)
+        if entry is not None and entry["names"] is None:
+            # 线程已经绑定过全部工具：继续绑定全部，保持工具列表不变
+            selected = None
+        elif entry is not None and selected is not None:
+            names = entry["names"] | {_tool_name(t) for t in selected}
+            selected = [t for t in tools if _tool_name(t) in names]
+
+        if thread_key is not None:
+            self._threads[thread_key] = {
+                "turn": turn,
+                "names": {_tool_name(t) for t in selected} if selected is not None else None,
+            }
+            self._threads.move_to_end(thread_key)
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+        return selected
+
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        """模型调用绑定线程的工具子集"""
+        tools = list(request.tools or [])
+        configurable = self._configurable()
+        if not tools or configurable.get("tool_selection") == "all":
+            return await handler(request)
+
+        selected = await self.thread_tools(tools, request.messages, self._thread_key(configurable, request.messages))
+        self.calls += 1
+        self.tools_offered += len(tools)
+        if selected is None:
+            self.fallbacks += 1
+            self.tools_bound += len(tools)
+            return await handler(request)
+
+        selected_names = {_tool_name(t) for t in selected}
+        saved = sum(n for name, n in self._schema_tokens.items() if name not in selected_names)
+        self.tools_bound += len(selected)
+        self.prompt_tokens_saved += saved
+        if self.verbose:
+            print(f"🧰 本次绑定 {len(selected)}/{len(tools)} 个工具，约节省 {saved} 个 prompt token: {sorted(selected_names)}")
+        return await handler(request.override(tools=selected))
+
+    def stats(self) -> dict:
+        """选择效果统计"""
+        return {
+            "calls": self.calls,
+            "selections": self.selections,
+            "threads": len(self._threads),
+            "fallbacks": self.fallbacks,
+            "avg_tools_offered": round(self.tools_offered / self.calls, 1) if self.calls else 0,
+            "avg_tools_bound": round(self.tools_bound / self.calls, 1) if self.calls else 0,
+            "prompt_tokens_saved": self.prompt_tokens_saved,
+        }
+
+
+def get_tool_selection_middleware() -> Optional[ToolSelectionMiddleware]:
+    """
+    创建按 config.yaml 的 model.tool_selection 段配置的工具选择中间件
+
+    Returns:
+        ToolSelectionMiddleware 实例；未启用时返回 None
+    """
+    config = get_config()
+    if not config.get('model.tool_selection.enabled', False):
+        return None
+
+    # 语义检索复用默认知识库的 embedding 模型
+    embeddings = None
+    if config.get('model.tool_selection.embedding.enabled', False):
+        try:
+            from app.rag.vector_store import get_vector_store_manager
+            embeddings = get_vector_store_manager().get_embeddings()
+        except Exception as e:
+            print(f"⚠️  工具选择无法使用 embedding，只使用 BM25: {e}")
+
+    pinned = config.get('model.tool_selection.pinned')
+    return ToolSelectionMiddleware(
+        top_n=int(config.get('model.tool_selection.top_n', 8)),
+        pinned=DEFAULT_PINNED_TOOLS if pinned is None else pinned,
+        embeddings=embeddings,
+        embedding_weight=float(config.get('model.tool_selection.embedding.weight', 0.5)),
+        min_score=float(config.get('model.tool_selection.min_score', 0.15)),
+        max_threads=int(config.get('model.tool_selection.max_threads', 1000)),
+        verbose=bool(config.get('model.tool_selection.verbose', False)),
+    )
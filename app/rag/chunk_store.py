@@ -0,0 +1,331 @@
+"""
+列式文本块存储
+用紧凑的列式结构保存所有文档块，替代每个块一个 Document 对象 + metadata 字典的方式
+
+存储结构：
+- 来源表：每个文件只保存一次 source / filename / file_type / 标签（字符串驻留）
+- 块列：source_id / chunk_index / 文本偏移量都保存在 array 中
+- 文本：所有块的 UTF-8 文本拼接在同一个 bytearray 缓冲区中
+- 引用：近似重复的块不再单独保存文本，只记录为代表块的额外出处
+
+只有检索命中的块才会被还原成 Document 对象。
+存储可以保存到目录并以 mmap 方式只读加载，多个进程共享同一份物理内存
+"""
+import json
+import os
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+import numpy as np
+from langchain_core.documents import Document
+
+
+_CORE_METADATA_KEYS = {"source", "file_type", "chunk_index", "filename", "duplicate_sources"}
+
+
+class ChunkStore:
+    """列式文本块存储"""
+
+    def __init__(self):
+        """初始化空的文本块存储"""
+        # 来源表（每个文件一行）
+        self._sources: List[str] = []
+        self._filenames: List[str] = []
+        self._file_types: List[str] = []
+        self._source_tags: List[Dict[str, Any]] = []
+        self._source_ids: Dict[str, int] = {}
+
+        # 块列（每个文本块一行）
+        self._chunk_source = array('I')
+        self._chunk_index = array('I')
+        self._offsets = array('Q', [0])
+
+        # 所有块的文本，UTF-8 编码后依次拼接
+        self._buffer = bytearray()
+
+        # 近似重复块的出处（引用列），以及代表块 ID -> 引用行号
+        self._ref_source = array('I')
+        self._ref_index = array('I')
+        self._chunk_refs: Dict[int, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._chunk_source)
+
+    def _intern_source(self, source: str, file_type: str, filename: Optional[str] = None,
+                       tags: Optional[Dict[str, Any]] = None) -> int:
+        """
+        驻留来源信息，返回来源 ID
+
+        Args:
+            source: 文件路径
+            file_type: 文件类型（txt / pdf）
+            filename: 文件名（默认取 source 的 basename）
+            tags: 文件级标签（如 team / cluster / runbook，可选）
+
+        Returns:
+            来源 ID
+        """
+        source_id = self._source_ids.get(source)
+        if source_id is None:
+            source_id = len(self._sources)
+            self._sources.append(source)
+            self._filenames.append(filename if filename is not None else os.path.basename(source))
+            self._file_types.append(file_type)
+            self._source_tags.append({})
+            self._source_ids[source] = source_id
+        if tags:
+            self._source_tags[source_id].update(tags)
+        return source_id
+
+    def add_chunk(self, source: str, file_type: str, chunk_index: int, text: str,
+                  filename: Optional[str] = None, tags: Optional[Dict[str, Any]] = None) -> int:
+        """
+        添加一个文本块
+
+        Args:
+            source: 文件路径
+            file_type: 文件类型（txt / pdf）
+            chunk_index: 块在文件中的序号
+            text: 文本内容
+            filename: 文件名（可选）
+            tags: 文件级标签（可选）
+
+        Returns:
+            文本块 ID
+        """
+        source_id = self._intern_source(source, file_type, filename, tags)
+        chunk_id = len(self._chunk_source)
+        self._chunk_source.append(source_id)
+        self._chunk_index.append(chunk_index)
+        self._buffer += text.encode('utf-8')
+        self._offsets.append(len(self._buffer))
+        return chunk_id
+
+    def add_chunks(self, source: str, file_type: str, chunks: Iterable[str],
+                   filename: Optional[str] = None, tags: Optional[Dict[str, Any]] = None) -> List[int]:
+        """
+        批量添加同一文件的文本块（chunk_index 从 0 开始递增）
+
+        Args:
+            source: 文件路径
+            file_type: 文件类型（txt / pdf）
+            chunks: 文本块列表
+            filename: 文件名（可选）
+            tags: 文件级标签（可选）
+
+        Returns:
+            文本块 ID 列表
+        """
+        return [
+            self.add_chunk(source, file_type, i, chunk, filename=filename, tags=tags)
+            for i, chunk in enumerate(chunks)
+        ]
+
+    def add_reference(self, chunk_id: int, source: str, file_type: str, chunk_index: int,
+                      filename: Optional[str] = None, tags: Optional[Dict[str, Any]] = None) -> None:
+        """
+        为已有文本块登记一个额外出处（用于折叠近似重复的块）
+
+        Args:
+            chunk_id: 代表块 ID
+            source: 重复块所在的文件路径
+            file_type: 文件类型（txt / pdf）
+            chunk_index: 重复块在文件中的序号
+            filename: 文件名（可选）
+            tags: 文件级标签（可选）
+        """
+        source_id = self._intern_source(source, file_type, filename, tags)
+        self._chunk_refs.setdefault(chunk_id, []).append(len(self._ref_source))
+        self._ref_source.append(source_id)
+        self._ref_index.append(chunk_index)
+
+    def get_text(self, chunk_id: int) -> str:
+        """获取文本块内容"""
+        start = self._offsets[chunk_id]
+        end = self._offsets[chunk_id + 1]
+        return bytes(self._buffer[start:end]).decode('utf-8')
+
+    def get_texts(self, chunk_ids: Iterable[int]) -> List[str]:
+        """批量获取文本块内容"""
+        return [self.get_text(i) for i in chunk_ids]
+
+    def get_metadata(self, chunk_id: int) -> dict:
+        """
+        还原文本块的 metadata（与 DocumentLoader 原有字段一致）
+
+        Args:
+            chunk_id: 文本块 ID
+
+        Returns:
+            metadata 字典
+        """
+        source_id = self._chunk_source[chunk_id]
+        metadata = dict(self._source_tags[source_id])
+        metadata.update({
+            "source": self._sources[source_id],
+            "file_type": self._file_types[source_id],
+            "chunk_index": int(self._chunk_index[chunk_id]),
+            "filename": self._filenames[source_id],
+        })
+        refs = self._chunk_refs.get(int(chunk_id))
+        if refs:
+            metadata["duplicate_sources"] = [
+                {
+                    "source": self._sources[self._ref_source[r]],
+                    "filename": self._filenames[self._ref_source[r]],
+                    "chunk_index": int(self._ref_index[r]),
+                }
+                for r in refs
+            ]
+        return metadata
+
+    def get_source_ids(self, chunk_id: int) -> List[int]:
+        """获取文本块的所有来源 ID（自身来源 + 近似重复块的来源）"""
+        source_ids = [int(self._chunk_source[chunk_id])]
+        for r in self._chunk_refs.get(int(chunk_id), ()):
+            source_ids.append(int(self._ref_source[r]))
+        return source_ids
+
+    def get_source_fields(self, source_id: int) -> Dict[str, Any]:
+        """
+        获取来源的可过滤字段（用于构建元数据倒排索引）
+
+        Args:
+            source_id: 来源 ID
+
+        Returns:
+            字段名 -> 值（标签值可以是列表）
+        """
+        fields = dict(self._source_tags[source_id])
+        fields.update({
+            "source": self._sources[source_id],
+            "filename": self._filenames[source_id],
+            "file_type": self._file_types[source_id],
+        })
+        return fields
+
+    def get_document(self, chunk_id: int) -> Document:
+        """将文本块还原为 Document 对象（仅对检索命中的块调用）"""
+        return Document(page_content=self.get_text(chunk_id), metadata=self.get_metadata(chunk_id))
+
+    def to_documents(self) -> List[Document]:
+        """将所有文本块还原为 Document 列表（仅用于兼容旧接口）"""
+        return [self.get_document(i) for i in range(len(self))]
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Document]) -> "ChunkStore":
+        """
+        从 Document 列表构建文本块存储
+
+        Args:
+            documents: Document 列表（metadata 需包含 source / file_type）
+
+        Returns:
+            ChunkStore 实例
+        """
+        store = cls()
+        for i, doc in enumerate(documents):
+            metadata = doc.metadata or {}
+            tags = {key: value for key, value in metadata.items() if key not in _CORE_METADATA_KEYS}
+            store.add_chunk(
+                source=str(metadata.get("source", "未知来源")),
+                file_type=metadata.get("file_type", ""),
+                chunk_index=metadata.get("chunk_index", i),
+                text=doc.page_content,
+                filename=metadata.get("filename"),
+                tags=tags,
+            )
+        return store
+
+    def save(self, directory: Union[str, Path]) -> None:
+        """
+        保存到目录（文本缓冲区和各列均为可 mmap 的文件）
+
+        Args:
+            directory: 目标目录（需已存在）
+        """
+        directory = Path(directory)
+        with open(directory / "text.bin", "wb") as f:
+            f.write(self._buffer)
+        np.save(directory / "chunk_source.npy", np.asarray(self._chunk_source, dtype=np.uint32))
+        np.save(directory / "chunk_index.npy", np.asarray(self._chunk_index, dtype=np.uint32))
+        np.save(directory / "offsets.npy", np.asarray(self._offsets, dtype=np.uint64))
+        np.save(directory / "ref_source.npy", np.asarray(self._ref_source, dtype=np.uint32))
+        np.save(directory / "ref_index.npy", np.asarray(self._ref_index, dtype=np.uint32))
+
+        ref_chunk = np.zeros(len(self._ref_source), dtype=np.uint32)
+        for chunk_id, refs in self._chunk_refs.items():
+            ref_chunk[refs] = chunk_id
+        np.save(directory / "ref_chunk.npy", ref_chunk)
+
+        sources = [
+            {
+                "source": self._sources[i],
+                "filename": self._filenames[i],
+                "file_type": self._file_types[i],
+                "tags": self._source_tags[i],
+            }
+            for i in range(len(self._sources))
+        ]
+        with open(directory / "sources.json", "w", encoding="utf-8") as f:
+            json.dump(sources, f, ensure_ascii=False, default=str)
+
+    @classmethod
+    def load(cls, directory: Union[str, Path], mmap: bool = True) -> "ChunkStore":
+        """
+        从目录加载（只读）
+
+        Args:
+            directory: save() 保存的目录
+            mmap: 是否以 mmap 方式加载（多个进程共享同一份物理内存）
+
+        Returns:
+            只读的 ChunkStore 实例（不能再添加文本块）
+        """
+        directory = Path(directory)
+        mmap_mode = "r" if mmap else None
+        store = cls()
+
+        with open(directory / "sources.json", "r", encoding="utf-8") as f:
+            for item in json.load(f):
+                store._intern_source(item["source"], item["file_type"], item["filename"], item.get("tags"))
+
+        text_path = directory / "text.bin"
+        if os.path.getsize(text_path) == 0:
+            store._buffer = bytearray()
+        elif mmap:
+            store._buffer = np.memmap(text_path, dtype=np.uint8, mode="r")
+        else:
+            store._buffer = bytearray(text_path.read_bytes())
+
+        store._chunk_source = np.load(directory / "chunk_source.npy", mmap_mode=mmap_mode)
+        store._chunk_index = np.load(directory / "chunk_index.npy", mmap_mode=mmap_mode)
+        store._offsets = np.load(directory / "offsets.npy", mmap_mode=mmap_mode)
+        store._ref_source = np.load(directory / "ref_source.npy")
+        store._ref_index = np.load(directory / "ref_index.npy")
+
+        for r, chunk_id in enumerate(np.load(directory / "ref_chunk.npy").tolist()):
+            store._chunk_refs.setdefault(chunk_id, []).append(r)
+        return store
+
+    @property
+    def num_sources(self) -> int:
+        """来源文件数量"""
+        return len(self._sources)
+
+    @property
+    def num_references(self) -> int:
+        """被折叠的近似重复块数量"""
+        return len(self._ref_source)
+
+    @property
+    def nbytes(self) -> int:
+        """估算占用的内存字节数（不含来源表中的少量字符串）"""
+        return (
+            len(self._buffer)
+            + self._chunk_source.itemsize * len(self._chunk_source)
+            + self._chunk_index.itemsize * len(self._chunk_index)
+            + self._offsets.itemsize * len(self._offsets)
+            + self._ref_source.itemsize * len(self._ref_source)
+            + self._ref_index.itemsize * len(self._ref_index)
+        )
@@ -0,0 +1,145 @@
+"""
+近似重复文本块检测
+使用 MinHash + LSH 分桶在入库阶段识别近似重复的文本块（页眉、免责声明、跨版本复制的操作步骤等）
+重复块只保留一份向量，其余出处作为来源引用记录下来
+"""
+import re
+import zlib
+from typing import Dict, List, Optional
+import numpy as np
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# 梅森素数 2^61 - 1：哈希族 (a * x + b) mod p 是两两独立的，LSH 分桶的概率计算依赖这一性质
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_LOW_29 = np.uint64((1 << 29) - 1)
+_LOW_32 = np.uint64(0xFFFFFFFF)
+
+# 签名算法版本，变化时已构建的索引需要重新去重（参与文档目录指纹计算）
+MINHASH_VERSION = 2
+
+
+def _mod_mersenne(y: np.ndarray) -> np.ndarray:
+    """y mod (2^61 - 1)，利用 2^61 ≡ 1 折叠高位（y < 2^64）"""
+    y = (y & _MERSENNE_PRIME) + (y >> np.uint64(61))
+    return np.where(y >= _MERSENNE_PRIME, y - _MERSENNE_PRIME, y)
+
+
+def _mulmod_mersenne(a: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """
+    a * x mod (2^61 - 1)，全程在 uint64 内计算不溢出
+
+    Args:
+        a: 系数（< 2^61）
+        x: 32 位哈希值（< 2^32）
+    """
+    a_hi, a_lo = a >> np.uint64(32), a & _LOW_32
+    # a * x = a_hi * x * 2^32 + a_lo * x；a_hi * x < 2^61，a_lo * x < 2^64
+    t = a_hi * x
+    # t * 2^32 = t_hi * 2^61 + t_lo * 2^32 ≡ t_hi + t_lo * 2^32 (mod p)
+    high = (t >> np.uint64(29)) + ((t & _LOW_29) << np.uint64(32))
+    return _mod_mersenne(_mod_mersenne(high) + _mod_mersenne(a_lo * x))
+
+
+class NearDuplicateDetector:
+    """基于 MinHash 的近似重复检测器"""
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        num_perm: int = 128,
+        bands: int = 32,
+        shingle_size: int = 5,
+        seed: int = 42,
+    ):
+        """
+        初始化近似重复检测器
+
+        Args:
+            threshold: 判定为重复的 Jaccard 相似度阈值（估计值）
+            num_perm: MinHash 签名长度
+            bands: LSH 分桶数量（num_perm 必须能被 bands 整除）
+            shingle_size: 字符 shingle 长度（按字符切分，兼容中文）
+            seed: 哈希函数随机种子（固定种子保证结果可复现）
+        """
+        if num_perm % bands != 0:
+            raise ValueError(f"num_perm ({num_perm}) 必须能被 bands ({bands}) 整除")
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+        # 已登记的代表块签名，以及 LSH 桶 (band, 签名片段) -> 代表块 ID 列表
+        self._signatures: Dict[int, np.ndarray] = {}
+        self._buckets: Dict[tuple, List[int]] = {}
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        计算文本的 MinHash 签名
+
+        Args:
+            text: 文本内容
+
+        Returns:
+            长度为 num_perm 的 uint32 签名
+        """
+        normalized = _WHITESPACE_RE.sub(" ", text).strip().lower()
+        k = self.shingle_size
+        if len(normalized) <= k:
+            shingles = {normalized}
+        else:
+            shingles = {normalized[i:i + k] for i in range(len(normalized) - k + 1)}
+
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode('utf-8')) for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        # h_i(x) = ((a_i * x + b_i) mod p) 的低 32 位，p = 2^61 - 1
+        permuted = _mod_mersenne(_mulmod_mersenne(self._a[None, :], hashes[:, None]) + self._b[None, :])
+        return (permuted & _MAX_HASH).min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def find_duplicate(self, signature: np.ndarray) -> Optional[int]:
+        """
+        查找与签名近似重复的代表块
+
+        Args:
+            signature: MinHash 签名
+
+        Returns:
+            代表块 ID，如果没有近似重复则返回 None
+        """
+        checked = set()
+        best_id, best_score = None, self.threshold
+        for key in self._band_keys(signature):
+            for candidate in self._buckets.get(key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                score = float(np.mean(self._signatures[candidate] == signature))
+                if score >= best_score:
+                    best_id, best_score = candidate, score
+        return best_id
+
+    def register(self, chunk_id: int, signature: np.ndarray) -> None:
+        """
+        登记一个代表块
+
+        Args:
+            chunk_id: 文本块 ID
+            signature: MinHash 签名
+        """
+        self._signatures[chunk_id] = signature
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(chunk_id)
@@ -3,17 +3,29 @@
 用于从 files 目录加载 txt 和 pdf 文件
 """
 import os
+import hashlib
+import yaml
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from app.rag.pdf_utils import PDFProcessor
+from app.rag.chunk_store import ChunkStore
+from app.rag.dedup import MINHASH_VERSION, NearDuplicateDetector
+from config.config_loader import get_config
 
 
 class DocumentLoader:
     """文档加载器"""
     
-    def __init__(self, files_dir: str = None, chunk_size: int = 1000, chunk_overlap: int = 200):
+    def __init__(
+        self,
+        files_dir: str = None,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        dedup: Optional[bool] = None,
+        dedup_threshold: Optional[float] = None,
+    ):
         """
         初始化文档加载器
         
@@ -21,7 +33,18 @@ class DocumentLoader:
             files_dir: 文件目录路径（默认为 app/rag/files）
             chunk_size: 文本块大小
             chunk_overlap: 文本块重叠大小
+            dedup: 是否在 load_all_chunks 时折叠近似重复的文本块（默认读取 model.rag.dedup.enabled）
+            dedup_threshold: 近似重复的相似度阈值（默认读取 model.rag.dedup.threshold）
         """
+        config = get_config()
+        self.dedup = dedup if dedup is not None else config.get('model.rag.dedup.enabled', True)
+        self.dedup_threshold = (
+            dedup_threshold if dedup_threshold is not None
+            else config.get('model.rag.dedup.threshold', 0.8)
+        )
+        # 每个文件的去重统计：文件名 -> (文档块总数, 近似重复块数)
+        self.dedup_stats: Dict[str, Tuple[int, int]] = {}
+        
         if files_dir is None:
             # 默认使用 app/rag/files 目录
             current_dir = Path(__file__).parent
@@ -29,6 +52,8 @@ class DocumentLoader:
         else:
             self.files_dir = Path(files_dir)
         
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
@@ -36,21 +61,33 @@ class DocumentLoader:
         )
         self.pdf_processor = PDFProcessor(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     
-    def load_txt_file(self, file_path: Path) -> List[Document]:
+    def split_txt_file(self, file_path: Path) -> List[str]:
         """
-        加载 TXT 文件
+        读取并分割 TXT 文件，返回文本块列表（不创建 Document 对象）
         
         Args:
             file_path: TXT 文件路径
             
         Returns:
-            文档块列表
+            文本块列表
         """
         with open(file_path, 'r', encoding='utf-8') as f:
             text = f.read()
         
         # 分割文本
-        chunks = self.text_splitter.split_text(text)
+        return self.text_splitter.split_text(text)
+    
+    def load_txt_file(self, file_path: Path) -> List[Document]:
+        """
+        加载 TXT 文件
+        
+        Args:
+            file_path: TXT 文件路径
+            
+        Returns:
+            文档块列表
+        """
+        chunks = self.split_txt_file(file_path)
         
         # 创建 Document 对象
         documents = []
@@ -80,18 +117,69 @@ class DocumentLoader:
         """
         return self.pdf_processor.process_pdf(str(file_path))
     
-    def load_all_documents(self) -> List[Document]:
+    def fingerprint(self) -> str:
         """
-        加载 files 目录下的所有 txt 和 pdf 文件
+        计算文档目录的指纹（文件名、大小、修改时间、标签文件以及分割/去重参数）
+        
+        指纹不变时可以直接复用之前构建好的索引，无需重新向量化
         
         Returns:
-            所有文档块列表
+            十六进制指纹字符串
+        """
+        digest = hashlib.sha1()
+        digest.update(
+            f"{self.chunk_size}:{self.chunk_overlap}:{self.dedup}:{self.dedup_threshold}:{MINHASH_VERSION}".encode('utf-8')
+        )
+        if self.files_dir.exists():
+            for file_path in sorted(self.files_dir.iterdir()):
+                if file_path.is_file() and (
+                    file_path.suffix.lower() in ('.txt', '.pdf') or file_path.name.endswith('.meta.yaml')
+                ):
+                    stat = file_path.stat()
+                    digest.update(f"{file_path.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+        return digest.hexdigest()
+    
+    def load_file_tags(self, file_path: Path) -> Dict[str, Any]:
+        """
+        读取文件的标签（同目录下的 <文件名>.meta.yaml，可选）
+        
+        标签用于检索时按元数据过滤，例如：
+            team: sre
+            cluster: [prod-bj, prod-sh]
+            runbook: node-not-ready
+        
+        Args:
+            file_path: 文档文件路径
+            
+        Returns:
+            标签字典，没有标签文件时返回空字典
+        """
+        meta_path = file_path.with_name(file_path.name + ".meta.yaml")
+        if not meta_path.exists():
+            return {}
+        
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                tags = yaml.safe_load(f) or {}
+        except yaml.YAMLError as e:
+            print(f"   ⚠️  标签文件解析失败 {meta_path.name}: {e}")
+            return {}
+        
+        if not isinstance(tags, dict):
+            print(f"   ⚠️  标签文件格式错误 {meta_path.name}: 需要 key: value 格式")
+            return {}
+        return tags
+    
+    def _iter_file_chunks(self) -> Iterator[Tuple[Path, str, List[str], Dict[str, Any]]]:
+        """
+        遍历 files 目录下的 txt 和 pdf 文件，逐个文件返回分割后的文本块
+        
+        Returns:
+            (文件路径, 文件类型, 文本块列表, 文件标签) 迭代器
         """
         if not self.files_dir.exists():
             print(f"⚠️  文件目录不存在: {self.files_dir}")
-            return []
-        
-        all_documents = []
+            return
         
         # 遍历文件目录
         for file_path in self.files_dir.iterdir():
@@ -101,20 +189,94 @@ class DocumentLoader:
                 try:
                     if file_ext == '.txt':
                         print(f"📄 加载 TXT 文件: {file_path.name}")
-                        docs = self.load_txt_file(file_path)
-                        all_documents.extend(docs)
-                        print(f"   ✅ 加载了 {len(docs)} 个文档块")
+                        chunks = self.split_txt_file(file_path)
+                        file_type = "txt"
                     
                     elif file_ext == '.pdf':
                         print(f"📕 加载 PDF 文件: {file_path.name}")
-                        docs = self.load_pdf_file(file_path)
-                        all_documents.extend(docs)
-                        print(f"   ✅ 加载了 {len(docs)} 个文档块")
+                        chunks = self.pdf_processor.split_pdf(str(file_path))
+                        file_type = "pdf"
+                    
+                    else:
+                        continue
                     
                 except Exception as e:
                     print(f"   ❌ 加载文件失败 {file_path.name}: {e}")
                     continue
+                
+                yield file_path, file_type, chunks, self.load_file_tags(file_path)
+    
+    def load_all_documents(self) -> List[Document]:
+        """
+        加载 files 目录下的所有 txt 和 pdf 文件
+        
+        Returns:
+            所有文档块列表
+        """
+        all_documents = []
+        
+        for file_path, file_type, chunks, tags in self._iter_file_chunks():
+            for i, chunk in enumerate(chunks):
+                all_documents.append(Document(
+                    page_content=chunk,
+                    metadata={
+                        **tags,
+                        "source": str(file_path),
+                        "file_type": file_type,
+                        "chunk_index": i,
+                        "filename": file_path.name
+                    }
+                ))
+            print(f"   ✅ 加载了 {len(chunks)} 个文档块")
         
         print(f"\n✅ 总共加载了 {len(all_documents)} 个文档块")
         return all_documents
-
+    
+    def load_all_chunks(self, chunk_store: Optional[ChunkStore] = None) -> ChunkStore:
+        """
+        加载 files 目录下的所有 txt 和 pdf 文件到列式文本块存储
+        
+        与 load_all_documents 相比不会为每个块创建 Document 对象，
+        来源信息只保存一次，适合大量文档块的场景。
+        启用去重时，近似重复的块（跨文件或同一文件内）只保留第一份，
+        其余出处记录为该块的额外来源，不再重复向量化
+        
+        Args:
+            chunk_store: 已有的文本块存储（可选，默认新建）
+        
+        Returns:
+            ChunkStore 实例
+        """
+        store = chunk_store if chunk_store is not None else ChunkStore()
+        detector = NearDuplicateDetector(threshold=self.dedup_threshold) if self.dedup else None
+        self.dedup_stats = {}
+        
+        for file_path, file_type, chunks, tags in self._iter_file_chunks():
+            if detector is None:
+                store.add_chunks(str(file_path), file_type, chunks, filename=file_path.name, tags=tags)
+                print(f"   ✅ 加载了 {len(chunks)} 个文档块")
+                continue
+            
+            duplicates = 0
+            for i, chunk in enumerate(chunks):
+                signature = detector.signature(chunk)
+                canonical_id = detector.find_duplicate(signature)
+                if canonical_id is not None:
+                    store.add_reference(canonical_id, str(file_path), file_type, i,
+                                        filename=file_path.name, tags=tags)
+                    duplicates += 1
+                else:
+                    chunk_id = store.add_chunk(str(file_path), file_type, i, chunk,
+                                               filename=file_path.name, tags=tags)
+                    detector.register(chunk_id, signature)
+            
+            self.dedup_stats[file_path.name] = (len(chunks), duplicates)
+            print(f"   ✅ 加载了 {len(chunks)} 个文档块")
+            if chunks:
+                print(f"   ♻️  近似重复 {duplicates}/{len(chunks)} 个（去重率 {duplicates / len(chunks):.1%}）")
+        
+        print(f"\n✅ 总共加载了 {len(store)} 个文档块")
+        if store.num_references:
+            total = len(store) + store.num_references
+            print(f"♻️  折叠了 {store.num_references} 个近似重复块（总去重率 {store.num_references / total:.1%}）")
+        return store
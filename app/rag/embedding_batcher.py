@@ -0,0 +1,184 @@
+"""
+查询向量化微批处理
+高并发时每个请求各自调用一次 embedding API，往返次数和速率限制压力都随 QPS 线性增长。
+微批处理器把几毫秒内到达的查询合并成一次批量查询向量化调用，再把向量分发给各个等待者
+
+有些模型的查询向量和文档向量不同（例如查询需要加指令前缀），不能用 embed_documents 代替 embed_query。
+批量查询的方式（batch_query_embedder）：
+- Embeddings 实现了 embed_queries(texts)：直接使用（如 ZhipuAIEmbeddings）
+- OpenAIEmbeddings：其 embed_query 就是 embed_documents([text])[0]，两者等价
+- 其他实现：无法确认等价，不做微批处理，逐条调用 embed_query
+"""
+import asyncio
+import weakref
+from typing import Callable, Dict, List, Optional, Tuple
+from langchain_core.embeddings import Embeddings
+from config.config_loader import get_config
+
+
+def batch_query_embedder(embeddings: Embeddings) -> Optional[Callable[[List[str]], List[List[float]]]]:
+    """
+    获取与逐条 embed_query 结果一致的批量查询向量化函数
+
+    Args:
+        embeddings: Embeddings 实例
+
+    Returns:
+        批量向量化函数；无法确认批量结果与 embed_query 一致时返回 None
+    """
+    embed_queries = getattr(embeddings, "embed_queries", None)
+    if callable(embed_queries):
+        return embed_queries
+    try:
+        from langchain_openai import OpenAIEmbeddings
+    except ImportError:
+        return None
+    if isinstance(embeddings, OpenAIEmbeddings) and type(embeddings).embed_query is OpenAIEmbeddings.embed_query:
+        return embeddings.embed_documents
+    return None
+
+
+class _LoopQueue:
+    """单个事件循环内的待处理查询（Future 只能在创建它的事件循环中完成）"""
+
+    def __init__(self):
+        self.pending: List[Tuple[str, asyncio.Future]] = []
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+
+
+class QueryEmbeddingBatcher:
+    """查询向量化微批处理器"""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_batch_size: int = 10,
+        max_wait_ms: float = 5.0,
+        embed_batch: Optional[Callable[[List[str]], List[List[float]]]] = None,
+    ):
+        """
+        初始化微批处理器
+
+        Args:
+            embeddings: 底层 Embeddings 实例
+            max_batch_size: 单次合并的最大查询数量（达到后立即发送）
+            max_wait_ms: 第一个查询到达后最多等待的毫秒数
+            embed_batch: 批量查询向量化函数（默认为 batch_query_embedder(embeddings)）
+
+        Raises:
+            ValueError: 无法确认批量结果与 embed_query 一致
+        """
+        self.embeddings = embeddings
+        self.embed_batch = embed_batch or batch_query_embedder(embeddings)
+        if self.embed_batch is None:
+            raise ValueError(f"{type(embeddings).__name__} 不支持批量查询向量化（需要实现 embed_queries）")
+        # 不超过客户端自身的批量大小，避免一次合并被拆成多次请求（智谱AI 分批之间还有延迟）
+        client_batch_size = getattr(embeddings, "batch_size", None)
+        if isinstance(client_batch_size, int) and client_batch_size > 0:
+            max_batch_size = min(max_batch_size, client_batch_size)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queues: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopQueue]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+        # 正在发送的批次（保留引用，避免任务被垃圾回收）
+        self._tasks: set = set()
+
+        # 统计信息
+        self.requests = 0
+        self.batches = 0
+
+    async def embed_query(self, text: str) -> List[float]:
+        """
+        为查询文本生成 embedding（与同一时间窗口内的其他查询合并请求）
+
+        Args:
+            text: 查询文本
+
+        Returns:
+            embedding 向量
+        """
+        loop = asyncio.get_running_loop()
+        queue = self._queues.get(loop)
+        if queue is None:
+            queue = self._queues[loop] = _LoopQueue()
+
+        future = loop.create_future()
+        queue.pending.append((text, future))
+        self.requests += 1
+
+        if len(queue.pending) >= self.max_batch_size:
+            self._flush(queue)
+        elif queue.flush_handle is None:
+            queue.flush_handle = loop.call_later(self.max_wait, self._flush, queue)
+        return await future
+
+    def _flush(self, queue: _LoopQueue) -> None:
+        """取出当前批次并在后台发送"""
+        if queue.flush_handle is not None:
+            queue.flush_handle.cancel()
+            queue.flush_handle = None
+        batch, queue.pending = queue.pending, []
+        if batch:
+            task = asyncio.ensure_future(self._embed_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _embed_batch(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        """调用一次批量查询向量化，并把结果分发给等待者（相同的查询只发送一次）"""
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.batches += 1
+        try:
+            vectors = await asyncio.to_thread(self.embed_batch, texts)
+            if len(vectors) != len(texts):
+                raise ValueError(f"Embedding 返回的向量数量不匹配: {len(vectors)} != {len(texts)}")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text: Dict[str, List[float]] = dict(zip(texts, vectors))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+    def stats(self) -> dict:
+        """合并效果统计（查询数、实际请求数、平均每次请求的查询数）"""
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+# Embeddings 实例 id -> 微批处理器（共享同一个 Embeddings 实例的知识库也共享批次）
+_batchers: Dict[int, QueryEmbeddingBatcher] = {}
+
+
+def get_query_batcher(embeddings: Embeddings) -> Optional[QueryEmbeddingBatcher]:
+    """
+    获取 Embeddings 实例对应的微批处理器
+
+    Args:
+        embeddings: Embeddings 实例
+
+    Returns:
+        QueryEmbeddingBatcher 实例；配置中关闭了微批处理，或该 Embeddings 不支持批量查询向量化时返回 None
+    """
+    config = get_config()
+    if not config.get('model.rag.query_batching.enabled', True):
+        return None
+    if batch_query_embedder(embeddings) is None:
+        return None
+
+    batcher = _batchers.get(id(embeddings))
+    if batcher is None or batcher.embeddings is not embeddings:
+        batcher = QueryEmbeddingBatcher(
+            embeddings,
+            max_batch_size=int(config.get('model.rag.query_batching.max_batch_size', 10)),
+            max_wait_ms=float(config.get('model.rag.query_batching.max_wait_ms', 5)),
+        )
+        _batchers[id(embeddings)] = batcher
+    return batcher
@@ -0,0 +1,133 @@
+"""
+向量索引快照
+每次构建（或重建）索引都会生成一个新版本的只读快照，通过原子引用替换发布。
+检索请求在开始时获取当前快照并持有到结束，因此重建期间的请求始终在完整的旧版本上完成；
+旧版本被替换后，等最后一个读者释放时才真正释放资源
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+
+class IndexSnapshot:
+    """某个版本的只读向量索引"""
+
+    def __init__(self, vector_store: Any, version: int):
+        """
+        初始化索引快照
+
+        Args:
+            vector_store: 已构建完成的向量存储（发布后不再修改）
+            version: 版本号（同一知识库内单调递增）
+        """
+        self.vector_store = vector_store
+        self.version = version
+        self.created_at = time.time()
+        self.nbytes = vector_store.nbytes
+        self._readers = 0
+        self._retired = False
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """登记一个读者"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"索引快照 v{self.version} 已释放")
+            self._readers += 1
+
+    def release(self) -> None:
+        """注销一个读者；如果快照已被替换且没有其他读者，则释放资源"""
+        with self._lock:
+            self._readers -= 1
+            should_close = self._retired and self._readers == 0
+        if should_close:
+            self._close()
+
+    def retire(self) -> None:
+        """标记快照已被新版本替换；没有读者时立即释放资源"""
+        with self._lock:
+            self._retired = True
+            should_close = self._readers == 0
+        if should_close:
+            self._close()
+
+    def _close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            vector_store, self.vector_store = self.vector_store, None
+        close = getattr(vector_store, "close", None)
+        if close is not None:
+            close()
+
+    @property
+    def readers(self) -> int:
+        """当前读者数量"""
+        return self._readers
+
+    @property
+    def closed(self) -> bool:
+        """资源是否已释放"""
+        return self._closed
+
+
+class SnapshotHolder:
+    """持有当前快照的引用，负责原子替换和读者登记"""
+
+    def __init__(self):
+        self._current: Optional[IndexSnapshot] = None
+        self._version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def current(self) -> Optional[IndexSnapshot]:
+        """当前快照（可能为 None）"""
+        return self._current
+
+    def publish(self, vector_store: Any) -> IndexSnapshot:
+        """
+        发布新版本并原子替换当前快照，旧版本在最后一个读者结束后释放
+
+        Args:
+            vector_store: 已构建完成的向量存储
+
+        Returns:
+            新的 IndexSnapshot
+        """
+        with self._lock:
+            self._version += 1
+            snapshot = IndexSnapshot(vector_store, self._version)
+            previous, self._current = self._current, snapshot
+        if previous is not None:
+            previous.retire()
+        return snapshot
+
+    def clear(self) -> None:
+        """撤下当前快照（用于淘汰），正在进行的读者不受影响"""
+        with self._lock:
+            previous, self._current = self._current, None
+        if previous is not None:
+            previous.retire()
+
+    @contextmanager
+    def read(self) -> Iterator[Optional[IndexSnapshot]]:
+        """
+        获取当前快照并在使用期间持有
+
+        Example:
+            with holder.read() as snapshot:
+                if snapshot is not None:
+                    snapshot.vector_store.similarity_search(...)
+        """
+        with self._lock:
+            snapshot = self._current
+            if snapshot is not None:
+                snapshot.acquire()
+        try:
+            yield snapshot
+        finally:
+            if snapshot is not None:
+                snapshot.release()
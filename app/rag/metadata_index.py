@@ -0,0 +1,108 @@
+"""
+元数据倒排索引
+在入库阶段把文本块的元数据（source / filename / file_type / 文件标签）索引为有序行号数组，
+检索时先用过滤条件得到候选行，再只对这些行计算相似度，避免全量扫描后再过滤
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from app.rag.chunk_store import ChunkStore
+
+
+# 过滤条件：字段名 -> 值或值列表（同一字段内为"或"，不同字段之间为"与"）
+MetadataFilter = Dict[str, Any]
+
+_EMPTY_ROWS = np.zeros(0, dtype=np.int64)
+
+
+def _as_values(value: Any) -> List[str]:
+    """将字段值统一为字符串列表"""
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [str(v) for v in value]
+    return [str(value)]
+
+
+class MetadataIndex:
+    """元数据倒排索引：(字段, 值) -> 有序行号数组"""
+
+    def __init__(self, postings: Dict[Tuple[str, str], np.ndarray], cache_size: int = 256):
+        """
+        初始化元数据倒排索引
+
+        Args:
+            postings: (字段, 值) -> 有序且去重的行号数组
+            cache_size: 过滤条件解析结果的缓存数量
+        """
+        self._postings = postings
+        self._cache: Dict[tuple, np.ndarray] = {}
+        self._cache_size = cache_size
+
+    @classmethod
+    def build(cls, chunk_store: ChunkStore, row_chunk_ids: Sequence[int]) -> "MetadataIndex":
+        """
+        根据文本块存储构建索引
+
+        Args:
+            chunk_store: 文本块存储
+            row_chunk_ids: 向量矩阵第 i 行对应的文本块 ID
+
+        Returns:
+            MetadataIndex 实例
+        """
+        # 先按来源聚合行号（近似重复块的所有来源都会命中该行）
+        source_rows: Dict[int, List[int]] = {}
+        for row, chunk_id in enumerate(row_chunk_ids):
+            for source_id in chunk_store.get_source_ids(chunk_id):
+                source_rows.setdefault(source_id, []).append(row)
+
+        # 再按 (字段, 值) 合并来源的行号
+        grouped: Dict[Tuple[str, str], List[int]] = {}
+        for source_id, rows in source_rows.items():
+            for field, value in chunk_store.get_source_fields(source_id).items():
+                for v in _as_values(value):
+                    grouped.setdefault((field, v), []).extend(rows)
+
+        postings = {key: np.unique(np.asarray(rows, dtype=np.int64)) for key, rows in grouped.items()}
+        return cls(postings)
+
+    def resolve(self, metadata_filter: Optional[MetadataFilter]) -> Optional[np.ndarray]:
+        """
+        将过滤条件解析为有序行号数组
+
+        Args:
+            metadata_filter: 过滤条件，例如 {"file_type": "pdf", "team": ["sre", "infra"]}
+
+        Returns:
+            满足条件的行号数组；没有过滤条件时返回 None（表示不过滤）
+        """
+        if not metadata_filter:
+            return None
+
+        cache_key = tuple(sorted((field, tuple(sorted(_as_values(value))))
+                                 for field, value in metadata_filter.items()))
+        rows = self._cache.get(cache_key)
+        if rows is not None:
+            return rows
+
+        for field, values in cache_key:
+            field_rows = _EMPTY_ROWS
+            for value in values:
+                posting = self._postings.get((field, value))
+                if posting is not None:
+                    field_rows = posting if field_rows.size == 0 else np.union1d(field_rows, posting)
+            rows = field_rows if rows is None else np.intersect1d(rows, field_rows, assume_unique=True)
+            if rows.size == 0:
+                break
+
+        if len(self._cache) >= self._cache_size:
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[cache_key] = rows
+        return rows
+
+    def values(self, field: str) -> List[str]:
+        """列出某个字段的所有取值（便于前端或工具展示可选过滤项）"""
+        return sorted(v for f, v in self._postings if f == field)
+
+    @property
+    def nbytes(self) -> int:
+        """估算索引占用的内存字节数"""
+        return sum(rows.nbytes for rows in self._postings.values())
@@ -64,21 +64,33 @@ class PDFProcessor:
         
         return "\n\n".join(text_content)
     
-    def process_pdf(self, pdf_path: str) -> List[Document]:
+    def split_pdf(self, pdf_path: str) -> List[str]:
         """
-        处理 PDF 文件，返回文档块列表
+        提取并分割 PDF 文本，返回文本块列表（不创建 Document 对象）
         
         Args:
             pdf_path: PDF 文件路径
             
         Returns:
-            文档块列表
+            文本块列表
         """
         # 提取文本
         text = self.extract_text_from_pdf(pdf_path)
         
         # 分割文本
-        chunks = self.text_splitter.split_text(text)
+        return self.text_splitter.split_text(text)
+    
+    def process_pdf(self, pdf_path: str) -> List[Document]:
+        """
+        处理 PDF 文件，返回文档块列表
+        
+        Args:
+            pdf_path: PDF 文件路径
+            
+        Returns:
+            文档块列表
+        """
+        chunks = self.split_pdf(pdf_path)
         
         # 创建 Document 对象
         documents = []
@@ -1,7 +1,8 @@
 import json
+import time
 import uvicorn
 
-from typing import List, Dict, Any, AsyncGenerator
+from typing import List, Dict, Any, AsyncGenerator, Callable, Literal, Optional
 from datetime import datetime
 from pydantic import BaseModel, Field
 
@@ -14,7 +15,8 @@ from langchain_core.messages import BaseMessage
 
 
 from app.core.agent import model_usage
-from app.rag.document_loader import DocumentLoader
+from app.core.prompt_cache import prompt_cache_stats
+from app.core.admission import AdmissionRejected, admission_metrics, get_admission_controller
 from app.rag.vector_store import get_vector_store_manager
 from app.rag.rag_retriever import get_rag_retriever
 
@@ -24,24 +26,23 @@ def get_model():
 
 # ==================== RAG 系统初始化 ====================
 def initialize_rag_system():
-    """初始化 RAG 系统：加载文档并构建向量存储"""
+    """
+    初始化 RAG 系统：加载默认知识库
+    
+    启用共享索引时，多个 worker 中只有一个会向量化文档，其他 worker 直接挂载已发布的索引段
+    """
     print("\n" + "="*60)
     print("🚀 初始化 RAG 知识库...")
     print("="*60 + "\n")
     
     try:
-        # 1. 加载文档
-        loader = DocumentLoader()
-        documents = loader.load_all_documents()
+        vector_store_manager = get_vector_store_manager()
+        vector_store_manager.ensure_loaded()
         
-        if not documents:
+        if not vector_store_manager.is_initialized():
             print("⚠️  未找到任何文档，RAG 功能将不可用")
             return False
         
-        # 2. 初始化向量存储
-        vector_store_manager = get_vector_store_manager()
-        vector_store_manager.initialize(documents)
-        
         print("="*60)
         print("✅ RAG 知识库初始化完成！")
         print("="*60 + "\n")
@@ -80,6 +81,15 @@ class ContentBlock(BaseModel):
 class MessageRequest(BaseModel):
     content_blocks: List[ContentBlock] = Field(default=[], description="内容块")
     history: List[Dict[str, Any]] = Field(default=[], description="对话历史")
+    rag_filter: Optional[Dict[str, Any]] = Field(
+        default=None,
+        description="知识库检索的元数据过滤条件，例如 {\"file_type\": \"pdf\", \"team\": [\"sre\"]}"
+    )
+    collection: Optional[str] = Field(default=None, description="检索的知识库名称（默认为默认知识库）")
+    priority: Literal["interactive", "batch"] = Field(
+        default="interactive",
+        description="模型调用的排队优先级，批量任务使用 batch（alert 保留给告警诊断）"
+    )
 
 
 class MessageResponse(BaseModel):
@@ -102,49 +112,77 @@ def create_multimodal_message(request: MessageRequest) -> HumanMessage:
 
     return HumanMessage(content=message_content[0]["text"])
 
-def convert_history_to_messages(history: List[Dict[str, Any]], rag_context: str = "") -> List[BaseMessage]:
+# 系统提示词保持逐字节不变：模型服务按前缀缓存（系统提示词 + 工具 + 历史），
+# 每次请求都不同的 RAG 上下文放在最后一条用户消息中，不破坏前面可复用的前缀
+RAG_SYSTEM_PROMPT = """你是一个专业的多模态 RAG 助手，具备与用户对话的能力，请以专业、准确、友好的方式回答用户所提问题。
+
+用户消息中可能附带【知识库信息】，请基于这些信息回答用户的问题。如果知识库中的信息不足以回答问题，请基于你的知识进行回答，但要明确说明信息来源。"""
+
+
+def _text_content(blocks: List[Dict[str, Any]]) -> Any:
+    """
+    用户消息内容：只有一个文本块时使用纯字符串，与当前消息的格式一致，
+    这样本轮的用户消息在下一轮成为历史时序列化结果不变，前缀缓存可以覆盖到它
+    """
+    message_content = [
+        {"type": "text", "text": block.get("content", "")}
+        for block in blocks
+        if block.get("type") == "text"
+    ]
+    if len(message_content) == 1:
+        return message_content[0]["text"]
+    return message_content
+
+
+def convert_history_to_messages(history: List[Dict[str, Any]]) -> List[BaseMessage]:
     """
     将历史记录转换为 LangChain 消息格式，支持多模态内容
     
     Args:
         history: 对话历史
-        rag_context: RAG 检索到的上下文（可选）
     """
-    messages = []
-
-    # 构建系统消息（包含 RAG 上下文）
-    system_prompt = """你是一个专业的多模态 RAG 助手，具备与用户对话的能力，请以专业、准确、友好的方式回答用户所提问题。"""
-    
-    if rag_context:
-        system_prompt += f"""
-
-以下是来自知识库的相关信息，请基于这些信息回答用户的问题。如果知识库中的信息不足以回答问题，请基于你的知识进行回答，但要明确说明信息来源。
-
-【知识库信息】
-{rag_context}
-    """
-
-    messages.append(SystemMessage(content=system_prompt))
+    messages = [SystemMessage(content=RAG_SYSTEM_PROMPT)]
 
     # 转换历史消息
-    for i, msg in enumerate(history):
+    for msg in history:
         content = msg.get("content", "")
-        content_blocks = msg.get("content_blocks", [])
-        message_content = []
         if msg["role"] == "user":
-            for block in content_blocks:
-                if block.get("type") == "text":
-                    message_content.append({
-                        "type": "text",
-                        "text": block.get("content", "")
-                    })
-            messages.append(HumanMessage(content=message_content))
+            messages.append(HumanMessage(content=_text_content(msg.get("content_blocks", []))))
         elif msg["role"] == "assistant":
             messages.append(AIMessage(content=content))
 
     return messages
 
 
+def with_rag_context(message: HumanMessage, rag_context: str = "") -> HumanMessage:
+    """
+    把 RAG 检索到的上下文附加到当前用户消息末尾（而不是系统消息中）
+    
+    Args:
+        message: 当前用户消息
+        rag_context: RAG 检索到的上下文（可选）
+    """
+    if not rag_context:
+        return message
+    return HumanMessage(content=f"""{message.content}
+
+【知识库信息】
+{rag_context}""")
+
+
+def build_chat_messages(request: "MessageRequest", rag_context: str = "") -> List[BaseMessage]:
+    """
+    组装本次请求的消息：稳定的系统提示词 -> 历史 -> 当前用户消息（附带 RAG 上下文）
+    
+    Args:
+        request: 聊天请求
+        rag_context: RAG 检索到的上下文（可选）
+    """
+    messages = convert_history_to_messages(request.history)
+    messages.append(with_rag_context(create_multimodal_message(request), rag_context))
+    return messages
+
+
 
 
 
@@ -152,7 +190,8 @@ def convert_history_to_messages(history: List[Dict[str, Any]], rag_context: str
 
 async def generate_streaming_response(
         messages: List[BaseMessage],
-        user_query: str = ""
+        user_query: str = "",
+        release: Optional[Callable[[], None]] = None
 ) -> AsyncGenerator[str, None]:
     """
     生成流式响应（集成 RAG）
@@ -160,6 +199,7 @@ async def generate_streaming_response(
     Args:
         messages: 消息列表
         user_query: 用户查询（用于 RAG 检索）
+        release: 流结束时归还模型调用名额的回调（准入控制）
     """
     try:
         model = get_model()
@@ -195,6 +235,65 @@ async def generate_streaming_response(
             "timestamp": datetime.now().isoformat()
         }
         yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+    finally:
+        if release:
+            release()
+
+
+async def admit(priority: str) -> Optional[Callable[[], None]]:
+    """
+    获取一个模型调用名额（准入控制）
+
+    Args:
+        priority: 排队优先级
+
+    Returns:
+        归还名额的回调（可重复调用，只归还一次）；未启用准入控制时返回 None
+
+    Raises:
+        HTTPException: 排队超时或队列已满（503 + Retry-After）
+    """
+    controller = get_admission_controller()
+    if controller is None:
+        return None
+    try:
+        await controller.acquire(priority)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    started = time.monotonic()
+    released = False
+
+    def release() -> None:
+        nonlocal released
+        if not released:
+            released = True
+            controller.release(time.monotonic() - started)
+
+    return release
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    持有模型调用名额的流式响应
+
+    生成器只有开始迭代后 finally 才会执行：客户端在响应体开始前断开、或响应被取消时，
+    生成器里的归还不会发生。这里在响应结束（无论正常结束、断开还是取消）时再归还一次兜底
+    """
+
+    def __init__(self, content: Any, release: Optional[Callable[[], None]] = None, **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.release:
+                self.release()
 
 
 
@@ -232,32 +331,39 @@ async def chat_stream(request: MessageRequest):
         
         # RAG 检索（如果已初始化）
         rag_context = ""
-        if _rag_initialized and user_query:
+        if user_query and (_rag_initialized or request.collection):
             try:
-                retriever = get_rag_retriever(k=4)
-                relevant_docs = await retriever.aretrieve(user_query)
+                retriever = get_rag_retriever(k=4, collection=request.collection)
+                relevant_docs = await retriever.aretrieve(user_query, filter=request.rag_filter)
                 if relevant_docs:
                     rag_context = retriever.format_context(relevant_docs)
             except Exception as e:
                 print(f"⚠️  RAG 检索失败: {e}")
         
-        # 转换消息历史（包含 RAG 上下文）
-        messages = convert_history_to_messages(request.history, rag_context=rag_context)
-
-        # 添加当前用户消息（支持多模态）
-        current_message = create_multimodal_message(request)
-        messages.append(current_message)
-
-        # 返回流式响应
-        return StreamingResponse(
-            generate_streaming_response(messages, user_query=user_query),
-            media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Content-Type": "text/event-stream",
-            }
-        )
+        # 组装消息（RAG 上下文附加在当前用户消息末尾，保持前缀稳定）
+        messages = build_chat_messages(request, rag_context=rag_context)
+
+        # 排队获取模型调用名额，流结束时归还
+        release = await admit(request.priority)
+
+        # 返回流式响应（构建失败时立即归还名额）
+        try:
+            return AdmittedStreamingResponse(
+                generate_streaming_response(messages, user_query=user_query, release=release),
+                release=release,
+                media_type="text/plain",
+                headers={
+                    "Cache-Control": "no-cache",
+                    "Connection": "keep-alive",
+                    "Content-Type": "text/event-stream",
+                }
+            )
+        except BaseException:
+            if release:
+                release()
+            raise
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -280,25 +386,26 @@ async def chat_sync(request: MessageRequest):
         
         # RAG 检索（如果已初始化）
         rag_context = ""
-        if _rag_initialized and user_query:
+        if user_query and (_rag_initialized or request.collection):
             try:
-                retriever = get_rag_retriever(k=4)
-                relevant_docs = await retriever.aretrieve(user_query)
+                retriever = get_rag_retriever(k=4, collection=request.collection)
+                relevant_docs = await retriever.aretrieve(user_query, filter=request.rag_filter)
                 if relevant_docs:
                     rag_context = retriever.format_context(relevant_docs)
             except Exception as e:
                 print(f"⚠️  RAG 检索失败: {e}")
         
-        # 转换消息历史（包含 RAG 上下文）
-        messages = convert_history_to_messages(request.history, rag_context=rag_context)
-
-        # 添加当前用户消息（支持多模态）
-        current_message = create_multimodal_message(request)
-        messages.append(current_message)
-
-        # 获取模型响应
-        model = get_model()
-        response = await model.ainvoke(messages)
+        # 组装消息（RAG 上下文附加在当前用户消息末尾，保持前缀稳定）
+        messages = build_chat_messages(request, rag_context=rag_context)
+
+        # 排队获取模型调用名额后获取模型响应
+        release = await admit(request.priority)
+        try:
+            model = get_model()
+            response = await model.ainvoke(messages)
+        finally:
+            if release:
+                release()
 
         return MessageResponse(
             content=response.content,
@@ -306,10 +413,59 @@ async def chat_sync(request: MessageRequest):
             timestamp=datetime.now().isoformat(),
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/rag/collections")
+async def list_collections():
+    """查看所有知识库的状态（是否已加载、当前版本、读者数、内存占用）"""
+    return {"collections": get_vector_store_manager().collection_status()}
+
+
+@app.post("/api/rag/reindex")
+async def reindex_collection(collection: Optional[str] = None):
+    """
+    在后台重建知识库索引
+
+    重建期间旧版本继续提供检索，完成后原子替换为新版本，正在进行的请求不受影响
+    """
+    manager = get_vector_store_manager()
+    try:
+        target = manager.get_collection(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    future = manager.rebuild_in_background(collection)
+    if collection is None:
+        # 默认知识库启动时初始化失败的情况下，重建成功后启用 RAG
+        def _mark_initialized(f):
+            global _rag_initialized
+            if not f.exception() and manager.is_initialized():
+                _rag_initialized = True
+        future.add_done_callback(_mark_initialized)
+
+    return {
+        "status": "accepted",
+        "collection": target.name,
+        "current_version": target.version,
+    }
+
+
+@app.get("/api/metrics/prompt_cache")
+async def prompt_cache_metrics():
+    """prompt 前缀缓存命中统计（命中 token 比例、命中 / 未命中调用的首 token 延迟分位数、前缀种类数）"""
+    return {"prompt_cache": prompt_cache_stats()}
+
+
+@app.get("/api/metrics/admission")
+async def admission_metrics_endpoint():
+    """模型调用准入控制指标（并发数、各优先级排队深度、等待时间分位数、拒绝 / 超时计数）"""
+    return {"admission": admission_metrics()}
+
+
 if __name__ == "__main__":
     uvicorn.run(
         app,
@@ -2,60 +2,95 @@
 RAG 检索器
 用于从知识库中检索相关信息
 """
-from typing import List, Optional
+import re
+from typing import Dict, List, Optional, Tuple
 from langchain_core.documents import Document
+from app.rag.metadata_index import MetadataFilter
 from app.rag.vector_store import get_vector_store_manager
+from app.utils.singleflight import SingleFlight, make_key
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# 并发的相同检索（告警风暴时大量请求问同一个问题）只执行一次
+_retrieval_flight = SingleFlight("rag_retrieval")
 
 
 class RAGRetriever:
     """RAG 检索器"""
     
-    def __init__(self, k: int = 4):
+    def __init__(self, k: int = 4, collection: Optional[str] = None):
         """
         初始化 RAG 检索器
         
         Args:
             k: 检索的文档数量（默认 4）
+            collection: 知识库名称（默认为默认知识库）
         """
         self.k = k
+        self.collection = collection
         self.vector_store_manager = get_vector_store_manager()
     
-    def retrieve(self, query: str) -> List[Document]:
+    def _is_available(self) -> bool:
+        """
+        检查知识库是否可用
+        
+        默认知识库在启动时加载，未加载成功则视为不可用；
+        命名知识库只要已注册即可用（首次检索时按需加载）
+        """
+        if self.collection is None:
+            return self.vector_store_manager.is_initialized()
+        return self.vector_store_manager.has_collection(self.collection)
+    
+    def retrieve(self, query: str, filter: Optional[MetadataFilter] = None) -> List[Document]:
         """
         检索相关文档
         
         Args:
             query: 查询文本
+            filter: 元数据过滤条件（可选），例如 {"team": "sre"}
             
         Returns:
             相关文档列表
         """
-        if not self.vector_store_manager.is_initialized():
+        if not self._is_available():
             return []
         
         try:
-            documents = self.vector_store_manager.search(query, k=self.k)
+            documents = self.vector_store_manager.search(
+                query, k=self.k, filter=filter, collection=self.collection
+            )
             return documents
         except Exception as e:
             print(f"⚠️  检索失败: {e}")
             return []
     
-    async def aretrieve(self, query: str) -> List[Document]:
+    async def aretrieve(self, query: str, filter: Optional[MetadataFilter] = None) -> List[Document]:
         """
         异步检索相关文档
         
         Args:
             query: 查询文本
+            filter: 元数据过滤条件（可选）
             
         Returns:
             相关文档列表
         """
-        if not self.vector_store_manager.is_initialized():
+        if not self._is_available():
             return []
         
+        # 相同的查询（忽略首尾和连续空白）、k、知识库和过滤条件共享同一次进行中的检索
+        normalized = _WHITESPACE_RE.sub(" ", query).strip()
+        key = make_key(normalized, self.k, self.collection, filter)
         try:
-            documents = await self.vector_store_manager.asearch(query, k=self.k)
-            return documents
+            documents = await _retrieval_flight.do(
+                key,
+                lambda: self.vector_store_manager.asearch(
+                    normalized, k=self.k, filter=filter, collection=self.collection
+                ),
+            )
+            # 每个调用者拿到独立的列表，避免互相修改
+            return list(documents)
         except Exception as e:
             print(f"⚠️  检索失败: {e}")
             return []
@@ -76,29 +111,35 @@ class RAGRetriever:
         context_parts = []
         for i, doc in enumerate(documents, 1):
             source = doc.metadata.get('filename', doc.metadata.get('source', '未知来源'))
+            duplicates = doc.metadata.get('duplicate_sources')
+            if duplicates:
+                also = sorted({d['filename'] for d in duplicates} - {source})
+                if also:
+                    source = f"{source}，另见 {', '.join(also)}"
             context_parts.append(f"[文档 {i} - {source}]\n{doc.page_content}\n")
         
         return "\n---\n\n".join(context_parts)
 
 
-# 全局 RAG 检索器实例
-_rag_retriever: Optional[RAGRetriever] = None
+# 全局 RAG 检索器实例：(k, 知识库名称) -> RAGRetriever
+_rag_retrievers: Dict[Tuple[int, Optional[str]], RAGRetriever] = {}
 
 
-def get_rag_retriever(k: int = 4) -> RAGRetriever:
+def get_rag_retriever(k: int = 4, collection: Optional[str] = None) -> RAGRetriever:
     """
-    获取 RAG 检索器（单例模式）
+    获取 RAG 检索器（每个 k / 知识库组合一个实例）
     
     Args:
         k: 检索的文档数量
+        collection: 知识库名称（默认为默认知识库）
         
     Returns:
         RAGRetriever 实例
     """
-    global _rag_retriever
+    key = (k, collection)
+    retriever = _rag_retrievers.get(key)
+    if retriever is None:
+        retriever = RAGRetriever(k=k, collection=collection)
+        _rag_retrievers[key] = retriever
     
-    if _rag_retriever is None or _rag_retriever.k != k:
-        _rag_retriever = RAGRetriever(k=k)
-    
-    return _rag_retriever
-
+    return retriever
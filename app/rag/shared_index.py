@@ -0,0 +1,256 @@
+"""
+跨进程共享的向量索引
+uvicorn 多 worker 部署时，每个 worker 都是独立进程。索引只由第一个拿到文件锁的 worker 构建一次，
+保存为可 mmap 的文件段（segment），其他 worker 直接以只读 mmap 方式挂载，
+所有进程共享同一份页缓存，不会重复向量化、也不会重复占用内存
+
+目录结构：
+    <index_dir>/<知识库名称>/
+        CURRENT              # 当前版本的段名称（指纹）
+        .lock                # 构建锁
+        <指纹>/              # 段目录
+            vectors.npy / row_chunk_ids.npy / text.bin / ... / meta.json
+            .readers/<pid>-<id>  # 读者租约：挂载该段的进程在释放前持有
+
+切换版本时保留最近 keep_previous 个旧段（正在读取 CURRENT 准备挂载的 worker 仍能挂载上一个版本），
+更早的段只有在没有存活进程持有读者租约时才删除
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+
+class SharedIndexStore:
+    """基于文件段 + mmap 的跨进程索引存储"""
+
+    def __init__(self, index_dir: str, keep_previous: int = 1):
+        """
+        初始化共享索引存储
+
+        Args:
+            index_dir: 索引根目录（所有 worker 需使用同一个目录）
+            keep_previous: 切换版本时无条件保留的旧段数量
+        """
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.keep_previous = keep_previous
+
+    def _collection_dir(self, collection: str) -> Path:
+        path = self.index_dir / collection
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def segment_path(self, collection: str, fingerprint: str) -> Path:
+        """段目录路径"""
+        return self._collection_dir(collection) / fingerprint
+
+    def has_segment(self, collection: str, fingerprint: str) -> bool:
+        """段是否已完整写入（meta.json 最后写入，作为完成标记）"""
+        return (self.segment_path(collection, fingerprint) / "meta.json").exists()
+
+    @contextmanager
+    def lock(self, collection: str) -> Iterator[None]:
+        """
+        跨进程构建锁（同一时间只有一个 worker 构建同一个知识库）
+
+        不支持 fcntl 的平台上退化为不加锁
+        """
+        if not HAS_FCNTL:
+            yield
+            return
+
+        with open(self._collection_dir(collection) / ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self, collection: str, fingerprint: str, vector_store, meta: Optional[dict] = None) -> Path:
+        """
+        将向量存储保存为段，并原子发布为当前版本
+
+        Args:
+            collection: 知识库名称
+            fingerprint: 文档指纹（段名称）
+            vector_store: CompactVectorStore 实例
+            meta: 附加的元信息（可选）
+
+        Returns:
+            段目录路径
+        """
+        final_path = self.segment_path(collection, fingerprint)
+        tmp_path = final_path.with_name(f".{fingerprint}.tmp-{os.getpid()}")
+        if tmp_path.exists():
+            shutil.rmtree(tmp_path)
+        tmp_path.mkdir(parents=True)
+
+        vector_store.save(tmp_path)
+        with open(tmp_path / "meta.json", "w", encoding="utf-8") as f:
+            json.dump({
+                **(meta or {}),
+                "fingerprint": fingerprint,
+                "rows": len(vector_store),
+                "created_at": time.time(),
+            }, f, ensure_ascii=False)
+
+        if final_path.exists():
+            shutil.rmtree(final_path)
+        os.rename(tmp_path, final_path)
+        self.set_current(collection, fingerprint)
+        return final_path
+
+    def load(self, collection: str, fingerprint: str, embedding: Embeddings):
+        """
+        以只读 mmap 方式挂载段
+
+        Args:
+            collection: 知识库名称
+            fingerprint: 段名称
+            embedding: 用于查询向量化的 Embeddings 实例
+
+        Returns:
+            CompactVectorStore 实例，段不存在时返回 None
+        """
+        # 延迟导入，避免与 vector_store 循环导入
+        from app.rag.vector_store import CompactVectorStore
+
+        if not self.has_segment(collection, fingerprint):
+            return None
+        lease = self._acquire_lease(collection, fingerprint)
+        if lease is None:
+            return None
+        try:
+            vector_store = CompactVectorStore.load(self.segment_path(collection, fingerprint), embedding, mmap=True)
+        except Exception:
+            self._release_lease(lease)
+            raise
+        # 向量存储释放（最后一个读者结束）时归还租约
+        vector_store.on_close = lambda: self._release_lease(lease)
+        return vector_store
+
+    def _acquire_lease(self, collection: str, fingerprint: str) -> Optional[Path]:
+        """
+        登记本进程正在使用该段
+
+        Returns:
+            租约文件路径；段已被删除时返回 None
+        """
+        readers_dir = self.segment_path(collection, fingerprint) / ".readers"
+        try:
+            # 不创建父目录：段已被删除时直接失败，而不是重新创建一个空段目录
+            readers_dir.mkdir(exist_ok=True)
+            lease = readers_dir / f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            lease.touch()
+        except FileNotFoundError:
+            return None
+        return lease
+
+    @staticmethod
+    def _release_lease(lease: Path) -> None:
+        try:
+            lease.unlink()
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        except OSError:
+            return False
+        return True
+
+    def live_readers(self, collection: str, fingerprint: str) -> int:
+        """
+        持有该段租约的存活读者数量（顺便清理已退出进程遗留的租约）
+
+        Args:
+            collection: 知识库名称
+            fingerprint: 段名称
+
+        Returns:
+            读者数量
+        """
+        readers_dir = self.segment_path(collection, fingerprint) / ".readers"
+        if not readers_dir.is_dir():
+            return 0
+        alive = 0
+        for lease in readers_dir.iterdir():
+            try:
+                pid = int(lease.name.split("-")[0])
+            except ValueError:
+                continue
+            if self._pid_alive(pid):
+                alive += 1
+            else:
+                self._release_lease(lease)
+        return alive
+
+    def _segments_by_age(self, collection: str) -> List[Path]:
+        """知识库的所有段，按创建时间从新到旧排列"""
+        def created_at(path: Path) -> float:
+            try:
+                with open(path / "meta.json", "r", encoding="utf-8") as f:
+                    return float(json.load(f).get("created_at", 0))
+            except (OSError, ValueError):
+                return path.stat().st_mtime
+
+        segments = [
+            path for path in self._collection_dir(collection).iterdir()
+            if path.is_dir() and not path.name.startswith(".")
+        ]
+        return sorted(segments, key=created_at, reverse=True)
+
+    def get_current(self, collection: str) -> Optional[str]:
+        """读取当前版本的段名称"""
+        try:
+            with open(self._collection_dir(collection) / "CURRENT", "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def set_current(self, collection: str, fingerprint: str) -> None:
+        """原子更新当前版本，并清理不再使用的旧段"""
+        collection_dir = self._collection_dir(collection)
+        tmp_file = collection_dir / f".CURRENT.tmp-{os.getpid()}"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(fingerprint)
+        os.replace(tmp_file, collection_dir / "CURRENT")
+        self.cleanup(collection)
+
+    def cleanup(self, collection: str) -> List[str]:
+        """
+        删除旧段：保留当前段和最近 keep_previous 个旧段，更早的段没有存活读者时才删除
+
+        Args:
+            collection: 知识库名称
+
+        Returns:
+            已删除的段名称列表
+        """
+        current = self.get_current(collection)
+        previous = [path for path in self._segments_by_age(collection) if path.name != current]
+        removed = []
+        for path in previous[self.keep_previous:]:
+            if self.live_readers(collection, path.name) > 0:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path.name)
+        return removed
@@ -4,13 +4,27 @@
 """
 import os
 import time
-from typing import List, Optional, Tuple
+import hashlib
+import asyncio
+import threading
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+import numpy as np
 from langchain.embeddings import init_embeddings
-from langchain_core.vectorstores import InMemoryVectorStore
 from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
 from config.config_loader import get_config
+from app.rag.chunk_store import ChunkStore
+from app.rag.document_loader import DocumentLoader
+from app.rag.embedding_batcher import get_query_batcher
+from app.rag.index_snapshot import SnapshotHolder
+from app.rag.metadata_index import MetadataFilter, MetadataIndex
+from app.rag.shared_index import SharedIndexStore
 from app.rag.zhipu_embeddings import ZhipuAIEmbeddings
+from app.core.key_pool import get_key_pool
 
 # 设置环境变量，避免 tiktoken 网络下载问题
 # 如果 TIKTOKEN_CACHE_DIR 已设置，tiktoken 会使用缓存
@@ -21,20 +35,284 @@ if "TIKTOKEN_CACHE_DIR" not in os.environ:
     os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
 
 
-class VectorStoreManager:
-    """向量存储管理器"""
+# 候选行占比超过 1/_DENSE_FILTER_RATIO 时，全量点积后再取候选行比复制候选行更快
+_DENSE_FILTER_RATIO = 4
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """按行做 L2 归一化，之后点积即为余弦相似度"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class CompactVectorStore:
+    """
+    紧凑向量存储
     
-    def __init__(self, embedding_model: Optional[str] = None):
+    文本和来源信息保存在 ChunkStore 中，向量保存在一个 float32 矩阵中（已归一化），
+    检索时只为命中的文本块构建 Document 对象。
+    入库完成后构建元数据倒排索引，带过滤条件的检索只对候选行计算相似度
+    """
+    
+    def __init__(self, embedding: Embeddings, chunk_store: ChunkStore):
         """
-        初始化向量存储管理器
+        初始化紧凑向量存储
+        
+        Args:
+            embedding: Embeddings 实例
+            chunk_store: 文本块存储
+        """
+        self.embedding = embedding
+        self.chunk_store = chunk_store
+        # 向量矩阵第 i 行对应的文本块 ID（向量化失败的块不在其中）
+        self._row_chunk_ids = array('I')
+        self._pending: List[np.ndarray] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._metadata_index: Optional[MetadataIndex] = None
+        # 释放时的回调（挂载共享段时用于归还读者租约）
+        self.on_close: Optional[Callable[[], None]] = None
+    
+    def __len__(self) -> int:
+        return len(self._row_chunk_ids)
+    
+    def add_chunks(self, chunk_ids: List[int]) -> None:
+        """
+        向量化并添加一批文本块
+        
+        Args:
+            chunk_ids: 文本块 ID 列表
+        """
+        texts = self.chunk_store.get_texts(chunk_ids)
+        vectors = np.asarray(self.embedding.embed_documents(texts), dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[0] != len(chunk_ids):
+            raise ValueError(f"Embedding 返回的向量数量不匹配: {vectors.shape}")
+        
+        self._pending.append(_normalize_rows(vectors))
+        self._row_chunk_ids.extend(chunk_ids)
+        self._metadata_index = None
+    
+    def finalize(self) -> None:
+        """入库完成：合并向量矩阵并构建元数据倒排索引"""
+        self._get_matrix()
+        self._get_metadata_index()
+    
+    def _get_matrix(self) -> np.ndarray:
+        """合并待处理的批次，返回完整的向量矩阵"""
+        if self._pending:
+            parts = self._pending if self._matrix is None else [self._matrix] + self._pending
+            self._matrix = np.vstack(parts)
+            self._pending = []
+        if self._matrix is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._matrix
+    
+    def _get_metadata_index(self) -> MetadataIndex:
+        """获取元数据倒排索引（尚未构建时立即构建）"""
+        if self._metadata_index is None:
+            self._metadata_index = MetadataIndex.build(self.chunk_store, self._row_chunk_ids)
+        return self._metadata_index
+    
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[MetadataFilter] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        根据查询向量检索最相似的文本块
         
         Args:
+            embedding: 查询向量
+            k: 返回的文档数量
+            filter: 元数据过滤条件（可选），在计算相似度之前生效
+            
+        Returns:
+            (文档, 余弦相似度) 元组列表
+        """
+        matrix = self._get_matrix()
+        if not len(embedding) or matrix.shape[0] == 0:
+            return []
+        
+        # 过滤条件解析为候选行号
+        rows = self._get_metadata_index().resolve(filter)
+        if rows is not None and rows.size == 0:
+            return []
+        
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        
+        if rows is None:
+            scores = matrix @ query
+        elif rows.size * _DENSE_FILTER_RATIO < matrix.shape[0]:
+            # 选择性高：只对候选行计算相似度
+            scores = matrix[rows] @ query
+        else:
+            # 选择性低：复制候选行的代价高于全量点积，先全量计算再取候选行
+            scores = (matrix @ query)[rows]
+        k = min(k, scores.shape[0])
+        if k < scores.shape[0]:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(scores.shape[0])
+        top = top[np.argsort(-scores[top])]
+        
+        results = []
+        for pos in top:
+            row = rows[pos] if rows is not None else pos
+            results.append((self.chunk_store.get_document(self._row_chunk_ids[row]), float(scores[pos])))
+        return results
+    
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[MetadataFilter] = None
+    ) -> List[Tuple[Document, float]]:
+        """检索相关文档（带相似度分数）"""
+        return self.similarity_search_with_score_by_vector(
+            self.embedding.embed_query(query), k=k, filter=filter
+        )
+    
+    def similarity_search(
+        self, query: str, k: int = 4, filter: Optional[MetadataFilter] = None
+    ) -> List[Document]:
+        """检索相关文档"""
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+    
+    async def asimilarity_search(
+        self, query: str, k: int = 4, filter: Optional[MetadataFilter] = None
+    ) -> List[Document]:
+        """异步检索相关文档（并发查询的向量化会被合并为批量请求）"""
+        batcher = get_query_batcher(self.embedding)
+        if batcher is not None:
+            embedding = await batcher.embed_query(query)
+        else:
+            embedding = await self.embedding.aembed_query(query)
+        return [
+            doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, filter=filter)
+        ]
+    
+    def save(self, directory: Union[str, Path]) -> None:
+        """
+        保存到目录（向量矩阵和文本块存储都可以 mmap 方式加载）
+        
+        Args:
+            directory: 目标目录（需已存在）
+        """
+        directory = Path(directory)
+        np.save(directory / "vectors.npy", self._get_matrix())
+        np.save(directory / "row_chunk_ids.npy", np.asarray(self._row_chunk_ids, dtype=np.uint32))
+        self.chunk_store.save(directory)
+    
+    @classmethod
+    def load(cls, directory: Union[str, Path], embedding: Embeddings, mmap: bool = True) -> "CompactVectorStore":
+        """
+        从目录加载只读的向量存储
+        
+        Args:
+            directory: save() 保存的目录
+            embedding: 用于查询向量化的 Embeddings 实例
+            mmap: 是否以 mmap 方式加载（多个进程共享同一份物理内存）
+        
+        Returns:
+            CompactVectorStore 实例（元数据倒排索引在加载时重建）
+        """
+        directory = Path(directory)
+        mmap_mode = "r" if mmap else None
+        store = cls(embedding=embedding, chunk_store=ChunkStore.load(directory, mmap=mmap))
+        store._matrix = np.load(directory / "vectors.npy", mmap_mode=mmap_mode)
+        store._row_chunk_ids = np.load(directory / "row_chunk_ids.npy", mmap_mode=mmap_mode)
+        store.finalize()
+        return store
+    
+    def close(self) -> None:
+        """释放向量矩阵和文本块存储的引用（mmap 在最后一个引用释放后解除映射）"""
+        self._matrix = None
+        self._pending = []
+        self._row_chunk_ids = array('I')
+        self._metadata_index = None
+        self.chunk_store = None
+        on_close, self.on_close = self.on_close, None
+        if on_close is not None:
+            on_close()
+    
+    @property
+    def nbytes(self) -> int:
+        """估算占用的内存字节数（向量 + 文本块存储 + 元数据索引）"""
+        matrix = self._get_matrix()
+        return (
+            matrix.nbytes
+            + self._row_chunk_ids.itemsize * len(self._row_chunk_ids)
+            + self.chunk_store.nbytes
+            + self._get_metadata_index().nbytes
+        )
+
+
+class KnowledgeCollection:
+    """
+    知识库（collection）
+    
+    每个知识库有自己的文档目录、embedding 模型和向量索引，
+    由 VectorStoreManager 统一管理、按需加载。
+    向量索引以版本化快照的形式发布：重建时在后台构建新版本，完成后原子替换，
+    正在进行的检索继续使用旧版本，旧版本在最后一个读者结束后释放。
+    配置了共享索引时，索引只由一个 worker 进程构建并保存为文件段，其他 worker 以只读 mmap 方式挂载
+    """
+    
+    def __init__(
+        self,
+        name: str = "default",
+        files_dir: Optional[str] = None,
+        embedding_model: Optional[str] = None,
+        embeddings_cache: Optional[Dict[str, Embeddings]] = None,
+        pinned: bool = False,
+        shared_index: Optional[SharedIndexStore] = None,
+        refresh_interval: float = 5.0,
+        load_retry_interval: float = 30.0,
+    ):
+        """
+        初始化知识库
+        
+        Args:
+            name: 知识库名称
+            files_dir: 文档目录（默认为 app/rag/files）
             embedding_model: Embedding 模型名称（例如: "openai:text-embedding-3-small"）
                             如果为 None，将从配置文件读取
+            embeddings_cache: 多个知识库共享的 Embeddings 实例缓存（模型名 -> 实例）
+            pinned: 是否常驻内存（不参与内存预算淘汰）
+            shared_index: 跨进程共享的索引存储（可选，多 worker 部署时使用）
+            refresh_interval: 检查其他 worker 是否发布了新版本索引的最小间隔（秒）
+            load_retry_interval: 加载失败后多少秒内不再重试（期间检索直接报未初始化）
         """
         self.config = get_config()
+        self.name = name
+        self.files_dir = files_dir
+        self.pinned = pinned
+        self.last_used = 0.0
+        self._embeddings_cache = embeddings_cache if embeddings_cache is not None else {}
+        self._load_lock = threading.Lock()
+        
+        # 加载失败后的重试时间（在此之前不再重试加载），以及正在使用该知识库的检索数（由管理器维护）
+        self.load_retry_interval = load_retry_interval
+        self._load_retry_at = 0.0
+        self.users = 0
         
-        # 初始化 embedding 模型
+        # 保存配置，延迟初始化 embeddings（避免启动时网络问题）
+        self.set_embedding_model(embedding_model)
+        
+        # 当前发布的向量索引快照
+        self._snapshots = SnapshotHolder()
+        
+        # 共享索引：当前挂载的段名称，以及上次检查新版本的时间
+        self.shared_index = shared_index
+        self.refresh_interval = refresh_interval
+        self._segment: Optional[str] = None
+        self._last_refresh_check = 0.0
+    
+    def set_embedding_model(self, embedding_model: Optional[str] = None) -> None:
+        """
+        设置 embedding 模型，并重新确定模型类型和对应的 API Key
+        
+        Args:
+            embedding_model: Embedding 模型名称，如果为 None，将从配置文件读取
+        """
         if embedding_model is None:
             # 尝试从配置读取，如果没有则使用默认值
             embedding_model = self.config.get(
@@ -42,31 +320,42 @@ class VectorStoreManager:
                 'openai:text-embedding-3-small'
             )
         
-        # 保存配置，延迟初始化 embeddings（避免启动时网络问题）
-        self.embedding_model = embedding_model
-        
         # 判断是否为智谱AI模型
-        self.is_zhipu_model = embedding_model in ['embedding-2', 'embedding-3']
+        is_zhipu_model = embedding_model in ['embedding-2', 'embedding-3']
         
-        if self.is_zhipu_model:
+        if is_zhipu_model:
             # 智谱AI配置
-            self.embedding_api_key = self.config.get('model.glm.api')
-            if not self.embedding_api_key:
-                raise ValueError("使用智谱AI embedding 模型需要配置 model.glm.api")
+            embedding_api_key = self.config.get('model.glm.api')
+            if not (embedding_api_key or self.config.get('model.glm.api_keys')):
+                raise ValueError("使用智谱AI embedding 模型需要配置 model.glm.api 或 model.glm.api_keys")
+            embedding_api_base = None
         else:
             # 其他模型配置（如 DeepSeek）
-            self.embedding_api_key = self.config.get('model.deepseek.api')
-            self.embedding_api_base = self.config.get('model.deepseek.api_base', 'https://api.deepseek.com')
+            embedding_api_key = self.config.get('model.deepseek.api')
+            embedding_api_base = self.config.get('model.deepseek.api_base', 'https://api.deepseek.com')
         
+        self.embedding_model = embedding_model
+        self.is_zhipu_model = is_zhipu_model
+        self.embedding_api_key = embedding_api_key
+        self.embedding_api_base = embedding_api_base
+        # 已创建的 Embeddings 实例属于旧模型，下次使用时按新模型创建
         self.embeddings: Optional[Embeddings] = None
-        
-        # 初始化向量存储
-        self.vector_store: Optional[InMemoryVectorStore] = None
-        self._is_initialized = False
+    
+    @property
+    def vector_store(self) -> Optional[CompactVectorStore]:
+        """当前版本的向量存储（未初始化时为 None）"""
+        snapshot = self._snapshots.current
+        return snapshot.vector_store if snapshot is not None else None
+    
+    @property
+    def version(self) -> int:
+        """当前索引版本号（未初始化时为 0）"""
+        snapshot = self._snapshots.current
+        return snapshot.version if snapshot is not None else 0
     
     def _init_embeddings(self) -> Embeddings:
         """
-        初始化 embedding 模型（带重试机制）
+        初始化 embedding 模型（相同模型的知识库共享同一个实例）
         
         Returns:
             Embeddings 实例
@@ -74,6 +363,20 @@ class VectorStoreManager:
         if self.embeddings is not None:
             return self.embeddings
         
+        cached = self._embeddings_cache.get(self.embedding_model)
+        if cached is None:
+            cached = self._create_embeddings()
+            self._embeddings_cache[self.embedding_model] = cached
+        self.embeddings = cached
+        return self.embeddings
+    
+    def _create_embeddings(self) -> Embeddings:
+        """
+        创建 embedding 模型（带重试机制）
+        
+        Returns:
+            Embeddings 实例
+        """
         max_retries = 3
         retry_count = 0
         
@@ -84,8 +387,8 @@ class VectorStoreManager:
                     print(f"🔄 初始化智谱AI {self.embedding_model} 模型...")
                     # 使用极小的批量大小和更长的请求延迟，避免触发速率限制
                     # 如果账户等级较低（V0/V1），建议使用更保守的设置
-                    self.embeddings = ZhipuAIEmbeddings(
-                        api_key=self.embedding_api_key,
+                    embeddings = ZhipuAIEmbeddings(
+                        key_pool=get_key_pool('glm'),  # 多个 Key 时 429 换 Key 重试
                         model=self.embedding_model,
                         batch_size=10,  # 每次只处理 1 条，最保守的设置
                         request_delay=1.0  # 增加请求延迟到 5 秒
@@ -96,14 +399,14 @@ class VectorStoreManager:
                     print(f"   ⚠️  如果仍有 429 错误，可能是账户配额或权限问题")
                 else:
                     # 使用其他模型（如 DeepSeek）
-                    self.embeddings = init_embeddings(
+                    embeddings = init_embeddings(
                         self.embedding_model,
                         api_key=self.embedding_api_key,
                         base_url=self.embedding_api_base
                     )
                     print(f"✅ Embedding 模型初始化成功 ({self.embedding_model})")
                 
-                return self.embeddings
+                return embeddings
                 
             except Exception as e:
                 retry_count += 1
@@ -119,12 +422,12 @@ class VectorStoreManager:
                     if not self.is_zhipu_model:
                         try:
                             print("   尝试使用默认配置（不指定 base_url）...")
-                            self.embeddings = init_embeddings(
+                            embeddings = init_embeddings(
                                 self.embedding_model,
                                 api_key=self.embedding_api_key
                             )
                             print("✅ Embedding 模型初始化成功（使用默认配置）")
-                            return self.embeddings
+                            return embeddings
                         except Exception as e2:
                             print(f"❌ Embedding 模型初始化最终失败: {e2}")
                             raise
@@ -132,33 +435,58 @@ class VectorStoreManager:
                         print(f"❌ 智谱AI Embedding 模型初始化最终失败: {error_msg}")
                         raise e
     
-    def initialize(self, documents: List[Document], batch_size: int = 10) -> None:
+    def initialize(self, documents: Union[ChunkStore, List[Document]], batch_size: int = 10) -> None:
         """
-        初始化向量存储并添加文档（批量处理，带重试机制）
+        构建新版本的向量索引并发布（批量处理，带重试机制）
+        
+        新版本在构建完成前对检索不可见；已有旧版本时，只有全部文档块向量化成功才会替换旧版本
         
         Args:
-            documents: 文档列表
+            documents: 文本块存储（推荐，由 DocumentLoader.load_all_chunks 生成）或文档列表
             batch_size: 每批处理的文档数量（默认 10）
         """
+        vector_store = self._build(documents, batch_size=batch_size)
+        if vector_store is not None:
+            self._publish(vector_store)
+    
+    def _build(
+        self, documents: Union[ChunkStore, List[Document]], batch_size: int = 10
+    ) -> Optional[CompactVectorStore]:
+        """
+        向量化文档并构建新版本的向量存储（不发布）
+        
+        Args:
+            documents: 文本块存储或文档列表
+            batch_size: 每批处理的文档数量
+        
+        Returns:
+            构建完成的 CompactVectorStore；没有可用结果时返回 None
+        """
         if not documents:
             print("⚠️  没有文档可加载")
-            return
+            return None
         
-        print(f"\n🔄 开始向量化 {len(documents)} 个文档块（批量大小: {batch_size}）...")
+        # 兼容旧接口：Document 列表转换为列式存储，不再保留 Document 对象
+        if isinstance(documents, ChunkStore):
+            chunk_store = documents
+        else:
+            chunk_store = ChunkStore.from_documents(documents)
+        
+        print(f"\n🔄 开始向量化 {len(chunk_store)} 个文档块（批量大小: {batch_size}）...")
         
         # 确保 embedding 已初始化
         embeddings = self._init_embeddings()
         
-        # 创建向量存储
-        self.vector_store = InMemoryVectorStore(embedding=embeddings)
+        # 创建新版本的向量存储（发布前对检索不可见）
+        vector_store = CompactVectorStore(embedding=embeddings, chunk_store=chunk_store)
         
         # 批量添加文档，带重试机制
-        total_docs = len(documents)
+        total_docs = len(chunk_store)
         success_count = 0
         failed_count = 0
         
         for i in range(0, total_docs, batch_size):
-            batch = documents[i:i + batch_size]
+            batch = list(range(i, min(i + batch_size, total_docs)))
             batch_num = (i // batch_size) + 1
             total_batches = (total_docs + batch_size - 1) // batch_size
             
@@ -168,7 +496,7 @@ class VectorStoreManager:
             while retry_count < max_retries:
                 try:
                     # 添加批次文档
-                    self.vector_store.add_documents(batch)
+                    vector_store.add_chunks(batch)
                     success_count += len(batch)
                     print(f"   ✅ 批次 {batch_num}/{total_batches}: 成功处理 {len(batch)} 个文档块")
                     break
@@ -189,67 +517,623 @@ class VectorStoreManager:
                 delay = 0.5 if self.is_zhipu_model else 0.5
                 time.sleep(delay)
         
-        if success_count > 0:
-            self._is_initialized = True
-            print(f"\n✅ 向量存储初始化完成！")
-            print(f"   - 成功: {success_count} 个文档块")
-            if failed_count > 0:
-                print(f"   - 失败: {failed_count} 个文档块")
-            print()
-        else:
+        if success_count > 0 and failed_count > 0 and self.is_initialized():
+            print(f"\n❌ 重建时有 {failed_count} 个文档块处理失败，继续使用当前版本 v{self.version}\n")
+            return None
+        if success_count == 0:
             print(f"\n❌ 所有文档块处理失败，向量存储未初始化\n")
+            return None
+        
+        # 合并向量矩阵并构建元数据倒排索引
+        vector_store.finalize()
+        print(f"\n✅ 向量存储构建完成！（知识库 {self.name}）")
+        print(f"   - 成功: {success_count} 个文档块")
+        if failed_count > 0:
+            print(f"   - 失败: {failed_count} 个文档块")
+        print()
+        return vector_store
+    
+    def _publish(self, vector_store: CompactVectorStore, segment: Optional[str] = None) -> None:
+        """
+        原子替换当前版本
+        
+        Args:
+            vector_store: 已构建完成的向量存储
+            segment: 对应的共享索引段名称（内存中构建的索引为 None）
+        """
+        snapshot = self._snapshots.publish(vector_store)
+        self._segment = segment
+        self.last_used = time.monotonic()
+        source = f"共享段 {segment[:12]}" if segment else "进程内存"
+        print(f"✅ 知识库 {self.name} 已发布版本 v{snapshot.version}（{source}）")
+    
+    def _attach(self, segment: str) -> bool:
+        """
+        以只读 mmap 方式挂载共享索引段并发布
+        
+        Args:
+            segment: 段名称
+        
+        Returns:
+            True 如果挂载成功，False 否则
+        """
+        try:
+            vector_store = self.shared_index.load(self.name, segment, self._init_embeddings())
+        except Exception as e:
+            print(f"⚠️  挂载知识库 {self.name} 的共享索引段失败: {e}")
+            return False
+        if vector_store is None:
+            return False
+        self._publish(vector_store, segment=segment)
+        return True
+    
+    def _maybe_refresh(self) -> None:
+        """检查其他 worker 是否发布了新的共享索引段，有则挂载（按 refresh_interval 节流）"""
+        if self.shared_index is None or self._segment is None:
+            return
+        now = time.monotonic()
+        if now - self._last_refresh_check < self.refresh_interval:
+            return
+        self._last_refresh_check = now
+        
+        current = self.shared_index.get_current(self.name)
+        if current is None or current == self._segment:
+            return
+        # 正在加载或重建时跳过，下次检查再挂载
+        if self._load_lock.acquire(blocking=False):
+            try:
+                if current != self._segment:
+                    self._attach(current)
+            finally:
+                self._load_lock.release()
     
-    def search(self, query: str, k: int = 4) -> List[Document]:
+    def search(self, query: str, k: int = 4, filter: Optional[MetadataFilter] = None) -> List[Document]:
         """
         搜索相关文档
         
         Args:
             query: 查询文本
             k: 返回的文档数量
+            filter: 元数据过滤条件（可选），例如 {"filename": "运维手册.pdf"}、
+                    {"file_type": "pdf", "team": ["sre", "infra"]}
             
         Returns:
             相关文档列表
         """
-        if not self._is_initialized or self.vector_store is None:
-            raise ValueError("向量存储未初始化，请先调用 initialize() 方法")
-        
-        return self.vector_store.similarity_search(query, k=k)
+        self._maybe_refresh()
+        with self._snapshots.read() as snapshot:
+            if snapshot is None:
+                raise ValueError(f"知识库 {self.name} 未初始化，请先调用 initialize() 方法")
+            
+            self.last_used = time.monotonic()
+            return snapshot.vector_store.similarity_search(query, k=k, filter=filter)
     
-    async def asearch(self, query: str, k: int = 4) -> List[Document]:
+    async def asearch(self, query: str, k: int = 4, filter: Optional[MetadataFilter] = None) -> List[Document]:
         """
         异步搜索相关文档
         
         Args:
             query: 查询文本
             k: 返回的文档数量
+            filter: 元数据过滤条件（可选）
             
         Returns:
             相关文档列表
         """
-        if not self._is_initialized or self.vector_store is None:
-            raise ValueError("向量存储未初始化，请先调用 initialize() 方法")
-        
-        return await self.vector_store.asimilarity_search(query, k=k)
+        self._maybe_refresh()
+        # 在整个检索期间持有快照，重建发布新版本不会影响本次检索
+        with self._snapshots.read() as snapshot:
+            if snapshot is None:
+                raise ValueError(f"知识库 {self.name} 未初始化，请先调用 initialize() 方法")
+            
+            self.last_used = time.monotonic()
+            return await snapshot.vector_store.asimilarity_search(query, k=k, filter=filter)
     
-    def search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+    def search_with_score(
+        self, query: str, k: int = 4, filter: Optional[MetadataFilter] = None
+    ) -> List[Tuple[Document, float]]:
         """
         搜索相关文档（带相似度分数）
         
         Args:
             query: 查询文本
             k: 返回的文档数量
+            filter: 元数据过滤条件（可选）
             
         Returns:
             (文档, 相似度分数) 元组列表
         """
-        if not self._is_initialized or self.vector_store is None:
-            raise ValueError("向量存储未初始化，请先调用 initialize() 方法")
-        
-        return self.vector_store.similarity_search_with_score(query, k=k)
+        self._maybe_refresh()
+        with self._snapshots.read() as snapshot:
+            if snapshot is None:
+                raise ValueError(f"知识库 {self.name} 未初始化，请先调用 initialize() 方法")
+            
+            self.last_used = time.monotonic()
+            return snapshot.vector_store.similarity_search_with_score(query, k=k, filter=filter)
     
     def is_initialized(self) -> bool:
         """检查向量存储是否已初始化"""
-        return self._is_initialized
+        return self._snapshots.current is not None
+    
+    def try_load(self) -> bool:
+        """
+        加载知识库；最近一次加载失败后的 load_retry_interval 秒内直接返回 False，
+        避免每次检索都重新扫描文档目录、重新向量化
+        
+        Returns:
+            True 如果加载成功，False 否则
+        
+        Raises:
+            加载过程中的异常（同样会记录失败时间）
+        """
+        now = time.monotonic()
+        if now < self._load_retry_at:
+            return False
+        try:
+            loaded = self.load()
+        except Exception:
+            self._load_retry_at = time.monotonic() + self.load_retry_interval
+            raise
+        if loaded:
+            self._load_retry_at = 0.0
+        else:
+            self._load_retry_at = time.monotonic() + self.load_retry_interval
+            print(f"⚠️  知识库 {self.name} 加载失败，{self.load_retry_interval:.0f} 秒内不再重试")
+        return loaded
+    
+    def load(self, force: bool = False) -> bool:
+        """
+        从文档目录加载文档并构建向量索引
+        
+        配置了共享索引时，先查找与文档目录指纹一致的共享段并直接挂载；
+        没有时由拿到构建锁的 worker 构建并保存为共享段，其他 worker 等锁释放后直接挂载
+        
+        Args:
+            force: 是否忽略已有的共享段强制重新向量化
+        
+        Returns:
+            True 如果加载成功，False 否则
+        """
+        print(f"📚 加载知识库: {self.name}")
+        loader = DocumentLoader(files_dir=self.files_dir)
+        if self.shared_index is None:
+            chunk_store = loader.load_all_chunks()
+            if not chunk_store:
+                print(f"⚠️  知识库 {self.name} 未找到任何文档")
+                return False
+            self.initialize(chunk_store)
+            return self.is_initialized()
+        
+        # 指纹包含 embedding 模型，切换模型后不会误用旧向量
+        fingerprint = hashlib.sha1(
+            f"{loader.fingerprint()}:{self.embedding_model}".encode('utf-8')
+        ).hexdigest()
+        if not force and self._attach_existing(fingerprint):
+            return True
+        
+        with self.shared_index.lock(self.name):
+            # 等锁期间其他 worker 可能已经构建完成
+            if not force and self._attach_existing(fingerprint):
+                return True
+            
+            chunk_store = loader.load_all_chunks()
+            if not chunk_store:
+                print(f"⚠️  知识库 {self.name} 未找到任何文档")
+                return False
+            vector_store = self._build(chunk_store)
+            if vector_store is None:
+                return self.is_initialized()
+            
+            # 强制重建时使用新的段名称，避免覆盖其他 worker 正在使用的同名段
+            segment = f"{fingerprint}-{int(time.time())}" if force else fingerprint
+            try:
+                self.shared_index.save(self.name, segment, vector_store, meta={
+                    "collection": self.name,
+                    "embedding_model": self.embedding_model,
+                })
+            except Exception as e:
+                print(f"⚠️  保存知识库 {self.name} 的共享索引段失败，仅在当前进程内使用: {e}")
+                self._publish(vector_store)
+                return True
+        
+        # 本进程也改为挂载共享段，释放构建时的私有副本
+        if not self._attach(segment):
+            self._publish(vector_store)
+        else:
+            vector_store.close()
+        return True
+    
+    def _attach_existing(self, fingerprint: str) -> bool:
+        """挂载与指纹一致的当前共享段（强制重建生成的段名称以 "<指纹>-" 开头）"""
+        current = self.shared_index.get_current(self.name)
+        if current is None or current.split("-")[0] != fingerprint:
+            return False
+        if current == self._segment and self.is_initialized():
+            return True
+        return self._attach(current)
+    
+    def rebuild(self) -> bool:
+        """
+        重新加载文档并构建新版本索引（构建期间旧版本继续提供检索）
+        
+        Returns:
+            True 如果发布了新版本，False 否则
+        """
+        with self._load_lock:
+            previous = self.version
+            self.load(force=True)
+            return self.version != previous
+    
+    def evict(self) -> None:
+        """撤下当前向量索引（正在进行的检索不受影响，下次访问时重新加载）"""
+        self._snapshots.clear()
+        self._segment = None
+    
+    @property
+    def nbytes(self) -> int:
+        """向量索引占用的内存字节数（未加载时为 0）"""
+        snapshot = self._snapshots.current
+        return snapshot.nbytes if snapshot is not None else 0
+    
+    def status(self) -> dict:
+        """知识库状态（用于监控和管理接口）"""
+        snapshot = self._snapshots.current
+        return {
+            "name": self.name,
+            "loaded": snapshot is not None,
+            "version": snapshot.version if snapshot is not None else 0,
+            "created_at": snapshot.created_at if snapshot is not None else None,
+            "readers": snapshot.readers if snapshot is not None else 0,
+            "nbytes": snapshot.nbytes if snapshot is not None else 0,
+            "embedding_model": self.embedding_model,
+            "pinned": self.pinned,
+            "shared_segment": self._segment,
+            "users": self.users,
+            "load_retry_in": round(max(self._load_retry_at - time.monotonic(), 0.0), 1),
+        }
+
+
+class VectorStoreManager:
+    """
+    向量存储管理器
+    
+    在一个进程内管理多个命名知识库（collection）：
+    - 知识库在 config.yaml 的 model.rag.collections 中配置，首次检索时按需加载
+    - 所有已加载知识库共享一个内存预算（model.rag.memory_budget_mb），
+      超出时按最近最少使用淘汰，被淘汰的知识库下次访问时重新加载
+    - 不指定知识库时使用默认知识库（常驻内存，不参与淘汰），兼容原有单知识库用法
+    """
+    
+    def __init__(self, embedding_model: Optional[str] = None):
+        """
+        初始化向量存储管理器
+        
+        Args:
+            embedding_model: 默认知识库的 Embedding 模型名称，如果为 None，将从配置文件读取
+        """
+        self.config = get_config()
+        self.default_collection = self.config.get('model.rag.default_collection', 'default')
+        self.memory_budget = int(self.config.get('model.rag.memory_budget_mb', 1024) * 1024 * 1024)
+        
+        # 模型名 -> Embeddings 实例，相同模型的知识库共享同一个客户端
+        self._embeddings_cache: Dict[str, Embeddings] = {}
+        self._collections: Dict[str, KnowledgeCollection] = {}
+        self._lock = threading.Lock()
+        # 后台重建索引的线程池（串行执行，避免同时向量化多个知识库触发速率限制）
+        self._rebuild_executor: Optional[ThreadPoolExecutor] = None
+        
+        # 跨 worker 进程共享的索引（多 worker 部署时只构建一次，其他 worker 以 mmap 方式挂载）
+        self.shared_index: Optional[SharedIndexStore] = None
+        self.refresh_interval = float(self.config.get('model.rag.shared_index.refresh_interval', 5))
+        self.load_retry_interval = float(self.config.get('model.rag.load_retry_interval', 30))
+        if self.config.get('model.rag.shared_index.enabled', False):
+            index_dir = self.config.get('model.rag.shared_index.index_dir', '.rag_index')
+            if not os.path.isabs(index_dir):
+                index_dir = str(Path(__file__).resolve().parent.parent.parent / index_dir)
+            self.shared_index = SharedIndexStore(
+                index_dir,
+                keep_previous=int(self.config.get('model.rag.shared_index.keep_previous', 1)),
+            )
+        
+        collections_config = self.config.get('model.rag.collections') or {}
+        for name, collection_config in collections_config.items():
+            collection_config = collection_config or {}
+            self.register_collection(
+                name,
+                files_dir=collection_config.get('files_dir'),
+                embedding_model=collection_config.get('embedding_model'),
+            )
+        
+        if self.default_collection not in self._collections:
+            self.register_collection(self.default_collection, embedding_model=embedding_model)
+        elif embedding_model is not None:
+            self._collections[self.default_collection].set_embedding_model(embedding_model)
+        self._collections[self.default_collection].pinned = True
+    
+    def register_collection(
+        self,
+        name: str,
+        files_dir: Optional[str] = None,
+        embedding_model: Optional[str] = None,
+    ) -> KnowledgeCollection:
+        """
+        注册一个知识库（不会立即加载）
+        
+        Args:
+            name: 知识库名称
+            files_dir: 文档目录，相对路径相对于项目根目录（默认为 app/rag/files）
+            embedding_model: Embedding 模型名称（默认读取 model.rag.embedding_model）
+        
+        Returns:
+            KnowledgeCollection 实例
+        """
+        if files_dir is not None and not os.path.isabs(files_dir):
+            files_dir = str(Path(__file__).resolve().parent.parent.parent / files_dir)
+        
+        collection = KnowledgeCollection(
+            name=name,
+            files_dir=files_dir,
+            embedding_model=embedding_model,
+            embeddings_cache=self._embeddings_cache,
+            shared_index=self.shared_index,
+            refresh_interval=self.refresh_interval,
+            load_retry_interval=self.load_retry_interval,
+        )
+        with self._lock:
+            self._collections[name] = collection
+        return collection
+    
+    def list_collections(self) -> List[str]:
+        """列出所有已注册的知识库名称"""
+        return list(self._collections)
+    
+    def has_collection(self, name: str) -> bool:
+        """检查知识库是否已注册"""
+        return name in self._collections
+    
+    def get_collection(self, name: Optional[str] = None) -> KnowledgeCollection:
+        """
+        获取知识库（不触发加载）
+        
+        Args:
+            name: 知识库名称（默认为默认知识库）
+        
+        Returns:
+            KnowledgeCollection 实例
+        """
+        name = name or self.default_collection
+        collection = self._collections.get(name)
+        if collection is None:
+            raise ValueError(f"知识库不存在: {name}，可用知识库: {self.list_collections()}")
+        return collection
+    
+    def ensure_loaded(self, name: Optional[str] = None) -> KnowledgeCollection:
+        """
+        确保知识库已加载（未加载时同步加载，并按内存预算淘汰其他知识库）
+        
+        Args:
+            name: 知识库名称（默认为默认知识库）
+        
+        Returns:
+            KnowledgeCollection 实例
+        """
+        collection = self.get_collection(name)
+        if collection.is_initialized():
+            return collection
+        
+        with collection._load_lock:
+            if not collection.is_initialized():
+                collection.try_load()
+        
+        if collection.is_initialized():
+            self._enforce_memory_budget(keep=collection)
+        return collection
+    
+    async def aensure_loaded(self, name: Optional[str] = None) -> KnowledgeCollection:
+        """异步版本：在线程池中加载，避免阻塞事件循环"""
+        collection = self.get_collection(name)
+        if collection.is_initialized():
+            return collection
+        return await asyncio.to_thread(self.ensure_loaded, name)
+    
+    @contextmanager
+    def _use(self, name: Optional[str] = None) -> Iterator[KnowledgeCollection]:
+        """
+        在检索期间标记知识库正在使用，内存预算淘汰会跳过正在使用的知识库
+        
+        计数在 self._lock 下修改，与淘汰互斥：淘汰要么发生在标记之前（检索会重新加载），要么跳过该知识库
+        
+        Args:
+            name: 知识库名称（默认为默认知识库）
+        """
+        collection = self.get_collection(name)
+        with self._lock:
+            collection.users += 1
+        try:
+            yield collection
+        finally:
+            with self._lock:
+                collection.users -= 1
+    
+    def _enforce_memory_budget(self, keep: Optional[KnowledgeCollection] = None) -> None:
+        """
+        按最近最少使用淘汰知识库，直到总内存不超过预算
+        
+        Args:
+            keep: 不参与淘汰的知识库（通常是刚加载的）
+        """
+        with self._lock:
+            loaded = [c for c in self._collections.values() if c.is_initialized()]
+            total = sum(c.nbytes for c in loaded)
+            candidates = sorted(
+                (c for c in loaded if not c.pinned and c is not keep and c.users == 0),
+                key=lambda c: c.last_used,
+            )
+            for collection in candidates:
+                if total <= self.memory_budget:
+                    break
+                size = collection.nbytes
+                collection.evict()
+                total -= size
+                print(f"♻️  知识库 {collection.name} 已被淘汰（释放 {size / 1024 / 1024:.1f} MB）")
+    
+    def memory_usage(self) -> Dict[str, int]:
+        """各知识库当前占用的内存字节数"""
+        return {name: c.nbytes for name, c in self._collections.items()}
+    
+    def collection_status(self) -> List[dict]:
+        """所有知识库的状态"""
+        return [c.status() for c in self._collections.values()]
+    
+    def rebuild(self, collection: Optional[str] = None) -> bool:
+        """
+        同步重建知识库索引（重建期间旧版本继续提供检索，完成后原子替换）
+        
+        Args:
+            collection: 知识库名称（默认为默认知识库）
+        
+        Returns:
+            True 如果发布了新版本，False 否则
+        """
+        target = self.get_collection(collection)
+        published = target.rebuild()
+        if published:
+            self._enforce_memory_budget(keep=target)
+        return published
+    
+    def rebuild_in_background(self, collection: Optional[str] = None) -> Future:
+        """
+        在后台线程重建知识库索引，立即返回
+        
+        Args:
+            collection: 知识库名称（默认为默认知识库）
+        
+        Returns:
+            concurrent.futures.Future，结果为是否发布了新版本
+        """
+        # 先校验知识库存在，避免错误被吞在后台线程里
+        self.get_collection(collection)
+        with self._lock:
+            if self._rebuild_executor is None:
+                self._rebuild_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-rebuild")
+            executor = self._rebuild_executor
+        return executor.submit(self.rebuild, collection)
+    
+    def initialize(
+        self,
+        documents: Union[ChunkStore, List[Document]],
+        batch_size: int = 10,
+        collection: Optional[str] = None,
+    ) -> None:
+        """
+        使用给定文档初始化知识库
+        
+        Args:
+            documents: 文本块存储或文档列表
+            batch_size: 每批处理的文档数量（默认 10）
+            collection: 知识库名称（默认为默认知识库）
+        """
+        target = self.get_collection(collection)
+        with target._load_lock:
+            target.initialize(documents, batch_size=batch_size)
+        if target.is_initialized():
+            self._enforce_memory_budget(keep=target)
+    
+    def search(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[MetadataFilter] = None,
+        collection: Optional[str] = None,
+    ) -> List[Document]:
+        """
+        搜索相关文档
+        
+        Args:
+            query: 查询文本
+            k: 返回的文档数量
+            filter: 元数据过滤条件（可选），例如 {"filename": "运维手册.pdf"}、
+                    {"file_type": "pdf", "team": ["sre", "infra"]}
+            collection: 知识库名称（默认为默认知识库），未加载时自动加载
+            
+        Returns:
+            相关文档列表
+        """
+        with self._use(collection) as target:
+            return self.ensure_loaded(target.name).search(query, k=k, filter=filter)
+    
+    async def asearch(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[MetadataFilter] = None,
+        collection: Optional[str] = None,
+    ) -> List[Document]:
+        """
+        异步搜索相关文档
+        
+        Args:
+            query: 查询文本
+            k: 返回的文档数量
+            filter: 元数据过滤条件（可选）
+            collection: 知识库名称（默认为默认知识库），未加载时自动加载
+            
+        Returns:
+            相关文档列表
+        """
+        with self._use(collection) as target:
+            await self.aensure_loaded(target.name)
+            return await target.asearch(query, k=k, filter=filter)
+    
+    def search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[MetadataFilter] = None,
+        collection: Optional[str] = None,
+    ) -> List[Tuple[Document, float]]:
+        """
+        搜索相关文档（带相似度分数）
+        
+        Args:
+            query: 查询文本
+            k: 返回的文档数量
+            filter: 元数据过滤条件（可选）
+            collection: 知识库名称（默认为默认知识库），未加载时自动加载
+            
+        Returns:
+            (文档, 相似度分数) 元组列表
+        """
+        with self._use(collection) as target:
+            return self.ensure_loaded(target.name).search_with_score(query, k=k, filter=filter)
+    
+    def is_initialized(self, collection: Optional[str] = None) -> bool:
+        """检查知识库是否已加载（默认为默认知识库）"""
+        name = collection or self.default_collection
+        target = self._collections.get(name)
+        return target is not None and target.is_initialized()
+    
+    def get_embeddings(self, collection: Optional[str] = None) -> Embeddings:
+        """
+        获取知识库使用的 Embeddings 实例（未初始化时立即创建，不加载索引）
+        
+        Args:
+            collection: 知识库名称（默认为默认知识库）
+        
+        Returns:
+            Embeddings 实例
+        """
+        return self.get_collection(collection)._init_embeddings()
+    
+    @property
+    def vector_store(self) -> Optional[CompactVectorStore]:
+        """默认知识库的向量存储（兼容旧接口）"""
+        return self.get_collection().vector_store
+    
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        """默认知识库的 Embeddings 实例（兼容旧接口）"""
+        return self.get_collection().embeddings
 
 
 # 全局向量存储管理器实例
@@ -269,4 +1153,3 @@ def get_vector_store_manager() -> VectorStoreManager:
         _vector_store_manager = VectorStoreManager()
     
     return _vector_store_manager
-
@@ -1,12 +1,16 @@
 """
 智谱AI Embeddings 实现
 用于调用智谱AI的 embedding-2 或 embedding-3 模型
+
+配置了多个 Key（model.glm.api_keys）时，请求按 Key 池分配；某个 Key 返回 429 时换用其他 Key，
+只有所有 Key 都在冷却中才等待
 """
 import requests
 import time
 from typing import List, Optional
 from langchain_core.embeddings import Embeddings
 from config.config_loader import get_config
+from app.core.key_pool import KeyPool, get_key_pool
 
 
 class ZhipuAIEmbeddings(Embeddings):
@@ -20,6 +24,7 @@ class ZhipuAIEmbeddings(Embeddings):
         dimensions: Optional[int] = None,
         batch_size: int = 10,
         request_delay: float = 1.0,
+        key_pool: Optional[KeyPool] = None,
     ):
         """
         初始化智谱AI Embeddings
@@ -31,11 +36,16 @@ class ZhipuAIEmbeddings(Embeddings):
             dimensions: 向量维度（仅 embedding-3 支持，可选：256, 512, 1024, 2048）
             batch_size: 每批处理的文本数量（默认 10，避免触发速率限制）
             request_delay: 请求之间的延迟时间（秒，默认 1.0）
+            key_pool: API Key 池（可选）；未指定时使用 api_key，api_key 也未指定时使用 model.glm 的 Key 池
         """
         self.config = get_config()
-        self.api_key = api_key if api_key else self.config.get('model.glm.api')
-        if not self.api_key:
-            raise ValueError("智谱AI API Key 未配置，请在 config.yaml 中设置 model.glm.api")
+        if key_pool is None:
+            try:
+                key_pool = KeyPool("glm", [api_key]) if api_key else get_key_pool("glm")
+            except ValueError:
+                raise ValueError("智谱AI API Key 未配置，请在 config.yaml 中设置 model.glm.api 或 model.glm.api_keys")
+        self.key_pool = key_pool
+        self.api_key = key_pool.keys[0].secret
         
         self.model = model
         self.api_base = api_base
@@ -121,11 +131,6 @@ class ZhipuAIEmbeddings(Embeddings):
             print("🔍 测试 API Key 有效性...")
             self._test_api_key()
         
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
         all_embeddings = []
         max_retries = 5  # 最大重试次数
         
@@ -144,11 +149,18 @@ class ZhipuAIEmbeddings(Embeddings):
             if self.model == "embedding-3" and self.dimensions:
                 payload["dimensions"] = self.dimensions
             
-            # 重试机制（处理 429 错误）
+            # 重试机制（处理 429 错误：先换用其他 Key，所有 Key 都在冷却中时才等待）
             retry_count = 0
             success = False
+            estimated_tokens = sum(len(t) for t in batch_texts)
             
             while retry_count < max_retries and not success:
+                key = self.key_pool.acquire(estimated_tokens, max_wait=self.key_pool.max_cooldown)
+                headers = {
+                    "Authorization": f"Bearer {key.secret}",
+                    "Content-Type": "application/json"
+                }
+                actual_tokens = None
                 try:
                     response = requests.post(
                         self.api_base,
@@ -165,16 +177,22 @@ class ZhipuAIEmbeddings(Embeddings):
                         except:
                             error_msg = response.text[:200]
                         
-                        retry_after = int(response.headers.get('Retry-After', 10))
-                        wait_time = retry_after * (2 ** retry_count)  # 指数退避
-                        wait_time = min(wait_time, 120)  # 最多等待 120 秒
+                        try:
+                            retry_after = float(response.headers.get('Retry-After', 10))
+                        except ValueError:
+                            retry_after = 10.0
+                        # 该 Key 进入冷却（连续 429 时冷却时间指数增长，最多 120 秒）
+                        wait_time = self.key_pool.mark_rate_limited(key, retry_after)
+                        
+                        if self.key_pool.has_available():
+                            print(f"   ⚠️  批次 {batch_num}/{total_batches} Key {key.name} 遇到速率限制 (429)，换用其他 Key 重试")
+                            continue
                         
                         retry_count += 1
                         if retry_count < max_retries:
                             print(f"   ⚠️  批次 {batch_num}/{total_batches} 遇到速率限制 (429)")
                             print(f"      错误详情: {error_msg[:100]}")
-                            print(f"      等待 {wait_time} 秒后重试 ({retry_count}/{max_retries})...")
-                            time.sleep(wait_time)
+                            print(f"      所有 Key 都在冷却中，等待 {wait_time:.0f} 秒后重试 ({retry_count}/{max_retries})...")
                             continue
                         else:
                             raise Exception(f"批次 {batch_num} 达到最大重试次数，速率限制仍未解除。错误: {error_msg}")
@@ -197,6 +215,8 @@ class ZhipuAIEmbeddings(Embeddings):
                     if "data" in result:
                         batch_embeddings = [item["embedding"] for item in result["data"]]
                         all_embeddings.extend(batch_embeddings)
+                        actual_tokens = (result.get("usage") or {}).get("total_tokens")
+                        self.key_pool.mark_success(key)
                         success = True
                     else:
                         raise ValueError(f"API 响应格式错误: {result}")
@@ -213,6 +233,9 @@ class ZhipuAIEmbeddings(Embeddings):
                 except requests.exceptions.RequestException as e:
                     # 非 429 错误，直接抛出
                     raise Exception(f"调用智谱AI Embedding API 失败: {str(e)}")
+                
+                finally:
+                    self.key_pool.release(key, actual_tokens, estimated_tokens)
             
             # 批次之间延迟，避免触发速率限制
             if i + self.batch_size < len(texts):
@@ -246,4 +269,21 @@ class ZhipuAIEmbeddings(Embeddings):
         """
         embeddings = self._embed([text])
         return embeddings[0] if embeddings else []
+    
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        为多个查询文本生成 embeddings（一次请求，供查询微批处理使用）
+        
+        智谱AI 的 embeddings 接口不区分查询和文档（没有 input_type 之类的参数），
+        embed_query 就是只有一条文本的 _embed 调用，因此批量查询与逐条 embed_query 的结果相同
+        
+        Args:
+            texts: 查询文本列表
+            
+        Returns:
+            embeddings 列表
+        """
+        if not texts:
+            return []
+        return self._embed(texts)
 
@@ -0,0 +1,26 @@
+"""
+告警分组的工作负载推断测试
+"""
+from app.core.alert_grouping import workload_of
+
+
+def test_workload_from_generated_pod_names():
+    """只去掉 Kubernetes 生成的后缀"""
+    assert workload_of({"pod": "api-7d9f8c6b5-x2k4p"}) == "api"
+    assert workload_of({"pod": "fluentd-9xk2w"}) == "fluentd"
+    assert workload_of({"pod": "web-0"}) == "web"
+
+
+def test_bare_pod_names_are_kept():
+    """普通名称段（含元音等不在随机后缀字符集中的字符）不会被当成后缀截断"""
+    assert workload_of({"pod": "nginx-proxy"}) == "nginx-proxy"
+    assert workload_of({"pod": "redis-cache"}) == "redis-cache"
+    assert workload_of({"pod": "nginx-proxy"}) != workload_of({"pod": "nginx-cache"})
+
+
+def test_labels_preferred_over_pod_name():
+    """工作负载标签和所属对象标签优先于 Pod 名称"""
+    assert workload_of({"deployment": "checkout", "pod": "checkout-legacy-x2k4p"}) == "checkout"
+    assert workload_of({"owner_name": "api-7d9f8c6b5", "owner_kind": "ReplicaSet", "pod": "api-7d9f8c6b5-x2k4p"}) == "api"
+    assert workload_of({"owner_name": "db", "owner_kind": "StatefulSet", "pod": "db-2"}) == "db"
+    assert workload_of({"replicaset": "api-7d9f8c6b5"}) == "api"
@@ -0,0 +1,181 @@
+"""
+集群状态缓存测试（httpx.MockTransport 模拟 apiserver 的 list / watch）
+"""
+import asyncio
+import json
+import time
+import httpx
+import pytest
+from app.core.cluster_cache import ClusterCache, Informer
+from app.tools.kubernetes_native import KubeCredentials, KubernetesClient, resolve_resource
+
+
+def make_client(handler) -> KubernetesClient:
+    credentials = KubeCredentials("https://k8s.example:6443", verify=False, token="abc", namespace="prod")
+    return KubernetesClient(credentials, transport=httpx.MockTransport(handler))
+
+
+def pod(name: str, version: str, namespace: str = "prod", labels: dict = None, node: str = "n1") -> dict:
+    return {
+        "metadata": {"name": name, "namespace": namespace, "resourceVersion": version, "labels": labels or {}},
+        "spec": {"nodeName": node},
+        "status": {"phase": "Running"},
+    }
+
+
+def watch_response(*events: dict) -> httpx.Response:
+    return httpx.Response(200, text="".join(json.dumps(e) + "\n" for e in events))
+
+
+async def run_until(informer: Informer, condition, timeout: float = 3) -> None:
+    """运行 informer 主循环直到条件满足，然后取消"""
+    task = asyncio.create_task(informer.run())
+    try:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, "informer 未在期限内到达预期状态"
+            await asyncio.sleep(0.01)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def test_paginated_relist_then_watch_resumes_from_resource_version():
+    """list 按 limit / continue 分页读完后整体替换，watch 从 list 的 resourceVersion 开始，断开后从最后一个事件续传"""
+    requests = []
+    idle = asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        params = request.url.params
+        requests.append(dict(params))
+        if "watch" not in params:
+            if "continue" not in params:
+                return httpx.Response(200, json={"items": [pod("a", "1"), pod("b", "2")], "metadata": {"continue": "t1"}})
+            return httpx.Response(200, json={"items": [pod("c", "3")], "metadata": {"resourceVersion": "100"}})
+        if params["resourceVersion"] == "100":
+            return watch_response(
+                {"type": "ADDED", "object": pod("d", "101")},
+                {"type": "DELETED", "object": pod("a", "102")},
+                {"type": "BOOKMARK", "object": {"metadata": {"resourceVersion": "103"}}},
+            )
+        await idle.wait()
+
+    informer = Informer(make_client(handler), resolve_resource("pods"), page_size=2)
+    watches = lambda: [r for r in requests if "watch" in r]
+    asyncio.run(run_until(informer, lambda: len(watches()) == 2))
+
+    lists = [r for r in requests if "watch" not in r]
+    assert [(r["limit"], r.get("continue")) for r in lists] == [("2", None), ("2", "t1")]
+    assert [w["resourceVersion"] for w in watches()] == ["100", "103"]
+    assert sorted(name for _, name in informer._objects) == ["b", "c", "d"]
+    assert informer.lists == 1
+    assert informer.events == 3
+
+
+@pytest.mark.parametrize("expired", ["http", "event"])
+def test_relist_when_resource_version_expired(expired):
+    """resourceVersion 过期（HTTP 410 或 watch 流中的 ERROR 410 事件）时重新 list，不退避"""
+    lists, watches = [], []
+    idle = asyncio.Event()
+    gone = {"kind": "Status", "code": 410, "reason": "Expired", "message": "too old resource version"}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        params = request.url.params
+        if "watch" not in params:
+            lists.append(1)
+            version = str(100 * len(lists))
+            return httpx.Response(200, json={"items": [pod(f"p{len(lists)}", version)], "metadata": {"resourceVersion": version}})
+        watches.append(params["resourceVersion"])
+        if params["resourceVersion"] == "100":
+            if expired == "http":
+                return httpx.Response(410, json=gone)
+            return watch_response({"type": "ERROR", "object": gone})
+        await idle.wait()
+
+    informer = Informer(make_client(handler), resolve_resource("pods"))
+    started = time.monotonic()
+    asyncio.run(run_until(informer, lambda: len(watches) == 2))
+
+    assert time.monotonic() - started < 1
+    assert watches == ["100", "200"]
+    assert informer.lists == 2
+    assert informer.relists_410 == 1
+    assert informer.errors == 0
+    assert [name for _, name in informer._objects] == ["p2"]
+
+
+def make_cache(**kwargs) -> ClusterCache:
+    """已同步、watch 连接中的缓存（不访问 apiserver）"""
+    cache = ClusterCache(make_client(lambda request: httpx.Response(500)), **kwargs)
+    for informer in cache.informers.values():
+        informer.synced = True
+        informer.watching = True
+    return cache
+
+
+def test_event_eviction_versus_truncation():
+    """事件超出上限时淘汰最久未更新的并继续使用缓存；其他资源超出上限时标记为不完整，查询回退到 apiserver"""
+    cache = make_cache(max_objects=2, max_events=2)
+    events, pods = cache.informers["events"], cache.informers["pods"]
+    for i in range(3):
+        events._put({"metadata": {"name": f"e{i}", "namespace": "prod"}, "reason": "BackOff"})
+        pods._put(pod(f"p{i}", str(i)))
+
+    assert events.evicted == 1 and not events.truncated
+    result = cache.query(resolve_resource("events"), "prod")
+    assert [e["metadata"]["name"] for e in result[0]] == ["e1", "e2"]
+
+    assert pods.truncated
+    assert cache.query(resolve_resource("pods"), "prod") is None
+    assert cache.stats()["fallbacks"] == 1
+
+
+def test_staleness_reporting():
+    """未同步时不使用缓存；watch 断开后报告断开秒数，超过 max_staleness 回退到 apiserver"""
+    cache = make_cache(max_staleness=60)
+    pods = cache.informers["pods"]
+    pods._put(pod("api-1", "1"))
+    resource = resolve_resource("pods")
+
+    assert cache.query(resource, "prod") == ([pods.get("prod", "api-1")], 0.0)
+
+    pods._mark_disconnected()
+    pods._disconnected_at = time.monotonic() - 10
+    items, staleness = cache.query(resource, "prod")
+    assert len(items) == 1 and 10 <= staleness < 11
+    assert pods.stats()["watching"] is False
+
+    pods._disconnected_at = time.monotonic() - 120
+    assert cache.query(resource, "prod") is None
+
+    pods.synced = False
+    assert pods.staleness() is None
+    assert cache.query(resource, "prod") is None
+
+
+def test_query_selectors_and_names():
+    """标签 / 字段选择器在本地计算；无法计算的选择器和没有命名空间的按名称查询回退到 apiserver"""
+    cache = make_cache()
+    pods = cache.informers["pods"]
+    pods._put(pod("api-1", "1", labels={"app": "api", "tier": "web"}))
+    pods._put(pod("api-2", "2", labels={"app": "api"}, node="n2"))
+    pods._put(pod("db-1", "3", labels={"app": "db"}))
+    pods._put(pod("api-1", "4", namespace="staging", labels={"app": "api"}))
+    cache.informers["nodes"]._put({"metadata": {"name": "n1"}})
+    resource = resolve_resource("pods")
+
+    def names(**kwargs):
+        return sorted(p["metadata"]["name"] for p in cache.query(resource, **kwargs)[0])
+
+    assert names(namespace="prod", label_selector="app=api") == ["api-1", "api-2"]
+    assert names(namespace="prod", label_selector="app in (api, db),!tier") == ["api-2", "db-1"]
+    assert names(namespace="prod", label_selector="app notin (db),tier") == ["api-1"]
+    assert names(namespace="prod", label_selector="app!=api") == ["db-1"]
+    assert names(namespace="prod", field_selector="spec.nodeName=n2") == ["api-2"]
+    assert names(label_selector="app==api") == ["api-1", "api-1", "api-2"]
+    assert cache.query(resource, "prod", field_selector="status.podIP=10.0.0.1") is None
+
+    assert cache.query(resource, "staging", name="api-1")[0][0]["metadata"]["resourceVersion"] == "4"
+    assert cache.query(resource, "prod", name="missing") == ([], 0.0)
+    assert cache.query(resource, None, name="api-1") is None
+    assert len(cache.query(resolve_resource("nodes"), "prod", name="n1")[0]) == 1
@@ -0,0 +1,85 @@
+"""
+诊断结果缓存测试（字典模拟每个对象的集群状态摘要）
+"""
+import asyncio
+from app.core.alert_grouping import AlertGroup
+from app.core.alert_queue import Alert
+from app.core.diagnosis_cache import DiagnosisCache, KubernetesStateProbe
+
+
+def make_alert(fingerprint: str, pod: str) -> Alert:
+    return Alert(fingerprint, "firing", {"alertname": "PodCrash", "namespace": "prod", "pod": pod}, {})
+
+
+def make_group(*alerts: Alert) -> AlertGroup:
+    group = AlertGroup(None, alerts[0], window=0, max_window=0)
+    for alert in alerts[1:]:
+        group.alerts[alert.fingerprint] = alert
+    return group
+
+
+def make_cache(states: dict) -> tuple:
+    """返回 (缓存, 诊断次数记录, 带缓存的诊断函数)；探针返回 states[pod]"""
+    async def probe(alert: Alert):
+        return states[alert.labels["pod"]]
+
+    cache = DiagnosisCache(probe=probe, ttl=600)
+    calls = []
+
+    async def diagnose(group: AlertGroup) -> str:
+        calls.append(sorted(group.alerts))
+        return f"diagnosis-{len(calls)}"
+
+    return cache, calls, cache.wrap(diagnose)
+
+
+def test_hit_requires_every_member_unchanged():
+    """组内每条告警的状态都未变化时复用诊断；任何一个成员的状态变化都重新诊断"""
+    states = {"api-1": "a", "api-2": "b"}
+    cache, calls, diagnose = make_cache(states)
+    group = make_group(make_alert("f1", "api-1"), make_alert("f2", "api-2"))
+
+    async def run():
+        first = await diagnose(group)
+        second = await diagnose(group)
+        states["api-2"] = "b-restarted"
+        third = await diagnose(group)
+        return first, second, third
+
+    assert asyncio.run(run()) == ("diagnosis-1", "diagnosis-1", "diagnosis-2")
+    assert len(calls) == 2
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["state_changed"] == 1
+    assert cache.stats()["entries"] == 2
+
+
+def test_new_member_or_invalidated_member_misses():
+    """组内出现没有条目的告警、或成员来自不同的诊断、或单条告警被清除时重新诊断"""
+    states = {"api-1": "a", "api-2": "b"}
+    cache, calls, diagnose = make_cache(states)
+    a1, a2 = make_alert("f1", "api-1"), make_alert("f2", "api-2")
+
+    async def run():
+        await diagnose(make_group(a1))
+        await diagnose(make_group(a1, a2))   # f2 没有条目
+        await diagnose(make_group(a1, a2))   # 命中
+        cache.invalidate("f1")
+        await diagnose(make_group(a1, a2))   # f1 被清除
+        await diagnose(make_group(a2))       # f2 单独命中（同一次诊断写入的条目）
+
+    asyncio.run(run())
+
+    assert calls == [["f1"], ["f1", "f2"], ["f1", "f2"]]
+    assert cache.stats()["hits"] == 2
+
+
+def test_probe_scoped_to_single_object():
+    """探针只查询告警指向的单个对象：Pod 优先，其次工作负载，最后节点"""
+    assert KubernetesStateProbe.query_for(make_alert("f1", "api-1")) == {
+        "resourceType": "pods", "name": "api-1", "namespace": "prod", "output": "json",
+    }
+    deployment = Alert("f2", "firing", {"namespace": "prod", "deployment": "api"}, {})
+    assert KubernetesStateProbe.query_for(deployment)["resourceType"] == "deployments"
+    node = Alert("f3", "firing", {"node": "n1"}, {})
+    assert KubernetesStateProbe.query_for(node) == {"resourceType": "nodes", "name": "n1", "output": "json"}
+    assert KubernetesStateProbe.query_for(Alert("f4", "firing", {"namespace": "prod"}, {})) is None
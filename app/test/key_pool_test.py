@@ -0,0 +1,98 @@
+"""
+Key 池认证测试（httpx.MockTransport 模拟 OpenAI 兼容接口）
+"""
+import asyncio
+import gzip
+import json
+import httpx
+from app.core.key_pool import KeyPool, KeyPoolAuth
+
+
+def make_client(handler, pool: KeyPool) -> httpx.AsyncClient:
+    return httpx.AsyncClient(auth=KeyPoolAuth(pool), transport=httpx.MockTransport(handler))
+
+
+async def network_body(data: bytes):
+    """像网络连接一样逐块返回的响应体（bytes 会被 httpx.Response 立即读完，不经过响应流）"""
+    for i in range(0, len(data), 16):
+        yield data[i:i + 16]
+
+
+def request_body(max_tokens: int = 100, stream: bool = False) -> dict:
+    return {"model": "m", "messages": [{"role": "user", "content": "x" * 400}], "max_tokens": max_tokens, "stream": stream}
+
+
+def test_estimate_includes_max_tokens_and_is_corrected_by_usage():
+    """预估值包含 max_tokens；响应读完后按 usage 修正预算窗口（gzip 响应体）"""
+    pool = KeyPool("test", ["key-a"])
+    key = pool.keys[0]
+    estimates = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        estimates.append(sum(tokens for _, tokens in key._usage))
+        body = gzip.compress(json.dumps({"choices": [], "usage": {"prompt_tokens": 20, "completion_tokens": 10, "total_tokens": 30}}).encode())
+        return httpx.Response(200, content=network_body(body), headers={"content-type": "application/json", "content-encoding": "gzip"})
+
+    async def run():
+        async with make_client(handler, pool) as client:
+            response = await client.post("http://llm.test/v1/chat/completions", json=request_body(max_tokens=100))
+            return response.json()
+
+    data = asyncio.run(run())
+
+    assert data["usage"]["total_tokens"] == 30
+    assert estimates[0] >= 100 + 400 // 4
+    assert key.tokens == 30
+    assert [tokens for _, tokens in key._usage] == [30]
+    assert key.inflight == 0
+
+
+def test_streaming_usage_from_final_chunk():
+    """流式响应在关闭时释放 Key，用最后一个 usage 块修正；读取期间 Key 仍计为进行中"""
+    pool = KeyPool("test", ["key-a"])
+    key = pool.keys[0]
+    chunks = [
+        {"choices": [{"index": 0, "delta": {"content": "hi"}}], "usage": None},
+        {"choices": [], "usage": {"prompt_tokens": 20, "completion_tokens": 2, "total_tokens": 22}},
+    ]
+    body = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=network_body(body.encode()), headers={"content-type": "text/event-stream"})
+
+    async def run():
+        async with make_client(handler, pool) as client:
+            async with client.stream("POST", "http://llm.test/v1/chat/completions", json=request_body(stream=True)) as response:
+                inflight = key.inflight
+                async for _ in response.aiter_lines():
+                    pass
+            return inflight
+
+    assert asyncio.run(run()) == 1
+    assert key.inflight == 0
+    assert key.tokens == 22
+
+
+def test_rate_limited_key_is_swapped():
+    """429 的 Key 进入冷却，换下一个 Key 重发；被拒绝的请求保留预估值"""
+    pool = KeyPool("test", ["key-aaaaaaaaaa", "key-bbbbbbbbbb"])
+    used = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        used.append(request.headers["Authorization"])
+        if len(used) == 1:
+            return httpx.Response(429, headers={"Retry-After": "5"})
+        return httpx.Response(200, content=network_body(json.dumps({"usage": {"total_tokens": 7}}).encode()))
+
+    async def run():
+        async with make_client(handler, pool) as client:
+            return await client.post("http://llm.test/v1/chat/completions", json=request_body())
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert used[0] != used[1]
+    limited = next(k for k in pool.keys if f"Bearer {k.secret}" == used[0])
+    served = next(k for k in pool.keys if f"Bearer {k.secret}" == used[1])
+    assert limited.rate_limited == 1 and limited.inflight == 0
+    assert served.tokens == 7 and served.inflight == 0
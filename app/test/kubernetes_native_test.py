@@ -0,0 +1,155 @@
+"""
+Kubernetes 原生客户端测试（httpx.MockTransport 模拟 apiserver，临时文件模拟 kubeconfig）
+"""
+import asyncio
+import base64
+import json
+import os
+import httpx
+import pytest
+import yaml
+from app.tools.kubernetes_native import (
+    KubeConfigError,
+    KubeCredentials,
+    KubernetesAPIError,
+    KubernetesClient,
+    load_kubeconfig,
+    resolve_resource,
+)
+
+
+def write_kubeconfig(tmp_path, user: dict, context_extra: dict = None, current: str = "dev") -> str:
+    """写入一个只有一个集群 / 用户 / 上下文的 kubeconfig，返回路径"""
+    kubeconfig = {
+        "apiVersion": "v1",
+        "kind": "Config",
+        "current-context": current,
+        "clusters": [{"name": "c1", "cluster": {"server": "https://k8s.example:6443/", "insecure-skip-tls-verify": True}}],
+        "users": [{"name": "u1", "user": user}],
+        "contexts": [{"name": "dev", "context": {"cluster": "c1", "user": "u1", **(context_extra or {})}}],
+    }
+    path = tmp_path / "config"
+    path.write_text(yaml.safe_dump(kubeconfig), encoding="utf-8")
+    return str(path)
+
+
+def test_load_kubeconfig_token(tmp_path):
+    """token 认证：解析地址、上下文和默认命名空间"""
+    path = write_kubeconfig(tmp_path, {"token": "abc"}, {"namespace": "prod"})
+    credentials = load_kubeconfig(path)
+
+    assert credentials.server == "https://k8s.example:6443"
+    assert credentials.verify is False
+    assert credentials.context == "dev"
+    assert credentials.namespace == "prod"
+    assert credentials.auth_headers() == {"Authorization": "Bearer abc"}
+
+
+def test_load_kubeconfig_token_file_rotation(tmp_path):
+    """tokenFile 相对 kubeconfig 所在目录解析，文件被轮换后重新读取"""
+    token_file = tmp_path / "token"
+    token_file.write_text("first\n", encoding="utf-8")
+    credentials = load_kubeconfig(write_kubeconfig(tmp_path, {"tokenFile": "token"}))
+
+    assert credentials.token_file == str(token_file)
+    assert credentials.namespace == "default"
+    assert credentials.auth_headers() == {"Authorization": "Bearer first"}
+
+    token_file.write_text("second\n", encoding="utf-8")
+    stat = os.stat(token_file)
+    os.utime(token_file, (stat.st_atime, stat.st_mtime + 10))
+    assert credentials.auth_headers() == {"Authorization": "Bearer second"}
+
+
+def test_load_kubeconfig_basic_auth(tmp_path):
+    """basic auth 生成 Basic 认证头"""
+    credentials = load_kubeconfig(write_kubeconfig(tmp_path, {"username": "admin", "password": "pw"}))
+    expected = base64.b64encode(b"admin:pw").decode("ascii")
+    assert credentials.auth_headers() == {"Authorization": f"Basic {expected}"}
+
+
+def test_load_kubeconfig_errors(tmp_path):
+    """不支持的认证插件、不存在的上下文和文件都抛出 KubeConfigError"""
+    exec_path = write_kubeconfig(tmp_path, {"exec": {"command": "aws"}})
+    with pytest.raises(KubeConfigError):
+        load_kubeconfig(exec_path)
+    with pytest.raises(KubeConfigError):
+        load_kubeconfig(write_kubeconfig(tmp_path, {"token": "abc"}), context="missing")
+    with pytest.raises(KubeConfigError):
+        load_kubeconfig(str(tmp_path / "not-exist"))
+
+
+def make_client(handler) -> KubernetesClient:
+    credentials = KubeCredentials("https://k8s.example:6443", verify=False, token="abc", namespace="prod")
+    return KubernetesClient(credentials, transport=httpx.MockTransport(handler))
+
+
+def test_client_list_and_get():
+    """list 补全 kind 并传递选择器，get 使用上下文的默认命名空间，请求带认证头"""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.path == "/api/v1/namespaces/prod/pods":
+            return httpx.Response(200, json={"kind": "PodList", "items": [{"metadata": {"name": "api-1"}}]})
+        if request.url.path == "/apis/apps/v1/namespaces/prod/deployments/api":
+            return httpx.Response(200, json={"kind": "Deployment", "metadata": {"name": "api"}})
+        return httpx.Response(404, json={"reason": "NotFound", "message": "not found"})
+
+    client = make_client(handler)
+
+    async def run():
+        pods = await client.list(resolve_resource("po"), "prod", label_selector="app=api")
+        deployment = await client.get(resolve_resource("deploy"), "api")
+        return pods, deployment
+
+    pods, deployment = asyncio.run(run())
+
+    assert pods["items"][0]["kind"] == "Pod"
+    assert deployment["metadata"]["name"] == "api"
+    assert requests[0].url.params["labelSelector"] == "app=api"
+    assert "fieldSelector" not in requests[0].url.params
+    assert all(r.headers["Authorization"] == "Bearer abc" for r in requests)
+
+
+def test_client_error_status():
+    """apiserver 的 Status 错误转换为 KubernetesAPIError"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(403, json={"kind": "Status", "reason": "Forbidden", "message": "pods is forbidden"})
+
+    client = make_client(handler)
+    with pytest.raises(KubernetesAPIError) as error:
+        asyncio.run(client.list(resolve_resource("pods"), "prod"))
+    assert error.value.status_code == 403
+    assert error.value.reason == "Forbidden"
+
+
+def test_client_logs_and_watch():
+    """日志请求带 tail / limitBytes 参数；watch 逐行解析事件"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/log"):
+            assert request.url.params["tailLines"] == "50"
+            assert request.url.params["limitBytes"] == str(5 * 1024 * 1024)
+            assert "previous" not in request.url.params
+            return httpx.Response(200, text="line1\nline2\n")
+        assert request.url.params["watch"] == "true"
+        assert request.url.params["resourceVersion"] == "10"
+        events = [
+            {"type": "ADDED", "object": {"metadata": {"name": "n1", "resourceVersion": "11"}}},
+            {"type": "BOOKMARK", "object": {"metadata": {"resourceVersion": "12"}}},
+        ]
+        return httpx.Response(200, text="\n".join(json.dumps(e) for e in events) + "\n")
+
+    client = make_client(handler)
+
+    async def run():
+        logs = await client.logs("api-1", "prod", tail=50)
+        connected = []
+        events = [e async for e in client.watch(resolve_resource("nodes"), "10", on_connected=lambda: connected.append(1))]
+        return logs, events, connected
+
+    logs, events, connected = asyncio.run(run())
+
+    assert logs == "line1\nline2\n"
+    assert [e["type"] for e in events] == ["ADDED", "BOOKMARK"]
+    assert connected == [1]
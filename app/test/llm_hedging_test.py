@@ -0,0 +1,245 @@
+"""
+LLM 对冲请求与故障切换测试（进程内的假模型接口，以及 httpx.MockTransport 模拟的 OpenAI 兼容服务）
+"""
+import asyncio
+import json
+import time
+from typing import Any, List
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import tool as lc_tool
+from langchain_openai import ChatOpenAI
+from pydantic import Field
+from app.core.llm_hedging import CircuitBreaker, HedgedChatModel
+
+
+class StubChatModel(BaseChatModel):
+    """假模型接口：可设置首 token 前的延迟、首 token 前失败和放行信号"""
+
+    text: str = "ok"
+    delay: float = 0.0
+    fail: bool = False
+    gate: Any = None
+    """asyncio.Event（可选）：设置后才输出首 token"""
+    events: List[str] = Field(default_factory=list)
+    """流的生命周期记录：opened / closed"""
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.text))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.events.append("opened")
+        try:
+            if self.gate is not None:
+                await self.gate.wait()
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            if self.fail:
+                raise RuntimeError(f"{self.text} 不可用")
+            yield ChatGenerationChunk(message=AIMessageChunk(content=self.text))
+        finally:
+            self.events.append("closed")
+
+
+def make_hedged(primary: StubChatModel, backup: StubChatModel, **kwargs) -> HedgedChatModel:
+    options = {"initial_hedge_delay": 0.05, "first_token_timeout": 5, "idle_timeout": 5}
+    options.update(kwargs)
+    return HedgedChatModel(endpoints=[("primary", primary), ("backup", backup)], **options)
+
+
+def test_stalled_primary_is_hedged():
+    """主接口首 token 卡住时向备用接口发出对冲请求，备用接口胜出后主接口的流被取消并关闭"""
+    primary = StubChatModel(text="primary", delay=10)
+    backup = StubChatModel(text="backup")
+    model = make_hedged(primary, backup)
+
+    started = time.monotonic()
+    result = asyncio.run(model.ainvoke("hi"))
+
+    assert result.content == "backup"
+    assert time.monotonic() - started < 2
+    stats = model.stats()
+    assert stats["hedges"] == 1
+    assert stats["secondary_wins"] == 1
+    assert stats["endpoints"]["primary"]["cancelled"] == 1
+    assert primary.events == ["opened", "closed"]
+    assert backup.events == ["opened", "closed"]
+
+
+def test_primary_failure_before_first_token_fails_over():
+    """主接口在首 token 之前出错时立即切换到备用接口，不等待对冲时间"""
+    primary = StubChatModel(text="primary", fail=True)
+    backup = StubChatModel(text="backup")
+    model = make_hedged(primary, backup, initial_hedge_delay=3)
+
+    started = time.monotonic()
+    result = asyncio.run(model.ainvoke("hi"))
+
+    assert result.content == "backup"
+    assert time.monotonic() - started < 1
+    stats = model.stats()
+    assert stats["failovers"] == 1
+    assert stats["hedges"] == 0
+    assert stats["endpoints"]["primary"]["failures"] == 1
+
+
+def test_circuit_breaker_half_open_and_reset():
+    """熔断后跳过主接口；冷却后放行一个试探请求，成功则恢复"""
+    primary = StubChatModel(text="primary", fail=True)
+    backup = StubChatModel(text="backup")
+    model = make_hedged(primary, backup, failure_threshold=1, reset_timeout=0.2)
+
+    async def run():
+        first = await model.ainvoke("hi")
+        assert model.stats()["endpoints"]["primary"]["circuit"] == "open"
+
+        # 熔断期间不向主接口发送请求
+        second = await model.ainvoke("hi")
+        assert model.stats()["endpoints"]["primary"]["requests"] == 1
+
+        # 冷却后放行试探请求，成功后回到 closed
+        await asyncio.sleep(0.25)
+        primary.fail = False
+        third = await model.ainvoke("hi")
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+
+    assert (first.content, second.content, third.content) == ("backup", "backup", "primary")
+    endpoint = model.stats()["endpoints"]["primary"]
+    assert endpoint["requests"] == 2
+    assert endpoint["circuit"] == "closed"
+
+
+def test_half_open_allows_single_probe():
+    """half_open 状态只放行一个试探请求，试探失败重新打开"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_streams_closed_when_both_finish_together():
+    """两个接口在同一轮输出首 token 时，落选接口已经打开的流在返回胜出者之前就被关闭"""
+    primary = StubChatModel(text="primary")
+    backup = StubChatModel(text="backup")
+    model = make_hedged(primary, backup)
+
+    async def run():
+        gate = asyncio.Event()
+        primary.gate = gate
+        backup.gate = gate
+        # 对冲请求发出之后同时放行两个接口
+        asyncio.get_running_loop().call_later(0.2, gate.set)
+        endpoint, stream, received = await model._race([], None, {})
+        # 立即检查（不让出事件循环，避免被垃圾回收时的异步生成器清理掩盖）
+        loser = backup if endpoint.name == "primary" else primary
+        loser_events = list(loser.events)
+        await stream.aclose()
+        return endpoint.name, received, loser_events
+
+    winner, received, loser_events = asyncio.run(run())
+
+    assert received[0].message.content == winner
+    assert loser_events == ["opened", "closed"]
+    assert model.stats()["hedges"] == 1
+
+
+def sse(*chunks: dict) -> List[bytes]:
+    """OpenAI 流式响应的 SSE 行"""
+    return [f"data: {json.dumps(c)}\n\n".encode() for c in chunks] + [b"data: [DONE]\n\n"]
+
+
+def completion_chunk(model: str, delta: dict, finish_reason: str = None, usage: dict = None) -> dict:
+    return {
+        "id": "chatcmpl-1",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+        "usage": usage,
+    }
+
+
+def test_openai_endpoints_tools_and_hedge():
+    """真实的 ChatOpenAI + httpx.MockTransport：工具定义原样发给备用接口，SSE 流解析出工具调用，落选的 httpx 流被取消"""
+    requests = {}
+    primary_events = []
+
+    async def primary_body():
+        primary_events.append("opened")
+        try:
+            # 只有 role 的首块不算首 token，之后卡住
+            yield sse(completion_chunk("primary-model", {"role": "assistant", "content": ""}))[0]
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            primary_events.append("cancelled")
+            raise
+        finally:
+            primary_events.append("closed")
+
+    def backup_body() -> List[bytes]:
+        call = {"index": 0, "id": "call_1", "type": "function", "function": {"name": "kubectl_get", "arguments": ""}}
+        return sse(
+            completion_chunk("backup-model", {"role": "assistant", "content": None, "tool_calls": [call]}),
+            completion_chunk("backup-model", {"tool_calls": [{"index": 0, "function": {"arguments": '{"resourceType": "pods"}'}}]}),
+            completion_chunk("backup-model", {}, finish_reason="tool_calls"),
+            completion_chunk("backup-model", None, usage={"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}),
+        )
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        requests[body["model"]] = body
+        headers = {"content-type": "text/event-stream"}
+        if body["model"] == "primary-model":
+            return httpx.Response(200, headers=headers, content=primary_body())
+        return httpx.Response(200, headers=headers, content=b"".join(backup_body()))
+
+    def openai(model: str) -> ChatOpenAI:
+        return ChatOpenAI(
+            model=model,
+            api_key="sk-test",
+            base_url="http://llm.test/v1",
+            stream_usage=True,
+            http_async_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        )
+
+    model = HedgedChatModel(
+        endpoints=[("primary", openai("primary-model")), ("backup", openai("backup-model"))],
+        initial_hedge_delay=0.1,
+        first_token_timeout=5,
+        idle_timeout=5,
+    )
+
+    @lc_tool
+    def kubectl_get(resourceType: str) -> str:
+        """获取 Kubernetes 资源"""
+        return resourceType
+
+    bound = model.bind_tools([kubectl_get], tool_choice="auto")
+    result = asyncio.run(bound.ainvoke("列出 pods"))
+
+    assert result.tool_calls == [{"name": "kubectl_get", "args": {"resourceType": "pods"}, "id": "call_1", "type": "tool_call"}]
+    assert result.usage_metadata["total_tokens"] == 15
+    for body in requests.values():
+        assert body["stream"] is True
+        assert body["tools"][0]["function"]["name"] == "kubectl_get"
+        assert body["tool_choice"] == "auto"
+    assert primary_events == ["opened", "cancelled", "closed"]
+    stats = model.stats()
+    assert stats["secondary_wins"] == 1
+    assert stats["endpoints"]["primary"]["cancelled"] == 1
+    # 落选请求的已等待时间计入截尾 TTFT 样本
+    assert stats["endpoints"]["primary"]["ttft_censored"] == 1
+    assert stats["endpoints"]["primary"]["ttft_p50"] >= 0.1
@@ -0,0 +1,37 @@
+"""
+MCP 工具包装测试（single-flight / 输出后处理包装后仍由 ToolNode 注入运行时）
+"""
+import asyncio
+from typing import Any
+from langchain_core.messages import AIMessage
+from langchain_core.tools import StructuredTool
+from langgraph.graph import START, MessagesState, StateGraph
+from langgraph.prebuilt import ToolNode
+from app.tools.mcp_tools import with_postprocessor, with_singleflight
+
+
+def test_wrapped_mcp_tool_receives_runtime():
+    """包装后的工具保留 MCP coroutine 的 runtime 参数，ToolNode 照常注入 ToolRuntime"""
+    runtimes = []
+
+    # 与 langchain-mcp-adapters 生成的 coroutine 签名一致
+    async def call_tool(runtime: Any = None, **arguments):
+        runtimes.append(runtime)
+        return f"pods in {arguments['namespace']}"
+
+    tool = StructuredTool(
+        name="kubectl_get",
+        description="get resources",
+        args_schema={"type": "object", "properties": {"namespace": {"type": "string"}}},
+        coroutine=call_tool,
+    )
+    wrapped = with_postprocessor(with_singleflight(tool), str.upper)
+
+    graph = StateGraph(MessagesState)
+    graph.add_node("tools", ToolNode([wrapped]))
+    graph.add_edge(START, "tools")
+    call = {"name": "kubectl_get", "args": {"namespace": "prod"}, "id": "call-1"}
+    result = asyncio.run(graph.compile().ainvoke({"messages": [AIMessage(content="", tool_calls=[call])]}))
+
+    assert result["messages"][-1].content == "PODS IN PROD"
+    assert type(runtimes[0]).__name__ == "ToolRuntime"
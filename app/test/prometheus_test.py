@@ -0,0 +1,105 @@
+"""
+Prometheus 客户端范围查询块缓存测试（httpx.MockTransport 模拟 Prometheus HTTP API）
+"""
+import asyncio
+import time
+import httpx
+from app.tools.prometheus import PrometheusClient
+
+
+STEP = 60.0
+BLOCK_POINTS = 10
+BLOCK_LEN = STEP * BLOCK_POINTS
+
+
+def make_client(settle_seconds: float = 60):
+    """创建使用模拟 Prometheus 的客户端，返回 (客户端, 收到的范围查询参数列表)"""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        params = request.url.params
+        start, end, step = float(params["start"]), float(params["end"]), float(params["step"])
+        requests.append((start, end, step))
+        values = []
+        t = start
+        while t <= end:
+            values.append([t, str(t)])
+            t += step
+        return httpx.Response(200, json={
+            "status": "success",
+            "data": {"resultType": "matrix", "result": [{"metric": {"pod": "api"}, "values": values}]},
+        })
+
+    client = PrometheusClient(
+        "http://prometheus:9090",
+        block_points=BLOCK_POINTS,
+        settle_seconds=settle_seconds,
+        transport=httpx.MockTransport(handler),
+    )
+    return client, requests
+
+
+def historical_base() -> float:
+    """远早于当前时间、按块对齐的时间点（块都已完成，可以缓存）"""
+    return (time.time() // BLOCK_LEN) * BLOCK_LEN - 100 * BLOCK_LEN
+
+
+def test_query_range_aligns_to_step_and_blocks():
+    """起止时间对齐到 step，上游请求按块边界展开，返回结果裁剪到对齐后的范围"""
+    client, requests = make_client()
+    base = historical_base()
+
+    data = asyncio.run(client.query_range("up", base + 130, base + 1300, STEP))
+
+    # 对齐到 step：base+120 ~ base+1260，覆盖第 0、1、2 个块
+    assert requests == [(base, base + 3 * BLOCK_LEN - STEP, STEP)]
+    values = data["result"][0]["values"]
+    assert values[0][0] == base + 120
+    assert values[-1][0] == base + 1260
+    assert len(values) == (1260 - 120) / STEP + 1
+    assert data["result"][0]["metric"] == {"pod": "api"}
+
+
+def test_query_range_refetches_only_missing_blocks():
+    """窗口向后移动时只请求缺失的块，已缓存的历史块直接复用"""
+    client, requests = make_client()
+    base = historical_base()
+
+    async def run():
+        first = await client.query_range("up", base, base + 2 * BLOCK_LEN - STEP, STEP)
+        second = await client.query_range("up", base + BLOCK_LEN, base + 4 * BLOCK_LEN - STEP, STEP)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert len(requests) == 2
+    # 第二次查询的第 1 个块命中缓存，只请求第 2、3 个块（相邻缺失块合并为一次请求）
+    assert requests[1] == (base + 2 * BLOCK_LEN, base + 4 * BLOCK_LEN - STEP, STEP)
+    assert client.stats()["block_hits"] == 1
+    assert client.stats()["block_misses"] == 4
+    values = second["result"][0]["values"]
+    assert [v[0] for v in values] == [base + BLOCK_LEN + i * STEP for i in range(3 * BLOCK_POINTS)]
+    assert len(first["result"][0]["values"]) == 2 * BLOCK_POINTS
+
+
+def test_recent_blocks_are_not_cached():
+    """距当前时间不足 settle_seconds 的块（数据可能还在写入）每次都重新请求"""
+    client, requests = make_client(settle_seconds=BLOCK_LEN)
+    now = time.time()
+    current_block = (now // BLOCK_LEN) * BLOCK_LEN
+
+    async def run():
+        await client.query_range("up", current_block - 3 * BLOCK_LEN, now, STEP)
+        await client.query_range("up", current_block - 3 * BLOCK_LEN, now, STEP)
+
+    asyncio.run(run())
+
+    # 最后一个采样点早于 now - settle_seconds 的块才会缓存：
+    # 第二次查询只重新请求最近的块（当前块，以及刚结束不足 settle_seconds 的上一个块）
+    assert len(requests) == 2
+    refetch_start = requests[1][0]
+    assert refetch_start >= current_block - BLOCK_LEN
+    assert refetch_start + BLOCK_LEN - STEP > now - BLOCK_LEN
+    for block_start in (current_block - 3 * BLOCK_LEN, current_block - 2 * BLOCK_LEN):
+        assert ("up", STEP, block_start) in client._blocks
+    assert ("up", STEP, current_block) not in client._blocks
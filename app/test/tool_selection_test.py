@@ -0,0 +1,80 @@
+"""
+工具子集选择测试（本地 / 原生工具 + 按 mcp-server-kubernetes 工具描述构造的英文工具）
+"""
+import asyncio
+from langchain_core.messages import HumanMessage
+from app.core.tool_selection import DEFAULT_PINNED_TOOLS, ToolSelectionMiddleware, _tool_name
+from app.tools.base import tools_usage
+from app.tools.kubernetes_native import kubectl_describe, kubectl_events, kubectl_get, kubectl_logs
+from app.tools.prometheus import prometheus_query, prometheus_query_range
+
+
+# agent.py 中的示例问题
+QUESTION = "如果什么pod有问题就查看他的日志看一下是什么原因导致的！"
+
+MCP_TOOLS = {
+    "kubectl_get": "Get or list Kubernetes resources by resource type, name, and optionally namespace",
+    "kubectl_describe": "Describe Kubernetes resources by resource type, name, and optionally namespace",
+    "kubectl_logs": "Get logs from Kubernetes resources like pods, deployments, or jobs",
+    "kubectl_apply": "Apply a Kubernetes YAML manifest from a string or file",
+    "kubectl_delete": "Delete Kubernetes resources by resource type, name, labels, or from a manifest file",
+    "kubectl_create": "Create Kubernetes resources using various methods (from file or using subcommands)",
+    "kubectl_scale": "Scale a Kubernetes deployment",
+    "kubectl_patch": "Update field(s) of a resource using strategic merge patch, JSON merge patch, or JSON patch",
+    "kubectl_rollout": "Manage the rollout of a resource (e.g., deployment, daemonset, statefulset)",
+    "kubectl_context": "Manage Kubernetes contexts - list, get, or set the current context",
+    "exec_in_pod": "Execute a command in a Kubernetes pod or container and return the output",
+    "port_forward": "Forward a local port to a port on a Kubernetes resource",
+    "install_helm_chart": "Install a Helm chart",
+    "upgrade_helm_chart": "Upgrade a Helm release",
+    "list_api_resources": "List the API resources available in the cluster",
+    "explain_resource": "Get documentation for a Kubernetes resource or field",
+}
+
+
+def mcp_tool(name: str, description: str) -> dict:
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "parameters": {"type": "object", "properties": {"namespace": {"type": "string"}}},
+        },
+    }
+
+
+def select(tools, question: str = QUESTION, **kwargs):
+    middleware = ToolSelectionMiddleware(top_n=4, **kwargs)
+    selected = asyncio.run(middleware.select(tools, [HumanMessage(content=question, id="q1")]))
+    return None if selected is None else [_tool_name(t) for t in selected]
+
+
+def test_chinese_question_against_english_tools_binds_all():
+    """中文问题对英文描述的 MCP 工具几乎没有词法重叠：回退为绑定全部工具"""
+    tools = list(tools_usage) + [mcp_tool(name, description) for name, description in MCP_TOOLS.items()]
+    assert select(tools) is None
+
+
+def test_sample_question_keeps_core_kubernetes_tools():
+    """hybrid 工具集：示例问题的子集包含基础只读工具，并按排名补足 top_n 个"""
+    native = [kubectl_get, kubectl_describe, kubectl_logs, kubectl_events]
+    native_names = {t.name for t in native}
+    tools = list(tools_usage) + native + [prometheus_query, prometheus_query_range] + [
+        mcp_tool(name, description) for name, description in MCP_TOOLS.items() if name not in native_names
+    ]
+
+    selected = select(tools)
+
+    assert selected is not None
+    assert set(DEFAULT_PINNED_TOOLS) <= set(selected)
+    assert len(selected) == len(DEFAULT_PINNED_TOOLS) + 4
+
+
+def test_fills_to_top_n_when_few_tools_match():
+    """只有一个工具与问题匹配时仍按排名补足 top_n 个（包含匹配的工具）"""
+    tools = [mcp_tool(name, description) for name, description in MCP_TOOLS.items()]
+
+    selected = select(tools, "scale the deployment", pinned=())
+
+    assert len(selected) == 4
+    assert "kubectl_scale" in selected
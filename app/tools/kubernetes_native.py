@@ -0,0 +1,853 @@
+"""
+Kubernetes 原生只读工具
+高频的只读操作（get / list / describe / logs / events）直接在进程内用 httpx 连接池请求 apiserver，
+不经过 agent -> stdio -> npx mcp-server-kubernetes（Node）-> kubectl 这条链路；
+工具名称与 MCP 工具保持一致，hybrid 模式下替换同名 MCP 工具，其余长尾操作仍由 MCP 服务器提供
+"""
+import asyncio
+import base64
+import json
+import os
+import ssl
+import tempfile
+import weakref
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+import httpx
+import yaml
+from langchain_core.tools import BaseTool, tool
+from config.config_loader import get_config
+
+
+# 集群内运行时的 ServiceAccount 凭据
+_SERVICE_ACCOUNT_DIR = "/var/run/secrets/kubernetes.io/serviceaccount"
+
+
+class KubeConfigError(Exception):
+    """kubeconfig 无法解析或使用了不支持的认证方式"""
+
+
+class KubernetesAPIError(Exception):
+    """apiserver 返回错误"""
+
+    def __init__(self, status_code: int, reason: str, message: str):
+        super().__init__(f"{status_code} {reason}: {message}")
+        self.status_code = status_code
+        self.reason = reason
+
+
+class KubeCredentials:
+    """连接 apiserver 所需的地址、TLS 和认证信息"""
+
+    def __init__(
+        self,
+        server: str,
+        verify: Any = True,
+        token: Optional[str] = None,
+        token_file: Optional[str] = None,
+        basic_auth: Optional[Tuple[str, str]] = None,
+        namespace: str = "default",
+        context: Optional[str] = None,
+    ):
+        """
+        初始化连接信息
+
+        Args:
+            server: apiserver 地址
+            verify: httpx 的 verify 参数（ssl.SSLContext 或 bool）
+            token: Bearer Token
+            token_file: Token 文件（每次请求前检查是否轮换）
+            basic_auth: (用户名, 密码)
+            namespace: 上下文的默认命名空间
+            context: 上下文名称
+        """
+        self.server = server.rstrip("/")
+        self.verify = verify
+        self.token = token
+        self.token_file = token_file
+        self.basic_auth = basic_auth
+        self.namespace = namespace
+        self.context = context
+        self._token_mtime = None
+
+    def auth_headers(self) -> Dict[str, str]:
+        """当前的认证请求头（token 文件被轮换时重新读取）"""
+        if self.token_file:
+            mtime = os.path.getmtime(self.token_file)
+            if mtime != self._token_mtime:
+                with open(self.token_file, "r", encoding="utf-8") as f:
+                    self.token = f.read().strip()
+                self._token_mtime = mtime
+        if self.token:
+            return {"Authorization": f"Bearer {self.token}"}
+        if self.basic_auth:
+            raw = f"{self.basic_auth[0]}:{self.basic_auth[1]}".encode("utf-8")
+            return {"Authorization": f"Basic {base64.b64encode(raw).decode('ascii')}"}
+        return {}
+
+
+def _load_cert_chain(ctx: ssl.SSLContext, cert_file: Optional[str], key_file: Optional[str],
+                     cert_data: Optional[str], key_data: Optional[str]) -> None:
+    """加载客户端证书；*-data 形式的证书先写入仅当前用户可读的临时文件，加载后立即删除"""
+    temp_files = []
+    try:
+        for data, suffix in ((cert_data, ".crt"), (key_data, ".key")):
+            if data:
+                fd, path = tempfile.mkstemp(prefix="kube-", suffix=suffix)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(base64.b64decode(data))
+                temp_files.append(path)
+                if suffix == ".crt":
+                    cert_file = path
+                else:
+                    key_file = path
+        if cert_file:
+            ctx.load_cert_chain(cert_file, key_file)
+    finally:
+        for path in temp_files:
+            os.unlink(path)
+
+
+def load_kubeconfig(path: Optional[str] = None, context: Optional[str] = None) -> KubeCredentials:
+    """
+    解析 kubeconfig（不存在时尝试集群内 ServiceAccount）
+
+    支持 token / tokenFile / 客户端证书 / basic auth；exec 和 auth-provider 插件不支持，
+    这类集群请使用 MCP 后端
+
+    Args:
+        path: kubeconfig 路径（默认 $KUBECONFIG 的第一个文件或 ~/.kube/config）
+        context: 上下文名称（默认 current-context）
+
+    Returns:
+        KubeCredentials 实例
+    """
+    path = path or (os.environ.get("KUBECONFIG", "").split(os.pathsep)[0] or os.path.expanduser("~/.kube/config"))
+    if not os.path.exists(path):
+        if os.environ.get("KUBERNETES_SERVICE_HOST"):
+            return _load_in_cluster()
+        raise KubeConfigError(f"kubeconfig 不存在: {path}")
+
+    with open(path, "r", encoding="utf-8") as f:
+        kubeconfig = yaml.safe_load(f) or {}
+    base_dir = os.path.dirname(os.path.abspath(path))
+
+    def find(section: str, name: str) -> dict:
+        for item in kubeconfig.get(section) or []:
+            if item.get("name") == name:
+                return item.get(section[:-1]) or {}
+        raise KubeConfigError(f"kubeconfig 中未找到 {section[:-1]}: {name}")
+
+    def resolve(file_path: Optional[str]) -> Optional[str]:
+        return os.path.join(base_dir, file_path) if file_path and not os.path.isabs(file_path) else file_path
+
+    context = context or kubeconfig.get("current-context")
+    if not context:
+        raise KubeConfigError("kubeconfig 未设置 current-context，请指定 context")
+    ctx_info = find("contexts", context)
+    cluster = find("clusters", ctx_info.get("cluster"))
+    user = find("users", ctx_info.get("user")) if ctx_info.get("user") else {}
+
+    if user.get("exec") or user.get("auth-provider"):
+        raise KubeConfigError(f"上下文 {context} 使用 exec / auth-provider 认证插件，原生客户端不支持")
+
+    if cluster.get("insecure-skip-tls-verify"):
+        verify: Any = False
+    else:
+        verify = ssl.create_default_context()
+        if cluster.get("certificate-authority-data"):
+            verify.load_verify_locations(cadata=base64.b64decode(cluster["certificate-authority-data"]).decode("utf-8"))
+        elif cluster.get("certificate-authority"):
+            verify.load_verify_locations(cafile=resolve(cluster["certificate-authority"]))
+        _load_cert_chain(
+            verify,
+            resolve(user.get("client-certificate")),
+            resolve(user.get("client-key")),
+            user.get("client-certificate-data"),
+            user.get("client-key-data"),
+        )
+
+    basic_auth = (user["username"], user.get("password", "")) if user.get("username") else None
+    return KubeCredentials(
+        server=cluster["server"],
+        verify=verify,
+        token=user.get("token"),
+        token_file=resolve(user.get("tokenFile")),
+        basic_auth=basic_auth,
+        namespace=ctx_info.get("namespace") or "default",
+        context=context,
+    )
+
+
+def _load_in_cluster() -> KubeCredentials:
+    host = os.environ["KUBERNETES_SERVICE_HOST"]
+    port = os.environ.get("KUBERNETES_SERVICE_PORT", "443")
+    if ":" in host:
+        host = f"[{host}]"
+    verify = ssl.create_default_context(cafile=os.path.join(_SERVICE_ACCOUNT_DIR, "ca.crt"))
+    namespace_file = os.path.join(_SERVICE_ACCOUNT_DIR, "namespace")
+    namespace = "default"
+    if os.path.exists(namespace_file):
+        with open(namespace_file, "r", encoding="utf-8") as f:
+            namespace = f.read().strip() or "default"
+    return KubeCredentials(
+        server=f"https://{host}:{port}",
+        verify=verify,
+        token_file=os.path.join(_SERVICE_ACCOUNT_DIR, "token"),
+        namespace=namespace,
+        context="in-cluster",
+    )
+
+
+class ResourceType:
+    """资源类型：API 路径前缀、复数名称、是否命名空间级别"""
+
+    def __init__(self, api: str, plural: str, namespaced: bool, kind: str):
+        self.api = api
+        self.plural = plural
+        self.namespaced = namespaced
+        self.kind = kind
+
+    def path(self, namespace: Optional[str] = None, name: Optional[str] = None) -> str:
+        """资源的 REST 路径（namespace 为 None 时列出所有命名空间）"""
+        prefix = "/api/v1" if self.api == "v1" else f"/apis/{self.api}"
+        parts = [prefix]
+        if self.namespaced and namespace:
+            parts.append(f"namespaces/{namespace}")
+        parts.append(self.plural)
+        if name:
+            parts.append(name)
+        return "/".join(parts)
+
+
+# 原生支持的资源类型（其他类型请使用 MCP 工具）
+RESOURCE_TYPES: Dict[str, ResourceType] = {
+    rt.plural: rt for rt in (
+        ResourceType("v1", "pods", True, "Pod"),
+        ResourceType("v1", "services", True, "Service"),
+        ResourceType("v1", "endpoints", True, "Endpoints"),
+        ResourceType("v1", "events", True, "Event"),
+        ResourceType("v1", "configmaps", True, "ConfigMap"),
+        ResourceType("v1", "persistentvolumeclaims", True, "PersistentVolumeClaim"),
+        ResourceType("v1", "serviceaccounts", True, "ServiceAccount"),
+        ResourceType("v1", "nodes", False, "Node"),
+        ResourceType("v1", "namespaces", False, "Namespace"),
+        ResourceType("v1", "persistentvolumes", False, "PersistentVolume"),
+        ResourceType("apps/v1", "deployments", True, "Deployment"),
+        ResourceType("apps/v1", "replicasets", True, "ReplicaSet"),
+        ResourceType("apps/v1", "statefulsets", True, "StatefulSet"),
+        ResourceType("apps/v1", "daemonsets", True, "DaemonSet"),
+        ResourceType("batch/v1", "jobs", True, "Job"),
+        ResourceType("batch/v1", "cronjobs", True, "CronJob"),
+        ResourceType("networking.k8s.io/v1", "ingresses", True, "Ingress"),
+        ResourceType("autoscaling/v2", "horizontalpodautoscalers", True, "HorizontalPodAutoscaler"),
+    )
+}
+
+_RESOURCE_ALIASES = {
+    "po": "pods", "svc": "services", "ep": "endpoints", "ev": "events", "cm": "configmaps",
+    "pvc": "persistentvolumeclaims", "sa": "serviceaccounts", "no": "nodes", "ns": "namespaces",
+    "pv": "persistentvolumes", "deploy": "deployments", "rs": "replicasets", "sts": "statefulsets",
+    "ds": "daemonsets", "cj": "cronjobs", "ing": "ingresses", "hpa": "horizontalpodautoscalers",
+}
+
+
+def resolve_resource(resource_type: str) -> ResourceType:
+    """
+    解析资源类型（支持复数、单数、简写和 kind，如 pods / pod / po / Pod / deployments.apps）
+
+    Args:
+        resource_type: 资源类型
+
+    Returns:
+        ResourceType 实例
+    """
+    name = resource_type.strip().lower().split(".")[0]
+    name = _RESOURCE_ALIASES.get(name, name)
+    if name in RESOURCE_TYPES:
+        return RESOURCE_TYPES[name]
+    for rt in RESOURCE_TYPES.values():
+        if name == rt.kind.lower() or name + "s" == rt.plural or name + "es" == rt.plural:
+            return rt
+    raise ValueError(f"原生工具不支持资源类型 {resource_type}，请使用 MCP 工具")
+
+
+class KubernetesClient:
+    """apiserver 的异步只读客户端（httpx 连接池）"""
+
+    def __init__(
+        self,
+        credentials: KubeCredentials,
+        timeout: float = 30,
+        max_connections: int = 20,
+        max_log_bytes: int = 5 * 1024 * 1024,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """
+        初始化 Kubernetes 客户端
+
+        Args:
+            credentials: 连接信息
+            timeout: 请求超时（秒）
+            max_connections: 连接池最大连接数
+            max_log_bytes: 单次读取日志的最大字节数
+            transport: 自定义 httpx 传输层（测试时可传入 httpx.MockTransport）
+        """
+        self.credentials = credentials
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_log_bytes = max_log_bytes
+        self._transport = transport
+
+        # 连接池绑定在创建它的事件循环上，每个事件循环各用一个客户端
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    @property
+    def default_namespace(self) -> str:
+        """上下文的默认命名空间"""
+        return self.credentials.namespace
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                base_url=self.credentials.server,
+                verify=self.credentials.verify,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                transport=self._transport,
+            )
+            self._clients[loop] = client
+        return client
+
+    @staticmethod
+    def _raise_for_status(response: httpx.Response) -> None:
+        if response.status_code < 400:
+            return
+        try:
+            status = response.json()
+        except ValueError:
+            raise KubernetesAPIError(response.status_code, response.reason_phrase, response.text[:200])
+        raise KubernetesAPIError(response.status_code, status.get("reason", ""), status.get("message", response.text))
+
+    async def _request(self, path: str, params: Optional[Dict[str, Any]] = None) -> httpx.Response:
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        response = await self._client().get(path, params=params, headers=self.credentials.auth_headers())
+        self._raise_for_status(response)
+        return response
+
+    async def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> dict:
+        """GET 并解析 JSON"""
+        return (await self._request(path, params)).json()
+
+    async def list(
+        self,
+        resource: ResourceType,
+        namespace: Optional[str] = None,
+        label_selector: Optional[str] = None,
+        field_selector: Optional[str] = None,
+    ) -> dict:
+        """
+        列出资源
+
+        Args:
+            resource: 资源类型
+            namespace: 命名空间（None 表示所有命名空间）
+            label_selector: 标签选择器
+            field_selector: 字段选择器
+
+        Returns:
+            List 对象（items 中的每个对象补全 kind）
+        """
+        data = await self.get_json(
+            resource.path(namespace),
+            {"labelSelector": label_selector, "fieldSelector": field_selector},
+        )
+        for item in data.get("items", []):
+            item.setdefault("kind", resource.kind)
+        return data
+
+    async def get(self, resource: ResourceType, name: str, namespace: Optional[str] = None) -> dict:
+        """获取单个资源"""
+        return await self.get_json(resource.path(namespace or self.default_namespace, name))
+
+    async def events_for(self, kind: str, name: str, namespace: Optional[str]) -> List[dict]:
+        """获取某个对象相关的事件"""
+        selector = f"involvedObject.kind={kind},involvedObject.name={name}"
+        data = await self.list(RESOURCE_TYPES["events"], namespace, field_selector=selector)
+        return data.get("items", [])
+
+    async def logs(
+        self,
+        name: str,
+        namespace: str,
+        container: Optional[str] = None,
+        tail: Optional[int] = None,
+        since_seconds: Optional[int] = None,
+        previous: bool = False,
+        timestamps: bool = False,
+    ) -> str:
+        """读取 Pod 日志（最多 max_log_bytes 字节）"""
+        response = await self._request(
+            RESOURCE_TYPES["pods"].path(namespace, name) + "/log",
+            {
+                "container": container,
+                "tailLines": tail,
+                "sinceSeconds": since_seconds,
+                "previous": "true" if previous else None,
+                "timestamps": "true" if timestamps else None,
+                "limitBytes": self.max_log_bytes,
+            },
+        )
+        return response.text
+
+    async def watch(
+        self,
+        resource: ResourceType,
+        resource_version: str,
+        timeout_seconds: int = 300,
+        on_connected: Optional[Callable[[], None]] = None,
+    ) -> AsyncIterator[dict]:
+        """
+        监听所有命名空间中某类资源的变化（watch 长连接，服务端在 timeout_seconds 后结束）
+
+        Args:
+            resource: 资源类型
+            resource_version: 从该版本之后开始监听
+            timeout_seconds: 单次 watch 的时长（秒）
+            on_connected: 连接建立（收到响应头）后的回调
+
+        Yields:
+            watch 事件（{"type": ADDED / MODIFIED / DELETED / BOOKMARK / ERROR, "object": {...}}）
+        """
+        params = {
+            "watch": "true",
+            "resourceVersion": resource_version,
+            "allowWatchBookmarks": "true",
+            "timeoutSeconds": timeout_seconds,
+        }
+        async with self._client().stream(
+            "GET",
+            resource.path(),
+            params=params,
+            headers=self.credentials.auth_headers(),
+            timeout=httpx.Timeout(self.timeout, read=timeout_seconds + 30),
+        ) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                self._raise_for_status(response)
+            if on_connected is not None:
+                on_connected()
+            async for line in response.aiter_lines():
+                if line.strip():
+                    yield json.loads(line)
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环的连接池"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+def _age(timestamp: Optional[str]) -> Optional[str]:
+    """创建时间 -> kubectl 风格的 age（如 3d4h / 15m）"""
+    if not timestamp:
+        return None
+    created = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    seconds = int((datetime.now(timezone.utc) - created).total_seconds())
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size:
+            return f"{seconds // size}{unit}"
+    return f"{max(seconds, 0)}s"
+
+
+def _pod_status(pod: dict) -> str:
+    """Pod 的显示状态（与 kubectl 一致，优先显示容器的等待 / 终止原因）"""
+    status = pod.get("status") or {}
+    if pod.get("metadata", {}).get("deletionTimestamp"):
+        return "Terminating"
+    for container in status.get("containerStatuses") or []:
+        state = container.get("state") or {}
+        reason = (state.get("waiting") or state.get("terminated") or {}).get("reason")
+        if reason and reason != "Completed":
+            return reason
+    return status.get("reason") or status.get("phase") or "Unknown"
+
+
+def summarize_object(obj: dict) -> dict:
+    """
+    将资源对象精简为关键字段（类似 kubectl get 的列）
+
+    Args:
+        obj: 资源对象
+
+    Returns:
+        精简后的字典
+    """
+    metadata = obj.get("metadata") or {}
+    spec = obj.get("spec") or {}
+    status = obj.get("status") or {}
+    kind = obj.get("kind")
+    item = {"name": metadata.get("name")}
+    if metadata.get("namespace"):
+        item["namespace"] = metadata["namespace"]
+
+    if kind == "Pod":
+        containers = status.get("containerStatuses") or []
+        item.update({
+            "status": _pod_status(obj),
+            "ready": f"{sum(1 for c in containers if c.get('ready'))}/{len(spec.get('containers') or containers)}",
+            "restarts": sum(c.get("restartCount", 0) for c in containers),
+            "node": spec.get("nodeName"),
+            "ip": status.get("podIP"),
+        })
+    elif kind in ("Deployment", "StatefulSet", "ReplicaSet"):
+        item.update({
+            "ready": f"{status.get('readyReplicas', 0)}/{spec.get('replicas', 0)}",
+            "updated": status.get("updatedReplicas", 0),
+            "available": status.get("availableReplicas", 0),
+        })
+    elif kind == "DaemonSet":
+        item.update({
+            "desired": status.get("desiredNumberScheduled", 0),
+            "ready": status.get("numberReady", 0),
+            "unavailable": status.get("numberUnavailable", 0),
+        })
+    elif kind == "Node":
+        conditions = {c.get("type"): c.get("status") for c in status.get("conditions") or []}
+        labels = metadata.get("labels") or {}
+        item.update({
+            "status": "Ready" if conditions.get("Ready") == "True" else "NotReady",
+            "roles": [k.split("/", 1)[1] for k in labels if k.startswith("node-role.kubernetes.io/")],
+            "version": (status.get("nodeInfo") or {}).get("kubeletVersion"),
+            "pressure": [t for t, s in conditions.items() if t != "Ready" and s == "True"],
+            "unschedulable": spec.get("unschedulable", False),
+        })
+    elif kind == "Service":
+        item.update({
+            "type": spec.get("type"),
+            "clusterIP": spec.get("clusterIP"),
+            "ports": [f"{p.get('port')}/{p.get('protocol', 'TCP')}" for p in spec.get("ports") or []],
+        })
+    elif kind == "Job":
+        item.update({
+            "completions": f"{status.get('succeeded', 0)}/{spec.get('completions', 1)}",
+            "failed": status.get("failed", 0),
+        })
+    elif kind == "Event":
+        involved = obj.get("involvedObject") or {}
+        item.update({
+            "type": obj.get("type"),
+            "reason": obj.get("reason"),
+            "object": f"{involved.get('kind')}/{involved.get('name')}",
+            "count": obj.get("count", 1),
+            "message": obj.get("message"),
+        })
+    elif "phase" in status:
+        item["status"] = status["phase"]
+
+    item["age"] = _age(metadata.get("creationTimestamp"))
+    return item
+
+
+def strip_noise(obj: dict) -> dict:
+    """去掉 managedFields 和 last-applied-configuration 注解（体积大且对诊断无用）"""
+    metadata = obj.get("metadata") or {}
+    metadata.pop("managedFields", None)
+    annotations = metadata.get("annotations") or {}
+    annotations.pop("kubectl.kubernetes.io/last-applied-configuration", None)
+    return obj
+
+
+def _format_events(events: List[dict]) -> List[str]:
+    """事件按最后发生时间排序并格式化为紧凑的文本行"""
+    def last_time(event: dict) -> str:
+        return event.get("lastTimestamp") or event.get("eventTime") or (event.get("metadata") or {}).get("creationTimestamp") or ""
+
+    lines = []
+    for event in sorted(events, key=last_time):
+        involved = event.get("involvedObject") or {}
+        lines.append(
+            f"{last_time(event)}  {event.get('type', '')}  {event.get('reason', '')}  "
+            f"{involved.get('kind')}/{involved.get('name')}  x{event.get('count', 1)}  {event.get('message', '')}".rstrip()
+        )
+    return lines
+
+
+# 全局 Kubernetes 客户端实例
+_kubernetes_client: Optional[KubernetesClient] = None
+
+
+def get_kubernetes_client(kubeconfig: Optional[str] = None, context: Optional[str] = None) -> KubernetesClient:
+    """
+    获取 Kubernetes 原生客户端（单例模式，参数从 config.yaml 的 model.mcp.kubernetes 段读取）
+
+    Args:
+        kubeconfig: kubeconfig 文件路径（可选）
+        context: 上下文名称（可选）
+
+    Returns:
+        KubernetesClient 实例
+    """
+    global _kubernetes_client
+
+    if _kubernetes_client is not None and kubeconfig is None and context is None:
+        return _kubernetes_client
+
+    config = get_config()
+    kubeconfig = kubeconfig or config.get('model.mcp.kubernetes.kubeconfig')
+    context = context or config.get('model.mcp.kubernetes.context')
+    credentials = load_kubeconfig(kubeconfig, context)
+    if (_kubernetes_client is None or
+        _kubernetes_client.credentials.server != credentials.server or
+        _kubernetes_client.credentials.context != credentials.context):
+        _kubernetes_client = KubernetesClient(
+            credentials,
+            timeout=float(config.get('model.mcp.kubernetes.native.timeout', 30)),
+            max_connections=int(config.get('model.mcp.kubernetes.native.max_connections', 20)),
+            max_log_bytes=int(config.get('model.mcp.kubernetes.native.max_log_bytes', 5 * 1024 * 1024)),
+        )
+    return _kubernetes_client
+
+
+def _from_cache(
+    client: KubernetesClient,
+    resource: ResourceType,
+    namespace: Optional[str] = None,
+    name: Optional[str] = None,
+    label_selector: Optional[str] = None,
+    field_selector: Optional[str] = None,
+) -> Optional[Tuple[List[dict], float]]:
+    """
+    尝试从集群缓存（informer）回答查询
+
+    Returns:
+        (对象列表, 缓存落后秒数)；未启用缓存或缓存无法回答时返回 None
+    """
+    from app.core.cluster_cache import get_cluster_cache
+
+    cache = get_cluster_cache(client)
+    if cache is None:
+        return None
+    cache.ensure_started()
+    return cache.query(resource, namespace, name, label_selector, field_selector)
+
+
+def _cache_note(staleness: float) -> str:
+    return "（数据来自本地集群缓存，实时同步中）" if staleness == 0 else f"（数据来自本地集群缓存，watch 已断开 {staleness:.0f} 秒）"
+
+
+@tool
+async def kubectl_get(
+    resourceType: str,
+    name: Optional[str] = None,
+    namespace: Optional[str] = None,
+    output: str = "summary",
+    allNamespaces: bool = False,
+    labelSelector: Optional[str] = None,
+    fieldSelector: Optional[str] = None,
+) -> str:
+    """
+    获取或列出 Kubernetes 资源（pods、deployments、services、nodes、events 等）
+    参数:
+    - resourceType: 资源类型，例如 pods、deployments、nodes、events（支持 po / deploy / svc 等简写）
+    - name: 资源名称（可选，不填则列出该类型的所有资源）
+    - namespace: 命名空间（可选，默认使用当前上下文的命名空间）
+    - output: summary（关键字段，默认）、json（完整对象）、yaml 或 name
+    - allNamespaces: 是否列出所有命名空间的资源
+    - labelSelector: 标签选择器，例如 app=nginx
+    - fieldSelector: 字段选择器，例如 status.phase=Running
+    返回:
+    - 资源信息
+    """
+    try:
+        client = get_kubernetes_client()
+        resource = resolve_resource(resourceType)
+        namespace = None if allNamespaces else (namespace or client.default_namespace)
+        cached = _from_cache(client, resource, namespace, name, labelSelector, fieldSelector)
+        if cached is not None:
+            items, staleness = cached
+            if name and not items:
+                return f'获取资源失败: 404 NotFound: {resource.plural} "{name}" not found'
+            data = items[0] if name else {"kind": f"{resource.kind}List", "items": items}
+        elif name:
+            data = strip_noise(await client.get(resource, name, namespace))
+            data.setdefault("kind", resource.kind)
+            items = [data]
+        else:
+            data = await client.list(resource, namespace, labelSelector, fieldSelector)
+            items = [strip_noise(item) for item in data.get("items", [])]
+
+        if output == "name":
+            return "\n".join(f"{resource.plural}/{item['metadata']['name']}" for item in items)
+        if output == "json":
+            return json.dumps(data, ensure_ascii=False)
+        if output == "yaml":
+            return yaml.safe_dump(data, allow_unicode=True, sort_keys=False)
+        summary = [summarize_object(item) for item in items]
+        result = summary[0] if name else {"kind": resource.kind, "count": len(summary), "items": summary}
+        if cached is not None:
+            result["cache_staleness_seconds"] = round(cached[1], 1)
+        return json.dumps(result, ensure_ascii=False)
+    except Exception as e:
+        return f"获取资源失败: {e}"
+
+
+@tool
+async def kubectl_describe(resourceType: str, name: str, namespace: Optional[str] = None) -> str:
+    """
+    查看 Kubernetes 资源的详细信息和相关事件（类似 kubectl describe）
+    参数:
+    - resourceType: 资源类型，例如 pod、deployment、node
+    - name: 资源名称
+    - namespace: 命名空间（可选，默认使用当前上下文的命名空间）
+    返回:
+    - 资源详情（YAML）和相关事件
+    """
+    try:
+        client = get_kubernetes_client()
+        resource = resolve_resource(resourceType)
+        namespace = (namespace or client.default_namespace) if resource.namespaced else None
+        cached_obj = _from_cache(client, resource, namespace, name)
+        cached_events = _from_cache(
+            client, RESOURCE_TYPES["events"], namespace,
+            field_selector=f"involvedObject.kind={resource.kind},involvedObject.name={name}",
+        )
+        if cached_obj is not None and not cached_obj[0]:
+            return f'查看资源详情失败: 404 NotFound: {resource.plural} "{name}" not found'
+        from_cache = cached_obj is not None and cached_events is not None
+        if from_cache:
+            obj, events = cached_obj[0][0], cached_events[0]
+        else:
+            obj, events = await asyncio.gather(
+                client.get(resource, name, namespace),
+                client.events_for(resource.kind, name, namespace),
+            )
+        text = yaml.safe_dump(strip_noise(obj), allow_unicode=True, sort_keys=False)
+        event_lines = _format_events(events)
+        text += "\nEvents:\n" + ("\n".join(event_lines) if event_lines else "  <none>")
+        return text + ("\n" + _cache_note(max(cached_obj[1], cached_events[1])) if from_cache else "")
+    except Exception as e:
+        return f"查看资源详情失败: {e}"
+
+
+@tool
+async def kubectl_logs(
+    resourceType: str,
+    name: str,
+    namespace: Optional[str] = None,
+    container: Optional[str] = None,
+    tail: Optional[int] = None,
+    since: Optional[str] = None,
+    previous: bool = False,
+    timestamps: bool = False,
+) -> str:
+    """
+    查看 Pod 日志；resourceType 为 deployment / statefulset / daemonset / job 时读取其所有 Pod 的日志
+    参数:
+    - resourceType: pod、deployment、statefulset、daemonset 或 job
+    - name: 资源名称
+    - namespace: 命名空间（可选，默认使用当前上下文的命名空间）
+    - container: 容器名称（多容器 Pod 时指定）
+    - tail: 只返回最后 N 行
+    - since: 只返回最近一段时间的日志，例如 10m、1h
+    - previous: 是否查看上一次（崩溃前）容器的日志
+    - timestamps: 是否在每行前加时间戳
+    返回:
+    - 日志内容
+    """
+    from app.tools.prometheus import parse_duration
+
+    try:
+        client = get_kubernetes_client()
+        resource = resolve_resource(resourceType)
+        namespace = namespace or client.default_namespace
+        options = {
+            "container": container,
+            "tail": tail,
+            "since_seconds": int(parse_duration(since)) if since else None,
+            "previous": previous,
+            "timestamps": timestamps,
+        }
+        if resource.plural == "pods":
+            return await client.logs(name, namespace, **options)
+
+        # 工作负载：按 selector 找到 Pod，依次读取日志
+        workload = await client.get(resource, name, namespace)
+        match_labels = ((workload.get("spec") or {}).get("selector") or {}).get("matchLabels") or {}
+        if not match_labels:
+            return f"{resource.kind}/{name} 没有 matchLabels 选择器，无法定位 Pod"
+        selector = ",".join(f"{k}={v}" for k, v in match_labels.items())
+        pods = (await client.list(RESOURCE_TYPES["pods"], namespace, label_selector=selector)).get("items", [])
+        pod_names = [p["metadata"]["name"] for p in pods]
+        logs = await asyncio.gather(*(client.logs(p, namespace, **options) for p in pod_names), return_exceptions=True)
+        return "\n".join(
+            f"==> {pod} <==\n{log if not isinstance(log, Exception) else f'读取日志失败: {log}'}"
+            for pod, log in zip(pod_names, logs)
+        ) or f"{resource.kind}/{name} 没有匹配的 Pod"
+    except Exception as e:
+        return f"获取日志失败: {e}"
+
+
+@tool
+async def kubectl_events(
+    namespace: Optional[str] = None,
+    allNamespaces: bool = False,
+    involvedObjectKind: Optional[str] = None,
+    involvedObjectName: Optional[str] = None,
+    type: Optional[str] = None,
+) -> str:
+    """
+    查看 Kubernetes 事件（按最后发生时间排序）
+    参数:
+    - namespace: 命名空间（可选，默认使用当前上下文的命名空间）
+    - allNamespaces: 是否查看所有命名空间的事件
+    - involvedObjectKind: 只看某类对象的事件，例如 Pod、Node
+    - involvedObjectName: 只看某个对象的事件
+    - type: 事件类型，Normal 或 Warning
+    返回:
+    - 事件列表（时间 类型 原因 对象 次数 消息）
+    """
+    try:
+        client = get_kubernetes_client()
+        namespace = None if allNamespaces else (namespace or client.default_namespace)
+        selectors = []
+        if involvedObjectKind:
+            selectors.append(f"involvedObject.kind={involvedObjectKind}")
+        if involvedObjectName:
+            selectors.append(f"involvedObject.name={involvedObjectName}")
+        if type:
+            selectors.append(f"type={type}")
+        field_selector = ",".join(selectors) or None
+        cached = _from_cache(client, RESOURCE_TYPES["events"], namespace, field_selector=field_selector)
+        if cached is not None:
+            events = cached[0]
+        else:
+            events = (await client.list(RESOURCE_TYPES["events"], namespace, field_selector=field_selector)).get("items", [])
+        lines = _format_events(events)
+        text = "\n".join(lines) if lines else "没有匹配的事件"
+        return text + ("\n" + _cache_note(cached[1]) if cached is not None else "")
+    except Exception as e:
+        return f"获取事件失败: {e}"
+
+
+def get_kubernetes_native_tools(kubeconfig: Optional[str] = None, context: Optional[str] = None) -> List[BaseTool]:
+    """
+    获取 Kubernetes 原生只读工具列表
+
+    Args:
+        kubeconfig: kubeconfig 文件路径（可选）
+        context: 上下文名称（可选）
+
+    Returns:
+        工具列表（kubeconfig 无法使用时抛出 KubeConfigError）
+    """
+    client = get_kubernetes_client(kubeconfig, context)
+    print(f"✅ Kubernetes 原生工具已连接 {client.credentials.server} (context: {client.credentials.context})")
+    return [kubectl_get, kubectl_describe, kubectl_logs, kubectl_events]
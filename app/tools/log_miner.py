@@ -0,0 +1,322 @@
+"""
+日志模板挖掘
+"查看 Pod 日志"会把整段日志（可能有几 MB）放进模型上下文。这里用 Drain 算法（固定深度的解析树）
+逐行增量地把日志归并为模板，只把模板、出现次数、首次 / 最后出现时间和少量样例交给模型
+
+Drain 的做法：
+- 先用正则把 IP、UUID、十六进制、数字等变量替换为 <*>
+- 按 token 数量 -> 前几个 token 逐层下钻到叶子节点，叶子中保存若干日志簇
+- 在叶子中找与当前行相似度（相同 token 比例）最高的簇，超过阈值则合并（不同位置变为 <*>），否则新建簇
+"""
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from config.config_loader import get_config
+
+
+WILDCARD = "<*>"
+
+# 行首时间戳：RFC3339（kubectl logs --timestamps）、"2024-01-01 12:00:00,123"、klog 格式（I0101 12:00:00.123456）
+_TIMESTAMP_RE = re.compile(
+    r"^\s*(?P<ts>"
+    r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?"
+    r"|[IWEF]\d{4} \d{2}:\d{2}:\d{2}\.\d+"
+    r")\s*"
+)
+
+# 变量掩码（按顺序替换）
+_MASKS = (
+    re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"),
+    re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b"),
+    re.compile(r"\b0x[0-9a-fA-F]+\b"),
+    re.compile(r"\b[0-9a-fA-F]{16,}\b"),
+    re.compile(r"(?<![A-Za-z])[-+]?\d+(?:\.\d+)?(?:ms|s|m|h|Mi|Gi|Ki|KB|MB|GB|%)?(?![A-Za-z])"),
+)
+
+# 日志级别关键字：包含这些关键字的模板在摘要中优先展示
+_ERROR_RE = re.compile(r"\b(error|err|fatal|panic|exception|fail(?:ed|ure)?|oom\w*|timeout|refused|denied|traceback)\b", re.IGNORECASE)
+
+
+def split_timestamp(line: str) -> Tuple[Optional[str], str]:
+    """
+    拆分行首时间戳
+
+    Args:
+        line: 日志行
+
+    Returns:
+        (时间戳，没有时为 None, 剩余内容)
+    """
+    match = _TIMESTAMP_RE.match(line)
+    if not match:
+        return None, line
+    return match.group("ts"), line[match.end():]
+
+
+def mask_variables(content: str) -> str:
+    """将 IP、UUID、十六进制、数字等变量替换为 <*>"""
+    for pattern in _MASKS:
+        content = pattern.sub(WILDCARD, content)
+    return content
+
+
+class LogCluster:
+    """一个日志模板（Drain 的日志簇）"""
+
+    def __init__(self, tokens: List[str], line: str, timestamp: Optional[str], max_samples: int):
+        self.tokens = tokens
+        self.count = 1
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.samples = [line]
+        self._max_samples = max_samples
+
+    @property
+    def template(self) -> str:
+        """模板文本"""
+        return " ".join(self.tokens)
+
+    def similarity(self, tokens: List[str]) -> Tuple[float, int]:
+        """
+        与一行 token 的相似度
+
+        Returns:
+            (相同 token 比例, 模板中的通配符数量)
+        """
+        same = wildcards = 0
+        for a, b in zip(self.tokens, tokens):
+            if a == WILDCARD:
+                wildcards += 1
+            elif a == b:
+                same += 1
+        return same / len(tokens), wildcards
+
+    def add(self, tokens: List[str], line: str, timestamp: Optional[str]) -> None:
+        """合并一行日志：不同位置变为通配符"""
+        self.tokens = [a if a == b else WILDCARD for a, b in zip(self.tokens, tokens)]
+        self.count += 1
+        if timestamp is not None:
+            self.first_seen = self.first_seen or timestamp
+            self.last_seen = timestamp
+        if len(self.samples) < self._max_samples and line not in self.samples:
+            self.samples.append(line)
+
+    def to_dict(self) -> dict:
+        """转换为可 JSON 序列化的字典"""
+        return {
+            "template": self.template,
+            "count": self.count,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "samples": self.samples,
+        }
+
+
+class LogTemplateMiner:
+    """Drain 风格的流式日志模板挖掘器"""
+
+    def __init__(
+        self,
+        depth: int = 4,
+        similarity_threshold: float = 0.4,
+        max_children: int = 100,
+        max_clusters: int = 1000,
+        max_samples: int = 2,
+        max_line_length: int = 2000,
+    ):
+        """
+        初始化日志模板挖掘器
+
+        Args:
+            depth: 解析树深度（含长度层，至少 3；depth - 2 个前缀 token 参与分层）
+            similarity_threshold: 合并到已有模板的最小相似度
+            max_children: 每个内部节点的最大子节点数，超出后归入通配符分支
+            max_clusters: 模板数量上限，超出后新行归入 "其他" 计数
+            max_samples: 每个模板保留的样例行数
+            max_line_length: 样例行的最大长度（超出截断）
+        """
+        self.depth = max(depth, 3)
+        self.similarity_threshold = similarity_threshold
+        self.max_children = max_children
+        self.max_clusters = max_clusters
+        self.max_samples = max_samples
+        self.max_line_length = max_line_length
+
+        # 解析树：{token 数量: {前缀 token: ... {前缀 token: [LogCluster]}}}
+        self._root: Dict[int, dict] = {}
+        self.clusters: List[LogCluster] = []
+        self.lines = 0
+        self.overflow = 0
+
+    def _leaf(self, tokens: List[str]) -> list:
+        node = self._root.setdefault(len(tokens), {})
+        prefix = tokens[: self.depth - 2]
+        for i, token in enumerate(prefix):
+            if any(c.isdigit() for c in token):
+                token = WILDCARD
+            if token not in node and len(node) >= self.max_children:
+                token = WILDCARD
+            last = i == len(prefix) - 1
+            node = node.setdefault(token, [] if last else {})
+        if not prefix:
+            node = node.setdefault("", [])
+        return node
+
+    def add(self, line: str) -> Optional[LogCluster]:
+        """
+        处理一行日志
+
+        Args:
+            line: 日志行
+
+        Returns:
+            该行所属的模板（空行或模板数量已满时返回 None）
+        """
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            return None
+        self.lines += 1
+
+        timestamp, content = split_timestamp(line)
+        tokens = mask_variables(content).split()
+        if not tokens:
+            return None
+        sample = line if len(line) <= self.max_line_length else line[: self.max_line_length] + "..."
+
+        leaf = self._leaf(tokens)
+        best, best_key = None, (-1.0, -1)
+        for cluster in leaf:
+            key = cluster.similarity(tokens)
+            if key > best_key:
+                best, best_key = cluster, key
+
+        if best is not None and best_key[0] >= self.similarity_threshold:
+            best.add(tokens, sample, timestamp)
+            return best
+
+        if len(self.clusters) >= self.max_clusters:
+            self.overflow += 1
+            return None
+        cluster = LogCluster(tokens, sample, timestamp, self.max_samples)
+        leaf.append(cluster)
+        self.clusters.append(cluster)
+        return cluster
+
+    def add_lines(self, lines: Iterable[str]) -> "LogTemplateMiner":
+        """逐行处理日志（可以是生成器，不需要一次性读入全部内容）"""
+        for line in lines:
+            self.add(line)
+        return self
+
+    def top_templates(self, limit: int = 50) -> List[LogCluster]:
+        """
+        按重要程度排序的模板：包含错误关键字的模板优先，其次按出现次数
+
+        Args:
+            limit: 返回的模板数量
+
+        Returns:
+            模板列表
+        """
+        return sorted(
+            self.clusters,
+            key=lambda c: (not _ERROR_RE.search(c.template), -c.count),
+        )[:limit]
+
+    def summary(self, limit: int = 50) -> str:
+        """
+        生成给模型看的紧凑文本摘要
+
+        Args:
+            limit: 最多展示的模板数量
+
+        Returns:
+            摘要文本
+        """
+        shown = self.top_templates(limit)
+        header = f"日志共 {self.lines} 行，归并为 {len(self.clusters)} 个模板"
+        if len(shown) < len(self.clusters):
+            header += f"（展示 {len(shown)} 个：错误相关优先，其余按次数）"
+        if self.overflow:
+            header += f"，另有 {self.overflow} 行超出模板数量上限未归类"
+        parts = [header + "：", ""]
+        for cluster in shown:
+            span = ""
+            if cluster.first_seen:
+                span = f" {cluster.first_seen}" if cluster.first_seen == cluster.last_seen else f" {cluster.first_seen} ~ {cluster.last_seen}"
+            parts.append(f"[x{cluster.count}]{span} {cluster.template}")
+            if WILDCARD in cluster.template:
+                parts.extend(f"    例: {sample}" for sample in cluster.samples)
+        return "\n".join(parts)
+
+
+def _log_text(output: str) -> Tuple[str, Optional[dict]]:
+    """
+    取出工具输出中的日志文本（兼容纯文本和 {"logs": "..."} 形式的 JSON）
+
+    Returns:
+        (日志文本, JSON 外层对象，纯文本时为 None)
+    """
+    try:
+        data = json.loads(output)
+    except ValueError:
+        return output, None
+    if isinstance(data, dict) and isinstance(data.get("logs"), str):
+        return data["logs"], data
+    return output, None
+
+
+def mine_log_output(
+    output: Any,
+    min_lines: int = 100,
+    max_templates: int = 50,
+    **miner_options: Any,
+) -> Any:
+    """
+    工具输出后处理：日志行数超过 min_lines 时替换为模板摘要
+
+    Args:
+        output: 工具输出（日志文本）
+        min_lines: 触发模板挖掘的最小行数，较短的日志原样返回
+        max_templates: 摘要中最多展示的模板数量
+        miner_options: LogTemplateMiner 的其他参数
+
+    Returns:
+        模板摘要；不是文本或行数较少时原样返回
+    """
+    if not isinstance(output, str):
+        return output
+    text, envelope = _log_text(output)
+    if text.count("\n") + 1 < min_lines:
+        return output
+
+    miner = LogTemplateMiner(**miner_options).add_lines(text.splitlines())
+    summary = miner.summary(max_templates)
+    if envelope is None:
+        return summary
+    return json.dumps({**envelope, "logs": summary}, ensure_ascii=False)
+
+
+def get_log_miner():
+    """
+    获取按 config.yaml 的 model.mcp.kubernetes.log_mining 段配置的后处理函数
+
+    Returns:
+        (后处理函数, 应用的工具名称列表)；未启用时返回 (None, [])
+    """
+    config = get_config()
+    if not config.get('model.mcp.kubernetes.log_mining.enabled', True):
+        return None, []
+    tools = list(config.get('model.mcp.kubernetes.log_mining.tools', ["kubectl_logs"]) or [])
+    min_lines = int(config.get('model.mcp.kubernetes.log_mining.min_lines', 100))
+    max_templates = int(config.get('model.mcp.kubernetes.log_mining.max_templates', 50))
+    options = {
+        "depth": int(config.get('model.mcp.kubernetes.log_mining.depth', 4)),
+        "similarity_threshold": float(config.get('model.mcp.kubernetes.log_mining.similarity_threshold', 0.4)),
+        "max_samples": int(config.get('model.mcp.kubernetes.log_mining.max_samples', 2)),
+    }
+
+    def mine(output: Any) -> Any:
+        return mine_log_output(output, min_lines=min_lines, max_templates=max_templates, **options)
+
+    return mine, tools
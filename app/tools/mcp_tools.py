@@ -3,10 +3,125 @@ MCP 工具集成模块
 用于将各种 MCP 服务器的工具集成到 Agent 中
 """
 import asyncio
-from typing import List
-from langchain_core.tools import BaseTool
+import functools
+from typing import Any, Callable, Dict, List
+from langchain_core.tools import BaseTool, StructuredTool
 from app.tools.base import tools_usage
 from app.core.mcp_servers.kubernetes_mcp import get_kubernetes_mcp_tools
+from app.tools.kubernetes_native import get_kubernetes_native_tools
+from app.core.cluster_snapshots import get_snapshot_tools
+from app.tools.prometheus import get_prometheus_tools
+from app.tools.metric_summary import get_metric_summarizer
+from app.tools.log_miner import get_log_miner
+from app.utils.singleflight import SingleFlight, make_key
+from config.config_loader import get_config
+
+
+# 默认启用 single-flight 的只读 Kubernetes 工具（相同工具 + 相同参数的并发调用只执行一次）
+DEFAULT_SINGLEFLIGHT_TOOLS = (
+    "kubectl_get",
+    "kubectl_describe",
+    "kubectl_logs",
+    "kubectl_events",
+    "list_api_resources",
+    "explain_resource",
+)
+
+# Kubernetes 工具后端：mcp（npx mcp-server-kubernetes）、native（进程内直连 apiserver 的只读工具）、
+# hybrid（原生只读工具 + 其余 MCP 工具）
+KUBERNETES_BACKENDS = ("mcp", "native", "hybrid")
+
+_tool_flight = SingleFlight("mcp_tools")
+
+
+def with_singleflight(tool: BaseTool, flight: SingleFlight = _tool_flight) -> BaseTool:
+    """
+    为只读工具加上 single-flight 合并（仅对有 coroutine 的 StructuredTool 生效）
+    
+    Args:
+        tool: 原始工具
+        flight: single-flight 合并器
+    
+    Returns:
+        包装后的工具（name / description / args_schema 不变）
+    """
+    if not isinstance(tool, StructuredTool) or tool.coroutine is None:
+        return tool
+    
+    coroutine = tool.coroutine
+    
+    # 保留原 coroutine 的签名和注解：ToolNode 按签名中的 runtime 参数决定是否注入运行时（MCP 工具需要）
+    @functools.wraps(coroutine)
+    async def call(*args, **kwargs):
+        # runtime / callbacks 等注入参数不参与合并键
+        arguments = {k: v for k, v in kwargs.items() if k not in ("runtime", "callbacks", "config")}
+        key = make_key(tool.name, args, arguments)
+        return await flight.do(key, lambda: coroutine(*args, **kwargs))
+    
+    return tool.model_copy(update={"coroutine": call})
+
+
+def _output_text(content: Any) -> Any:
+    """MCP 工具返回的内容块列表拼接为文本，其他类型原样返回"""
+    if isinstance(content, list):
+        return "".join(
+            block.get("text", "") if isinstance(block, dict) else str(block)
+            for block in content
+        )
+    return content
+
+
+def with_postprocessor(tool: BaseTool, processor: Callable[[Any], Any]) -> BaseTool:
+    """
+    为工具加上输出后处理（如指标摘要），在结果进入模型上下文之前压缩内容
+    
+    Args:
+        tool: 原始工具
+        processor: 后处理函数，输入工具输出文本，返回处理后的输出
+    
+    Returns:
+        包装后的工具（name / description / args_schema 不变）
+    """
+    if not isinstance(tool, StructuredTool) or tool.coroutine is None:
+        return tool
+    
+    coroutine = tool.coroutine
+    
+    @functools.wraps(coroutine)
+    async def call(*args, **kwargs):
+        output = await coroutine(*args, **kwargs)
+        # response_format="content_and_artifact" 的 MCP 工具返回 (内容, artifact)
+        if tool.response_format == "content_and_artifact" and isinstance(output, tuple):
+            content, artifact = output
+            return processor(_output_text(content)), artifact
+        return processor(output)
+    
+    return tool.model_copy(update={"coroutine": call})
+
+
+def get_tool_postprocessors() -> Dict[str, Callable[[Any], Any]]:
+    """
+    按配置获取各工具的输出后处理函数
+    
+    Returns:
+        工具名称 -> 后处理函数
+    """
+    processors = {}
+    metric_summarizer = get_metric_summarizer()
+    if metric_summarizer is not None:
+        processors["prometheus_query_range"] = metric_summarizer
+    log_miner, log_tools = get_log_miner()
+    if log_miner is not None:
+        processors.update({name: log_miner for name in log_tools})
+    return processors
+
+
+def apply_postprocessors(tools: List[BaseTool], processors: Dict[str, Callable[[Any], Any]]) -> List[BaseTool]:
+    """为配置了后处理函数的工具加上后处理"""
+    return [
+        with_postprocessor(t, processors[t.name]) if t.name in processors else t
+        for t in tools
+    ]
 
 
 async def get_all_tools(
@@ -14,6 +129,10 @@ async def get_all_tools(
     kubernetes_non_destructive: bool = False,
     kubernetes_kubeconfig: str = None,
     kubernetes_context: str = None,
+    include_prometheus: bool = False,
+    prometheus_url: str = None,
+    prometheus_token: str = None,
+    kubernetes_backend: str = "mcp",
 ) -> List[BaseTool]:
     """
     获取所有工具（本地工具 + MCP 工具）
@@ -23,28 +142,69 @@ async def get_all_tools(
         kubernetes_non_destructive: Kubernetes 是否使用非破坏性模式
         kubernetes_kubeconfig: Kubernetes kubeconfig 文件路径（可选）
         kubernetes_context: Kubernetes 上下文名称（可选）
+        include_prometheus: 是否包含 Prometheus 查询工具（进程内直接调用 HTTP API）
+        prometheus_url: Prometheus 服务地址（可选，默认读取配置）
+        prometheus_token: Prometheus 认证 Token（可选）
+        kubernetes_backend: Kubernetes 工具后端（mcp / native / hybrid）
     
     Returns:
         List[BaseTool]: 所有工具的列表
     """
+    if kubernetes_backend not in KUBERNETES_BACKENDS:
+        raise ValueError(f"kubernetes_backend 必须是 {KUBERNETES_BACKENDS} 之一: {kubernetes_backend}")
+    
     all_tools = list(tools_usage)  # 本地工具
+    postprocessors = get_tool_postprocessors()
     
-    # 添加 Kubernetes MCP 工具
+    # 添加 Kubernetes 工具
     if include_kubernetes:
-        try:
-            k8s_tools = await get_kubernetes_mcp_tools(
-                non_destructive=kubernetes_non_destructive,
-                kubeconfig=kubernetes_kubeconfig,
-                context=kubernetes_context
-            )
-            all_tools.extend(k8s_tools)
-            print(f"✅ 总共加载了 {len(all_tools)} 个工具（{len(tools_usage)} 个本地 + {len(k8s_tools)} 个 Kubernetes MCP）")
-        except Exception as e:
-            print(f"⚠️  加载 Kubernetes MCP 工具失败: {e}")
-            print("   请确保：")
-            print("   1. 已安装 Node.js 和 npx")
-            print("   2. 已配置 kubectl 和 kubeconfig")
-            print("   3. 网络可以访问 npm registry")
+        native_tools = []
+        if kubernetes_backend in ("native", "hybrid"):
+            try:
+                native_tools = get_kubernetes_native_tools(kubeconfig=kubernetes_kubeconfig, context=kubernetes_context)
+                native_tools += get_snapshot_tools()
+            except Exception as e:
+                print(f"⚠️  加载 Kubernetes 原生工具失败，{'改用 MCP 工具' if kubernetes_backend == 'hybrid' else '不加载 Kubernetes 工具'}: {e}")
+        
+        mcp_tools = []
+        if kubernetes_backend in ("mcp", "hybrid"):
+            try:
+                mcp_tools = await get_kubernetes_mcp_tools(
+                    non_destructive=kubernetes_non_destructive,
+                    kubeconfig=kubernetes_kubeconfig,
+                    context=kubernetes_context
+                )
+            except Exception as e:
+                print(f"⚠️  加载 Kubernetes MCP 工具失败: {e}")
+                print("   请确保：")
+                print("   1. 已安装 Node.js 和 npx")
+                print("   2. 已配置 kubectl 和 kubeconfig")
+                print("   3. 网络可以访问 npm registry")
+        
+        # 同名工具优先使用原生实现，其余长尾操作由 MCP 提供
+        native_names = {t.name for t in native_tools}
+        k8s_tools = native_tools + [t for t in mcp_tools if t.name not in native_names]
+        
+        # 先后处理再合并，合并的并发调用共享处理后的结果
+        k8s_tools = apply_postprocessors(k8s_tools, postprocessors)
+        singleflight_tools = set(
+            get_config().get('model.mcp.kubernetes.singleflight_tools', DEFAULT_SINGLEFLIGHT_TOOLS) or ()
+        )
+        k8s_tools = [
+            with_singleflight(t) if t.name in singleflight_tools else t
+            for t in k8s_tools
+        ]
+        all_tools.extend(k8s_tools)
+        if k8s_tools:
+            print(f"✅ 总共加载了 {len(all_tools)} 个工具（{len(tools_usage)} 个本地 + "
+                  f"{len(native_tools)} 个 Kubernetes 原生 + {len(k8s_tools) - len(native_tools)} 个 Kubernetes MCP）")
+    
+    # 添加 Prometheus 查询工具
+    if include_prometheus:
+        prometheus_tools = get_prometheus_tools(url=prometheus_url, token=prometheus_token)
+        prometheus_tools = apply_postprocessors(prometheus_tools, postprocessors)
+        all_tools.extend(prometheus_tools)
+        print(f"✅ 已加载 {len(prometheus_tools)} 个 Prometheus 工具")
     
     return all_tools
 
@@ -54,6 +214,10 @@ def get_all_tools_sync(
     kubernetes_non_destructive: bool = False,
     kubernetes_kubeconfig: str = None,
     kubernetes_context: str = None,
+    include_prometheus: bool = False,
+    prometheus_url: str = None,
+    prometheus_token: str = None,
+    kubernetes_backend: str = "mcp",
 ) -> List[BaseTool]:
     """
     同步版本：获取所有工具（本地工具 + MCP 工具）
@@ -63,6 +227,10 @@ def get_all_tools_sync(
         kubernetes_non_destructive: Kubernetes 是否使用非破坏性模式
         kubernetes_kubeconfig: Kubernetes kubeconfig 文件路径（可选）
         kubernetes_context: Kubernetes 上下文名称（可选）
+        include_prometheus: 是否包含 Prometheus 查询工具（进程内直接调用 HTTP API）
+        prometheus_url: Prometheus 服务地址（可选，默认读取配置）
+        prometheus_token: Prometheus 认证 Token（可选）
+        kubernetes_backend: Kubernetes 工具后端（mcp / native / hybrid）
     
     Returns:
         List[BaseTool]: 所有工具的列表
@@ -71,6 +239,10 @@ def get_all_tools_sync(
         include_kubernetes,
         kubernetes_non_destructive,
         kubernetes_kubeconfig,
-        kubernetes_context
+        kubernetes_context,
+        include_prometheus,
+        prometheus_url,
+        prometheus_token,
+        kubernetes_backend,
     ))
 
@@ -0,0 +1,210 @@
+"""
+指标序列摘要
+Prometheus 范围查询的原始结果（几十条序列 × 几百个采样点）直接交给 LLM 会让上下文膨胀、推理变慢。
+这里用 NumPy 一次性计算所有序列的统计量、趋势斜率、分位数、变点和 z-score 异常，
+只把最异常的 top-N 条序列以紧凑格式返回给模型
+"""
+import json
+from typing import Any, Dict, List, Optional
+import numpy as np
+from config.config_loader import get_config
+
+
+def _series_matrix(result: List[dict]):
+    """
+    将 matrix 结果对齐到统一的时间轴
+
+    Returns:
+        (时间戳数组, 值矩阵 [序列数 × 时间点数]，缺失点为 NaN)
+    """
+    timestamps = [np.asarray([float(t) for t, _ in s.get("values", [])], dtype=np.float64) for s in result]
+    grid = np.unique(np.concatenate(timestamps)) if timestamps else np.empty(0)
+    values = np.full((len(result), len(grid)), np.nan, dtype=np.float64)
+    for i, (series, ts) in enumerate(zip(result, timestamps)):
+        if len(ts) == 0:
+            continue
+        raw = np.asarray([v for _, v in series["values"]], dtype=object)
+        # Prometheus 用字符串表示采样值（包括 "NaN" / "+Inf"）
+        values[i, np.searchsorted(grid, ts)] = raw.astype(np.float64)
+    values[~np.isfinite(values)] = np.nan
+    return grid, values
+
+
+def summarize_matrix(result: List[dict], top_n: int = 5, z_threshold: float = 3.0) -> Dict[str, Any]:
+    """
+    计算所有序列的摘要并返回最异常的 top-N 条
+
+    异常得分取以下三项的最大值（平稳的噪声序列得分在 z_threshold 附近或以下）：
+    - 单点 z-score 的最大值（尖峰）
+    - 变点前后均值差 / 切分后的残差标准差（水平突变）
+    - 窗口内趋势变化量 / 去趋势后的残差标准差（持续上涨或下跌）
+
+    Args:
+        result: Prometheus matrix 结果（[{"metric": {...}, "values": [[t, "v"], ...]}, ...]）
+        top_n: 返回的序列数量
+        z_threshold: z-score 异常阈值
+
+    Returns:
+        摘要字典（时间范围、序列总数和 top-N 序列的统计信息）
+    """
+    grid, values = _series_matrix(result)
+    if values.size == 0:
+        return {"series_total": len(result), "series": []}
+
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=1)
+    rows = counts > 0
+    safe = np.where(valid, values, 0.0)
+    n = np.maximum(counts, 1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = safe.sum(axis=1) / n
+        centered = np.where(valid, values - mean[:, None], 0.0)
+        std = np.sqrt((centered ** 2).sum(axis=1) / n)
+        p50, p95, p99 = (np.nanpercentile(values[rows], q, axis=1) for q in (50, 95, 99))
+
+        # z-score 异常点
+        z = np.where(valid, centered / np.where(std > 0, std, np.inf)[:, None], 0.0)
+        abs_z = np.abs(z)
+        max_z = abs_z.max(axis=1)
+        anomalies = (abs_z >= z_threshold).sum(axis=1)
+        peak_index = abs_z.argmax(axis=1)
+
+        # 趋势斜率（最小二乘，单位：每小时）
+        hours = (grid - grid[0]) / 3600.0
+        t_mean = np.where(valid, hours[None, :], 0.0).sum(axis=1) / n
+        t_centered = np.where(valid, hours[None, :] - t_mean[:, None], 0.0)
+        denominator = (t_centered ** 2).sum(axis=1)
+        slope = np.where(denominator > 0, (t_centered * centered).sum(axis=1) / np.where(denominator > 0, denominator, 1), 0.0)
+        detrended = np.where(valid, centered - slope[:, None] * t_centered, 0.0)
+        trend_std = np.sqrt((detrended ** 2).sum(axis=1) / n)
+        trend_score = np.abs(slope) * (hours[-1] - hours[0]) / np.where(trend_std > 0, trend_std, np.inf)
+
+        # 单变点检测：缺失点用序列均值填充后，找前后两段均值差最大的切分位置
+        filled = np.where(valid, values, mean[:, None])
+        length = filled.shape[1]
+        cumsum = np.cumsum(filled, axis=1)
+        split = np.arange(1, length)
+        left_mean = cumsum[:, :-1] / split
+        right_mean = (cumsum[:, -1:] - cumsum[:, :-1]) / (length - split)
+        # 按两段长度加权，避免在序列两端切出只有一个点的"变点"
+        weight = np.sqrt(split * (length - split) / length)
+        shift_score = np.abs(right_mean - left_mean) * weight
+        if length > 1:
+            change_index = shift_score.argmax(axis=1) + 1
+            rows_idx = np.arange(len(values))
+            change_before = left_mean[rows_idx, change_index - 1]
+            change_after = right_mean[rows_idx, change_index - 1]
+            shift = change_after - change_before
+            left_share = change_index / length
+            residual_var = std ** 2 - left_share * (1 - left_share) * shift ** 2
+            change_score = np.abs(shift) / np.sqrt(np.where(residual_var > 0, residual_var, np.inf))
+        else:
+            change_index = np.zeros(len(values), dtype=int)
+            change_before = change_after = mean
+            change_score = np.zeros(len(values))
+
+    score = np.where(rows, np.maximum.reduce([max_z, change_score, trend_score]), -1.0)
+    last_valid = values.shape[1] - 1 - valid[:, ::-1].argmax(axis=1)
+    last = values[np.arange(len(values)), last_valid]
+
+    percentiles = np.full((len(values), 3), np.nan)
+    percentiles[rows] = np.column_stack([p50, p95, p99])
+
+    def r(x: float) -> Optional[float]:
+        return float(f"{x:.4g}") if np.isfinite(x) else None
+
+    order = np.argsort(-score, kind="stable")[:top_n]
+    series = []
+    for i in order:
+        if not rows[i]:
+            continue
+        item = {
+            "metric": result[i].get("metric", {}),
+            "points": int(counts[i]),
+            "score": r(score[i]),
+            "min": r(np.nanmin(values[i])),
+            "max": r(np.nanmax(values[i])),
+            "mean": r(mean[i]),
+            "last": r(last[i]),
+            "p50": r(percentiles[i, 0]),
+            "p95": r(percentiles[i, 1]),
+            "p99": r(percentiles[i, 2]),
+            "slope_per_hour": r(slope[i]),
+        }
+        if anomalies[i]:
+            item["anomalies"] = {
+                "count": int(anomalies[i]),
+                "max_z": r(max_z[i]),
+                "peak_at": int(grid[peak_index[i]]),
+                "peak_value": r(values[i, peak_index[i]]),
+            }
+        # 持续趋势在中点处也会表现为均值差，此时只报告趋势
+        if change_score[i] >= max(z_threshold, trend_score[i]):
+            item["change_point"] = {
+                "at": int(grid[change_index[i]]),
+                "before": r(change_before[i]),
+                "after": r(change_after[i]),
+            }
+        series.append(item)
+
+    return {
+        "start": int(grid[0]),
+        "end": int(grid[-1]),
+        "step": int(np.median(np.diff(grid))) if len(grid) > 1 else None,
+        "series_total": len(result),
+        "series_shown": len(series),
+        "series": series,
+    }
+
+
+def summarize_prometheus_output(output: Any, top_n: int = 5, z_threshold: float = 3.0, max_raw_points: int = 500) -> Any:
+    """
+    工具输出后处理：范围查询结果的采样点总数超过 max_raw_points 时替换为摘要
+
+    Args:
+        output: 工具输出（Prometheus data 的 JSON 文本）
+        top_n: 保留的序列数量
+        z_threshold: z-score 异常阈值
+        max_raw_points: 不做摘要时允许的最大采样点总数
+
+    Returns:
+        摘要 JSON 文本；不是 matrix 结果或数据量较小时原样返回
+    """
+    if not isinstance(output, str):
+        return output
+    try:
+        data = json.loads(output)
+    except ValueError:
+        return output
+    if not isinstance(data, dict) or data.get("resultType") != "matrix":
+        return output
+
+    result = data.get("result") or []
+    total_points = sum(len(s.get("values", [])) for s in result)
+    if total_points <= max_raw_points:
+        return output
+
+    summary = summarize_matrix(result, top_n=top_n, z_threshold=z_threshold)
+    summary["note"] = f"原始结果共 {len(result)} 条序列、{total_points} 个采样点，仅展示最异常的 {summary['series_shown']} 条序列的摘要"
+    return json.dumps(summary, ensure_ascii=False, separators=(",", ":"))
+
+
+def get_metric_summarizer():
+    """
+    获取按 config.yaml 的 model.mcp.prometheus.summarize 段配置的后处理函数
+
+    Returns:
+        后处理函数；未启用时返回 None
+    """
+    config = get_config()
+    if not config.get('model.mcp.prometheus.summarize.enabled', True):
+        return None
+    top_n = int(config.get('model.mcp.prometheus.summarize.top_n', 5))
+    z_threshold = float(config.get('model.mcp.prometheus.summarize.z_threshold', 3.0))
+    max_raw_points = int(config.get('model.mcp.prometheus.summarize.max_raw_points', 500))
+
+    def summarize(output: Any) -> Any:
+        return summarize_prometheus_output(output, top_n=top_n, z_threshold=z_threshold, max_raw_points=max_raw_points)
+
+    return summarize
@@ -0,0 +1,367 @@
+"""
+Prometheus 查询工具
+进程内直接调用 Prometheus HTTP API（不经过 MCP 子进程）：
+- httpx.AsyncClient 连接池复用 TCP / TLS 连接
+- 范围查询按 step 对齐切分为固定长度的时间块，已完成的历史块缓存复用；
+  诊断过程中反复查询"最近 1 小时的 CPU"时只需要请求最新的一小段
+"""
+import asyncio
+import json
+import re
+import time
+import weakref
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+from langchain_core.tools import BaseTool, tool
+from config.config_loader import get_config
+
+
+_DURATION_RE = re.compile(r"^(\d+(?:\.\d+)?)(ms|s|m|h|d|w)?$")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, None: 1}
+
+
+def parse_duration(value: Any) -> float:
+    """
+    解析时长（"30s" / "5m" / "1h" / 数字秒）
+
+    Args:
+        value: 时长
+
+    Returns:
+        秒数
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _DURATION_RE.match(str(value).strip())
+    if not match:
+        raise ValueError(f"无法解析时长: {value}")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def parse_time(value: Any, now: Optional[float] = None) -> float:
+    """
+    解析时间（"now" / "-1h" / "now-30m" / Unix 时间戳 / RFC3339）
+
+    Args:
+        value: 时间
+        now: 当前时间戳（默认 time.time()）
+
+    Returns:
+        Unix 时间戳（秒）
+    """
+    now = time.time() if now is None else now
+    if value is None:
+        return now
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    if text == "now":
+        return now
+    if text.startswith("now-"):
+        return now - parse_duration(text[4:])
+    if text.startswith("-"):
+        return now - parse_duration(text[1:])
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp()
+
+
+class PrometheusError(Exception):
+    """Prometheus API 返回错误"""
+
+
+class PrometheusClient:
+    """带连接池和范围查询块缓存的异步 Prometheus 客户端"""
+
+    def __init__(
+        self,
+        base_url: str,
+        token: Optional[str] = None,
+        timeout: float = 30,
+        max_connections: int = 20,
+        block_points: int = 120,
+        cache_blocks: int = 2048,
+        settle_seconds: float = 60,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """
+        初始化 Prometheus 客户端
+
+        Args:
+            base_url: Prometheus 地址（例如 http://prometheus:9090）
+            token: Bearer Token（可选）
+            timeout: 请求超时（秒）
+            max_connections: 连接池最大连接数
+            block_points: 每个缓存块包含的采样点数（块长度 = step * block_points）
+            cache_blocks: 最多缓存的块数量（LRU 淘汰）
+            settle_seconds: 距当前时间不足该秒数的块视为未完成（数据可能还在写入），不缓存
+            transport: 自定义 httpx 传输层（测试时可传入 httpx.MockTransport）
+        """
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.block_points = block_points
+        self.cache_blocks = cache_blocks
+        self.settle_seconds = settle_seconds
+        self._transport = transport
+
+        # 连接池绑定在创建它的事件循环上，每个事件循环各用一个客户端
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+        # (查询, step, 块起点) -> {序列标签 JSON: [[时间戳, 值], ...]}
+        self._blocks: "OrderedDict[Tuple[str, float, float], Dict[str, list]]" = OrderedDict()
+
+        # 统计信息
+        self._counters = {"requests": 0, "block_hits": 0, "block_misses": 0}
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            headers = {"Authorization": f"Bearer {self.token}"} if self.token else None
+            client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                transport=self._transport,
+            )
+            self._clients[loop] = client
+        return client
+
+    async def _get(self, path: str, params: Dict[str, Any]) -> dict:
+        self._counters["requests"] += 1
+        response = await self._client().get(path, params=params)
+        try:
+            body = response.json()
+        except ValueError:
+            response.raise_for_status()
+            raise PrometheusError(f"Prometheus 返回了非 JSON 响应: {response.text[:200]}")
+        if body.get("status") != "success":
+            raise PrometheusError(f"{body.get('errorType', response.status_code)}: {body.get('error', response.text[:200])}")
+        return body["data"]
+
+    async def query(self, promql: str, at: Optional[float] = None) -> dict:
+        """
+        即时查询
+
+        Args:
+            promql: PromQL 表达式
+            at: 查询时间戳（默认当前时间）
+
+        Returns:
+            Prometheus 返回的 data（resultType + result）
+        """
+        params = {"query": promql}
+        if at is not None:
+            params["time"] = at
+        return await self._get("/api/v1/query", params)
+
+    async def query_range(self, promql: str, start: float, end: float, step: float) -> dict:
+        """
+        范围查询（按 step 对齐切块，复用已缓存的历史块）
+
+        起止时间会对齐到 step 的整数倍（与 Grafana 的做法一致），保证相邻窗口的采样点完全相同、可以复用
+
+        Args:
+            promql: PromQL 表达式
+            start: 起始时间戳
+            end: 结束时间戳
+            step: 采样间隔（秒）
+
+        Returns:
+            与 Prometheus 相同格式的 data：{"resultType": "matrix", "result": [{"metric": ..., "values": ...}]}
+        """
+        if step <= 0:
+            raise ValueError("step 必须大于 0")
+        start = (start // step) * step
+        end = (end // step) * step
+        if end < start:
+            return {"resultType": "matrix", "result": []}
+
+        block_len = step * self.block_points
+        first_block = (start // block_len) * block_len
+        block_starts = []
+        b = first_block
+        while b <= end:
+            block_starts.append(b)
+            b += block_len
+
+        # 找出缺失的块，相邻的缺失块合并成一次请求
+        blocks: Dict[float, Dict[str, list]] = {}
+        missing: List[float] = []
+        for b in block_starts:
+            cached = self._blocks.get((promql, step, b))
+            if cached is not None:
+                self._blocks.move_to_end((promql, step, b))
+                blocks[b] = cached
+                self._counters["block_hits"] += 1
+            else:
+                missing.append(b)
+                self._counters["block_misses"] += 1
+
+        runs: List[List[float]] = []
+        for b in missing:
+            if runs and b - runs[-1][-1] == block_len:
+                runs[-1].append(b)
+            else:
+                runs.append([b])
+        fetched = await asyncio.gather(*(
+            self._fetch_run(promql, run[0], run[-1] + block_len - step, step, block_len)
+            for run in runs
+        ))
+        for run_blocks in fetched:
+            blocks.update(run_blocks)
+
+        # 按序列合并各块，并裁剪到请求的时间范围
+        merged: Dict[str, list] = {}
+        for b in block_starts:
+            for series_key, values in blocks.get(b, {}).items():
+                merged.setdefault(series_key, []).extend(v for v in values if start <= v[0] <= end)
+        return {
+            "resultType": "matrix",
+            "result": [
+                {"metric": json.loads(series_key), "values": values}
+                for series_key, values in merged.items()
+                if values
+            ],
+        }
+
+    async def _fetch_run(
+        self, promql: str, start: float, end: float, step: float, block_len: float
+    ) -> Dict[float, Dict[str, list]]:
+        """请求一段连续的块，并按块切分后缓存已完成的块"""
+        data = await self._get("/api/v1/query_range", {"query": promql, "start": start, "end": end, "step": step})
+        if data.get("resultType") != "matrix":
+            raise PrometheusError(f"范围查询返回了非 matrix 结果: {data.get('resultType')}")
+
+        blocks: Dict[float, Dict[str, list]] = {}
+        b = start
+        while b <= end:
+            blocks[b] = {}
+            b += block_len
+        for series in data.get("result", []):
+            series_key = json.dumps(series.get("metric", {}), sort_keys=True)
+            for t, v in series.get("values", []):
+                block = (float(t) // block_len) * block_len
+                if block in blocks:
+                    blocks[block].setdefault(series_key, []).append([float(t), v])
+
+        # 只缓存已经完成的历史块（块的最后一个采样点早于 now - settle_seconds）
+        complete_before = time.time() - self.settle_seconds
+        for b, series in blocks.items():
+            if b + block_len - step <= complete_before:
+                self._blocks[(promql, step, b)] = series
+                self._blocks.move_to_end((promql, step, b))
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return blocks
+
+    def stats(self) -> dict:
+        """请求次数和块缓存命中统计"""
+        return {"cached_blocks": len(self._blocks), **self._counters}
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环的连接池"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+# 全局 Prometheus 客户端实例
+_prometheus_client: Optional[PrometheusClient] = None
+
+
+def get_prometheus_client(url: Optional[str] = None, token: Optional[str] = None) -> PrometheusClient:
+    """
+    获取 Prometheus 客户端（单例模式，参数从 config.yaml 的 model.mcp.prometheus 段读取）
+
+    Args:
+        url: Prometheus 地址（可选，覆盖配置）
+        token: Bearer Token（可选，覆盖配置）
+
+    Returns:
+        PrometheusClient 实例
+    """
+    global _prometheus_client
+
+    if _prometheus_client is not None and url is None and token is None:
+        return _prometheus_client
+
+    config = get_config()
+    url = url or config.get('model.mcp.prometheus.url', 'http://localhost:9090')
+    token = token or config.get('model.mcp.prometheus.token')
+    if _prometheus_client is None or _prometheus_client.base_url != url.rstrip("/") or _prometheus_client.token != token:
+        _prometheus_client = PrometheusClient(
+            base_url=url,
+            token=token,
+            timeout=float(config.get('model.mcp.prometheus.timeout', 30)),
+            max_connections=int(config.get('model.mcp.prometheus.max_connections', 20)),
+            block_points=int(config.get('model.mcp.prometheus.cache.block_points', 120)),
+            cache_blocks=int(config.get('model.mcp.prometheus.cache.max_blocks', 2048)),
+            settle_seconds=float(config.get('model.mcp.prometheus.cache.settle_seconds', 60)),
+        )
+    return _prometheus_client
+
+
+@tool
+async def prometheus_query(query: str, time: Optional[str] = None) -> str:
+    """
+    Prometheus 即时查询（PromQL）
+    参数:
+    - query: PromQL 表达式，例如 sum(rate(container_cpu_usage_seconds_total{namespace="prod"}[5m])) by (pod)
+    - time: 查询时间（可选，默认当前时间），支持 "now"、"-1h"、Unix 时间戳或 RFC3339
+    返回:
+    - JSON 格式的查询结果
+    """
+    try:
+        data = await get_prometheus_client().query(query, at=parse_time(time) if time else None)
+        return json.dumps(data, ensure_ascii=False)
+    except Exception as e:
+        return f"Prometheus 查询失败: {e}"
+
+
+@tool
+async def prometheus_query_range(query: str, start: str = "-1h", end: str = "now", step: str = "60s") -> str:
+    """
+    Prometheus 范围查询（PromQL），用于查看指标在一段时间内的变化趋势
+    参数:
+    - query: PromQL 表达式，例如 rate(container_cpu_usage_seconds_total{pod="api-xxx"}[5m])
+    - start: 起始时间，支持 "-1h"、"now-30m"、Unix 时间戳或 RFC3339（默认 -1h）
+    - end: 结束时间（默认 now）
+    - step: 采样间隔，例如 "30s"、"1m"、"5m"（默认 60s）
+    返回:
+    - JSON 格式的查询结果（matrix）
+    """
+    try:
+        now = time.time()
+        data = await get_prometheus_client().query_range(
+            query, parse_time(start, now), parse_time(end, now), parse_duration(step)
+        )
+        return json.dumps(data, ensure_ascii=False)
+    except Exception as e:
+        return f"Prometheus 范围查询失败: {e}"
+
+
+def get_prometheus_tools(url: Optional[str] = None, token: Optional[str] = None) -> List[BaseTool]:
+    """
+    获取 Prometheus 查询工具列表
+
+    Args:
+        url: Prometheus 地址（可选，默认读取 model.mcp.prometheus.url）
+        token: Bearer Token（可选）
+
+    Returns:
+        Prometheus 工具列表
+    """
+    get_prometheus_client(url, token)
+    return [prometheus_query, prometheus_query_range]
@@ -0,0 +1,99 @@
+"""
+Single-flight 合并
+同一时刻对同一个 key 的多个并发调用只真正执行一次，其余调用等待并共享同一个结果（或异常）。
+与结果缓存不同：调用结束后立即移除，不保存结果，只消除同时到达的重复请求（惊群）
+
+使用方法：
+    flight = SingleFlight("rag")
+    result = await flight.do(make_key("rag", query, k), lambda: retrieve(query, k))
+"""
+import asyncio
+import json
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+
+T = TypeVar("T")
+
+
+def make_key(*parts: Any) -> str:
+    """
+    将任意参数组合成稳定的 key（字典按键排序，不可 JSON 序列化的值使用 str）
+
+    Args:
+        *parts: 组成 key 的各个部分
+
+    Returns:
+        key 字符串
+    """
+    return json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _consume_exception(task: asyncio.Task) -> None:
+    """所有等待者都已取消时，避免出现 "Task exception was never retrieved" 警告"""
+    if not task.cancelled():
+        task.exception()
+
+
+class SingleFlight:
+    """异步 single-flight 合并器"""
+
+    def __init__(self, name: str = "default"):
+        """
+        初始化 single-flight 合并器
+
+        Args:
+            name: 名称（用于统计展示）
+        """
+        self.name = name
+        # 事件循环 -> (key -> 正在执行的任务)；Task 只能在创建它的事件循环中等待
+        self._inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, asyncio.Task]]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+        # 统计信息
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        执行调用；如果相同 key 的调用正在进行，则等待并共享其结果
+
+        Args:
+            key: 调用的 key（相同 key 视为相同操作）
+            fn: 无参数的协程工厂，只有第一个调用者的 fn 会被执行
+
+        Returns:
+            调用结果（异常同样会传播给所有等待者）
+        """
+        loop = asyncio.get_running_loop()
+        inflight = self._inflight.get(loop)
+        if inflight is None:
+            inflight = self._inflight[loop] = {}
+
+        task = inflight.get(key)
+        if task is None:
+            task = loop.create_task(fn())
+            inflight[key] = task
+            self.executed += 1
+
+            def _done(t: asyncio.Task, key=key) -> None:
+                if inflight.get(key) is t:
+                    del inflight[key]
+                _consume_exception(t)
+
+            task.add_done_callback(_done)
+        else:
+            self.shared += 1
+
+        # shield：某个调用者被取消不会取消其他调用者共享的任务
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        """合并效果统计"""
+        return {
+            "name": self.name,
+            "executed": self.executed,
+            "shared": self.shared,
+            "inflight": sum(len(calls) for calls in self._inflight.values()),
+        }
@@ -1,50 +1,145 @@
 """
 模型工厂模块
 用于根据配置文件创建 langchain 模型实例
+
+模型注册表：
+- model.<供应商>（如 deepseek、glm）保存供应商的 API Key、接口地址和默认模型
+- model.registry 为具体模型命名，引用供应商的凭据并可以覆盖模型名称、max_token 等参数
+两者都可以作为模型名称使用，例如 create_model_from_config('glm') 或 create_model_from_config('glm-4-flash')
 """
+import threading
+from typing import Any, Dict, List
+
 from langchain.chat_models import init_chat_model
 from config.config_loader import get_config
 
 
-def create_model_from_config(model_name: str = 'deepseek'):
+# 供应商默认参数（均为 OpenAI 兼容接口）
+PROVIDER_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    'deepseek': {
+        'model': 'deepseek-chat',
+        'model_provider': 'openai',
+        'api_base': 'https://api.deepseek.com',
+    },
+    'glm': {
+        'model': 'glm-4-flash',
+        'model_provider': 'openai',
+        'api_base': 'https://open.bigmodel.cn/api/paas/v4/',
+    },
+}
+
+# 透传给 init_chat_model 的可选参数
+_OPTIONAL_PARAMS = ('temperature', 'timeout', 'max_retries')
+
+
+def resolve_model_config(model_name: str) -> Dict[str, Any]:
+    """
+    解析模型名称对应的完整参数（注册表条目 + 供应商凭据 + 供应商默认值）
+
+    Args:
+        model_name: model.registry 中的名称，或 model 下的供应商名称
+
+    Returns:
+        参数字典（model / model_provider / api / api_base / max_token 等）
+
+    Raises:
+        ValueError: 模型或供应商未配置
+    """
+    config = get_config()
+    entry = config.get(f'model.registry.{model_name}')
+    if entry is not None:
+        provider = entry.get('provider')
+        if not provider:
+            raise ValueError(f"模型注册表条目缺少 provider: {model_name}")
+    else:
+        provider, entry = model_name, {}
+
+    provider_config = config.get_model_config(provider)
+    if provider_config is None and provider not in PROVIDER_DEFAULTS:
+        raise ValueError(f"模型配置不存在: {model_name}")
+
+    resolved = dict(PROVIDER_DEFAULTS.get(provider, {}))
+    resolved.update(provider_config or {})
+    resolved.update({k: v for k, v in entry.items() if k != 'provider'})
+    resolved['provider'] = provider
+    if not resolved.get('model'):
+        raise ValueError(f"模型 {model_name} 未配置 model 字段")
+    return resolved
+
+
+def create_model_from_config(model_name: str = 'deepseek', **kwargs: Any):
     """
     根据配置文件创建模型实例
-    
+
     Args:
-        model_name: 模型名称，对应 config.yaml 中的 model 键，如 'deepseek' 或 'glm'
-    
+        model_name: 模型名称，model.registry 中的名称或 model 下的供应商名称，如 'deepseek' 或 'glm'
+        kwargs: 额外传给 init_chat_model 的参数（如 callbacks）
+
     Returns:
         BaseChatModel 实例
-    
+
     Example:
         from config.model_factory import create_model_from_config
-        
+
         # 创建 deepseek 模型
         model = create_model_from_config('deepseek')
-        
+
         # 在 create_agent 中使用
         from langchain.agents import create_agent
         agent = create_agent(model=model, tools=[...])
     """
+    model_config = resolve_model_config(model_name)
+    api_keys = model_config.get('api_keys') or []
+    params = {
+        'model_provider': model_config.get('model_provider', 'openai'),
+        'api_key': model_config.get('api') or next((k if isinstance(k, str) else k.get('key') for k in api_keys), None),
+        'base_url': model_config.get('api_base'),
+        'max_tokens': model_config.get('max_token'),
+    }
+    params.update({k: model_config[k] for k in _OPTIONAL_PARAMS if model_config.get(k) is not None})
+    if params['model_provider'] == 'openai':
+        # 配置了多个 Key 时，每个请求从 Key 池选择 Key，429 时换 Key 重发
+        from app.core.key_pool import key_pool_http_clients
+
+        params.update(key_pool_http_clients(model_config['provider']))
+    params.update(kwargs)
+    return init_chat_model(model_config['model'], **params)
+
+
+def list_models() -> List[str]:
+    """注册表中的模型名称（含已配置 model 字段或有默认参数的供应商）"""
     config = get_config()
-    model_config = config.get_model_config(model_name)
-    
-    if not model_config:
-        raise ValueError(f"模型配置不存在: {model_name}")
-    
-    # 根据模型名称确定模型标识符
-    if model_name == 'deepseek':
-        model_id = model_config.get('model', 'deepseek-chat')
-        return init_chat_model(
-            model_id,
-            api_key=model_config.get('api'),
-            base_url=model_config.get('api_base'),
-            max_tokens=model_config.get('max_token'),
-        )
-    elif model_name == 'glm':
-        # GLM 模型的处理（如果需要的话）
-        # 这里可以根据实际情况调整
-        raise NotImplementedError(f"模型 {model_name} 暂未实现")
-    else:
-        raise ValueError(f"不支持的模型: {model_name}")
+    names = list(config.get('model.registry', {}) or {})
+    for provider, provider_config in (config.get('model', {}) or {}).items():
+        if isinstance(provider_config, dict) and (provider in PROVIDER_DEFAULTS or 'model' in provider_config):
+            names.append(provider)
+    return names
+
+
+_models: Dict[str, Any] = {}
+_models_lock = threading.Lock()
+
+
+def get_model(model_name: str = 'deepseek'):
+    """
+    获取模型实例（按名称缓存，同一模型在进程内共享一个实例和连接池）
+
+    流式调用返回 token 用量，按 model.hedging 配置加上对冲请求和故障切换，
+    并挂上 prompt 前缀缓存遥测回调（如果启用）
+
+    Args:
+        model_name: 模型名称
+
+    Returns:
+        BaseChatModel 实例
+    """
+    with _models_lock:
+        if model_name not in _models:
+            from app.core.llm_hedging import create_hedged_model
+            from app.core.prompt_cache import get_prompt_cache_telemetry
 
+            model = create_hedged_model(model_name, create_model_from_config(model_name, stream_usage=True))
+            telemetry = get_prompt_cache_telemetry()
+            model.callbacks = [telemetry] if telemetry else None
+            _models[model_name] = model
+        return _models[model_name]